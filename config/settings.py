@@ -153,6 +153,52 @@ INSTALLED_APPS = [
 # 库存警告
 LOW_STOCK_ALERT_THRESHOLD = int(os.getenv("LOW_STOCK_ALERT_THRESHOLD", "60000"))
 
+# 进程内主数据缓存（单位/合作方/仓库/物品）比对数据库版本号的间隔（秒）；0 表示每次都比对
+MASTERDATA_CHECK_SECONDS = float(os.getenv("MASTERDATA_CHECK_SECONDS", "2"))
+
+# 后台大表分页：PostgreSQL 估算行数超过该值时直接显示估算值，不再 COUNT(*)；0 表示总是精确计数
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv("ADMIN_EXACT_COUNT_LIMIT", "10000"))
+
+# 批量写入接口单次请求允许的最大流水条数
+API_BATCH_MAX_MOVES = int(os.getenv("API_BATCH_MAX_MOVES", "5000"))
+
+# 余额维护方式：signal（Django 信号逐条重算）或 trigger（数据库触发器按增量维护，修改后需执行 migrate）
+STOCK_BALANCE_ENGINE = _env_value("STOCK_BALANCE_ENGINE", "signal").strip().lower()
+if STOCK_BALANCE_ENGINE not in {"signal", "trigger"}:
+    raise ImproperlyConfigured(f"Unsupported STOCK_BALANCE_ENGINE: {STOCK_BALANCE_ENGINE}")
+
+# 事务性 outbox：流水写入时同事务记录外发事件，由 relay_outbox 命令投递；已投递事件保留天数、
+# relay 领取一批事件后的租期（秒，超过仍未确认视为 relay 已退出，事件可被重新领取）
+OUTBOX_ENABLED = _env_bool("OUTBOX_ENABLED", default=False)
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+
+# 后台任务队列（run_workers）：默认 worker 数、空闲轮询间隔、运行超时回收、失败重试退避基数（秒，按次数翻倍）、已结束任务保留天数
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_LOCK_TIMEOUT_SECONDS = int(os.getenv("JOB_LOCK_TIMEOUT_SECONDS", "3600"))
+JOB_RETRY_BACKOFF_SECONDS = int(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "30"))
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "14"))
+
+# 库存预留：默认有效期与接口允许的最长有效期（秒），到期由 sweep_reservations 释放
+RESERVATION_TTL_SECONDS = int(os.getenv("RESERVATION_TTL_SECONDS", "1800"))
+RESERVATION_MAX_TTL_SECONDS = int(os.getenv("RESERVATION_MAX_TTL_SECONDS", "604800"))
+
+# 余额变动推送（SSE）：local 为进程内广播；postgres 用 LISTEN/NOTIFY 跨 worker 扇出
+EVENT_BROKER = _env_value("EVENT_BROKER", "local").strip().lower()
+if EVENT_BROKER not in {"local", "postgres"}:
+    raise ImproperlyConfigured(f"Unsupported EVENT_BROKER: {EVENT_BROKER}")
+EVENT_STREAM_HEARTBEAT_SECONDS = int(os.getenv("EVENT_STREAM_HEARTBEAT_SECONDS", "15"))
+# 与 deploy.sh 的 SERVER_MODE 一致。WSGI 下每条 SSE 连接占住一个同步 worker、local 广播也到不了
+# 其他 worker，所以只有 ASGI 部署或 postgres 广播时看板才打开实时推送
+SERVER_MODE = _env_value("SERVER_MODE", "wsgi").strip().lower()
+if SERVER_MODE not in {"wsgi", "asgi"}:
+    raise ImproperlyConfigured(f"Unsupported SERVER_MODE: {SERVER_MODE}")
+EVENT_STREAM_ENABLED = SERVER_MODE == "asgi" or EVENT_BROKER == "postgres"
+
+# 表单令牌 / Idempotency-Key 的有效期（秒），过期记录由 purge_idempotency_keys 清理
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -161,8 +207,17 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    "products.middleware.SlowQueryMiddleware",
+    "products.middleware.ReplicaStickinessMiddleware",
 ]
 
+# 慢查询日志：超过阈值（毫秒）的 ORM 查询连同 EXPLAIN 计划写入滚动日志，0 表示关闭
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "0"))
+SLOW_QUERY_EXPLAIN = _env_bool("SLOW_QUERY_EXPLAIN", default=True)
+SLOW_QUERY_LOG_PATH = _env_path("SLOW_QUERY_LOG_PATH", BASE_DIR / "logs" / "slow_queries.log")
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUP_COUNT = int(os.getenv("SLOW_QUERY_LOG_BACKUP_COUNT", "5"))
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -256,6 +311,105 @@ def _database_from_url(url: str) -> dict:
 if DATABASE_URL:
     DATABASES["default"] = _database_from_url(DATABASE_URL)
 
+# 进程内连接池（仅 PostgreSQL）：开启后每个 worker 进程最多 POSTGRES_POOL_MAX_SIZE 个连接，
+# 请求结束即归还；CONN_MAX_AGE 置 0，连接复用交给连接池
+POSTGRES_POOL = _env_bool("POSTGRES_POOL", default=False)
+POSTGRES_POOL_OPTIONS = {
+    "min_size": int(os.getenv("POSTGRES_POOL_MIN_SIZE", "2")),
+    "max_size": int(os.getenv("POSTGRES_POOL_MAX_SIZE", "10")),
+    "timeout": float(os.getenv("POSTGRES_POOL_TIMEOUT", "10")),
+    "check_after": float(os.getenv("POSTGRES_POOL_CHECK_SECONDS", "30")),
+    "max_idle": float(os.getenv("POSTGRES_POOL_MAX_IDLE_SECONDS", "600")),
+    "max_lifetime": float(os.getenv("POSTGRES_POOL_MAX_LIFETIME_SECONDS", "3600")),
+}
+
+# 只读副本：流水列表、导出、只读接口走 replica；写入后 DATABASE_REPLICA_STICKY_SECONDS 秒内仍读主库
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL", "")
+DATABASE_REPLICA_STICKY_SECONDS = int(os.getenv("DATABASE_REPLICA_STICKY_SECONDS", "10"))
+
+if DATABASE_REPLICA_URL:
+    DATABASES["replica"] = _database_from_url(DATABASE_REPLICA_URL)
+    DATABASES["replica"].setdefault("CONN_MAX_AGE", DATABASES["default"].get("CONN_MAX_AGE", 0))
+    # 测试时 replica 直接复用 default 的测试库
+    DATABASES["replica"]["TEST"] = {"MIRROR": "default"}
+    DATABASE_ROUTERS = ["products.routers.ReplicaRouter"]
+
+if POSTGRES_POOL:
+    for _database in DATABASES.values():
+        if _database["ENGINE"] == "django.db.backends.postgresql":
+            _database["ENGINE"] = "products.db_pool"
+            _database["CONN_MAX_AGE"] = 0
+            _database["POOL"] = dict(POSTGRES_POOL_OPTIONS)
+
+
+# Cache
+# DJANGO_CACHE_URL 示例：locmem://、file:///var/tmp/inventory_cache、
+# memcached://127.0.0.1:11211（需 pymemcache）、redis://127.0.0.1:6379/1（需 redis）
+DJANGO_CACHE_URL = os.getenv("DJANGO_CACHE_URL", "")
+
+
+def _cache_from_url(url: str) -> dict:
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    backend_map = {
+        "locmem": 'django.core.cache.backends.locmem.LocMemCache',
+        "file": 'django.core.cache.backends.filebased.FileBasedCache',
+        "memcached": 'django.core.cache.backends.memcached.PyMemcacheCache',
+        "pymemcache": 'django.core.cache.backends.memcached.PyMemcacheCache',
+        "redis": 'django.core.cache.backends.redis.RedisCache',
+        "rediss": 'django.core.cache.backends.redis.RedisCache',
+        "dummy": 'django.core.cache.backends.dummy.DummyCache',
+    }
+
+    if scheme not in backend_map:
+        raise ImproperlyConfigured(f"Unsupported DJANGO_CACHE_URL scheme: {scheme}")
+
+    config = {
+        'BACKEND': backend_map[scheme],
+        'TIMEOUT': int(os.getenv("DJANGO_CACHE_TIMEOUT", "300")),
+        'KEY_PREFIX': os.getenv("DJANGO_CACHE_KEY_PREFIX", "inventory"),
+    }
+    if scheme == "locmem":
+        config['LOCATION'] = parsed.netloc or "inventory"
+    elif scheme == "file":
+        if not parsed.path:
+            raise ImproperlyConfigured("file:// DJANGO_CACHE_URL must include a directory")
+        config['LOCATION'] = parsed.path
+    elif scheme in {"memcached", "pymemcache"}:
+        # 多个节点用逗号分隔：memcached://host1:11211,host2:11211
+        config['LOCATION'] = parsed.netloc.split(",")
+    elif scheme in {"redis", "rediss"}:
+        config['LOCATION'] = url
+
+    return config
+
+
+CACHES = {
+    "default": _cache_from_url(DJANGO_CACHE_URL or "locmem://"),
+}
+
+
+# Sessions：db（默认）、cache、cached_db、signed_cookies
+# cached_db 在缓存命中时不查 django_session；cache / cached_db 配 locmem 只适合单进程开发环境：
+# 多 worker 时各自保留会话副本，登出不会在其他 worker 生效
+_SESSION_ENGINES = {
+    "db": "django.contrib.sessions.backends.db",
+    "cache": "django.contrib.sessions.backends.cache",
+    "cached_db": "django.contrib.sessions.backends.cached_db",
+    "signed_cookies": "django.contrib.sessions.backends.signed_cookies",
+}
+_session_engine = _env_value("DJANGO_SESSION_ENGINE", "db").strip().lower()
+if _session_engine not in _SESSION_ENGINES:
+    raise ImproperlyConfigured(f"Unsupported DJANGO_SESSION_ENGINE: {_session_engine}")
+if (
+    ENVIRONMENT == "production"
+    and _session_engine in ("cache", "cached_db")
+    and CACHES["default"]["BACKEND"].endswith(("LocMemCache", "DummyCache"))
+):
+    raise ImproperlyConfigured(f"DJANGO_SESSION_ENGINE={_session_engine} requires a shared cache in production.")
+SESSION_ENGINE = _SESSION_ENGINES[_session_engine]
+SESSION_COOKIE_AGE = int(os.getenv("DJANGO_SESSION_COOKIE_AGE", str(14 * 24 * 3600)))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -14,6 +14,14 @@ SERVICE_NAME="${SERVICE_NAME:-inventory}"              # systemd 服务名
 BIND_ADDR="${BIND_ADDR:-127.0.0.1:8000}"               # gunicorn 监听地址（host:port）
 DJANGO_SETTINGS="${DJANGO_SETTINGS:-config.settings}"
 WSGI_APP="${WSGI_APP:-config.wsgi:application}"
+ASGI_APP="${ASGI_APP:-config.asgi:application}"
+SERVER_MODE="${SERVER_MODE:-wsgi}"                     # wsgi：同步 worker；asgi：UvicornWorker（/api/ 只读接口为 async）
+WORKERS="${WORKERS:-3}"
+GUNICORN_TIMEOUT="${GUNICORN_TIMEOUT:-300}"               # 大文件导入可能超过默认 30s
+OUTBOX_RELAY_ARGS="${OUTBOX_RELAY_ARGS:-}"              # 非空时部署 outbox 投递服务，例如 "--sink file --path /srv/events.jsonl"
+RUN_JOB_WORKERS="${RUN_JOB_WORKERS:-1}"                 # 1：部署后台任务 worker 服务（导出、对账）
+JOB_WORKER_ARGS="${JOB_WORKER_ARGS:-}"                  # run_workers 额外参数，例如 "--concurrency 4 --pool process"
+RUN_RESERVATION_SWEEPER="${RUN_RESERVATION_SWEEPER:-1}" # 1：部署过期预留释放服务
 
 # Python 路径：优先 python3.11，否则 python3
 PY_BIN="${PY_BIN:-}"
@@ -157,8 +165,24 @@ django_prepare(){
   python manage.py collectstatic --noinput || die "collectstatic failed. Ensure STATIC_ROOT is set in settings.py"
 }
 
+gunicorn_cmd(){
+  case "${SERVER_MODE}" in
+    wsgi)
+      echo "${APP_DIR}/venv/bin/gunicorn --workers ${WORKERS} --timeout ${GUNICORN_TIMEOUT} --bind ${BIND_ADDR} ${WSGI_APP}"
+      ;;
+    asgi)
+      echo "${APP_DIR}/venv/bin/gunicorn --workers ${WORKERS} --worker-class uvicorn.workers.UvicornWorker --timeout ${GUNICORN_TIMEOUT} --bind ${BIND_ADDR} ${ASGI_APP}"
+      ;;
+    *)
+      die "Unsupported SERVER_MODE: ${SERVER_MODE} (expected wsgi or asgi)"
+      ;;
+  esac
+}
+
 write_systemd_service(){
-  log "Write systemd service: ${SERVICE_NAME}.service"
+  log "Write systemd service: ${SERVICE_NAME}.service (${SERVER_MODE})"
+  local exec_start
+  exec_start="$(gunicorn_cmd)"
   sudo tee "/etc/systemd/system/${SERVICE_NAME}.service" >/dev/null <<EOF
 [Unit]
 Description=Inventory System Gunicorn Service
@@ -175,8 +199,10 @@ EnvironmentFile=-${APP_DIR}/.env
 
 Environment="PATH=${APP_DIR}/venv/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
 Environment=DJANGO_SETTINGS_MODULE=${DJANGO_SETTINGS}
+# 看板据此决定是否打开实时推送
+Environment=SERVER_MODE=${SERVER_MODE}
 
-ExecStart=${APP_DIR}/venv/bin/gunicorn --workers 3 --bind ${BIND_ADDR} ${WSGI_APP}
+ExecStart=${exec_start}
 Restart=always
 RestartSec=5
 
@@ -191,6 +217,61 @@ EOF
   sudo systemctl status "${SERVICE_NAME}" --no-pager || true
 }
 
+# 后台常驻的 manage.py 命令：$1 服务名后缀，$2 描述，其余为命令参数
+write_manage_service(){
+  local suffix="$1" description="$2"
+  shift 2
+  local unit="${SERVICE_NAME}-${suffix}"
+  log "Write systemd service: ${unit}.service"
+  sudo tee "/etc/systemd/system/${unit}.service" >/dev/null <<EOF
+[Unit]
+Description=${description}
+After=network.target
+
+[Service]
+Type=simple
+User=${APP_USER}
+Group=${APP_GROUP}
+WorkingDirectory=${APP_DIR}
+EnvironmentFile=-${APP_DIR}/.env
+Environment="PATH=${APP_DIR}/venv/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
+Environment=DJANGO_SETTINGS_MODULE=${DJANGO_SETTINGS}
+
+ExecStart=${APP_DIR}/venv/bin/python manage.py $*
+Restart=always
+RestartSec=5
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
+  sudo systemctl daemon-reload
+  sudo systemctl enable --now "${unit}"
+  sudo systemctl restart "${unit}"
+}
+
+write_outbox_service(){
+  if [[ -z "${OUTBOX_RELAY_ARGS}" ]]; then
+    return 0
+  fi
+  # 投递服务需要 .env 中 OUTBOX_ENABLED=1 才会有事件
+  write_manage_service outbox "Inventory System Outbox Relay" relay_outbox ${OUTBOX_RELAY_ARGS}
+}
+
+write_jobs_service(){
+  if [[ "${RUN_JOB_WORKERS}" != "1" ]]; then
+    return 0
+  fi
+  write_manage_service jobs "Inventory System Job Workers" run_workers ${JOB_WORKER_ARGS}
+}
+
+write_reservation_service(){
+  if [[ "${RUN_RESERVATION_SWEEPER}" != "1" ]]; then
+    return 0
+  fi
+  write_manage_service reservations "Inventory System Reservation Sweeper" sweep_reservations --verbosity 0
+}
+
 write_nginx_conf(){
   log "Write nginx reverse proxy config"
   sudo mkdir -p /etc/nginx/conf.d
@@ -204,7 +285,7 @@ server {
     listen 80;
     server_name _;
 
-    client_max_body_size 20M;
+    client_max_body_size 200M;
 
     location /static/ {
         alias ${APP_DIR}/staticfiles/;
@@ -214,6 +295,7 @@ server {
 
     location / {
         proxy_pass http://inventory_app;
+        proxy_read_timeout ${GUNICORN_TIMEOUT}s;
         proxy_set_header Host \$host;
         proxy_set_header X-Real-IP \$remote_addr;
         proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
@@ -251,6 +333,9 @@ main(){
   setup_venv_and_deps
   django_prepare
   write_systemd_service
+  write_outbox_service
+  write_jobs_service
+  write_reservation_service
   write_nginx_conf
   self_check
 }
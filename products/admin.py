@@ -1,10 +1,109 @@
+import json
+
+from django.conf import settings
 from django.contrib import admin
-from .models import Warehouse, Item, StockMove, StockBalance, Unit, Partner
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from .models import (
+    Warehouse, Item, ItemUnit, StockMove, StockBalance, Unit, Partner, ApiToken, OutboxEvent, Job, Reservation, Lot,
+    LotBalance, Stocktake, StockDocument,
+)
+from .masterdata import master_data
+from .search import ITEM_SEARCH_FIELDS, MOVE_SEARCH_FIELDS, search_q
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    PostgreSQL 上先看查询计划估算的行数，超过 ADMIN_EXACT_COUNT_LIMIT 就直接用估算值，
+    不再对几千万行流水做 COUNT(*)；行数较少或其他数据库仍精确计数。
+    """
+
+    def _estimate(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return None
+        sql, params = queryset.order_by().query.get_compiler(using=queryset.db).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    @cached_property
+    def count(self):
+        limit = getattr(settings, "ADMIN_EXACT_COUNT_LIMIT", 0)
+        if limit:
+            estimate = self._estimate()
+            if estimate is not None and estimate > limit:
+                return estimate
+        return super().count
+
+
+class AutocompleteFilter(admin.FieldListFilter):
+    """外键筛选：用后台自带的 autocomplete 接口按需搜索，而不是把整张表渲染进侧栏。"""
+    template = "admin/autocomplete_filter.html"
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f"{field_path}__{field.target_field.name}__exact"
+        self.lookup_val = params.get(self.lookup_kwarg)
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.admin_site = model_admin.admin_site
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def choices(self, changelist):
+        # 第一项“全部”的链接同时作为选择后拼接参数的基础 URL
+        yield {
+            "selected": self.lookup_val is None,
+            "query_string": changelist.get_query_string(remove=[self.lookup_kwarg]),
+            "display": "全部",
+        }
+
+    def widget(self):
+        widget = AutocompleteSelect(
+            self.field,
+            self.admin_site,
+            attrs={"id": f"filter_{self.lookup_kwarg}", "style": "width: 100%"},
+        )
+        form_field = self.field.formfield(widget=widget, required=False)
+        return form_field.widget.render(self.lookup_kwarg, self.lookup_val)
+
+
+class IndexedSearchAdmin(admin.ModelAdmin):
+    """后台搜索改用 search_q：PostgreSQL 走 trigram 索引，SQLite 走 FTS5。"""
+
+    def get_search_results(self, request, queryset, search_term):
+        # search_q 只经过外键正向关联，不会产生重复行
+        return queryset.filter(search_q(self.model, search_term, self.search_fields)), False
+
+
+class LargeTableAdmin(IndexedSearchAdmin):
+    """流水 / 余额这类大表：估算总数、不统计全表行数、外键筛选走 autocomplete。"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @property
+    def media(self):
+        return super().media + AutocompleteSelect(None, self.admin_site).media
+
+
+def quantity_column(field, description):
+    """列表里按物品单位精度显示定点数量；编辑表单仍是千分之一单位的整数。"""
+    @admin.display(description=description, ordering=field)
+    def column(obj):
+        return master_data().format_item_quantity(obj.item_id, getattr(obj, field))
+    return column
 
 
 @admin.register(Unit)
 class UnitAdmin(admin.ModelAdmin):
-    list_display = ("name", "is_active", "created_at")
+    list_display = ("name", "precision", "is_active", "created_at")
     list_filter = ("is_active",)
     search_fields = ("name",)
     ordering = ("name",)
@@ -18,21 +117,42 @@ class WarehouseAdmin(admin.ModelAdmin):
     ordering = ("name",)
 
 
+class ItemUnitInline(admin.TabularInline):
+    """辅助单位：导入、接口按这些单位录入时换算成基本单位。"""
+    model = ItemUnit
+    extra = 0
+    autocomplete_fields = ("unit",)
+
+
 @admin.register(Item)
-class ItemAdmin(admin.ModelAdmin):
+class ItemAdmin(IndexedSearchAdmin):
     list_display = ("name", "unit", "category", "is_active", "created_at")
-    search_fields = ("name", "barcode")
+    search_fields = ITEM_SEARCH_FIELDS
     list_filter = ("unit", "is_active", "category")
+    list_select_related = ("unit",)
     ordering = ("name",)
     autocomplete_fields = ("unit",)
+    inlines = (ItemUnitInline,)
 
 
 @admin.register(StockMove)
-class StockMoveAdmin(admin.ModelAdmin):
-    list_display = ("created_at", "move_type", "warehouse", "item", "partner", "quantity", "unit_cost", "reference")
-    list_filter = ("move_type", "warehouse", "partner")
-    search_fields = ("item__name", "reference", "note", "partner__name")
-    ordering = ("-created_at", "-id")
+class StockMoveAdmin(LargeTableAdmin):
+    list_display = (
+        "created_at", "move_type", "warehouse", "item", "lot", "partner",
+        quantity_column("quantity", "数量"), "unit_cost", "reference",
+    )
+    list_filter = (
+        "move_type",
+        ("warehouse", AutocompleteFilter),
+        ("item", AutocompleteFilter),
+        ("partner", AutocompleteFilter),
+    )
+    # Item.__str__ 会用到仓库名
+    list_select_related = ("warehouse", "item__warehouse", "partner", "lot")
+    search_fields = MOVE_SEARCH_FIELDS
+    # id 与创建时间同序；按 -id 排序倒序扫主键索引，分页不用排序
+    ordering = ("-id",)
+    autocomplete_fields = ("warehouse", "item", "partner", "lot", "document")
 
     # ✅ 禁止修改已有流水（只能新增）
     def has_change_permission(self, request, obj=None):
@@ -45,11 +165,13 @@ class StockMoveAdmin(admin.ModelAdmin):
 
 
 @admin.register(StockBalance)
-class StockBalanceAdmin(admin.ModelAdmin):
-    list_display = ("warehouse", "item", "on_hand", "updated_at")
-    list_filter = ("warehouse",)
+class StockBalanceAdmin(LargeTableAdmin):
+    list_display = ("warehouse", "item", quantity_column("on_hand", "现存"), "updated_at")
+    list_filter = (("warehouse", AutocompleteFilter), ("item", AutocompleteFilter))
+    list_select_related = ("warehouse", "item__warehouse")
     search_fields = ("item__name",)
-    ordering = ("warehouse__name", "item__name")
+    # 按 (item, warehouse) 唯一索引的顺序，不再按关联表名称排序
+    ordering = ("item_id", "warehouse_id")
 
     # ✅ 禁止手动改余额（余额应由流水自动算出来）
     def has_add_permission(self, request):
@@ -65,3 +187,123 @@ class PartnerAdmin(admin.ModelAdmin):
     list_filter = ("is_active",)
     search_fields = ("name",)
     ordering = ("name",)
+
+
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+    list_display = ("name", "user", "is_active", "created_at", "last_used_at")
+    list_filter = ("is_active",)
+    search_fields = ("name", "user__username")
+    readonly_fields = ("key", "created_at", "last_used_at")
+    autocomplete_fields = ("user",)
+    list_select_related = ("user",)
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ("id", "topic", "key", "created_at", "delivered_at", "attempts")
+    list_filter = ("topic",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ("-id",)
+    readonly_fields = ("topic", "key", "payload", "created_at", "delivered_at", "attempts", "last_error")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "status", "priority", "run_at", "attempts", "created_by", "finished_at")
+    list_filter = ("status", "kind")
+    list_select_related = ("created_by",)
+    ordering = ("-id",)
+    readonly_fields = (
+        "kind", "payload", "status", "priority", "run_at", "attempts", "max_attempts", "locked_by",
+        "locked_at", "last_error", "result", "created_by", "created_at", "finished_at",
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Reservation)
+class ReservationAdmin(LargeTableAdmin):
+    list_display = (
+        "id", "item", "warehouse", quantity_column("quantity", "数量"), "status", "reference", "expires_at", "created_by",
+    )
+    list_filter = ("status", ("warehouse", AutocompleteFilter))
+    list_select_related = ("item", "warehouse", "created_by")
+    search_fields = ("reference",)
+    ordering = ("-id",)
+    readonly_fields = (
+        "item", "warehouse", "quantity", "status", "reference", "note", "expires_at",
+        "created_by", "created_at", "closed_at", "move",
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Lot)
+class LotAdmin(admin.ModelAdmin):
+    list_display = ("lot_no", "item", "expiry_date", "created_at")
+    list_select_related = ("item__warehouse",)
+    search_fields = ("lot_no",)
+    ordering = ("-id",)
+    autocomplete_fields = ("item",)
+
+
+@admin.register(LotBalance)
+class LotBalanceAdmin(LargeTableAdmin):
+    list_display = ("lot", "item", "warehouse", "expiry_date", quantity_column("on_hand", "结存"), "updated_at")
+    list_filter = (("warehouse", AutocompleteFilter), ("item", AutocompleteFilter))
+    list_select_related = ("lot", "item__warehouse", "warehouse")
+    search_fields = ("lot__lot_no",)
+    ordering = ("expiry_date", "id")
+
+    # 批次余额同样由流水算出
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(StockDocument)
+class StockDocumentAdmin(admin.ModelAdmin):
+    list_display = ("id", "doc_type", "reference", "line_count", "created_by", "created_at", "reverses")
+    list_filter = ("doc_type",)
+    list_select_related = ("created_by", "reverses")
+    search_fields = ("reference",)
+    ordering = ("-id",)
+    readonly_fields = ("doc_type", "reference", "note", "line_count", "created_by", "created_at", "reverses")
+
+    # 单据随批量写入生成，冲销在单据页面处理
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Stocktake)
+class StocktakeAdmin(admin.ModelAdmin):
+    list_display = ("id", "warehouse", "status", "created_by", "created_at", "approved_by", "closed_at")
+    list_filter = ("status", "warehouse")
+    list_select_related = ("warehouse", "created_by", "approved_by")
+    ordering = ("-id",)
+    readonly_fields = ("warehouse", "status", "created_by", "created_at", "approved_by", "closed_at")
+
+    # 明细与过账在盘点页面处理
+    def has_add_permission(self, request):
+        return False
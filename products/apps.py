@@ -1,4 +1,57 @@
 from django.apps import AppConfig
+from django.core import checks
+from django.db.models.signals import post_migrate
+
+
+def _repair_search_indexes(sender, using, **kwargs):
+    from django.db import connections
+
+    from .search import install_search_indexes
+
+    connection = connections[using]
+    if connection.vendor == "sqlite":
+        install_search_indexes(connection)
+
+
+def _sync_balance_triggers(sender, using, **kwargs):
+    from django.db import connections
+
+    from .balance_triggers import sync_balance_triggers
+    from .change_feed import install_change_seq_triggers
+
+    # 切换 STOCK_BALANCE_ENGINE 后执行 migrate 即生效；SQLite 重建表时丢失的触发器也在这里补齐
+    connection = connections[using]
+    if "products_stockmove" not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        columns = {column.name for column in connection.introspection.get_table_description(cursor, "products_stockmove")}
+    # 回退到 0030 之前时没有 change_seq 列：当前的触发器会写这一列，保留迁移装好的历史版本
+    if "change_seq" in columns:
+        sync_balance_triggers(connection)
+        install_change_seq_triggers(connection)
+
+
+@checks.register(checks.Tags.database)
+def check_balance_engine(app_configs, databases=None, **kwargs):
+    from django.db import connections
+
+    from .balance_triggers import balance_triggers_installed, trigger_engine_enabled
+
+    errors = []
+    for alias in databases or ():
+        connection = connections[alias]
+        if connection.vendor not in ("postgresql", "sqlite"):
+            continue
+        if "products_stockmove" not in connection.introspection.table_names():
+            continue
+        if balance_triggers_installed(connection) != trigger_engine_enabled():
+            # 用 Warning：Error 会挡住用来修复它的 migrate
+            errors.append(checks.Warning(
+                f"数据库 {alias} 的余额触发器与 STOCK_BALANCE_ENGINE 不一致，余额会漏记或重复记账",
+                hint="修改 STOCK_BALANCE_ENGINE 后执行 python manage.py migrate 同步触发器",
+                id="products.W001",
+            ))
+    return errors
 
 
 class ProductsConfig(AppConfig):
@@ -6,4 +59,6 @@ class ProductsConfig(AppConfig):
     name = 'products'
 
     def ready(self):
-        from . import signals  # noqa
\ No newline at end of file
+        from . import signals  # noqa
+        post_migrate.connect(_repair_search_indexes, sender=self)
+        post_migrate.connect(_sync_balance_triggers, sender=self)
@@ -0,0 +1,133 @@
+"""
+由数据库触发器维护库存余额（STOCK_BALANCE_ENGINE=trigger）。
+
+触发器在写入流水的同一条语句里按增量更新 ``StockBalance``：原生 SQL、``bulk_create``、
+``QuerySet.delete()`` 都不会漏记，也不需要每行回到 Python 重算。
+
+- PostgreSQL：语句级触发器 + 过渡表，一条语句涉及的流水按 (物品, 仓库) 汇总后一次 upsert；
+- SQLite（开发 / 测试）：行级触发器，逻辑相同。
+
+安装与卸载跟随配置：迁移和每次 migrate 之后都会按 STOCK_BALANCE_ENGINE 同步。
+"""
+from django.conf import settings
+
+ENGINE_SIGNAL = "signal"
+ENGINE_TRIGGER = "trigger"
+
+FUNCTION_NAME = "products_stockmove_balance"
+TRIGGER_EVENTS = {
+    "INSERT": "REFERENCING NEW TABLE AS new_rows",
+    "UPDATE": "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    "DELETE": "REFERENCING OLD TABLE AS old_rows",
+}
+SQLITE_TRIGGERS = ("products_stockmove_balance_ai", "products_stockmove_balance_au", "products_stockmove_balance_ad")
+
+_PG_UPSERT = """
+        INSERT INTO products_stockbalance AS b (item_id, warehouse_id, on_hand, reserved, last_move_id, updated_at, change_seq)
+        SELECT item_id, warehouse_id, SUM(delta)::bigint, 0, MAX(last_id), now(), 0
+        FROM ({changes}) AS changes
+        GROUP BY item_id, warehouse_id
+        ORDER BY item_id, warehouse_id
+        ON CONFLICT (item_id, warehouse_id) DO UPDATE SET
+            on_hand = b.on_hand + EXCLUDED.on_hand,
+            last_move_id = GREATEST(b.last_move_id, EXCLUDED.last_move_id),
+            updated_at = EXCLUDED.updated_at;"""
+_PG_NEW = "SELECT item_id, warehouse_id, quantity AS delta, id AS last_id FROM new_rows"
+_PG_OLD = "SELECT item_id, warehouse_id, -quantity AS delta, 0 AS last_id FROM old_rows"
+
+_SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+_SQLITE_ADD = f"""
+    INSERT INTO products_stockbalance (item_id, warehouse_id, on_hand, reserved, last_move_id, updated_at, change_seq)
+    VALUES (new.item_id, new.warehouse_id, new.quantity, 0, new.id, {_SQLITE_NOW}, 0)
+    ON CONFLICT (item_id, warehouse_id) DO UPDATE SET
+        on_hand = on_hand + excluded.on_hand,
+        last_move_id = MAX(last_move_id, excluded.last_move_id),
+        updated_at = excluded.updated_at;"""
+_SQLITE_SUBTRACT = f"""
+    UPDATE products_stockbalance
+    SET on_hand = on_hand - old.quantity, updated_at = {_SQLITE_NOW}
+    WHERE item_id = old.item_id AND warehouse_id = old.warehouse_id;"""
+
+
+def trigger_engine_enabled():
+    return getattr(settings, "STOCK_BALANCE_ENGINE", ENGINE_SIGNAL) == ENGINE_TRIGGER
+
+
+def _postgres_statements():
+    # 三个分支各自只引用本事件存在的过渡表（plpgsql 按需编译语句）
+    function = f"""
+CREATE OR REPLACE FUNCTION {FUNCTION_NAME}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN{_PG_UPSERT.format(changes=_PG_NEW)}
+    ELSIF TG_OP = 'UPDATE' THEN{_PG_UPSERT.format(changes=f"{_PG_NEW} UNION ALL {_PG_OLD}")}
+    ELSE{_PG_UPSERT.format(changes=_PG_OLD)}
+    END IF;
+    RETURN NULL;
+END;
+$$"""
+    statements = [function]
+    for event, referencing in TRIGGER_EVENTS.items():
+        name = f"{FUNCTION_NAME}_{event.lower()}"
+        statements.append(f'DROP TRIGGER IF EXISTS "{name}" ON products_stockmove')
+        statements.append(
+            f'CREATE TRIGGER "{name}" AFTER {event} ON products_stockmove '
+            f"{referencing} FOR EACH STATEMENT EXECUTE FUNCTION {FUNCTION_NAME}()"
+        )
+    return statements
+
+
+def _sqlite_statements():
+    ai, au, ad = SQLITE_TRIGGERS
+    # 先删后建：触发器体随版本变化时，已安装的旧版本也会被替换
+    return [f"DROP TRIGGER IF EXISTS {name}" for name in SQLITE_TRIGGERS] + [
+        f"CREATE TRIGGER {ai} AFTER INSERT ON products_stockmove BEGIN{_SQLITE_ADD} END",
+        f"CREATE TRIGGER {au} AFTER UPDATE OF item_id, warehouse_id, quantity "
+        f"ON products_stockmove BEGIN{_SQLITE_SUBTRACT}{_SQLITE_ADD} END",
+        f"CREATE TRIGGER {ad} AFTER DELETE ON products_stockmove BEGIN{_SQLITE_SUBTRACT} END",
+    ]
+
+
+def install_balance_triggers(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            for statement in _postgres_statements():
+                cursor.execute(statement)
+        elif connection.vendor == "sqlite":
+            for statement in _sqlite_statements():
+                cursor.execute(statement)
+
+
+def uninstall_balance_triggers(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            for event in TRIGGER_EVENTS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS "{FUNCTION_NAME}_{event.lower()}" ON products_stockmove')
+            cursor.execute(f"DROP FUNCTION IF EXISTS {FUNCTION_NAME}()")
+        elif connection.vendor == "sqlite":
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def balance_triggers_installed(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                "SELECT COUNT(*) FROM pg_trigger WHERE tgrelid = 'products_stockmove'::regclass AND tgname LIKE %s",
+                [f"{FUNCTION_NAME}_%"],
+            )
+            return cursor.fetchone()[0] == len(TRIGGER_EVENTS)
+        if connection.vendor == "sqlite":
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+                list(SQLITE_TRIGGERS),
+            )
+            return cursor.fetchone()[0] == len(SQLITE_TRIGGERS)
+    return False
+
+
+def sync_balance_triggers(connection):
+    """按 STOCK_BALANCE_ENGINE 安装或卸载触发器；可重复执行。"""
+    if trigger_engine_enabled():
+        install_balance_triggers(connection)
+    else:
+        uninstall_balance_triggers(connection)
@@ -0,0 +1,68 @@
+"""
+进程内物品索引：供输入联想（typeahead）使用，避免每次渲染都下发完整物品列表。
+
+索引按名称（小写）排序，前缀匹配走二分查找，不足时再做子串扫描。
+索引挂在主数据快照上，随快照（见 products.masterdata）一起失效。
+"""
+import threading
+from bisect import bisect_left
+
+from products.masterdata import master_data
+
+
+class ItemIndex:
+    __slots__ = ("keys", "entries")
+
+    def __init__(self, rows):
+        # entries: (小写名称, id, 名称, warehouse_id, 单位名称)
+        self.entries = sorted(
+            (name.lower(), item_id, name, warehouse_id, unit_name or "")
+            for item_id, name, warehouse_id, unit_name in rows
+        )
+        self.keys = [entry[0] for entry in self.entries]
+
+    def search(self, q, warehouse_ids, limit):
+        """先取前缀匹配，再补充子串匹配；``warehouse_ids`` 为允许的仓库集合。"""
+        q = q.strip().lower()
+        results = []
+        seen = set()
+
+        # 从二分位置按下标向后走，不复制列表尾部
+        entries = self.entries
+        for position in range(bisect_left(self.keys, q) if q else 0, len(entries)):
+            entry = entries[position]
+            if q and not entry[0].startswith(q):
+                break
+            if entry[3] in warehouse_ids:
+                results.append(entry)
+                seen.add(entry[1])
+                if len(results) >= limit:
+                    return results
+
+        if q:
+            for entry in self.entries:
+                if entry[1] in seen or entry[3] not in warehouse_ids:
+                    continue
+                if q in entry[0]:
+                    results.append(entry)
+                    if len(results) >= limit:
+                        break
+        return results
+
+
+_lock = threading.Lock()
+
+
+def item_index() -> ItemIndex:
+    data = master_data()
+    index = data.item_index
+    if index is None:
+        with _lock:
+            index = data.item_index
+            if index is None:
+                index = data.item_index = ItemIndex(
+                    (item.id, item.name, item.warehouse_id, data.unit_name(item.unit_id))
+                    for item in data.items.values()
+                    if item.is_active and item.warehouse_id is not None
+                )
+    return index
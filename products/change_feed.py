@@ -0,0 +1,110 @@
+"""
+变更流（/api/changes/）的提交顺序游标。
+
+流水 id 在插入时分配，不按提交顺序：大事务里先拿到的小 id 可能比后面的大 id 晚提交，
+按 id 前移的游标会把它跳过。这里给流水和余额的每次写入打上 ``change_seq``，并提供低水位：
+
+- PostgreSQL：``change_seq`` 为写入事务的事务号，低水位取当前快照的 xmin，
+  小于它的事务都已结束，之后不会再出现更小的 ``change_seq``；
+- SQLite（开发 / 测试）：同一时刻只有一个写事务，``change_seq`` 取两表当前最大值加一，
+  低水位即已提交的最大值加一。
+
+余额行每次更新都会重新打号，删除流水导致的余额变化同样会进入变更流。
+触发器与迁移 / 每次 migrate 之后一起同步，SQLite 重建表时丢失的也会补齐。
+"""
+
+from django.db import connections
+
+FUNCTION_NAME = "products_change_seq"
+TABLES = ("products_stockmove", "products_stockbalance")
+
+_SQLITE_NEXT = """(
+    SELECT COALESCE(MAX(seq), 0) + 1 FROM (
+        SELECT MAX(change_seq) AS seq FROM products_stockmove
+        UNION ALL
+        SELECT MAX(change_seq) FROM products_stockbalance
+    )
+)"""
+
+
+def _sqlite_trigger_names(table):
+    return (f"{table}_change_seq_ai", f"{table}_change_seq_au")
+
+
+def _postgres_statements():
+    statements = [f"""
+CREATE OR REPLACE FUNCTION {FUNCTION_NAME}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.change_seq := pg_current_xact_id()::text::bigint;
+    RETURN NEW;
+END;
+$$"""]
+    for table in TABLES:
+        statements.append(f'DROP TRIGGER IF EXISTS "{FUNCTION_NAME}" ON {table}')
+        statements.append(
+            f'CREATE TRIGGER "{FUNCTION_NAME}" BEFORE INSERT OR UPDATE ON {table} '
+            f"FOR EACH ROW EXECUTE FUNCTION {FUNCTION_NAME}()"
+        )
+    return statements
+
+
+def _sqlite_statements():
+    statements = []
+    for table in TABLES:
+        ai, au = _sqlite_trigger_names(table)
+        stamp = f"UPDATE {table} SET change_seq = {_SQLITE_NEXT} WHERE id = new.id;"
+        statements += [
+            f"DROP TRIGGER IF EXISTS {ai}",
+            f"DROP TRIGGER IF EXISTS {au}",
+            f"CREATE TRIGGER {ai} AFTER INSERT ON {table} BEGIN {stamp} END",
+            # 打号本身改的是 change_seq，WHEN 条件让它不再触发自己
+            f"CREATE TRIGGER {au} AFTER UPDATE ON {table} "
+            f"WHEN new.change_seq IS old.change_seq BEGIN {stamp} END",
+        ]
+    return statements
+
+
+def install_change_seq_triggers(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            for statement in _postgres_statements():
+                cursor.execute(statement)
+        elif connection.vendor == "sqlite":
+            for statement in _sqlite_statements():
+                cursor.execute(statement)
+
+
+def uninstall_change_seq_triggers(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            for table in TABLES:
+                cursor.execute(f'DROP TRIGGER IF EXISTS "{FUNCTION_NAME}" ON {table}')
+            cursor.execute(f"DROP FUNCTION IF EXISTS {FUNCTION_NAME}()")
+        elif connection.vendor == "sqlite":
+            for table in TABLES:
+                for name in _sqlite_trigger_names(table):
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def low_water_mark(using):
+    """change_seq 小于返回值的写入都已提交且在 ``using`` 库上可见，之后也不会再出现。"""
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+        else:
+            cursor.execute(f"SELECT {_SQLITE_NEXT}")
+        return cursor.fetchone()[0]
+
+
+def encode_cursor(seq, move_id):
+    return f"{seq}-{move_id}"
+
+
+def decode_cursor(value):
+    """解析 ``<change_seq>-<流水 id>``；缺省或无法识别时从头开始。"""
+    try:
+        seq, move_id = (int(part) for part in (value or "").split("-"))
+    except ValueError:
+        return 0, 0
+    return max(0, seq), max(0, move_id)
@@ -0,0 +1,6 @@
+"""
+带连接池的 PostgreSQL 后端（ENGINE = "products.db_pool"）。
+
+Django 4.2 + psycopg2 没有内置连接池，这里在进程内维护一个有上限的池：
+请求结束时 Django 关闭连接即归还到池，取出前对闲置过久的连接做健康检查。
+"""
@@ -0,0 +1,17 @@
+from django.db.backends.postgresql import base
+
+from products.db_pool.pool import get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def _pool(self):
+        return get_pool(self.alias, self.settings_dict)
+
+    def get_new_connection(self, conn_params):
+        parent = super().get_new_connection
+        return self._pool().getconn(lambda: parent(conn_params))
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self._pool().putconn(self.connection)
@@ -0,0 +1,232 @@
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+
+# psycopg2 连接事务状态（psycopg2.extensions.TRANSACTION_STATUS_*）
+_STATUS_IDLE = 0
+_STATUS_UNKNOWN = 4
+
+
+class PoolTimeout(OperationalError):
+    """等待空闲连接超时。"""
+
+
+class ConnectionPool:
+    """
+    线程安全、有上限的连接池。
+
+    - 最多 ``max_size`` 个连接，耗尽时最多等待 ``timeout`` 秒；
+    - 取连接时池内不足 ``min_size`` 个会先补齐，补出的连接放入空闲队列；
+    - 闲置超过 ``check_after`` 秒的连接在取出前先执行 ``SELECT 1``；
+    - 闲置超过 ``max_idle`` 秒（保留 ``min_size`` 个）或存活超过 ``max_lifetime`` 秒的连接会被关闭。
+    """
+
+    def __init__(self, min_size=0, max_size=10, timeout=10.0, check_after=30.0, max_idle=600.0, max_lifetime=3600.0):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, created_at, returned_at)，右端为最近归还
+        self._created_at = {}
+        self._size = 0
+        self._stats = {
+            "connections_created": 0,
+            "connections_discarded": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "wait_ms_total": 0.0,
+            "timeouts": 0,
+            "health_checks": 0,
+            "health_check_failures": 0,
+        }
+
+    # ---- internal ----
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._created_at.pop(id(conn), None)
+            self._size -= 1
+            self._stats["connections_discarded"] += 1
+            self._cond.notify()
+
+    def _trim_idle(self, now):
+        """关闭闲置过久的连接；需持有锁。返回需要在锁外关闭的连接。"""
+        expired = []
+        while len(self._idle) > self.min_size and now - self._idle[0][2] > self.max_idle:
+            expired.append(self._idle.popleft()[0])
+        return expired
+
+    def _count(self, name, value=1):
+        with self._cond:
+            self._stats[name] += value
+
+    def _healthy(self, conn, created_at, returned_at, now):
+        if conn.closed:
+            return False
+        if now - created_at > self.max_lifetime:
+            return False
+        if now - returned_at < self.check_after:
+            return True
+        self._count("health_checks")
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            if conn.info.transaction_status != _STATUS_IDLE:
+                conn.rollback()
+            return True
+        except Exception:
+            self._count("health_check_failures")
+            return False
+
+    def _fill(self, factory):
+        """补齐到 ``min_size`` 个连接；新建的连接直接进入空闲队列。"""
+        with self._cond:
+            missing = max(0, self.min_size - self._size)
+            self._size += missing
+        for created in range(missing):
+            try:
+                conn = factory()
+            except Exception:
+                # 补齐失败不影响本次取连接，下次再补
+                with self._cond:
+                    self._size -= missing - created
+                    self._cond.notify_all()
+                return
+            now = time.monotonic()
+            with self._cond:
+                self._created_at[id(conn)] = now
+                self._stats["connections_created"] += 1
+                self._idle.appendleft((conn, now, now))
+                self._cond.notify()
+
+    # ---- public ----
+
+    def getconn(self, factory):
+        """取一个连接；池内没有可用连接时用 ``factory()`` 新建。"""
+        if self._size < self.min_size:
+            self._fill(factory)
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        while True:
+            candidate = None
+            create = False
+            with self._cond:
+                for conn in self._trim_idle(time.monotonic()):
+                    self._size -= 1
+                    self._stats["connections_discarded"] += 1
+                    self._created_at.pop(id(conn), None)
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                if self._idle:
+                    candidate = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                    create = True
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"数据库连接池已满（{self.max_size}），等待 {self.timeout:g} 秒后仍无空闲连接"
+                        )
+                    if not waited:
+                        waited = True
+                        self._stats["waits"] += 1
+                    self._cond.wait(remaining)
+                    continue
+
+            if create:
+                try:
+                    conn = factory()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created_at[id(conn)] = time.monotonic()
+                    self._stats["connections_created"] += 1
+                break
+
+            conn, created_at, returned_at = candidate
+            if self._healthy(conn, created_at, returned_at, time.monotonic()):
+                break
+            self._discard(conn)
+
+        with self._cond:
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["wait_ms_total"] += (time.monotonic() - started) * 1000
+        return conn
+
+    def putconn(self, conn):
+        """归还连接：残留事务先回滚，状态异常的连接直接关闭。"""
+        if conn.closed:
+            self._discard(conn)
+            return
+        try:
+            status = conn.info.transaction_status
+            if status == _STATUS_UNKNOWN:
+                raise OperationalError("connection in unknown state")
+            if status != _STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+
+        now = time.monotonic()
+        with self._cond:
+            created_at = self._created_at.get(id(conn), now)
+            if now - created_at <= self.max_lifetime:
+                self._idle.append((conn, created_at, now))
+                self._cond.notify()
+                return
+        self._discard(conn)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def metrics(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                **self._stats,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict):
+    pool = _pools.get(alias)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(alias)
+            if pool is None:
+                pool = _pools[alias] = ConnectionPool(**settings_dict.get("POOL", {}))
+    return pool
+
+
+def all_pool_metrics():
+    return {alias: pool.metrics() for alias, pool in list(_pools.items())}
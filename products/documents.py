@@ -0,0 +1,160 @@
+"""
+库存单据（StockDocument）。
+
+一次导入、接口批量、调拨或盘点过账先开一张单据，写入的流水都带 ``document_id``；
+按单据查流水、整单冲销都走 stockmove 上的 document 索引，只读写本单的流水，
+不再按 ``BATCH-<时间>-<用户>`` 这样的单号字符串扫描。
+
+冲销把整单流水取反（出入库记为调整），经 ``bulk_post_moves()`` 一次写入新的冲销单；
+冲销单与原单一对一关联，同一张单据只能冲销一次。
+"""
+import uuid
+from collections import defaultdict
+
+from django.db import transaction
+
+from products.ledger import bulk_post_moves, lock_balances
+from products.masterdata import master_data
+from products.models import DocumentType, LotBalance, MoveType, StockDocument, StockMove
+
+POST_BATCH_SIZE = 2000
+
+# 流水类型对应的单据类型（界面单条录入和单一类型的批量）
+DOCUMENT_TYPES = {
+    "INBOUND": DocumentType.INBOUND,
+    "OUTBOUND": DocumentType.OUTBOUND,
+    "ADJUST": DocumentType.ADJUST,
+    "TRANSFER": DocumentType.TRANSFER,
+}
+
+
+class DocumentError(Exception):
+    """单据不存在、已冲销，或冲销后库存会变为负数。"""
+
+
+def open_document(doc_type, *, user=None, reference="", note=""):
+    """新建单据头；流水经 ``bulk_post_moves(..., document=...)`` 挂到单据下并累计 line_count。"""
+    return StockDocument.objects.create(
+        doc_type=doc_type,
+        reference=reference[:100],
+        note=note,
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+
+
+def document_type_for(move_types):
+    """一批流水的单据类型：单一流水类型按类型开单，混合类型记为接口批量。"""
+    move_types = set(move_types)
+    if len(move_types) == 1:
+        return DOCUMENT_TYPES.get(move_types.pop(), DocumentType.BATCH)
+    return DocumentType.BATCH
+
+
+def document_warehouse_ids(document):
+    """单据涉及的仓库 id 集合。"""
+    return set(
+        StockMove.objects
+        .filter(document_id=document.pk)
+        .order_by()
+        .values_list("warehouse_id", flat=True)
+        .distinct()
+    )
+
+
+def _check_available(deltas):
+    """冲销中减少库存的 (物品, 仓库) 不能把可用量扣成负数。"""
+    decreasing = {key: delta for key, delta in deltas.items() if delta < 0}
+    locked = lock_balances(decreasing)
+    data = master_data()
+    for key, delta in sorted(decreasing.items()):
+        on_hand, reserved = locked.get(key, (0, 0))
+        available = on_hand - reserved
+        if available + delta < 0:
+            item = data.items.get(key[0])
+            warehouse = data.warehouses.get(key[1])
+            raise DocumentError(
+                f"{warehouse.name if warehouse else key[1]} - {item.name if item else key[0]} "
+                f"可用 {data.format_item_quantity(key[0], available)}，"
+                f"冲销需扣减 {data.format_item_quantity(key[0], -delta)}"
+            )
+
+
+def _check_lots(deltas):
+    decreasing = {key: delta for key, delta in deltas.items() if delta < 0}
+    if not decreasing:
+        return
+    on_hand = {
+        (lot_id, warehouse_id): value
+        for lot_id, warehouse_id, value in LotBalance.objects
+        .select_for_update()
+        .filter(
+            lot_id__in={lot_id for lot_id, _ in decreasing},
+            warehouse_id__in={warehouse_id for _, warehouse_id in decreasing},
+        )
+        .order_by("pk")
+        .values_list("lot_id", "warehouse_id", "on_hand")
+    }
+    for key, delta in sorted(decreasing.items()):
+        if on_hand.get(key, 0) + delta < 0:
+            raise DocumentError(f"批次 #{key[0]} 在仓库 #{key[1]} 的结存不足，无法冲销")
+
+
+def reverse_document(document_id, *, user=None, note=""):
+    """
+    整单冲销：逐条取反原单流水（保留批次、合作方），写入一张冲销单并返回。
+    出入库的冲销记为调整（ADJUST），不出现负数的入库、正数的出库；调拨仍记为调拨，
+    成对换新 transfer_id。冲销单经 ``reverses`` 关联原单，流水备注原单号。
+    冲销后可用量或批次结存会变为负数时整单拒绝。
+    """
+    with transaction.atomic():
+        document = StockDocument.objects.select_for_update().filter(pk=document_id).first()
+        if document is None:
+            raise DocumentError("单据不存在")
+        if document.doc_type == DocumentType.REVERSAL:
+            raise DocumentError("冲销单不能再冲销")
+        if StockDocument.objects.filter(reverses_id=document.pk).exists():
+            raise DocumentError(f"{document.number} 已冲销")
+
+        originals = list(
+            StockMove.objects
+            .filter(document_id=document.pk)
+            .order_by("pk")
+            .values_list("move_type", "item_id", "warehouse_id", "lot_id", "partner_id", "quantity", "transfer_id")
+        )
+        if not originals:
+            raise DocumentError(f"{document.number} 没有流水")
+
+        deltas = defaultdict(int)
+        lot_deltas = defaultdict(int)
+        for _, item_id, warehouse_id, lot_id, _, quantity, _ in originals:
+            deltas[(item_id, warehouse_id)] -= quantity
+            if lot_id is not None:
+                lot_deltas[(lot_id, warehouse_id)] -= quantity
+        _check_available(deltas)
+        _check_lots(lot_deltas)
+
+        reversal = StockDocument.objects.create(
+            doc_type=DocumentType.REVERSAL,
+            reverses=document,
+            reference=document.number,
+            note=note or f"冲销 {document.number}",
+            created_by=user if user is not None and user.is_authenticated else None,
+        )
+        transfer_ids = defaultdict(uuid.uuid4)
+        moves = [
+            StockMove(
+                move_type=MoveType.TRANSFER if move_type == MoveType.TRANSFER else MoveType.ADJUST,
+                item_id=item_id,
+                warehouse_id=warehouse_id,
+                lot_id=lot_id,
+                partner_id=partner_id,
+                quantity=-quantity,
+                reference=document.number,
+                note=reversal.note,
+                transfer_id=transfer_ids[transfer_id] if transfer_id else None,
+            )
+            for move_type, item_id, warehouse_id, lot_id, partner_id, quantity, transfer_id in originals
+        ]
+        bulk_post_moves(moves, batch_size=POST_BATCH_SIZE, document=reversal)
+        reversal.line_count = len(moves)
+    return reversal
@@ -0,0 +1,253 @@
+"""
+库存变动事件：流水提交后（transaction.on_commit）把受影响的余额推给 SSE 订阅者。
+
+- local：进程内广播，适合开发、测试和单进程部署；
+- postgres：通过 LISTEN/NOTIFY 在多个 worker / 多台机器之间扇出。
+"""
+import asyncio
+import json
+import logging
+import os
+import select
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from products.models import StockBalance
+from products.quantities import quantity_json
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "inventory_events"
+# 一次提交涉及的 (物品, 仓库) 超过这个数量时只发 refresh，由页面自行刷新
+MAX_KEYS_PER_COMMIT = 200
+QUEUE_SIZE = 1000
+
+
+class Subscription:
+    """一个 SSE 连接的事件队列，只能在创建它的事件循环里读取。"""
+
+    def __init__(self, broker, warehouse_ids):
+        self.broker = broker
+        self.warehouse_ids = warehouse_ids
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def _offer(self, event):
+        if self.queue.full():
+            # 客户端跟不上：丢弃积压，让页面整体刷新
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "refresh"})
+            return
+        self.queue.put_nowait(event)
+
+    def deliver(self, event):
+        warehouse_id = event.get("warehouse_id")
+        if warehouse_id is not None and warehouse_id not in self.warehouse_ids:
+            return
+        self.loop.call_soon_threadsafe(self._offer, event)
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def subscribe(self, warehouse_ids):
+        subscription = Subscription(self, set(warehouse_ids))
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def dispatch(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.deliver(event)
+            except RuntimeError:
+                # 事件循环已关闭：连接已断开
+                self.unsubscribe(subscription)
+
+    def publish(self, event):
+        self.dispatch(event)
+
+
+class PostgresBroker(LocalBroker):
+    """
+    publish 走 pg_notify；每个进程一个后台线程 LISTEN 并分发给本进程的订阅者。
+
+    监听线程只在本进程有订阅者时 LISTEN，没有时 UNLISTEN；发布方据此从 pg_stat_activity
+    判断各进程是否还有订阅者，没有人听时提交就不再查余额、发 NOTIFY。
+    """
+    LISTEN_SQL = f"LISTEN {NOTIFY_CHANNEL}"
+    # 其他进程有无订阅者的查询结果缓存秒数
+    PRESENCE_TTL = 2
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_w, False)
+        self._presence = (0.0, False)
+
+    def has_subscribers(self):
+        if self._subscribers:
+            return True
+        checked_at, listening = self._presence
+        if time.monotonic() - checked_at < self.PRESENCE_TTL:
+            return listening
+        with connection.cursor() as cursor:
+            # 监听连接执行完 LISTEN 后一直空闲，其最后一条语句即当前状态；UNLISTEN 后不再匹配
+            cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM pg_stat_activity "
+                "WHERE datname = current_database() AND pid <> pg_backend_pid() AND query = %s)",
+                [self.LISTEN_SQL],
+            )
+            listening = cursor.fetchone()[0]
+        self._presence = (time.monotonic(), listening)
+        return listening
+
+    def publish(self, event):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [NOTIFY_CHANNEL, json.dumps(event)])
+
+    def subscribe(self, warehouse_ids):
+        subscription = super().subscribe(warehouse_ids)
+        self._ensure_listener()
+        self._wakeup()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        super().unsubscribe(subscription)
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except BlockingIOError:
+            # 管道里已有未读的唤醒
+            pass
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name="inventory-events", daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        import psycopg2
+        import psycopg2.extensions
+
+        params = connections["default"].get_connection_params()
+        while True:
+            try:
+                conn = psycopg2.connect(**params)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                listening = False
+                while True:
+                    wanted = bool(self._subscribers)
+                    if wanted != listening:
+                        with conn.cursor() as cursor:
+                            cursor.execute(self.LISTEN_SQL if wanted else f"UN{self.LISTEN_SQL}")
+                        listening = wanted
+                    readable, _, _ = select.select([conn, self._wakeup_r], [], [], 5)
+                    if self._wakeup_r in readable:
+                        os.read(self._wakeup_r, 4096)
+                    if conn not in readable:
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.dispatch(json.loads(notify.payload))
+            except Exception:
+                logger.exception("LISTEN %s 连接中断，5 秒后重连", NOTIFY_CHANNEL)
+                time.sleep(5)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                kind = getattr(settings, "EVENT_BROKER", "local")
+                _broker = PostgresBroker() if kind == "postgres" else LocalBroker()
+    return _broker
+
+
+def balance_event(item_id, warehouse_id, on_hand, reserved, updated_at):
+    return {
+        "type": "balance",
+        "item_id": item_id,
+        "warehouse_id": warehouse_id,
+        "on_hand": quantity_json(on_hand),
+        "reserved": quantity_json(reserved),
+        "available": quantity_json(on_hand - reserved),
+        "updated_at": updated_at.isoformat() if updated_at else None,
+        "updated_at_display": timezone.localtime(updated_at).strftime("%Y-%m-%d %H:%M") if updated_at else "--",
+    }
+
+
+def replay_balance_events(warehouse_ids, since):
+    """
+    断线重连时补发：``change_seq >= since`` 的余额（见 products.change_feed）。
+
+    since 为之前推送的事件 id（低水位），断线期间提交的变动都会在内；太多时只发 refresh。
+    """
+    rows = list(
+        StockBalance.objects.filter(warehouse_id__in=warehouse_ids, change_seq__gte=since)
+        .order_by("change_seq", "id")
+        .values_list("item_id", "warehouse_id", "on_hand", "reserved", "updated_at")[:MAX_KEYS_PER_COMMIT + 1]
+    )
+    if len(rows) > MAX_KEYS_PER_COMMIT:
+        return [{"type": "refresh"}]
+    return [balance_event(*row) for row in rows]
+
+
+def _publish_balances(keys):
+    broker = get_broker()
+    if not broker.has_subscribers():
+        return
+    try:
+        if len(keys) > MAX_KEYS_PER_COMMIT:
+            broker.publish({"type": "refresh"})
+            return
+        rows = StockBalance.objects.filter(
+            item_id__in={item_id for item_id, _ in keys},
+            warehouse_id__in={warehouse_id for _, warehouse_id in keys},
+        ).values_list("item_id", "warehouse_id", "on_hand", "reserved", "updated_at")
+        for item_id, warehouse_id, on_hand, reserved, updated_at in rows:
+            if (item_id, warehouse_id) in keys:
+                broker.publish(balance_event(item_id, warehouse_id, on_hand, reserved, updated_at))
+    except Exception:
+        # 推送失败不影响已提交的业务
+        logger.exception("余额变动事件发布失败")
+
+
+def notify_balances(keys):
+    """在当前事务提交后推送这些 (item_id, warehouse_id) 的最新余额。"""
+    keys = frozenset(keys)
+    if keys:
+        transaction.on_commit(partial(_publish_balances, keys))
@@ -10,7 +10,7 @@ class WarehouseForm(forms.ModelForm):
 class UnitForm(forms.ModelForm):
     class Meta:
         model = Unit
-        fields = ["name", "is_active"]
+        fields = ["name", "precision", "is_active"]
 
 
 class PartnerForm(forms.ModelForm):
@@ -0,0 +1,108 @@
+"""
+防重复提交。
+
+表单令牌是签名后的无状态字符串（用户 + 用途 + 随机数），渲染页面时不写 session；
+提交时校验签名，再把随机数登记到 IdempotencyKey，唯一索引保证同一令牌只生效一次。
+接口客户端通过 ``Idempotency-Key`` 请求头使用同一张表，并保存首次响应用于重放。
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+
+from products.models import IdempotencyKey
+
+FORM_TOKEN_SALT = "products.idempotency.form"
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 128
+
+
+def _ttl():
+    return timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS)
+
+
+def claim(user, scope, key):
+    """登记一次提交；首次返回新记录，重复（且未过期）返回 None。"""
+    now = timezone.now()
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    user=user,
+                    scope=scope,
+                    key=key,
+                    expires_at=now + _ttl(),
+                )
+        except IntegrityError:
+            # 过期记录视为不存在：删掉后再试一次
+            deleted, _ = IdempotencyKey.objects.filter(
+                user=user, scope=scope, key=key, expires_at__lte=now,
+            ).delete()
+            if not deleted:
+                return None
+    return None
+
+
+def issue_form_token(user, scope: str) -> str:
+    return signing.dumps(
+        {"u": user.pk, "s": scope, "n": uuid.uuid4().hex},
+        salt=FORM_TOKEN_SALT,
+    )
+
+
+def verify_form_token(request, scope: str) -> bool:
+    token = (request.POST.get("form_token") or "").strip()
+    if not token:
+        return False
+    try:
+        data = signing.loads(
+            token,
+            salt=FORM_TOKEN_SALT,
+            max_age=settings.IDEMPOTENCY_TTL_SECONDS,
+        )
+    except signing.BadSignature:
+        return False
+    if data.get("u") != request.user.pk or data.get("s") != scope:
+        return False
+    return claim(request.user, f"form:{scope}", data["n"]) is not None
+
+
+class _Duplicate(Exception):
+    pass
+
+
+def idempotent_json(request, scope, handler):
+    """
+    按 Idempotency-Key 请求头执行 ``handler() -> (status, body)`` 并返回 JsonResponse。
+
+    登记与业务写入在同一事务中：处理失败抛异常时登记一并回滚，可用同一 key 重试；
+    已完成的 key 直接返回首次的响应。没有请求头时直接执行。
+    """
+    key = (request.headers.get(IDEMPOTENCY_HEADER) or "").strip()
+    if not key:
+        status, body = handler()
+        return JsonResponse(body, status=status)
+    if len(key) > MAX_KEY_LENGTH:
+        return JsonResponse({"error": f"{IDEMPOTENCY_HEADER} 最长 {MAX_KEY_LENGTH} 个字符"}, status=400)
+
+    try:
+        with transaction.atomic():
+            record = claim(request.user, scope, key)
+            if record is None:
+                raise _Duplicate
+            status, body = handler()
+            record.response_status = status
+            record.response_body = body
+            record.save(update_fields=["response_status", "response_body"])
+    except _Duplicate:
+        record = IdempotencyKey.objects.filter(user=request.user, scope=scope, key=key).first()
+        if record is None or record.response_status is None:
+            return JsonResponse({"error": f"相同 {IDEMPOTENCY_HEADER} 的请求正在处理"}, status=409)
+        response = JsonResponse(record.response_body, status=record.response_status)
+        response["Idempotent-Replayed"] = "true"
+        return response
+    return JsonResponse(body, status=status)
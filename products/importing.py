@@ -0,0 +1,342 @@
+"""
+文件导入（CSV / XLSX）：逐行流式读取，按块校验并批量写入。
+
+整个导入在一个事务里完成；出现任何错误行则整体回滚，只返回前若干条错误明细，
+不会把整份文件或全部错误留在内存里。
+"""
+import csv
+import io
+import zipfile
+
+from django.db import transaction
+
+from products.documents import DOCUMENT_TYPES, open_document
+from products.ledger import bulk_post_moves, lock_balances
+from products.lots import clean_lot, resolve_lots, split_fefo
+from products.masterdata import master_data
+from products.models import MoveType, StockMove
+from products.transfers import post_transfers
+
+CHUNK_SIZE = 2000
+MAX_REPORTED_ERRORS = 200
+
+HEADER_ALIASES = {
+    "仓库": "warehouse",
+    "调出仓库": "warehouse",
+    "warehouse": "warehouse",
+    "warehouse_id": "warehouse_id",
+    "调入仓库": "to_warehouse",
+    "to_warehouse": "to_warehouse",
+    "to_warehouse_id": "to_warehouse_id",
+    "物品": "item",
+    "item": "item",
+    "item_id": "item_id",
+    "数量": "quantity",
+    "quantity": "quantity",
+    "单位": "unit",
+    "unit": "unit",
+    "合作方": "partner",
+    "partner": "partner",
+    "partner_id": "partner_id",
+    "单号": "reference",
+    "单号/来源": "reference",
+    "reference": "reference",
+    "备注": "note",
+    "note": "note",
+    "批号": "lot_no",
+    "lot_no": "lot_no",
+    "有效期": "expiry_date",
+    "有效期至": "expiry_date",
+    "expiry_date": "expiry_date",
+}
+
+ENCODING_CHOICES = [
+    ("utf-8-sig", "UTF-8"),
+    ("gb18030", "GBK / GB18030"),
+]
+
+
+class ImportAborted(Exception):
+    """有错误行时用于回滚整个导入事务。"""
+
+
+class FileFormatError(ValueError):
+    """文件内容不是有效的 CSV / XLSX。"""
+
+
+def _iter_csv(upload, encoding):
+    upload.seek(0)
+    text = io.TextIOWrapper(upload.file, encoding=encoding, newline="")
+    try:
+        yield from csv.reader(text)
+    except csv.Error as exc:
+        raise FileFormatError(f"CSV 格式有误：{exc}") from exc
+    finally:
+        text.detach()
+
+
+def _iter_xlsx(upload):
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    upload.seek(0)
+    try:
+        workbook = load_workbook(upload, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException) as exc:
+        raise FileFormatError("不是有效的 XLSX 文件") from exc
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def iter_rows(upload, encoding="utf-8-sig"):
+    """按文件扩展名产出 (行号, {列名: 值})，表头行用 HEADER_ALIASES 归一。"""
+    name = (upload.name or "").lower()
+    if name.endswith(".xlsx"):
+        raw_rows = _iter_xlsx(upload)
+    elif name.endswith(".csv"):
+        raw_rows = _iter_csv(upload, encoding)
+    else:
+        raise ValueError("仅支持 .csv 或 .xlsx 文件")
+
+    columns = None
+    for line_no, raw in enumerate(raw_rows, start=1):
+        if raw is None or all(cell in (None, "") for cell in raw):
+            continue
+        if columns is None:
+            columns = [HEADER_ALIASES.get(str(cell or "").strip().lower()) for cell in raw]
+            if "quantity" not in columns or not ({"item", "item_id"} & set(columns)):
+                raise ValueError("表头缺少“物品”或“数量”列")
+            continue
+        yield line_no, {
+            column: cell
+            for column, cell in zip(columns, raw)
+            if column is not None
+        }
+
+
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+class FileImporter:
+    """按主数据快照解析 id / 名称，并持有各 (物品, 仓库) 的滚动余额；整份文件的流水挂在同一张单据下。"""
+
+    def __init__(self, action, role_context, user=None, reference=""):
+        self.action = action
+        self.user = user
+        self.reference = reference
+        self.document = None
+        self.data = master_data(strict=True)
+        self.warehouse_ids = {w.id for w in self.data.allowed_warehouses(role_context)}
+
+        self.running = {}
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+
+    def _error(self, line_no, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"第 {line_no} 行：{message}")
+
+    def _format(self, row, quantity):
+        return self.data.format_item_quantity(row["item_id"], quantity)
+
+    def _resolve(self, row, name_key, id_key, records, names):
+        """按 id 列或名称列找到主数据记录；只认已启用的记录。"""
+        raw_id = _text(row.get(id_key))
+        if raw_id:
+            try:
+                record = records.get(int(raw_id))
+            except ValueError:
+                return None
+        else:
+            record = names.get(_text(row.get(name_key)))
+        return record if record is not None and record.is_active else None
+
+    def _validate(self, line_no, row):
+        data = self.data
+        item = self._resolve(row, "item", "item_id", data.items, data.item_names)
+        if item is None or item.warehouse_id not in self.warehouse_ids:
+            self._error(line_no, "物品不存在、已停用或无权限")
+            return None
+
+        transfer = self.action == MoveType.TRANSFER
+        warehouse_id = item.warehouse_id
+        if _text(row.get("warehouse")) or _text(row.get("warehouse_id")):
+            given = self._resolve(row, "warehouse", "warehouse_id", data.warehouses, data.warehouse_names)
+            # 调拨可以从物品所属仓库以外、有权限的仓库调出
+            if transfer and given is not None and given.id in self.warehouse_ids:
+                warehouse_id = given.id
+            elif given is None or given.id != warehouse_id:
+                self._error(line_no, "仓库不存在或与物品不匹配")
+                return None
+
+        to_warehouse_id = None
+        if transfer:
+            target = self._resolve(row, "to_warehouse", "to_warehouse_id", data.warehouses, data.warehouse_names)
+            if target is None or target.id not in self.warehouse_ids:
+                self._error(line_no, "调入仓库不存在或无权限")
+                return None
+            if target.id == warehouse_id:
+                self._error(line_no, "调出与调入仓库不能相同")
+                return None
+            to_warehouse_id = target.id
+
+        try:
+            quantity = data.parse_item_quantity(item.id, _text(row.get("quantity")), _text(row.get("unit")))
+        except ValueError as exc:
+            self._error(line_no, str(exc))
+            return None
+        if quantity <= 0:
+            self._error(line_no, "数量必须大于 0")
+            return None
+
+        partner_id = None
+        if _text(row.get("partner")) or _text(row.get("partner_id")):
+            partner = self._resolve(row, "partner", "partner_id", data.partners, data.partner_names)
+            if partner is None:
+                self._error(line_no, "合作方不存在或已停用")
+                return None
+            partner_id = partner.id
+
+        try:
+            lot_no, expiry_date = clean_lot(_text(row.get("lot_no")), row.get("expiry_date"))
+        except ValueError as exc:
+            self._error(line_no, str(exc))
+            return None
+        if lot_no and self.action in (MoveType.OUTBOUND, MoveType.TRANSFER):
+            self._error(line_no, "出库 / 调拨按先到期先出自动分配批次，不能指定批号")
+            return None
+
+        return {
+            "line_no": line_no,
+            "item_id": item.id,
+            "warehouse_id": warehouse_id,
+            "to_warehouse_id": to_warehouse_id,
+            "quantity": quantity,
+            "partner_id": partner_id,
+            "reference": _text(row.get("reference"))[:100],
+            "note": _text(row.get("note")),
+            "lot_no": lot_no,
+            "expiry_date": expiry_date,
+        }
+
+    def _flush_transfers(self, chunk):
+        """调拨：调出、调入两边余额一起锁定，每块的两条腿一次批量写入。"""
+        new_keys = (
+            {(r["item_id"], r["warehouse_id"]) for r in chunk}
+            | {(r["item_id"], r["to_warehouse_id"]) for r in chunk}
+        ) - self.running.keys()
+        locked = lock_balances(new_keys)
+        for key in new_keys:
+            on_hand, reserved = locked.get(key, (0, 0))
+            self.running[key] = on_hand - reserved
+
+        transfers = []
+        for row in chunk:
+            source = (row["item_id"], row["warehouse_id"])
+            quantity = row["quantity"]
+            if self.running[source] < quantity:
+                self._error(row["line_no"], f"调出仓库可用库存不足，可用 {self._format(row, self.running[source])}，需 {self._format(row, quantity)}")
+                continue
+            self.running[source] -= quantity
+            self.running[(row["item_id"], row["to_warehouse_id"])] += quantity
+            transfers.append({
+                "item_id": row["item_id"],
+                "from_warehouse_id": row["warehouse_id"],
+                "to_warehouse_id": row["to_warehouse_id"],
+                "quantity": quantity,
+                "reference": row["reference"],
+                "note": row["note"],
+            })
+
+        if self.error_count:
+            return
+        post_transfers(transfers, batch_size=2 * CHUNK_SIZE, document=self._document())
+        self.imported += len(transfers)
+
+    def _document(self):
+        """第一块写入时开单；导入回滚时单据随之回滚。"""
+        if self.document is None:
+            self.document = open_document(
+                DOCUMENT_TYPES[self.action],
+                user=self.user,
+                reference=self.reference,
+                note="文件导入",
+            )
+        return self.document
+
+    def _flush(self, chunk):
+        if not chunk:
+            return
+        if self.action == MoveType.TRANSFER:
+            self._flush_transfers(chunk)
+            return
+        outbound = self.action == MoveType.OUTBOUND
+        if outbound:
+            new_keys = {(r["item_id"], r["warehouse_id"]) for r in chunk} - self.running.keys()
+            locked = lock_balances(new_keys)
+            for key in new_keys:
+                # 出库按可用量校验：已预留的部分不能出
+                on_hand, reserved = locked.get(key, (0, 0))
+                self.running[key] = on_hand - reserved
+
+        lot_ids = resolve_lots({
+            (row["item_id"], row["lot_no"]): row["expiry_date"]
+            for row in chunk
+            if row["lot_no"]
+        })
+        moves = []
+        for row in chunk:
+            key = (row["item_id"], row["warehouse_id"])
+            quantity = row["quantity"]
+            if outbound:
+                if self.running[key] < quantity:
+                    self._error(row["line_no"], f"可用库存不足，可用 {self._format(row, self.running[key])}，需 {self._format(row, quantity)}")
+                    continue
+                self.running[key] -= quantity
+                quantity = -quantity
+            moves.append(StockMove(
+                move_type=self.action,
+                item_id=row["item_id"],
+                warehouse_id=row["warehouse_id"],
+                lot_id=lot_ids.get((row["item_id"], row["lot_no"])),
+                quantity=quantity,
+                reference=row["reference"],
+                note=row["note"],
+                partner_id=row["partner_id"],
+            ))
+
+        # 已有错误时整批会回滚，不必再写
+        if self.error_count:
+            return
+        bulk_post_moves(split_fefo(moves) if outbound else moves, batch_size=CHUNK_SIZE, document=self._document())
+        self.imported += len(moves)
+
+    def run(self, rows):
+        """消费 iter_rows() 的输出；有错误时回滚并返回 False。"""
+        try:
+            with transaction.atomic():
+                chunk = []
+                for line_no, row in rows:
+                    valid = self._validate(line_no, row)
+                    if valid is not None:
+                        chunk.append(valid)
+                    if len(chunk) >= CHUNK_SIZE:
+                        self._flush(chunk)
+                        chunk = []
+                self._flush(chunk)
+                if self.error_count:
+                    raise ImportAborted
+        except ImportAborted:
+            self.imported = 0
+            self.document = None
+            return False
+        return True
@@ -0,0 +1,326 @@
+"""
+数据库任务队列：导出、对账等耗时操作不再占用 web 请求。
+
+任务写入 ``Job`` 表，由 ``run_workers`` 命令的线程 / 进程池领取执行：
+PostgreSQL 上用 ``SELECT ... FOR UPDATE SKIP LOCKED`` 领取，多个 worker 互不阻塞；
+领取后再按 status 条件更新一次，SQLite（不支持行锁）上也不会重复执行。
+失败的任务按指数退避重新排队，超过 max_attempts 后标记为失败。
+
+处理函数用 ``@job("kind")`` 注册，接收 ``Job`` 实例，返回值保存到 ``result``；
+不能 JSON 序列化的返回值会让任务标记为失败。
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import traceback
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from products.models import Job, JobStatus
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF_SECONDS = 3600
+EXPORT_DIR = "exports"
+
+REGISTRY = {}
+
+
+def job(kind):
+    """注册任务处理函数。"""
+    def decorator(func):
+        REGISTRY[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload=None, *, user=None, priority=0, run_at=None, max_attempts=3):
+    """新建任务；在事务内调用时随事务一起提交，worker 看不到回滚的任务。"""
+    if kind not in REGISTRY:
+        raise ValueError(f"未知的任务类型：{kind}")
+    return Job.objects.create(
+        kind=kind,
+        payload=payload or {},
+        priority=priority,
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts,
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+
+
+def worker_name(index=0):
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+def claim(worker_id, kinds=None, due_before=None):
+    """
+    领取一条到期的排队任务并标记为运行中；没有可执行任务时返回 None。
+
+    按优先级、到期时间挑选，但不保证严格有序：SKIP LOCKED 会跳过其他 worker 正在领取的行，
+    此时可能领到优先级更低的任务。``due_before`` 限定只领取在该时刻之前到期的任务。
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        queued = (
+            Job.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=JobStatus.QUEUED, run_at__lte=min(now, due_before or now))
+        )
+        if kinds:
+            queued = queued.filter(kind__in=kinds)
+        pk = queued.order_by("-priority", "run_at", "id").values_list("pk", flat=True).first()
+        if pk is None:
+            return None
+        claimed = Job.objects.filter(pk=pk, status=JobStatus.QUEUED).update(
+            status=JobStatus.RUNNING,
+            locked_by=worker_id,
+            locked_at=now,
+            attempts=F("attempts") + 1,
+        )
+        if not claimed:
+            return None
+    return Job.objects.get(pk=pk)
+
+
+def backoff_seconds(attempts):
+    base = getattr(settings, "JOB_RETRY_BACKOFF_SECONDS", 30)
+    return min(MAX_BACKOFF_SECONDS, base * 2 ** max(attempts - 1, 0))
+
+
+def run_job(job):
+    """执行已领取的任务，返回是否成功。处理函数抛出的异常记录到 last_error，不会向上传播。"""
+    handler = REGISTRY.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f"未注册的任务类型：{job.kind}")
+        result = handler(job)
+    except Exception:
+        error = traceback.format_exc()[-4000:]
+        logger.warning("任务 %s 第 %s 次执行失败", job, job.attempts, exc_info=True)
+        now = timezone.now()
+        owned = Job.objects.filter(pk=job.pk, status=JobStatus.RUNNING, locked_by=job.locked_by)
+        if job.attempts < job.max_attempts:
+            owned.update(
+                status=JobStatus.QUEUED,
+                run_at=now + timedelta(seconds=backoff_seconds(job.attempts)),
+                locked_by="",
+                locked_at=None,
+                last_error=error,
+            )
+        else:
+            owned.update(status=JobStatus.FAILED, finished_at=now, locked_at=None, last_error=error)
+        return False
+
+    owned = Job.objects.filter(pk=job.pk, status=JobStatus.RUNNING, locked_by=job.locked_by)
+    try:
+        json.dumps(result)
+    except (TypeError, ValueError) as exc:
+        # 重试也得到同样的结果，直接标记为失败
+        logger.error("任务 %s 的返回值无法保存：%s", job, exc)
+        owned.update(
+            status=JobStatus.FAILED,
+            finished_at=timezone.now(),
+            locked_at=None,
+            last_error=f"返回值不能序列化为 JSON：{exc}",
+        )
+        return False
+    owned.update(
+        status=JobStatus.SUCCEEDED,
+        result=result,
+        finished_at=timezone.now(),
+        locked_at=None,
+        last_error="",
+    )
+    return True
+
+
+def requeue_stale(timeout_seconds=None):
+    """
+    运行超过 JOB_LOCK_TIMEOUT_SECONDS 仍未结束的任务视为 worker 已退出：
+    还有重试次数的重新排队，否则标记为失败。返回处理条数。
+    """
+    if timeout_seconds is None:
+        timeout_seconds = getattr(settings, "JOB_LOCK_TIMEOUT_SECONDS", 3600)
+    now = timezone.now()
+    stale = Job.objects.filter(status=JobStatus.RUNNING, locked_at__lt=now - timedelta(seconds=timeout_seconds))
+    error = f"worker 超过 {timeout_seconds} 秒未完成任务，已回收"
+    requeued = stale.filter(attempts__lt=F("max_attempts")).update(
+        status=JobStatus.QUEUED,
+        run_at=now,
+        locked_by="",
+        locked_at=None,
+        last_error=error,
+    )
+    failed = stale.update(status=JobStatus.FAILED, finished_at=now, locked_at=None, last_error=error)
+    return requeued + failed
+
+
+def retry(job):
+    """把失败的任务重新排队并清零重试次数；任务不是失败状态时返回 False。"""
+    return bool(
+        Job.objects.filter(pk=job.pk, status=JobStatus.FAILED).update(
+            status=JobStatus.QUEUED,
+            run_at=timezone.now(),
+            attempts=0,
+            locked_by="",
+            finished_at=None,
+        )
+    )
+
+
+def purge_finished(days, batch_size=1000):
+    """删除结束超过 ``days`` 天的任务（连同导出文件），返回删除条数。"""
+    cutoff = timezone.now() - timedelta(days=days)
+    total = 0
+    while True:
+        rows = list(
+            Job.objects
+            .filter(status__in=[JobStatus.SUCCEEDED, JobStatus.FAILED], finished_at__lt=cutoff)
+            .values_list("pk", "result")[:batch_size]
+        )
+        if not rows:
+            return total
+        for _, result in rows:
+            path = result_file(result)
+            if path is not None:
+                path.unlink(missing_ok=True)
+        deleted, _ = Job.objects.filter(pk__in=[pk for pk, _ in rows]).delete()
+        total += deleted
+
+
+def job_stats():
+    """各状态任务数，以及最早一条到期未领取任务的等待时间。"""
+    counts = dict(
+        Job.objects.values("status").annotate(n=Count("id")).values_list("status", "n")
+    )
+    now = timezone.now()
+    oldest = (
+        Job.objects.filter(status=JobStatus.QUEUED, run_at__lte=now)
+        .aggregate(at=Min("run_at"))["at"]
+    )
+    return {
+        **{status: counts.get(status, 0) for status in JobStatus.values},
+        "lag_seconds": round((now - oldest).total_seconds(), 3) if oldest else 0,
+    }
+
+
+def result_file(result):
+    """任务结果中的导出文件路径（位于 MEDIA_ROOT/exports 下），没有则返回 None。"""
+    name = (result or {}).get("file") if isinstance(result, dict) else None
+    if not name:
+        return None
+    root = (Path(settings.MEDIA_ROOT) / EXPORT_DIR).resolve()
+    path = (Path(settings.MEDIA_ROOT) / name).resolve()
+    return path if path.parent == root else None
+
+
+def work(worker_id, stop, kinds=None, interval=1.0, once=False, handle_signals=False):
+    """
+    worker 主循环：领取并执行任务，队列为空时等待 ``interval`` 秒。
+    ``stop`` 为 threading / multiprocessing 的 Event，置位后执行完当前任务即退出。
+    ``once`` 只处理启动时已到期的任务：失败后重新排队的任务留给下一次运行，不会在本轮反复重试。
+    """
+    due_before = timezone.now() if once else None
+    if handle_signals:
+        # 进程池子进程：systemd 停止服务时整组收到 SIGTERM，先做完手上的任务
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: stop.set())
+    try:
+        while not stop.is_set():
+            try:
+                claimed = claim(worker_id, kinds, due_before)
+            except DatabaseError:
+                logger.warning("worker %s 领取任务失败", worker_id, exc_info=True)
+                connections.close_all()
+                stop.wait(interval)
+                continue
+            if claimed is None:
+                if once:
+                    return
+                stop.wait(interval)
+                continue
+            try:
+                run_job(claimed)
+            except DatabaseError:
+                # 记录结果失败（如连接中断）：任务留在运行中，超时后由 requeue_stale 回收
+                logger.exception("worker %s 保存任务 %s 的结果失败", worker_id, claimed)
+                connections.close_all()
+    finally:
+        connections.close_all()
+
+
+# ---------------------------------------------------------------------------
+# 内置任务
+# ---------------------------------------------------------------------------
+
+@job("reconcile_balances")
+def reconcile_balances(job):
+    """按流水合计核对余额，不一致的逐组重算，并按有效预留核对 reserved；payload 可指定 warehouse_id。"""
+    from django.db.models import Sum
+
+    from products.models import StockBalance, StockMove
+    from products.reservations import reconcile_reserved
+    from products.signals import recalc_balance
+
+    warehouse_id = job.payload.get("warehouse_id")
+    moves = StockMove.objects.all()
+    balances = StockBalance.objects.all()
+    if warehouse_id:
+        moves = moves.filter(warehouse_id=warehouse_id)
+        balances = balances.filter(warehouse_id=warehouse_id)
+
+    totals = {
+        (item_id, wh_id): total
+        for item_id, wh_id, total in moves.values("item_id", "warehouse_id")
+        .annotate(total=Sum("quantity"))
+        .values_list("item_id", "warehouse_id", "total")
+        .iterator()
+    }
+    on_hand = {
+        (item_id, wh_id): value
+        for item_id, wh_id, value in balances.values_list("item_id", "warehouse_id", "on_hand").iterator()
+    }
+    mismatched = sorted(
+        key for key in totals.keys() | on_hand.keys()
+        if (totals.get(key) or 0) != (on_hand.get(key) or 0)
+    )
+    for item_id, wh_id in mismatched:
+        recalc_balance(item_id, wh_id)
+    return {
+        "checked": len(totals.keys() | on_hand.keys()),
+        "fixed": len(mismatched),
+        "reserved_fixed": reconcile_reserved(),
+    }
+
+
+@job("export_moves")
+def export_moves(job):
+    """
+    后台导出库存流水：payload 为 {"query": 流水列表的查询串, "user_id": 提交人}，
+    按提交人的仓库权限过滤，结果写到 MEDIA_ROOT/exports。
+    """
+    from django.contrib.auth import get_user_model
+    from django.http import HttpRequest, QueryDict
+
+    from products.views.stockmove_list import _build_move_context, write_moves_workbook
+
+    request = HttpRequest()
+    request.GET = QueryDict(job.payload.get("query", ""))
+    request.user = get_user_model().objects.get(pk=job.payload["user_id"])
+    moves = _build_move_context(request)["moves"]
+
+    name = f"{EXPORT_DIR}/stockmoves_{job.pk}.xlsx"
+    path = Path(settings.MEDIA_ROOT) / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as fh:
+        rows = write_moves_workbook(moves, fh)
+    os.replace(tmp, path)
+    return {"file": name, "rows": rows}
@@ -0,0 +1,125 @@
+"""
+批量记账工具。
+
+``bulk_create`` 不会触发 ``post_save``，因此批量写入流水后由这里按
+(物品, 仓库) 汇总增量、一次性更新 ``StockBalance``，而不是逐条重算。
+STOCK_BALANCE_ENGINE=trigger 时余额由数据库触发器维护，这里只负责推送变动。
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, F, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from products.balance_triggers import trigger_engine_enabled
+from products.events import notify_balances
+from products.lots import apply_lot_deltas, lot_deltas
+from products.models import StockBalance, StockDocument, StockMove
+from products.outbox import TOPIC_MOVE_CREATED, enqueue_balances, enqueue_moves
+
+UPDATE_BATCH_SIZE = 500
+
+
+def lock_balances(keys):
+    """锁定并返回 {(item_id, warehouse_id): (on_hand, reserved)}；需在事务内调用。"""
+    keys = set(keys)
+    if not keys:
+        return {}
+    item_ids = {item_id for item_id, _ in keys}
+    warehouse_ids = {warehouse_id for _, warehouse_id in keys}
+    rows = (
+        StockBalance.objects
+        .select_for_update()
+        .filter(item_id__in=item_ids, warehouse_id__in=warehouse_ids)
+        .order_by("pk")
+        .values_list("item_id", "warehouse_id", "on_hand", "reserved")
+    )
+    return {
+        (item_id, warehouse_id): (on_hand, reserved)
+        for item_id, warehouse_id, on_hand, reserved in rows
+        if (item_id, warehouse_id) in keys
+    }
+
+
+def apply_balance_deltas(deltas, last_move_ids=None):
+    """
+    按 {(item_id, warehouse_id): 增量} 更新余额，缺失的余额行先补建。
+
+    ``last_move_ids`` 为 {(item_id, warehouse_id): 本批最大流水 id}，供变更流使用；
+    只会往大了更新，避免并发批次提交顺序不同时把 last_move_id 改小。
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    last_move_ids = last_move_ids or {}
+
+    with transaction.atomic():
+        StockBalance.objects.bulk_create(
+            [
+                StockBalance(item_id=item_id, warehouse_id=warehouse_id, on_hand=0)
+                for item_id, warehouse_id in deltas
+            ],
+            ignore_conflicts=True,
+        )
+        balance_ids = {
+            (item_id, warehouse_id): pk
+            for pk, item_id, warehouse_id in StockBalance.objects.filter(
+                item_id__in={item_id for item_id, _ in deltas},
+                warehouse_id__in={warehouse_id for _, warehouse_id in deltas},
+            ).values_list("pk", "item_id", "warehouse_id")
+        }
+
+        rows = sorted(
+            (balance_ids[key], delta, last_move_ids.get(key, 0))
+            for key, delta in deltas.items()
+        )
+        now = timezone.now()
+        for start in range(0, len(rows), UPDATE_BATCH_SIZE):
+            batch = rows[start:start + UPDATE_BATCH_SIZE]
+            StockBalance.objects.filter(pk__in=[pk for pk, _, _ in batch]).update(
+                on_hand=F("on_hand") + Case(
+                    *[When(pk=pk, then=Value(delta)) for pk, delta, _ in batch],
+                    output_field=BigIntegerField(),
+                ),
+                last_move_id=Greatest(
+                    F("last_move_id"),
+                    Case(
+                        *[When(pk=pk, then=Value(last_id)) for pk, _, last_id in batch],
+                        output_field=BigIntegerField(),
+                    ),
+                ),
+                updated_at=now,
+            )
+        notify_balances(deltas)
+
+
+def bulk_post_moves(moves, batch_size=1000, document=None):
+    """批量写入流水并同步余额；给出 ``document`` 时流水挂到该单据下并累计其 line_count。返回已保存的流水对象。"""
+    moves = list(moves)
+    if not moves:
+        return moves
+
+    with transaction.atomic():
+        if document is not None:
+            for move in moves:
+                move.document_id = document.pk
+        created = StockMove.objects.bulk_create(moves, batch_size=batch_size)
+        if document is not None:
+            StockDocument.objects.filter(pk=document.pk).update(line_count=F("line_count") + len(created))
+        keys = {(move.item_id, move.warehouse_id) for move in created}
+        if trigger_engine_enabled():
+            notify_balances(keys)
+        else:
+            deltas = defaultdict(int)
+            last_move_ids = {}
+            for move in created:
+                key = (move.item_id, move.warehouse_id)
+                deltas[key] += move.quantity
+                last_move_ids[key] = max(last_move_ids.get(key, 0), move.pk or 0)
+            apply_balance_deltas(deltas, last_move_ids)
+        # 批次余额由应用维护，与余额引擎无关
+        apply_lot_deltas(lot_deltas(created))
+        enqueue_moves(created, TOPIC_MOVE_CREATED)
+        enqueue_balances(keys)
+    return created
@@ -0,0 +1,228 @@
+"""
+批次与先到期先出（FEFO）。
+
+入库 / 正数调整可带批号（和效期），流水记到对应 ``Lot``；出库和负数调整不指定批次，
+由 ``split_fefo()`` 按效期从早到晚拆到各批次：同一批流水涉及的全部 (物品, 仓库)
+用一次加锁的有序查询取出有货批次（走 lot_balance_fefo_idx），批次不够的部分不带批次，
+扣减未按批次管理的存量。
+
+``LotBalance`` 由应用维护（两种余额引擎下都一样）：批量记账按 (批次, 仓库) 汇总增量回写，
+单条保存由信号按流水重算。
+"""
+from collections import defaultdict, deque
+from datetime import date, datetime, timedelta
+
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, F, Sum, Value, When
+from django.utils import timezone
+
+from products.models import Lot, LotBalance, StockMove
+
+UPDATE_BATCH_SIZE = 500
+MAX_LOT_NO_LENGTH = 64
+
+
+def clean_lot(lot_no, expiry_date=None):
+    """
+    规范化批号与效期输入，返回 (批号, 效期)；没有批号时返回 ("", None)。
+    效期可以是 YYYY-MM-DD 字符串或日期（Excel 单元格），格式不对时抛出 ValueError。
+    """
+    lot_no = str(lot_no or "").strip()
+    if isinstance(expiry_date, str):
+        expiry_date = expiry_date.strip()
+    if not lot_no:
+        if expiry_date:
+            raise ValueError("填写有效期时必须填写批号")
+        return "", None
+    if len(lot_no) > MAX_LOT_NO_LENGTH:
+        raise ValueError(f"批号最长 {MAX_LOT_NO_LENGTH} 个字符")
+    if not expiry_date:
+        return lot_no, None
+    if isinstance(expiry_date, datetime):
+        return lot_no, expiry_date.date()
+    if isinstance(expiry_date, date):
+        return lot_no, expiry_date
+    try:
+        return lot_no, datetime.strptime(str(expiry_date), "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError("有效期格式应为 YYYY-MM-DD")
+
+
+def resolve_lots(lots):
+    """
+    ``lots`` 为 {(item_id, lot_no): expiry_date 或 None}，不存在的批次批量新建。
+    返回 {(item_id, lot_no): lot_id}；已有批次保留原效期。
+    """
+    if not lots:
+        return {}
+    Lot.objects.bulk_create(
+        [
+            Lot(item_id=item_id, lot_no=lot_no, expiry_date=expiry_date)
+            for (item_id, lot_no), expiry_date in lots.items()
+        ],
+        ignore_conflicts=True,
+    )
+    return {
+        (item_id, lot_no): pk
+        for pk, item_id, lot_no in Lot.objects.filter(
+            item_id__in={item_id for item_id, _ in lots},
+            lot_no__in={lot_no for _, lot_no in lots},
+        ).values_list("pk", "item_id", "lot_no")
+        if (item_id, lot_no) in lots
+    }
+
+
+def _copy_move(move, lot_id, quantity):
+    fields = {
+        field.attname: getattr(move, field.attname)
+        for field in StockMove._meta.concrete_fields
+        if not field.primary_key
+    }
+    fields.update(lot_id=lot_id, quantity=quantity)
+    return StockMove(**fields)
+
+
+def allocate_fefo(moves):
+    """
+    把未指定批次的负数流水按先到期先出拆成带批次的流水，返回与 ``moves`` 一一对应的列表的列表。
+    需在事务内调用：分配到的批次余额行在事务结束前保持锁定。
+    """
+    keys = {
+        (move.item_id, move.warehouse_id)
+        for move in moves
+        if move.quantity < 0 and move.lot_id is None
+    }
+    if not keys:
+        return [[move] for move in moves]
+
+    queues = defaultdict(deque)
+    rows = (
+        LotBalance.objects
+        .select_for_update()
+        .filter(
+            item_id__in={item_id for item_id, _ in keys},
+            warehouse_id__in={warehouse_id for _, warehouse_id in keys},
+            on_hand__gt=0,
+        )
+        .order_by("item_id", "warehouse_id", F("expiry_date").asc(nulls_last=True), "id")
+        .values_list("item_id", "warehouse_id", "lot_id", "on_hand")
+    )
+    for item_id, warehouse_id, lot_id, on_hand in rows:
+        if (item_id, warehouse_id) in keys:
+            queues[(item_id, warehouse_id)].append([lot_id, on_hand])
+
+    groups = []
+    for move in moves:
+        if move.quantity >= 0 or move.lot_id is not None:
+            groups.append([move])
+            continue
+        group = []
+        need = -move.quantity
+        queue = queues[(move.item_id, move.warehouse_id)]
+        while need and queue:
+            lot = queue[0]
+            take = min(need, lot[1])
+            group.append(_copy_move(move, lot[0], -take))
+            need -= take
+            lot[1] -= take
+            if not lot[1]:
+                queue.popleft()
+        if need:
+            group.append(_copy_move(move, None, -need))
+        groups.append(group)
+    return groups
+
+
+def split_fefo(moves):
+    """``allocate_fefo()`` 的扁平版本：返回拆分后的流水列表，顺序不变。"""
+    return [move for group in allocate_fefo(moves) for move in group]
+
+
+def apply_lot_deltas(deltas):
+    """按 {(lot_id, warehouse_id): 增量} 更新批次余额，缺失的行先补建；需在事务内调用。"""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    lots = {
+        pk: (item_id, expiry_date)
+        for pk, item_id, expiry_date in Lot.objects.filter(
+            pk__in={lot_id for lot_id, _ in deltas},
+        ).values_list("pk", "item_id", "expiry_date")
+    }
+    LotBalance.objects.bulk_create(
+        [
+            LotBalance(
+                lot_id=lot_id,
+                warehouse_id=warehouse_id,
+                item_id=lots[lot_id][0],
+                expiry_date=lots[lot_id][1],
+                on_hand=0,
+            )
+            for lot_id, warehouse_id in deltas
+        ],
+        ignore_conflicts=True,
+    )
+    balance_ids = {
+        (lot_id, warehouse_id): pk
+        for pk, lot_id, warehouse_id in LotBalance.objects.filter(
+            lot_id__in={lot_id for lot_id, _ in deltas},
+            warehouse_id__in={warehouse_id for _, warehouse_id in deltas},
+        ).values_list("pk", "lot_id", "warehouse_id")
+    }
+    rows = sorted((balance_ids[key], delta) for key, delta in deltas.items())
+    now = timezone.now()
+    for start in range(0, len(rows), UPDATE_BATCH_SIZE):
+        batch = rows[start:start + UPDATE_BATCH_SIZE]
+        LotBalance.objects.filter(pk__in=[pk for pk, _ in batch]).update(
+            on_hand=F("on_hand") + Case(
+                *[When(pk=pk, then=Value(delta)) for pk, delta in batch],
+                output_field=BigIntegerField(),
+            ),
+            updated_at=now,
+        )
+
+
+def lot_deltas(moves):
+    deltas = defaultdict(int)
+    for move in moves:
+        if move.lot_id is not None:
+            deltas[(move.lot_id, move.warehouse_id)] += move.quantity
+    return deltas
+
+
+def recalc_lot_balance(lot_id, warehouse_id):
+    """按流水合计重算一个批次余额（单条保存 / 删除流水时使用）。"""
+    total = (
+        StockMove.objects
+        .filter(lot_id=lot_id, warehouse_id=warehouse_id)
+        .aggregate(s=Sum("quantity"))["s"]
+    ) or 0
+    with transaction.atomic():
+        balance = LotBalance.objects.select_for_update().filter(lot_id=lot_id, warehouse_id=warehouse_id).first()
+        if balance is None:
+            lot = Lot.objects.only("item_id", "expiry_date").get(pk=lot_id)
+            LotBalance.objects.create(
+                lot_id=lot_id,
+                warehouse_id=warehouse_id,
+                item_id=lot.item_id,
+                expiry_date=lot.expiry_date,
+                on_hand=total,
+            )
+        elif balance.on_hand != total:
+            balance.on_hand = total
+            balance.save(update_fields=["on_hand", "updated_at"])
+
+
+def expiring_lots(warehouse_ids, days, today=None):
+    """``days`` 天内到期（含已过期）且仍有库存的批次余额，按效期排序；走 lot_balance_expiry_idx。"""
+    today = today or timezone.localdate()
+    return (
+        LotBalance.objects
+        .select_related("lot", "item", "warehouse")
+        .filter(
+            on_hand__gt=0,
+            expiry_date__lte=today + timedelta(days=days),
+            warehouse_id__in=warehouse_ids,
+        )
+        .order_by("expiry_date", "id")
+    )
@@ -0,0 +1,108 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test.utils import override_settings
+
+from products.balance_triggers import ENGINE_SIGNAL, ENGINE_TRIGGER, sync_balance_triggers
+from products.ledger import bulk_post_moves
+from products.models import Item, MoveType, StockBalance, StockMove
+from products.quantities import QUANTITY_SCALE
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare stock-move write throughput of the signal and trigger balance engines; "
+        "every write is rolled back, so it is safe to run against a live database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--moves", type=int, default=2000, help="Moves written per engine and mode")
+        parser.add_argument("--batch-size", type=int, default=500, help="Moves per bulk_post_moves call")
+        parser.add_argument(
+            "--engine",
+            action="append",
+            dest="engines",
+            choices=[ENGINE_SIGNAL, ENGINE_TRIGGER],
+            help="Engine to measure (repeatable); defaults to both",
+        )
+
+    def handle(self, *args, **options):
+        total = options["moves"]
+        batch_size = options["batch_size"]
+        if total <= 0 or batch_size <= 0:
+            raise CommandError("--moves 和 --batch-size 必须大于 0")
+
+        keys = list(
+            Item.objects.filter(is_active=True, warehouse__isnull=False)
+            .values_list("id", "warehouse_id")[:200]
+        )
+        if not keys:
+            raise CommandError("没有可用的物品（需要至少一个关联了仓库的启用物品）")
+
+        engines = options["engines"] or [ENGINE_SIGNAL, ENGINE_TRIGGER]
+        self.stdout.write(f"数据库：{connection.vendor}  每组写入 {total} 条流水，涉及 {len(keys)} 个 (物品, 仓库)")
+        for engine in engines:
+            for mode in ("create", "bulk"):
+                elapsed, mismatched = self._measure(engine, mode, keys, total, batch_size)
+                line = f"{engine:<8} {mode:<7} {elapsed:8.2f}s  {total / elapsed:10.1f} 条/秒"
+                if mismatched:
+                    self.stdout.write(self.style.ERROR(f"{line}  余额不一致 {mismatched} 组"))
+                else:
+                    self.stdout.write(f"{line}  余额校验通过")
+
+    def _moves(self, keys, count):
+        for _ in range(count):
+            item_id, warehouse_id = random.choice(keys)
+            yield StockMove(
+                move_type=MoveType.INBOUND,
+                item_id=item_id,
+                warehouse_id=warehouse_id,
+                quantity=random.randint(1, 30) * QUANTITY_SCALE,
+                reference="BENCH",
+            )
+
+    def _measure(self, engine, mode, keys, total, batch_size):
+        result = None
+        with override_settings(STOCK_BALANCE_ENGINE=engine):
+            try:
+                with transaction.atomic():
+                    sync_balance_triggers(connection)
+                    started = time.perf_counter()
+                    if mode == "create":
+                        for move in self._moves(keys, total):
+                            move.save()
+                    else:
+                        for start in range(0, total, batch_size):
+                            bulk_post_moves(self._moves(keys, min(batch_size, total - start)), batch_size=batch_size)
+                    elapsed = time.perf_counter() - started
+                    result = (elapsed, self._mismatched(keys))
+                    raise _Rollback
+            except _Rollback:
+                pass
+        return result
+
+    def _mismatched(self, keys):
+        keys = set(keys)
+        totals = {
+            (row["item_id"], row["warehouse_id"]): row["total"]
+            for row in StockMove.objects.filter(
+                item_id__in={item_id for item_id, _ in keys},
+            ).values("item_id", "warehouse_id").annotate(total=Sum("quantity"))
+        }
+        balances = dict(
+            ((item_id, warehouse_id), on_hand)
+            for item_id, warehouse_id, on_hand in StockBalance.objects.filter(
+                item_id__in={item_id for item_id, _ in keys},
+            ).values_list("item_id", "warehouse_id", "on_hand")
+        )
+        return sum(
+            1 for key in keys
+            if totals.get(key, 0) != balances.get(key, 0)
+        )
@@ -0,0 +1,74 @@
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent GET requests at a running server and report throughput/latency; "
+        "run once against the wsgi deployment and once against the asgi one to compare"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Server base URL")
+        parser.add_argument(
+            "--path",
+            action="append",
+            dest="paths",
+            help="Path to request (repeatable); defaults to the three /api/ read endpoints",
+        )
+        parser.add_argument("--token", default="", help="ApiToken key sent as Authorization: Token <key>")
+        parser.add_argument("--concurrency", type=int, default=50, help="Concurrent clients")
+        parser.add_argument("--requests", type=int, default=1000, help="Total requests")
+        parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+
+    def _fetch(self, url, headers, timeout):
+        request = urllib.request.Request(url, headers=headers)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as exc:
+            status = exc.code
+        except OSError:
+            status = None
+        return status, (time.perf_counter() - started) * 1000
+
+    def handle(self, *args, **options):
+        paths = options["paths"] or ["/api/dashboard/", "/api/moves/", "/api/balances/"]
+        base = options["url"].rstrip("/")
+        total = options["requests"]
+        if total <= 0 or options["concurrency"] <= 0:
+            raise CommandError("--requests 和 --concurrency 必须大于 0")
+
+        headers = {}
+        if options["token"]:
+            headers["Authorization"] = f"Token {options['token']}"
+        urls = [base + paths[index % len(paths)] for index in range(total)]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+            results = list(pool.map(lambda url: self._fetch(url, headers, options["timeout"]), urls))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(ms for _, ms in results)
+        ok = sum(1 for status, _ in results if status == 200)
+        failed = total - ok
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+        self.stdout.write(f"目标：{base}  路径：{', '.join(paths)}")
+        self.stdout.write(f"并发 {options['concurrency']}，请求 {total}，耗时 {elapsed:.2f}s")
+        self.stdout.write(f"吞吐：{total / elapsed:.1f} req/s（成功 {ok}，失败 {failed}）")
+        self.stdout.write(
+            f"延迟 ms：平均 {statistics.mean(latencies):.1f}  p50 {percentile(0.5):.1f}  "
+            f"p95 {percentile(0.95):.1f}  p99 {percentile(0.99):.1f}  最大 {latencies[-1]:.1f}"
+        )
+        if failed:
+            self.stdout.write(self.style.WARNING("存在失败请求：检查 --token、ALLOWED_HOSTS 或服务器日志"))
@@ -0,0 +1,42 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = "Delete expired sessions in batches (db / cached_db engines), or defer to the engine's clear_expired()"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows deleted per statement")
+
+    def handle(self, *args, **options):
+        engine = import_module(settings.SESSION_ENGINE)
+        store = engine.SessionStore
+        if not hasattr(store, "get_model_class"):
+            # cache / signed_cookies 由过期时间自动失效，file 引擎自己扫描目录
+            try:
+                store.clear_expired()
+            except NotImplementedError:
+                self.stdout.write(f"{settings.SESSION_ENGINE} 无需清理")
+                return
+            self.stdout.write(self.style.SUCCESS("已清理过期 session"))
+            return
+
+        # 按主键分批删，避免一条 DELETE 长时间锁住 django_session
+        model = store.get_model_class()
+        now = timezone.now()
+        batch_size = options["batch_size"]
+        total = 0
+        while True:
+            keys = list(
+                model.objects
+                .filter(expire_date__lt=now)
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not keys:
+                break
+            deleted, _ = model.objects.filter(pk__in=keys).delete()
+            total += deleted
+        self.stdout.write(self.style.SUCCESS(f"已清理过期 session {total} 条"))
@@ -0,0 +1,75 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from products.outbox import SINKS, get_sink, outbox_stats, purge_delivered, relay_batch
+
+MAX_BACKOFF_SECONDS = 60
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver pending outbox events in id order to a sink (stdout, file, http or a dotted class path); "
+        "events are marked delivered only after the sink accepts them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sink",
+            default="stdout",
+            help=f"Sink name ({', '.join(SINKS)}) or dotted path to a class with send(events)",
+        )
+        parser.add_argument("--path", help="Output file for the file sink (JSON Lines)")
+        parser.add_argument("--url", help="Endpoint for the http sink")
+        parser.add_argument("--timeout", type=float, default=10.0, help="HTTP sink timeout in seconds")
+        parser.add_argument("--batch-size", type=int, default=500, help="Events per delivery")
+        parser.add_argument("--interval", type=float, default=1.0, help="Seconds to wait when the outbox is empty")
+        parser.add_argument("--once", action="store_true", help="Exit once the outbox is drained")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size 必须大于 0")
+        if not settings.OUTBOX_ENABLED:
+            self.stdout.write(self.style.WARNING("OUTBOX_ENABLED 未开启：不会产生新事件，只投递已有积压"))
+        try:
+            sink = get_sink(
+                options["sink"],
+                path=options["path"],
+                url=options["url"],
+                timeout=options["timeout"],
+            )
+        except (ImportError, ValueError) as exc:
+            raise CommandError(str(exc))
+        # stdout sink 输出事件本身，统计信息改写到 stderr
+        log = self.stderr if options["sink"] == "stdout" else self.stdout
+
+        failures = 0
+        delivered_total = 0
+        while True:
+            delivered, error = relay_batch(sink, options["batch_size"])
+            if error is not None:
+                failures += 1
+                backoff = min(MAX_BACKOFF_SECONDS, options["interval"] * 2 ** failures)
+                log.write(self.style.ERROR(f"投递失败（第 {failures} 次）：{error}；{backoff:.0f} 秒后重试"))
+                time.sleep(backoff)
+                continue
+            failures = 0
+
+            if delivered:
+                delivered_total += delivered
+                if options["verbosity"] >= 1:
+                    stats = outbox_stats()
+                    log.write(
+                        f"已投递 {delivered} 条（累计 {delivered_total}），"
+                        f"积压 {stats['pending']} 条，延迟 {stats['lag_seconds']} 秒"
+                    )
+                continue
+
+            purged = purge_delivered(settings.OUTBOX_RETENTION_DAYS)
+            if purged:
+                log.write(f"已清理 {purged} 条过期事件")
+            if options["once"]:
+                log.write(self.style.SUCCESS(f"outbox 已清空，本次投递 {delivered_total} 条"))
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,111 @@
+import multiprocessing
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from products.jobs import REGISTRY, purge_finished, requeue_stale, work, worker_name
+
+MAINTENANCE_INTERVAL_SECONDS = 60
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background jobs from the database queue with a pool of worker threads or processes; "
+        "jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several commands can run side by side"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.JOB_WORKERS,
+            help="Number of workers (default: JOB_WORKERS)",
+        )
+        parser.add_argument(
+            "--pool",
+            choices=["thread", "process"],
+            default="thread",
+            help="Run workers as threads (I/O bound jobs) or forked processes (CPU bound jobs)",
+        )
+        parser.add_argument(
+            "--kind",
+            action="append",
+            dest="kinds",
+            help=f"Only run jobs of this kind (repeatable): {', '.join(sorted(REGISTRY))}",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.JOB_POLL_SECONDS,
+            help="Seconds to wait when the queue is empty (default: JOB_POLL_SECONDS)",
+        )
+        parser.add_argument("--once", action="store_true", help="Run the jobs that are due now once, then exit")
+
+    def handle(self, *args, **options):
+        concurrency = options["concurrency"]
+        if concurrency <= 0:
+            raise CommandError("--concurrency 必须大于 0")
+        unknown = set(options["kinds"] or []) - set(REGISTRY)
+        if unknown:
+            raise CommandError(f"未知的任务类型：{', '.join(sorted(unknown))}")
+
+        recovered = requeue_stale()
+        if recovered:
+            self.stdout.write(self.style.WARNING(f"已回收 {recovered} 个超时任务"))
+
+        if options["pool"] == "process":
+            stop = multiprocessing.get_context("fork").Event()
+            # 子进程 fork 时不能继承父进程的数据库连接
+            connections.close_all()
+            workers = [
+                multiprocessing.get_context("fork").Process(
+                    target=work,
+                    args=(worker_name(n), stop, options["kinds"], options["interval"], options["once"], True),
+                    daemon=True,
+                )
+                for n in range(concurrency)
+            ]
+        else:
+            stop = threading.Event()
+            workers = [
+                threading.Thread(
+                    target=work,
+                    args=(worker_name(n), stop, options["kinds"], options["interval"], options["once"]),
+                    daemon=True,
+                )
+                for n in range(concurrency)
+            ]
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: stop.set())
+
+        self.stdout.write(f"启动 {concurrency} 个 {options['pool']} worker")
+        for worker in workers:
+            worker.start()
+
+        maintained_at = time.monotonic()
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=1)
+            if not options["once"] and time.monotonic() - maintained_at >= MAINTENANCE_INTERVAL_SECONDS:
+                maintained_at = time.monotonic()
+                self._maintain()
+        connections.close_all()
+        self.stdout.write(self.style.SUCCESS("worker 已全部退出"))
+
+    def _maintain(self):
+        try:
+            recovered = requeue_stale()
+            purged = purge_finished(settings.JOB_RETENTION_DAYS)
+        except Exception as exc:
+            self.stderr.write(self.style.ERROR(f"维护任务失败：{exc}"))
+            return
+        if recovered:
+            self.stdout.write(self.style.WARNING(f"已回收 {recovered} 个超时任务"))
+        if purged:
+            self.stdout.write(f"已清理 {purged} 个过期任务")
+        connections.close_all()
@@ -1,11 +1,11 @@
 import random
-from decimal import Decimal
 
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from django.utils import timezone
 
 from products.models import Item, Partner, StockBalance, StockMove, MoveType
+from products.quantities import QUANTITY_SCALE
 
 
 class Command(BaseCommand):
@@ -41,7 +41,7 @@ class Command(BaseCommand):
 
         for _ in range(inbound_count):
             item = random.choice(items)
-            qty = random.randint(5, 30)
+            qty = random.randint(5, 30) * QUANTITY_SCALE
             partner = random.choice(partners) if partners else None
             self._create_move(item=item, quantity=qty, move_type=MoveType.INBOUND, partner=partner)
             created["inbound"] += 1
@@ -54,11 +54,12 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.WARNING("库存不足，无法继续生成出库数据"))
                 break
             balance = random.choice(balances)
-            max_qty = int(balance.on_hand)
+            # 按整单位生成出库数量
+            max_qty = balance.on_hand // QUANTITY_SCALE
             if max_qty <= 0:
                 balances.remove(balance)
                 continue
-            qty = random.randint(1, max_qty)
+            qty = random.randint(1, max_qty) * QUANTITY_SCALE
             partner = random.choice(partners) if partners else None
             self._create_move(
                 item=balance.item,
@@ -67,7 +68,7 @@ class Command(BaseCommand):
                 partner=partner,
             )
             created["outbound"] += 1
-            balance.on_hand -= Decimal(qty)
+            balance.on_hand -= qty
             if balance.on_hand <= 0:
                 balances.remove(balance)
 
@@ -0,0 +1,84 @@
+import json
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Summarize the slow-query log by normalized SQL shape"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--log",
+            default=str(settings.SLOW_QUERY_LOG_PATH),
+            help="Path to the slow-query log (rotated backups are read too)",
+        )
+        parser.add_argument("--limit", type=int, default=20, help="Number of shapes to show")
+        parser.add_argument(
+            "--order",
+            choices=["total", "max", "count"],
+            default="total",
+            help="Rank shapes by total time, worst single run, or occurrences",
+        )
+        parser.add_argument("--plans", action="store_true", help="Print the latest EXPLAIN plan of each shape")
+
+    def _log_files(self, path: Path):
+        files = [path]
+        for index in range(1, settings.SLOW_QUERY_LOG_BACKUP_COUNT + 1):
+            files.append(path.with_name(f"{path.name}.{index}"))
+        return [f for f in files if f.exists()]
+
+    def handle(self, *args, **options):
+        files = self._log_files(Path(options["log"]))
+        if not files:
+            raise CommandError(f"找不到慢查询日志：{options['log']}")
+
+        stats = defaultdict(lambda: {
+            "count": 0,
+            "total_ms": 0.0,
+            "max_ms": 0.0,
+            "views": defaultdict(int),
+            "sample": None,
+        })
+        for log_file in files:
+            with log_file.open(encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    entry = stats[record.get("shape") or record.get("sql", "")]
+                    duration = float(record.get("duration_ms") or 0)
+                    entry["count"] += 1
+                    entry["total_ms"] += duration
+                    entry["views"][record.get("view") or "-"] += 1
+                    if duration >= entry["max_ms"]:
+                        entry["max_ms"] = duration
+                        entry["sample"] = record
+
+        order_key = {
+            "total": lambda item: item[1]["total_ms"],
+            "max": lambda item: item[1]["max_ms"],
+            "count": lambda item: item[1]["count"],
+        }[options["order"]]
+        ranked = sorted(stats.items(), key=order_key, reverse=True)[: options["limit"]]
+
+        self.stdout.write(self.style.NOTICE(f"共 {len(stats)} 种 SQL 形状，显示前 {len(ranked)} 种"))
+        for rank, (shape, entry) in enumerate(ranked, start=1):
+            avg = entry["total_ms"] / entry["count"]
+            views = ", ".join(
+                f"{name}×{hits}"
+                for name, hits in sorted(entry["views"].items(), key=lambda v: v[1], reverse=True)[:3]
+            )
+            self.stdout.write(self.style.WARNING(
+                f"\n#{rank} 次数 {entry['count']}｜总计 {entry['total_ms']:.1f}ms｜"
+                f"平均 {avg:.1f}ms｜最慢 {entry['max_ms']:.1f}ms"
+            ))
+            self.stdout.write(f"视图：{views}")
+            self.stdout.write(shape)
+            sample = entry["sample"] or {}
+            if options["plans"] and sample.get("plan"):
+                self.stdout.write(self.style.NOTICE("EXPLAIN:"))
+                self.stdout.write(sample["plan"])
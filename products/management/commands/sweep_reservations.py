@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = "Release expired stock reservations in batches and return their quantity to available stock"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Reservations released per transaction")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds between sweeps")
+        parser.add_argument("--once", action="store_true", help="Sweep once and exit")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size 必须大于 0")
+        while True:
+            try:
+                released = release_expired(options["batch_size"])
+            except Exception as exc:
+                self.stderr.write(self.style.ERROR(f"释放过期预留失败：{exc}"))
+                released = 0
+            if released and options["verbosity"] >= 1:
+                self.stdout.write(f"已释放 {released} 条过期预留")
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,282 @@
+"""
+进程内主数据缓存：单位、合作方、仓库、物品，以及物品的辅助单位换算表。
+
+记录用不可变的 NamedTuple 保存，按 id 和名称建索引，整份快照一次性替换。
+主数据任何变更都会在同一事务内把 MasterDataVersion 加一；各 worker 每隔
+MASTERDATA_CHECK_SECONDS 用一次主键查询比对版本号，不一致才重新加载。
+"""
+import threading
+import time
+from fractions import Fraction
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+
+from products.models import Item, ItemUnit, MasterDataVersion, Partner, Unit, Warehouse
+from products.quantities import convert_quantity, format_quantity, parse_quantity
+
+VERSION_PK = 1
+
+
+class UnitRecord(NamedTuple):
+    id: int
+    name: str
+    is_active: bool
+    precision: int
+
+
+class PartnerRecord(NamedTuple):
+    id: int
+    name: str
+    is_active: bool
+
+
+class WarehouseRecord(NamedTuple):
+    id: int
+    name: str
+    warehouse_type: str
+    is_active: bool
+
+
+class ItemRecord(NamedTuple):
+    id: int
+    name: str
+    warehouse_id: Optional[int]
+    unit_id: int
+    is_active: bool
+
+
+class ItemUnitRecord(NamedTuple):
+    """辅助单位：1 个 unit = numerator / denominator 个基本单位（加载时由 factor 预先约分）。"""
+    item_id: int
+    unit_id: int
+    numerator: int
+    denominator: int
+
+
+def _item_unit_record(item_id, unit_id, factor):
+    factor = Fraction(factor)
+    return ItemUnitRecord(item_id, unit_id, factor.numerator, factor.denominator)
+
+
+def _to_pk(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _sorted_active(records):
+    return sorted((r for r in records if r.is_active), key=lambda r: r.name)
+
+
+class MasterData:
+    __slots__ = (
+        "version",
+        "checked_at",
+        "units",
+        "partners",
+        "warehouses",
+        "items",
+        "unit_names",
+        "partner_names",
+        "warehouse_names",
+        "item_names",
+        "active_units",
+        "active_partners",
+        "active_warehouses",
+        "item_units",
+        "item_index",
+    )
+
+    def __init__(self, version, units, partners, warehouses, items, item_units):
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.units = {r.id: r for r in units}
+        self.partners = {r.id: r for r in partners}
+        self.warehouses = {r.id: r for r in warehouses}
+        self.items = {r.id: r for r in items}
+        # 名称在各表上都有唯一约束
+        self.unit_names = {r.name: r for r in units}
+        self.partner_names = {r.name: r for r in partners}
+        self.warehouse_names = {r.name: r for r in warehouses}
+        self.item_names = {r.name: r for r in items}
+        self.active_units = _sorted_active(units)
+        self.active_partners = _sorted_active(partners)
+        self.active_warehouses = _sorted_active(warehouses)
+        # item_id -> {unit_id: ItemUnitRecord}，只含已启用的换算
+        self.item_units = {}
+        for r in item_units:
+            self.item_units.setdefault(r.item_id, {})[r.unit_id] = r
+        # 由 catalog.item_index() 按需构建
+        self.item_index = None
+
+    def unit(self, pk):
+        return self.units.get(_to_pk(pk))
+
+    def partner(self, pk):
+        return self.partners.get(_to_pk(pk))
+
+    def warehouse(self, pk):
+        return self.warehouses.get(_to_pk(pk))
+
+    def item(self, pk):
+        return self.items.get(_to_pk(pk))
+
+    def unit_name(self, pk):
+        unit = self.units.get(pk)
+        return unit.name if unit else ""
+
+    def unit_precision(self, pk):
+        unit = self.units.get(pk)
+        return unit.precision if unit else 0
+
+    def item_precision(self, item_id):
+        """物品单位的小数位数：数量输入按它校验、显示按它保留。"""
+        item = self.items.get(item_id)
+        return self.unit_precision(item.unit_id) if item else 0
+
+    def format_item_quantity(self, item_id, value):
+        """定点数量按物品单位精度转成显示文本（提示信息、导出用）。"""
+        return format_quantity(value, self.item_precision(item_id))
+
+    def item_unit_names(self, item_id):
+        """物品可用于录入的单位名称：基本单位在前，其余为已启用的辅助单位。"""
+        item = self.items.get(item_id)
+        if item is None:
+            return []
+        names = [self.unit_name(item.unit_id)]
+        for unit_id in self.item_units.get(item_id, {}):
+            unit = self.units.get(unit_id)
+            if unit is not None and unit.is_active:
+                names.append(unit.name)
+        return names
+
+    def parse_item_quantity(self, item_id, value, unit=""):
+        """
+        按录入单位（名称；空为基本单位）解析数量，换算成基本单位的定点整数。
+        单位未给该物品配置、数量超出单位精度或换算后超出基本单位精度时抛出 ValueError。
+        """
+        item = self.items.get(item_id)
+        precision = self.item_precision(item_id)
+        unit = (unit or "").strip()
+        if item is None or not unit or unit == self.unit_name(item.unit_id):
+            return parse_quantity(value, precision)
+        record = self.unit_names.get(unit)
+        conversion = self.item_units.get(item_id, {}).get(record.id) if record is not None else None
+        if conversion is None or not record.is_active:
+            raise ValueError(f"物品未配置单位“{unit}”")
+        quantity = parse_quantity(value, record.precision)
+        return convert_quantity(quantity, conversion.numerator, conversion.denominator, precision)
+
+    def allowed_warehouses(self, role_context):
+        """与 ``role_context["warehouse"]`` 相同的仓库集合（已启用、按名称排序）。"""
+        types = role_context["warehouse_filter"].get("warehouse__warehouse_type__in")
+        if types is None:
+            return list(self.active_warehouses)
+        return [w for w in self.active_warehouses if w.warehouse_type in types]
+
+    def warehouse_allowed(self, warehouse, role_context):
+        """仓库类型是否在角色范围内（不要求已启用，对应 ``role_context["warehouse_filter"]``）。"""
+        types = role_context["warehouse_filter"].get("warehouse__warehouse_type__in")
+        return warehouse is not None and (types is None or warehouse.warehouse_type in types)
+
+    def allowed_warehouse(self, pk, role_context):
+        """``role_context["warehouse"].filter(id=pk).first()`` 的缓存版本。"""
+        warehouse = self.warehouse(pk)
+        if warehouse is None or not warehouse.is_active:
+            return None
+        return warehouse if self.warehouse_allowed(warehouse, role_context) else None
+
+    def items_in(self, warehouse_ids, active_only=True):
+        warehouse_ids = set(warehouse_ids)
+        return sorted(
+            (
+                r for r in self.items.values()
+                if r.warehouse_id in warehouse_ids and (r.is_active or not active_only)
+            ),
+            key=lambda r: r.name,
+        )
+
+
+def _current_version():
+    return (
+        MasterDataVersion.objects.using("default")
+        .filter(pk=VERSION_PK)
+        .values_list("version", flat=True)
+        .first()
+    ) or 0
+
+
+def _load(version):
+    # 固定读主库：只读副本可能落后于版本号
+    return MasterData(
+        version,
+        [
+            UnitRecord(*row)
+            for row in Unit.objects.using("default").values_list("id", "name", "is_active", "precision")
+        ],
+        [PartnerRecord(*row) for row in Partner.objects.using("default").values_list("id", "name", "is_active")],
+        [
+            WarehouseRecord(*row)
+            for row in Warehouse.objects.using("default").values_list("id", "name", "warehouse_type", "is_active")
+        ],
+        [
+            ItemRecord(*row)
+            for row in Item.objects.using("default").values_list("id", "name", "warehouse_id", "unit_id", "is_active")
+        ],
+        [
+            _item_unit_record(*row)
+            for row in ItemUnit.objects.using("default").filter(is_active=True).values_list("item_id", "unit_id", "factor")
+        ],
+    )
+
+
+_lock = threading.Lock()
+_current = None
+
+
+def master_data(strict=False) -> MasterData:
+    """
+    当前主数据快照。``strict=True`` 时无论上次检查多久都先比对版本号，
+    用于写操作前的校验（仍只多一次主键查询）。
+    """
+    global _current
+    data = _current
+    now = time.monotonic()
+    interval = getattr(settings, "MASTERDATA_CHECK_SECONDS", 2)
+    if data is not None and not strict and now - data.checked_at < interval:
+        return data
+
+    version = _current_version()
+    if data is not None and data.version == version:
+        data.checked_at = now
+        return data
+
+    if connections["default"].in_atomic_block:
+        # 事务里可能读到本事务未提交的修改，加载结果只给本次使用，不放进进程缓存
+        return _load(version)
+
+    with _lock:
+        data = _current
+        if data is None or data.version != version:
+            data = _current = _load(version)
+        data.checked_at = now
+    return data
+
+
+def expire():
+    """下次调用 master_data() 时重新比对版本号。"""
+    data = _current
+    if data is not None:
+        data.checked_at = float("-inf")
+
+
+def bump_version():
+    """在当前事务内把版本号加一，提交后本进程立即失效，其他 worker 在下次检查时失效。"""
+    updated = MasterDataVersion.objects.filter(pk=VERSION_PK).update(version=F("version") + 1)
+    if not updated:
+        MasterDataVersion.objects.get_or_create(pk=VERSION_PK, defaults={"version": 1})
+    transaction.on_commit(expire)
@@ -0,0 +1,83 @@
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from products.querylog import SlowQueryRecorder
+from products.routers import STICKY_COOKIE, replica_enabled
+
+
+class _SyncAndAsyncMiddleware:
+    """同时支持 WSGI 与 ASGI：ASGI 下 async 视图不会因为中间件而退回线程执行。"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.handle(request)
+
+
+class SlowQueryMiddleware(_SyncAndAsyncMiddleware):
+    """为每个请求挂上慢查询记录器；阈值为 0 时整个中间件不启用。"""
+
+    def __init__(self, get_response):
+        self.threshold_ms = getattr(settings, "SLOW_QUERY_THRESHOLD_MS", 0)
+        if self.threshold_ms <= 0:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def _install(self, stack, request):
+        for connection in connections.all():
+            recorder = SlowQueryRecorder(connection, self.threshold_ms, request=request)
+            stack.enter_context(connection.execute_wrapper(recorder))
+
+    def handle(self, request):
+        with ExitStack() as stack:
+            self._install(stack, request)
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        # 连接按线程区分：在 async ORM 调用所在的 thread-sensitive 线程里挂载和撤下记录器
+        stack = ExitStack()
+        await sync_to_async(self._install)(stack, request)
+        try:
+            return await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+
+
+class ReplicaStickinessMiddleware(_SyncAndAsyncMiddleware):
+    """用户提交写请求后的一小段时间内，use_replica 视图仍读主库（读到自己的写入）。"""
+
+    def __init__(self, get_response):
+        if not replica_enabled():
+            raise MiddlewareNotUsed
+        self.sticky_seconds = settings.DATABASE_REPLICA_STICKY_SECONDS
+        super().__init__(get_response)
+
+    def handle(self, request):
+        return self._mark(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self._mark(request, await self.get_response(request))
+
+    def _mark(self, request, response):
+        if request.method not in ("GET", "HEAD", "OPTIONS", "TRACE") and response.status_code < 500:
+            response.set_cookie(
+                STICKY_COOKIE,
+                "1",
+                max_age=self.sticky_seconds,
+                httponly=True,
+                samesite="Lax",
+                secure=settings.SESSION_COOKIE_SECURE,
+            )
+        return response
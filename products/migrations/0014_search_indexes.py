@@ -0,0 +1,86 @@
+from django.db import migrations
+
+# 本迁移时的搜索索引 SQL，原样冻结：products/search.py 以后的修改不影响历史迁移
+SEARCH_COLUMNS = {
+    "products_item": ("name",),
+    "products_warehouse": ("name",),
+    "products_partner": ("name",),
+    "products_stockmove": ("reference", "note"),
+}
+
+
+def _trgm_index_name(table, column):
+    return f"{table}_{column}_trgm"
+
+
+def _postgres_statements():
+    statements = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"]
+    for table, columns in SEARCH_COLUMNS.items():
+        for column in columns:
+            statements.append(
+                f'CREATE INDEX IF NOT EXISTS "{_trgm_index_name(table, column)}" '
+                f'ON "{table}" USING gin ((UPPER("{column}"::text)) gin_trgm_ops)'
+            )
+    return statements
+
+
+def _sqlite_statements(table, columns):
+    fts = f"{table}_fts"
+    cols = ", ".join(columns)
+    new_values = ", ".join(f"new.{c}" for c in columns)
+    old_values = ", ".join(f"old.{c}" for c in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{cols}, content='{table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_values}); END",
+    ]
+
+
+def forwards(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            for statement in _postgres_statements():
+                cursor.execute(statement)
+    elif connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            for table, columns in SEARCH_COLUMNS.items():
+                fts = f"{table}_fts"
+                try:
+                    for statement in _sqlite_statements(table, columns):
+                        cursor.execute(statement)
+                except Exception:  # 未编译 FTS5 的 SQLite：搜索保留 icontains
+                    return
+                cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def backwards(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            for table, columns in SEARCH_COLUMNS.items():
+                for column in columns:
+                    cursor.execute(f'DROP INDEX IF EXISTS "{_trgm_index_name(table, column)}"')
+        elif connection.vendor == "sqlite":
+            for table in SEARCH_COLUMNS:
+                fts = f"{table}_fts"
+                for suffix in ("ai", "ad", "au"):
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+                cursor.execute(f"DROP TABLE IF EXISTS {fts}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0013_alter_stockmove_move_type"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.27 on 2026-10-19 08:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0014_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterField(
+            model_name='stockmove',
+            name='move_type',
+            field=models.CharField(choices=[('INBOUND', '入库'), ('OUTBOUND', '出库'), ('ADJUST', '调整')], max_length=20, verbose_name='类型'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['warehouse', 'updated_at'], name='products_it_warehou_3d6c66_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockbalance',
+            index=models.Index(fields=['warehouse', 'updated_at'], name='products_st_warehou_4ce008_idx'),
+        ),
+    ]
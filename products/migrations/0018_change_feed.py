@@ -0,0 +1,40 @@
+# Generated by Django 4.2.27 on 2026-10-19 08:30
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_last_move_id(apps, schema_editor):
+    StockBalance = apps.get_model("products", "StockBalance")
+    StockMove = apps.get_model("products", "StockMove")
+    latest = (
+        StockMove.objects
+        .filter(item_id=OuterRef("item_id"), warehouse_id=OuterRef("warehouse_id"))
+        .values("item_id", "warehouse_id")
+        .annotate(last=Max("id"))
+        .values("last")
+    )
+    StockBalance.objects.update(
+        last_move_id=Coalesce(Subquery(latest), Value(0), output_field=models.BigIntegerField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0017_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockbalance',
+            name='last_move_id',
+            field=models.BigIntegerField(db_index=True, default=0, verbose_name='最近流水 ID'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmove',
+            index=models.Index(fields=['warehouse', 'id'], name='products_st_warehou_3ac119_idx'),
+        ),
+        migrations.RunPython(backfill_last_move_id, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.27 on 2026-10-19 08:36
+
+from django.db import migrations, models
+
+
+def create_version_row(apps, schema_editor):
+    MasterDataVersion = apps.get_model("products", "MasterDataVersion")
+    MasterDataVersion.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0018_change_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MasterDataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_version_row, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,105 @@
+from django.conf import settings
+from django.db import migrations
+
+# 本迁移时的余额触发器 SQL，原样冻结：此时余额表还没有 reserved / change_seq 列，
+# products/balance_triggers.py 以后的修改不影响历史迁移（最新的触发器由最后一个相关迁移和 post_migrate 安装）
+FUNCTION_NAME = "products_stockmove_balance"
+TRIGGER_EVENTS = {
+    "INSERT": "REFERENCING NEW TABLE AS new_rows",
+    "UPDATE": "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    "DELETE": "REFERENCING OLD TABLE AS old_rows",
+}
+SQLITE_TRIGGERS = ("products_stockmove_balance_ai", "products_stockmove_balance_au", "products_stockmove_balance_ad")
+
+_PG_UPSERT = """
+        INSERT INTO products_stockbalance AS b (item_id, warehouse_id, on_hand, last_move_id, updated_at)
+        SELECT item_id, warehouse_id, SUM(delta)::integer, MAX(last_id), now()
+        FROM ({changes}) AS changes
+        GROUP BY item_id, warehouse_id
+        ORDER BY item_id, warehouse_id
+        ON CONFLICT (item_id, warehouse_id) DO UPDATE SET
+            on_hand = b.on_hand + EXCLUDED.on_hand,
+            last_move_id = GREATEST(b.last_move_id, EXCLUDED.last_move_id),
+            updated_at = EXCLUDED.updated_at;"""
+_PG_NEW = "SELECT item_id, warehouse_id, quantity AS delta, id AS last_id FROM new_rows"
+_PG_OLD = "SELECT item_id, warehouse_id, -quantity AS delta, 0 AS last_id FROM old_rows"
+
+_SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+_SQLITE_ADD = f"""
+    INSERT INTO products_stockbalance (item_id, warehouse_id, on_hand, last_move_id, updated_at)
+    VALUES (new.item_id, new.warehouse_id, new.quantity, new.id, {_SQLITE_NOW})
+    ON CONFLICT (item_id, warehouse_id) DO UPDATE SET
+        on_hand = on_hand + excluded.on_hand,
+        last_move_id = MAX(last_move_id, excluded.last_move_id),
+        updated_at = excluded.updated_at;"""
+_SQLITE_SUBTRACT = f"""
+    UPDATE products_stockbalance
+    SET on_hand = on_hand - old.quantity, updated_at = {_SQLITE_NOW}
+    WHERE item_id = old.item_id AND warehouse_id = old.warehouse_id;"""
+
+
+def _postgres_statements():
+    statements = [f"""
+CREATE OR REPLACE FUNCTION {FUNCTION_NAME}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN{_PG_UPSERT.format(changes=_PG_NEW)}
+    ELSIF TG_OP = 'UPDATE' THEN{_PG_UPSERT.format(changes=f"{_PG_NEW} UNION ALL {_PG_OLD}")}
+    ELSE{_PG_UPSERT.format(changes=_PG_OLD)}
+    END IF;
+    RETURN NULL;
+END;
+$$"""]
+    for event, referencing in TRIGGER_EVENTS.items():
+        name = f"{FUNCTION_NAME}_{event.lower()}"
+        statements.append(f'DROP TRIGGER IF EXISTS "{name}" ON products_stockmove')
+        statements.append(
+            f'CREATE TRIGGER "{name}" AFTER {event} ON products_stockmove '
+            f"{referencing} FOR EACH STATEMENT EXECUTE FUNCTION {FUNCTION_NAME}()"
+        )
+    return statements
+
+
+def _sqlite_statements():
+    ai, au, ad = SQLITE_TRIGGERS
+    return [f"DROP TRIGGER IF EXISTS {name}" for name in SQLITE_TRIGGERS] + [
+        f"CREATE TRIGGER {ai} AFTER INSERT ON products_stockmove BEGIN{_SQLITE_ADD} END",
+        f"CREATE TRIGGER {au} AFTER UPDATE OF item_id, warehouse_id, quantity "
+        f"ON products_stockmove BEGIN{_SQLITE_SUBTRACT}{_SQLITE_ADD} END",
+        f"CREATE TRIGGER {ad} AFTER DELETE ON products_stockmove BEGIN{_SQLITE_SUBTRACT} END",
+    ]
+
+
+def backwards(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            for event in TRIGGER_EVENTS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS "{FUNCTION_NAME}_{event.lower()}" ON products_stockmove')
+            cursor.execute(f"DROP FUNCTION IF EXISTS {FUNCTION_NAME}()")
+        elif connection.vendor == "sqlite":
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def forwards(apps, schema_editor):
+    # 按 STOCK_BALANCE_ENGINE 安装或卸载
+    if getattr(settings, "STOCK_BALANCE_ENGINE", "signal") != "trigger":
+        backwards(apps, schema_editor)
+        return
+    connection = schema_editor.connection
+    statements = {"postgresql": _postgres_statements, "sqlite": _sqlite_statements}.get(connection.vendor)
+    if statements is not None:
+        with connection.cursor() as cursor:
+            for statement in statements():
+                cursor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0019_masterdataversion"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,155 @@
+# Generated by Django 4.2.27 on 2026-10-19 08:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# 本迁移前后的余额触发器 SQL，原样冻结：迁移前余额表没有 reserved 列，迁移后有；
+# products/balance_triggers.py 以后的修改不影响历史迁移
+FUNCTION_NAME = "products_stockmove_balance"
+TRIGGER_EVENTS = {
+    "INSERT": "REFERENCING NEW TABLE AS new_rows",
+    "UPDATE": "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    "DELETE": "REFERENCING OLD TABLE AS old_rows",
+}
+SQLITE_TRIGGERS = ("products_stockmove_balance_ai", "products_stockmove_balance_au", "products_stockmove_balance_ad")
+
+_PG_UPSERT = """
+        INSERT INTO products_stockbalance AS b (item_id, warehouse_id, on_hand, {reserved_column}last_move_id, updated_at)
+        SELECT item_id, warehouse_id, SUM(delta)::integer, {reserved_value}MAX(last_id), now()
+        FROM ({changes}) AS changes
+        GROUP BY item_id, warehouse_id
+        ORDER BY item_id, warehouse_id
+        ON CONFLICT (item_id, warehouse_id) DO UPDATE SET
+            on_hand = b.on_hand + EXCLUDED.on_hand,
+            last_move_id = GREATEST(b.last_move_id, EXCLUDED.last_move_id),
+            updated_at = EXCLUDED.updated_at;"""
+_PG_NEW = "SELECT item_id, warehouse_id, quantity AS delta, id AS last_id FROM new_rows"
+_PG_OLD = "SELECT item_id, warehouse_id, -quantity AS delta, 0 AS last_id FROM old_rows"
+
+_SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+_SQLITE_ADD = """
+    INSERT INTO products_stockbalance (item_id, warehouse_id, on_hand, {reserved_column}last_move_id, updated_at)
+    VALUES (new.item_id, new.warehouse_id, new.quantity, {reserved_value}new.id, {now})
+    ON CONFLICT (item_id, warehouse_id) DO UPDATE SET
+        on_hand = on_hand + excluded.on_hand,
+        last_move_id = MAX(last_move_id, excluded.last_move_id),
+        updated_at = excluded.updated_at;"""
+_SQLITE_SUBTRACT = f"""
+    UPDATE products_stockbalance
+    SET on_hand = on_hand - old.quantity, updated_at = {_SQLITE_NOW}
+    WHERE item_id = old.item_id AND warehouse_id = old.warehouse_id;"""
+
+
+def _reserved(reserved):
+    return {"reserved_column": "reserved, " if reserved else "", "reserved_value": "0, " if reserved else ""}
+
+
+def _postgres_statements(reserved):
+    on_insert, on_update, on_delete = (
+        _PG_UPSERT.format(changes=changes, **_reserved(reserved))
+        for changes in (_PG_NEW, f"{_PG_NEW} UNION ALL {_PG_OLD}", _PG_OLD)
+    )
+    statements = [f"""
+CREATE OR REPLACE FUNCTION {FUNCTION_NAME}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN{on_insert}
+    ELSIF TG_OP = 'UPDATE' THEN{on_update}
+    ELSE{on_delete}
+    END IF;
+    RETURN NULL;
+END;
+$$"""]
+    for event, referencing in TRIGGER_EVENTS.items():
+        name = f"{FUNCTION_NAME}_{event.lower()}"
+        statements.append(f'DROP TRIGGER IF EXISTS "{name}" ON products_stockmove')
+        statements.append(
+            f'CREATE TRIGGER "{name}" AFTER {event} ON products_stockmove '
+            f"{referencing} FOR EACH STATEMENT EXECUTE FUNCTION {FUNCTION_NAME}()"
+        )
+    return statements
+
+
+def _sqlite_statements(reserved):
+    ai, au, ad = SQLITE_TRIGGERS
+    add = _SQLITE_ADD.format(now=_SQLITE_NOW, **_reserved(reserved))
+    return [f"DROP TRIGGER IF EXISTS {name}" for name in SQLITE_TRIGGERS] + [
+        f"CREATE TRIGGER {ai} AFTER INSERT ON products_stockmove BEGIN{add} END",
+        f"CREATE TRIGGER {au} AFTER UPDATE OF item_id, warehouse_id, quantity "
+        f"ON products_stockmove BEGIN{_SQLITE_SUBTRACT}{add} END",
+        f"CREATE TRIGGER {ad} AFTER DELETE ON products_stockmove BEGIN{_SQLITE_SUBTRACT} END",
+    ]
+
+
+def drop_triggers(apps, schema_editor):
+    # SQLite 重建 products_stockbalance 时，引用它的触发器会让改名失败；先卸载，加完字段后按配置重装
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            for event in TRIGGER_EVENTS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS "{FUNCTION_NAME}_{event.lower()}" ON products_stockmove')
+            cursor.execute(f"DROP FUNCTION IF EXISTS {FUNCTION_NAME}()")
+        elif connection.vendor == "sqlite":
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def _sync_triggers(schema_editor, reserved):
+    # 按 STOCK_BALANCE_ENGINE 安装或卸载
+    if getattr(settings, "STOCK_BALANCE_ENGINE", "signal") != "trigger":
+        drop_triggers(None, schema_editor)
+        return
+    connection = schema_editor.connection
+    statements = {"postgresql": _postgres_statements, "sqlite": _sqlite_statements}.get(connection.vendor)
+    if statements is not None:
+        with connection.cursor() as cursor:
+            for statement in statements(reserved):
+                cursor.execute(statement)
+
+
+def restore_triggers(apps, schema_editor):
+    _sync_triggers(schema_editor, reserved=False)
+
+
+def sync_triggers(apps, schema_editor):
+    _sync_triggers(schema_editor, reserved=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('products', '0022_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_triggers, restore_triggers),
+        migrations.AddField(
+            model_name='stockbalance',
+            name='reserved',
+            field=models.IntegerField(default=0, verbose_name='已预留'),
+        ),
+        migrations.CreateModel(
+            name='Reservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='预留数量')),
+                ('status', models.CharField(choices=[('ACTIVE', '有效'), ('RELEASED', '已释放'), ('EXPIRED', '已过期'), ('FULFILLED', '已出库')], default='ACTIVE', max_length=10)),
+                ('reference', models.CharField(blank=True, max_length=100, verbose_name='单号/来源')),
+                ('note', models.TextField(blank=True, verbose_name='备注')),
+                ('expires_at', models.DateTimeField(verbose_name='过期时间')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservations', to=settings.AUTH_USER_MODEL)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='reservations', to='products.item')),
+                ('move', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.stockmove')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='reservations', to='products.warehouse')),
+            ],
+            options={
+                'verbose_name': '库存预留',
+                'verbose_name_plural': '库存预留',
+                'indexes': [models.Index(condition=models.Q(('status', 'ACTIVE')), fields=['expires_at'], name='reservation_active_exp_idx'), models.Index(fields=['item', 'warehouse', 'status'], name='products_re_item_id_967e47_idx'), models.Index(fields=['reference'], name='products_re_referen_4ac284_idx')],
+            },
+        ),
+        migrations.RunPython(sync_triggers, drop_triggers),
+    ]
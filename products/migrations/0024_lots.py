@@ -0,0 +1,58 @@
+# Generated by Django 4.2.27 on 2026-10-19 08:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0023_reservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lot_no', models.CharField(max_length=64, verbose_name='批号')),
+                ('expiry_date', models.DateField(blank=True, null=True, verbose_name='有效期至')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='lots', to='products.item')),
+            ],
+            options={
+                'verbose_name': '批次',
+                'verbose_name_plural': '批次',
+            },
+        ),
+        migrations.AddField(
+            model_name='stockmove',
+            name='lot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='moves', to='products.lot', verbose_name='批次'),
+        ),
+        migrations.CreateModel(
+            name='LotBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expiry_date', models.DateField(blank=True, null=True, verbose_name='有效期至')),
+                ('on_hand', models.IntegerField(default=0, verbose_name='当前库存')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='lot_balances', to='products.item')),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='balances', to='products.lot')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='lot_balances', to='products.warehouse')),
+            ],
+            options={
+                'verbose_name': '批次余额',
+                'verbose_name_plural': '批次余额',
+                'indexes': [models.Index(condition=models.Q(('on_hand__gt', 0)), fields=['item', 'warehouse', 'expiry_date', 'id'], name='lot_balance_fefo_idx'), models.Index(condition=models.Q(('on_hand__gt', 0)), fields=['expiry_date', 'warehouse'], name='lot_balance_expiry_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='lotbalance',
+            constraint=models.UniqueConstraint(fields=('lot', 'warehouse'), name='uniq_lot_balance_lot_warehouse'),
+        ),
+        migrations.AddConstraint(
+            model_name='lot',
+            constraint=models.UniqueConstraint(fields=('item', 'lot_no'), name='uniq_lot_item_lot_no'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.27 on 2026-10-19 08:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('products', '0024_lots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Stocktake',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('OPEN', '盘点中'), ('APPROVED', '已过账'), ('CANCELLED', '已取消')], default='OPEN', max_length=10)),
+                ('note', models.TextField(blank=True, verbose_name='备注')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('approved_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stocktakes', to=settings.AUTH_USER_MODEL)),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='stocktakes', to='products.warehouse', verbose_name='仓库')),
+            ],
+            options={
+                'verbose_name': '盘点单',
+                'verbose_name_plural': '盘点单',
+            },
+        ),
+        migrations.CreateModel(
+            name='StocktakeLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('expected', models.IntegerField(default=0, verbose_name='账面数')),
+                ('counted', models.IntegerField(blank=True, null=True, verbose_name='实盘数')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='products.item')),
+                ('stocktake', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='products.stocktake')),
+            ],
+            options={
+                'verbose_name': '盘点明细',
+                'verbose_name_plural': '盘点明细',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='stocktakeline',
+            constraint=models.UniqueConstraint(fields=('stocktake', 'item'), name='uniq_stocktake_line_item'),
+        ),
+        migrations.AddIndex(
+            model_name='stocktake',
+            index=models.Index(fields=['warehouse', 'status'], name='products_st_warehou_ee1723_idx'),
+        ),
+    ]
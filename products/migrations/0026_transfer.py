@@ -0,0 +1,119 @@
+# Generated by Django 4.2.27 on 2026-10-19 09:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+# 本迁移时的余额触发器 SQL，原样冻结（此时余额表已有 reserved、还没有 change_seq 列），
+# products/balance_triggers.py 以后的修改不影响历史迁移
+FUNCTION_NAME = "products_stockmove_balance"
+TRIGGER_EVENTS = {
+    "INSERT": "REFERENCING NEW TABLE AS new_rows",
+    "UPDATE": "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    "DELETE": "REFERENCING OLD TABLE AS old_rows",
+}
+SQLITE_TRIGGERS = ("products_stockmove_balance_ai", "products_stockmove_balance_au", "products_stockmove_balance_ad")
+
+_PG_UPSERT = """
+        INSERT INTO products_stockbalance AS b (item_id, warehouse_id, on_hand, reserved, last_move_id, updated_at)
+        SELECT item_id, warehouse_id, SUM(delta)::integer, 0, MAX(last_id), now()
+        FROM ({changes}) AS changes
+        GROUP BY item_id, warehouse_id
+        ORDER BY item_id, warehouse_id
+        ON CONFLICT (item_id, warehouse_id) DO UPDATE SET
+            on_hand = b.on_hand + EXCLUDED.on_hand,
+            last_move_id = GREATEST(b.last_move_id, EXCLUDED.last_move_id),
+            updated_at = EXCLUDED.updated_at;"""
+_PG_NEW = "SELECT item_id, warehouse_id, quantity AS delta, id AS last_id FROM new_rows"
+_PG_OLD = "SELECT item_id, warehouse_id, -quantity AS delta, 0 AS last_id FROM old_rows"
+
+_SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+_SQLITE_ADD = f"""
+    INSERT INTO products_stockbalance (item_id, warehouse_id, on_hand, reserved, last_move_id, updated_at)
+    VALUES (new.item_id, new.warehouse_id, new.quantity, 0, new.id, {_SQLITE_NOW})
+    ON CONFLICT (item_id, warehouse_id) DO UPDATE SET
+        on_hand = on_hand + excluded.on_hand,
+        last_move_id = MAX(last_move_id, excluded.last_move_id),
+        updated_at = excluded.updated_at;"""
+_SQLITE_SUBTRACT = f"""
+    UPDATE products_stockbalance
+    SET on_hand = on_hand - old.quantity, updated_at = {_SQLITE_NOW}
+    WHERE item_id = old.item_id AND warehouse_id = old.warehouse_id;"""
+
+
+def _postgres_statements():
+    statements = [f"""
+CREATE OR REPLACE FUNCTION {FUNCTION_NAME}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN{_PG_UPSERT.format(changes=_PG_NEW)}
+    ELSIF TG_OP = 'UPDATE' THEN{_PG_UPSERT.format(changes=f"{_PG_NEW} UNION ALL {_PG_OLD}")}
+    ELSE{_PG_UPSERT.format(changes=_PG_OLD)}
+    END IF;
+    RETURN NULL;
+END;
+$$"""]
+    for event, referencing in TRIGGER_EVENTS.items():
+        name = f"{FUNCTION_NAME}_{event.lower()}"
+        statements.append(f'DROP TRIGGER IF EXISTS "{name}" ON products_stockmove')
+        statements.append(
+            f'CREATE TRIGGER "{name}" AFTER {event} ON products_stockmove '
+            f"{referencing} FOR EACH STATEMENT EXECUTE FUNCTION {FUNCTION_NAME}()"
+        )
+    return statements
+
+
+def _sqlite_statements():
+    ai, au, ad = SQLITE_TRIGGERS
+    return [f"DROP TRIGGER IF EXISTS {name}" for name in SQLITE_TRIGGERS] + [
+        f"CREATE TRIGGER {ai} AFTER INSERT ON products_stockmove BEGIN{_SQLITE_ADD} END",
+        f"CREATE TRIGGER {au} AFTER UPDATE OF item_id, warehouse_id, quantity "
+        f"ON products_stockmove BEGIN{_SQLITE_SUBTRACT}{_SQLITE_ADD} END",
+        f"CREATE TRIGGER {ad} AFTER DELETE ON products_stockmove BEGIN{_SQLITE_SUBTRACT} END",
+    ]
+
+
+def drop_triggers(apps, schema_editor):
+    # SQLite 修改 move_type 的 choices 会重建 products_stockmove，先卸载触发器，改完后按配置重装
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            for event in TRIGGER_EVENTS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS "{FUNCTION_NAME}_{event.lower()}" ON products_stockmove')
+            cursor.execute(f"DROP FUNCTION IF EXISTS {FUNCTION_NAME}()")
+        elif connection.vendor == "sqlite":
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def sync_triggers(apps, schema_editor):
+    # 按 STOCK_BALANCE_ENGINE 安装或卸载
+    if getattr(settings, "STOCK_BALANCE_ENGINE", "signal") != "trigger":
+        drop_triggers(apps, schema_editor)
+        return
+    connection = schema_editor.connection
+    statements = {"postgresql": _postgres_statements, "sqlite": _sqlite_statements}.get(connection.vendor)
+    if statements is not None:
+        with connection.cursor() as cursor:
+            for statement in statements():
+                cursor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0025_stocktake'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_triggers, sync_triggers),
+        migrations.AddField(
+            model_name='stockmove',
+            name='transfer_id',
+            field=models.UUIDField(blank=True, db_index=True, null=True, verbose_name='调拨单号'),
+        ),
+        migrations.AlterField(
+            model_name='stockmove',
+            name='move_type',
+            field=models.CharField(choices=[('INBOUND', '入库'), ('OUTBOUND', '出库'), ('ADJUST', '调整'), ('TRANSFER', '调拨')], max_length=20, verbose_name='类型'),
+        ),
+        migrations.RunPython(sync_triggers, drop_triggers),
+    ]
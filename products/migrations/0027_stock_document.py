@@ -0,0 +1,120 @@
+# Generated by Django 4.2.27 on 2026-10-19 09:04
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+UPDATE_BATCH_SIZE = 1000
+DOCUMENT_TYPES = {"INBOUND", "OUTBOUND", "ADJUST", "TRANSFER"}
+
+
+def backfill_documents(apps, schema_editor):
+    """
+    历史批次按单号归档成单据：``BATCH-<时间>-<用户 id>``（导入未填单号的行）与已过账盘点的
+    ``STOCKTAKE-<id>``。只扫描一遍这两类流水，再按主键分批回写 document_id。
+    """
+    StockDocument = apps.get_model("products", "StockDocument")
+    StockMove = apps.get_model("products", "StockMove")
+    Stocktake = apps.get_model("products", "Stocktake")
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+
+    groups = defaultdict(lambda: {"ids": [], "types": set(), "created_at": None})
+    rows = (
+        StockMove.objects
+        .filter(models.Q(reference__startswith="BATCH-") | models.Q(reference__startswith="STOCKTAKE-"))
+        .values_list("pk", "reference", "move_type", "created_at")
+        .iterator()
+    )
+    for pk, reference, move_type, created_at in rows:
+        group = groups[reference]
+        group["ids"].append(pk)
+        group["types"].add(move_type)
+        if group["created_at"] is None or created_at < group["created_at"]:
+            group["created_at"] = created_at
+    if not groups:
+        return
+
+    user_ids = set(User.objects.values_list("pk", flat=True))
+    stocktakes = {
+        f"STOCKTAKE-{pk}": (pk, approved_by_id)
+        for pk, approved_by_id in Stocktake.objects.filter(status="APPROVED").values_list("pk", "approved_by_id")
+    }
+    for reference, group in groups.items():
+        user_id = None
+        if reference in stocktakes:
+            doc_type = "STOCKTAKE"
+            user_id = stocktakes[reference][1]
+        elif reference.startswith("BATCH-"):
+            types = group["types"]
+            doc_type = next(iter(types)) if len(types) == 1 and types <= DOCUMENT_TYPES else "BATCH"
+            suffix = reference.rsplit("-", 1)[-1]
+            if suffix.isdigit() and int(suffix) in user_ids:
+                user_id = int(suffix)
+        else:
+            continue
+        document = StockDocument.objects.create(
+            doc_type=doc_type,
+            reference=reference,
+            line_count=len(group["ids"]),
+            created_by_id=user_id,
+        )
+        # auto_now_add 会覆盖 created_at，建好后改回批次的时间
+        StockDocument.objects.filter(pk=document.pk).update(created_at=group["created_at"])
+        ids = group["ids"]
+        for start in range(0, len(ids), UPDATE_BATCH_SIZE):
+            StockMove.objects.filter(pk__in=ids[start:start + UPDATE_BATCH_SIZE]).update(document_id=document.pk)
+        if reference in stocktakes:
+            Stocktake.objects.filter(pk=stocktakes[reference][0]).update(document_id=document.pk)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('products', '0026_transfer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('doc_type', models.CharField(choices=[('INBOUND', '入库单'), ('OUTBOUND', '出库单'), ('ADJUST', '调整单'), ('TRANSFER', '调拨单'), ('STOCKTAKE', '盘点过账'), ('BATCH', '接口批量'), ('REVERSAL', '冲销单')], max_length=10, verbose_name='单据类型')),
+                ('reference', models.CharField(blank=True, max_length=100, verbose_name='单号/来源')),
+                ('note', models.TextField(blank=True, verbose_name='备注')),
+                ('line_count', models.PositiveIntegerField(default=0, verbose_name='流水条数')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_documents', to=settings.AUTH_USER_MODEL)),
+                ('reverses', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='reversal', to='products.stockdocument', verbose_name='冲销的单据')),
+            ],
+            options={
+                'verbose_name': '单据',
+                'verbose_name_plural': '单据',
+            },
+        ),
+        migrations.AddField(
+            model_name='stockmove',
+            name='document',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='moves', to='products.stockdocument', verbose_name='单据'),
+        ),
+        migrations.AddField(
+            model_name='stocktake',
+            name='document',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.stockdocument'),
+        ),
+        migrations.AddIndex(
+            model_name='stockdocument',
+            index=models.Index(fields=['doc_type', 'created_at'], name='products_st_doc_typ_ee62b6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockdocument',
+            index=models.Index(fields=['created_by', 'created_at'], name='products_st_created_856305_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockdocument',
+            index=models.Index(fields=['created_at'], name='products_st_created_e8bc76_idx'),
+        ),
+        migrations.RunPython(backfill_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,194 @@
+# Generated by Django 4.2.27 on 2026-10-19 09:15
+
+import django.core.validators
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+SCALE = 1000
+
+# 改为定点整数（千分之一单位）的数量列
+QUANTITY_COLUMNS = [
+    ("StockMove", "quantity"),
+    ("StockBalance", "on_hand"),
+    ("StockBalance", "reserved"),
+    ("LotBalance", "on_hand"),
+    ("Reservation", "quantity"),
+    ("StocktakeLine", "expected"),
+    ("StocktakeLine", "counted"),
+]
+
+# 本迁移前后的余额触发器 SQL，原样冻结：数量列改为 BigInteger 后，PostgreSQL 汇总改按 bigint；
+# products/balance_triggers.py 以后的修改不影响历史迁移
+FUNCTION_NAME = "products_stockmove_balance"
+TRIGGER_EVENTS = {
+    "INSERT": "REFERENCING NEW TABLE AS new_rows",
+    "UPDATE": "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    "DELETE": "REFERENCING OLD TABLE AS old_rows",
+}
+SQLITE_TRIGGERS = ("products_stockmove_balance_ai", "products_stockmove_balance_au", "products_stockmove_balance_ad")
+
+_PG_UPSERT = """
+        INSERT INTO products_stockbalance AS b (item_id, warehouse_id, on_hand, reserved, last_move_id, updated_at)
+        SELECT item_id, warehouse_id, SUM(delta)::{cast}, 0, MAX(last_id), now()
+        FROM ({changes}) AS changes
+        GROUP BY item_id, warehouse_id
+        ORDER BY item_id, warehouse_id
+        ON CONFLICT (item_id, warehouse_id) DO UPDATE SET
+            on_hand = b.on_hand + EXCLUDED.on_hand,
+            last_move_id = GREATEST(b.last_move_id, EXCLUDED.last_move_id),
+            updated_at = EXCLUDED.updated_at;"""
+_PG_NEW = "SELECT item_id, warehouse_id, quantity AS delta, id AS last_id FROM new_rows"
+_PG_OLD = "SELECT item_id, warehouse_id, -quantity AS delta, 0 AS last_id FROM old_rows"
+
+_SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+_SQLITE_ADD = f"""
+    INSERT INTO products_stockbalance (item_id, warehouse_id, on_hand, reserved, last_move_id, updated_at)
+    VALUES (new.item_id, new.warehouse_id, new.quantity, 0, new.id, {_SQLITE_NOW})
+    ON CONFLICT (item_id, warehouse_id) DO UPDATE SET
+        on_hand = on_hand + excluded.on_hand,
+        last_move_id = MAX(last_move_id, excluded.last_move_id),
+        updated_at = excluded.updated_at;"""
+_SQLITE_SUBTRACT = f"""
+    UPDATE products_stockbalance
+    SET on_hand = on_hand - old.quantity, updated_at = {_SQLITE_NOW}
+    WHERE item_id = old.item_id AND warehouse_id = old.warehouse_id;"""
+
+
+def _postgres_statements(cast):
+    statements = [f"""
+CREATE OR REPLACE FUNCTION {FUNCTION_NAME}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN{_PG_UPSERT.format(changes=_PG_NEW, cast=cast)}
+    ELSIF TG_OP = 'UPDATE' THEN{_PG_UPSERT.format(changes=f"{_PG_NEW} UNION ALL {_PG_OLD}", cast=cast)}
+    ELSE{_PG_UPSERT.format(changes=_PG_OLD, cast=cast)}
+    END IF;
+    RETURN NULL;
+END;
+$$"""]
+    for event, referencing in TRIGGER_EVENTS.items():
+        name = f"{FUNCTION_NAME}_{event.lower()}"
+        statements.append(f'DROP TRIGGER IF EXISTS "{name}" ON products_stockmove')
+        statements.append(
+            f'CREATE TRIGGER "{name}" AFTER {event} ON products_stockmove '
+            f"{referencing} FOR EACH STATEMENT EXECUTE FUNCTION {FUNCTION_NAME}()"
+        )
+    return statements
+
+
+def _sqlite_statements():
+    ai, au, ad = SQLITE_TRIGGERS
+    return [f"DROP TRIGGER IF EXISTS {name}" for name in SQLITE_TRIGGERS] + [
+        f"CREATE TRIGGER {ai} AFTER INSERT ON products_stockmove BEGIN{_SQLITE_ADD} END",
+        f"CREATE TRIGGER {au} AFTER UPDATE OF item_id, warehouse_id, quantity "
+        f"ON products_stockmove BEGIN{_SQLITE_SUBTRACT}{_SQLITE_ADD} END",
+        f"CREATE TRIGGER {ad} AFTER DELETE ON products_stockmove BEGIN{_SQLITE_SUBTRACT} END",
+    ]
+
+
+def drop_triggers(apps, schema_editor):
+    # 改列类型会重建表；换算流水数量时也不能让触发器再改一遍余额
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            for event in TRIGGER_EVENTS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS "{FUNCTION_NAME}_{event.lower()}" ON products_stockmove')
+            cursor.execute(f"DROP FUNCTION IF EXISTS {FUNCTION_NAME}()")
+        elif connection.vendor == "sqlite":
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def _sync_triggers(schema_editor, cast):
+    # 按 STOCK_BALANCE_ENGINE 安装或卸载
+    if getattr(settings, "STOCK_BALANCE_ENGINE", "signal") != "trigger":
+        drop_triggers(None, schema_editor)
+        return
+    connection = schema_editor.connection
+    if connection.vendor == "postgresql":
+        statements = _postgres_statements(cast)
+    elif connection.vendor == "sqlite":
+        statements = _sqlite_statements()
+    else:
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def restore_triggers(apps, schema_editor):
+    _sync_triggers(schema_editor, cast="integer")
+
+
+def sync_triggers(apps, schema_editor):
+    _sync_triggers(schema_editor, cast="bigint")
+
+
+def _rescale(apps, schema_editor, forward):
+    using = schema_editor.connection.alias
+    for model_name, field in QUANTITY_COLUMNS:
+        model = apps.get_model("products", model_name)
+        value = F(field) * SCALE if forward else F(field) / SCALE
+        model.objects.using(using).exclude(**{field: 0}).exclude(**{f"{field}__isnull": True}).update(**{field: value})
+
+
+def scale_quantities(apps, schema_editor):
+    _rescale(apps, schema_editor, forward=True)
+
+
+def unscale_quantities(apps, schema_editor):
+    # 回退时小数部分被截断
+    _rescale(apps, schema_editor, forward=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0027_stock_document'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_triggers, restore_triggers),
+        migrations.AddField(
+            model_name='unit',
+            name='precision',
+            field=models.PositiveSmallIntegerField(default=0, help_text='0 为整数（件、箱）；kg、m 等可设 1~3 位', validators=[django.core.validators.MaxValueValidator(3)], verbose_name='小数位数'),
+        ),
+        migrations.AlterField(
+            model_name='lotbalance',
+            name='on_hand',
+            field=models.BigIntegerField(default=0, verbose_name='当前库存（千分之一单位）'),
+        ),
+        migrations.AlterField(
+            model_name='reservation',
+            name='quantity',
+            field=models.PositiveBigIntegerField(verbose_name='预留数量（千分之一单位）'),
+        ),
+        migrations.AlterField(
+            model_name='stockbalance',
+            name='on_hand',
+            field=models.BigIntegerField(default=0, verbose_name='当前库存（千分之一单位）'),
+        ),
+        migrations.AlterField(
+            model_name='stockbalance',
+            name='reserved',
+            field=models.BigIntegerField(default=0, verbose_name='已预留（千分之一单位）'),
+        ),
+        migrations.AlterField(
+            model_name='stockmove',
+            name='quantity',
+            field=models.BigIntegerField(verbose_name='变动数量（千分之一单位）'),
+        ),
+        migrations.AlterField(
+            model_name='stocktakeline',
+            name='counted',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='实盘数（千分之一单位）'),
+        ),
+        migrations.AlterField(
+            model_name='stocktakeline',
+            name='expected',
+            field=models.BigIntegerField(default=0, verbose_name='账面数（千分之一单位）'),
+        ),
+        migrations.RunPython(scale_quantities, unscale_quantities),
+        migrations.RunPython(sync_triggers, drop_triggers),
+    ]
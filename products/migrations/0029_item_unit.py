@@ -0,0 +1,34 @@
+# Generated by Django 4.2.27 on 2026-10-19 09:19
+
+from decimal import Decimal
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0028_fixed_point_quantities'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemUnit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('factor', models.DecimalField(decimal_places=6, help_text='1 个该单位折合多少个基本单位', max_digits=18, validators=[django.core.validators.MinValueValidator(Decimal('0.000001'))], verbose_name='换算系数')),
+                ('is_active', models.BooleanField(default=True, verbose_name='是否启用')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alt_units', to='products.item', verbose_name='物品')),
+                ('unit', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='item_conversions', to='products.unit', verbose_name='单位')),
+            ],
+            options={
+                'verbose_name': '辅助单位',
+                'verbose_name_plural': '辅助单位',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='itemunit',
+            constraint=models.UniqueConstraint(fields=('item', 'unit'), name='uniq_item_unit'),
+        ),
+    ]
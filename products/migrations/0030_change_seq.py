@@ -0,0 +1,137 @@
+# Generated by Django 4.2.27 on 2026-10-19 09:31
+
+from django.db import migrations, models
+
+from products.balance_triggers import sync_balance_triggers, trigger_engine_enabled, uninstall_balance_triggers
+from products.change_feed import install_change_seq_triggers, uninstall_change_seq_triggers
+from products.search import install_search_indexes, uninstall_search_indexes
+
+# 0029 时的余额触发器 SQL，原样冻结（没有 change_seq 列），只在回退时使用
+FUNCTION_NAME = "products_stockmove_balance"
+TRIGGER_EVENTS = {
+    "INSERT": "REFERENCING NEW TABLE AS new_rows",
+    "UPDATE": "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    "DELETE": "REFERENCING OLD TABLE AS old_rows",
+}
+SQLITE_TRIGGERS = ("products_stockmove_balance_ai", "products_stockmove_balance_au", "products_stockmove_balance_ad")
+
+_PG_UPSERT = """
+        INSERT INTO products_stockbalance AS b (item_id, warehouse_id, on_hand, reserved, last_move_id, updated_at)
+        SELECT item_id, warehouse_id, SUM(delta)::bigint, 0, MAX(last_id), now()
+        FROM ({changes}) AS changes
+        GROUP BY item_id, warehouse_id
+        ORDER BY item_id, warehouse_id
+        ON CONFLICT (item_id, warehouse_id) DO UPDATE SET
+            on_hand = b.on_hand + EXCLUDED.on_hand,
+            last_move_id = GREATEST(b.last_move_id, EXCLUDED.last_move_id),
+            updated_at = EXCLUDED.updated_at;"""
+_PG_NEW = "SELECT item_id, warehouse_id, quantity AS delta, id AS last_id FROM new_rows"
+_PG_OLD = "SELECT item_id, warehouse_id, -quantity AS delta, 0 AS last_id FROM old_rows"
+
+_SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+_SQLITE_ADD = f"""
+    INSERT INTO products_stockbalance (item_id, warehouse_id, on_hand, reserved, last_move_id, updated_at)
+    VALUES (new.item_id, new.warehouse_id, new.quantity, 0, new.id, {_SQLITE_NOW})
+    ON CONFLICT (item_id, warehouse_id) DO UPDATE SET
+        on_hand = on_hand + excluded.on_hand,
+        last_move_id = MAX(last_move_id, excluded.last_move_id),
+        updated_at = excluded.updated_at;"""
+_SQLITE_SUBTRACT = f"""
+    UPDATE products_stockbalance
+    SET on_hand = on_hand - old.quantity, updated_at = {_SQLITE_NOW}
+    WHERE item_id = old.item_id AND warehouse_id = old.warehouse_id;"""
+
+
+def _postgres_statements():
+    statements = [f"""
+CREATE OR REPLACE FUNCTION {FUNCTION_NAME}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN{_PG_UPSERT.format(changes=_PG_NEW)}
+    ELSIF TG_OP = 'UPDATE' THEN{_PG_UPSERT.format(changes=f"{_PG_NEW} UNION ALL {_PG_OLD}")}
+    ELSE{_PG_UPSERT.format(changes=_PG_OLD)}
+    END IF;
+    RETURN NULL;
+END;
+$$"""]
+    for event, referencing in TRIGGER_EVENTS.items():
+        name = f"{FUNCTION_NAME}_{event.lower()}"
+        statements.append(f'DROP TRIGGER IF EXISTS "{name}" ON products_stockmove')
+        statements.append(
+            f'CREATE TRIGGER "{name}" AFTER {event} ON products_stockmove '
+            f"{referencing} FOR EACH STATEMENT EXECUTE FUNCTION {FUNCTION_NAME}()"
+        )
+    return statements
+
+
+def _sqlite_statements():
+    ai, au, ad = SQLITE_TRIGGERS
+    return [f"DROP TRIGGER IF EXISTS {name}" for name in SQLITE_TRIGGERS] + [
+        f"CREATE TRIGGER {ai} AFTER INSERT ON products_stockmove BEGIN{_SQLITE_ADD} END",
+        f"CREATE TRIGGER {au} AFTER UPDATE OF item_id, warehouse_id, quantity "
+        f"ON products_stockmove BEGIN{_SQLITE_SUBTRACT}{_SQLITE_ADD} END",
+        f"CREATE TRIGGER {ad} AFTER DELETE ON products_stockmove BEGIN{_SQLITE_SUBTRACT} END",
+    ]
+
+
+def drop_triggers(apps, schema_editor):
+    # SQLite 加列会重建表
+    uninstall_change_seq_triggers(schema_editor.connection)
+    uninstall_balance_triggers(schema_editor.connection)
+    if schema_editor.connection.vendor == "sqlite":
+        # 换成只在搜索列变化时触发的 FTS 更新触发器，否则打变更序号的 UPDATE 会先于 FTS 插入触发
+        uninstall_search_indexes(schema_editor.connection)
+
+
+def restore_triggers(apps, schema_editor):
+    # 回退到 0029：余额表还没有 change_seq 列，只能装当时的触发器
+    if schema_editor.connection.vendor == "sqlite":
+        install_search_indexes(schema_editor.connection)
+    if not trigger_engine_enabled():
+        return
+    connection = schema_editor.connection
+    statements = {"postgresql": _postgres_statements, "sqlite": _sqlite_statements}.get(connection.vendor)
+    if statements is not None:
+        with connection.cursor() as cursor:
+            for statement in statements():
+                cursor.execute(statement)
+
+
+def install_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        install_search_indexes(schema_editor.connection)
+    install_change_seq_triggers(schema_editor.connection)
+    sync_balance_triggers(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0029_item_unit'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_triggers, restore_triggers),
+        migrations.RemoveIndex(
+            model_name='stockmove',
+            name='products_st_warehou_3ac119_idx',
+        ),
+        migrations.AddField(
+            model_name='stockbalance',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='变更序号'),
+        ),
+        migrations.AddField(
+            model_name='stockmove',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='变更序号'),
+        ),
+        migrations.AddIndex(
+            model_name='stockbalance',
+            index=models.Index(fields=['change_seq'], name='products_st_change__c355a5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmove',
+            index=models.Index(fields=['change_seq', 'id'], name='products_st_change__d83e01_idx'),
+        ),
+        migrations.RunPython(install_triggers, drop_triggers),
+    ]
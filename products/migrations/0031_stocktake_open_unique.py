@@ -0,0 +1,17 @@
+# Generated by Django 4.2.27 on 2026-10-19 09:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0030_change_seq'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='stocktake',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'OPEN')), fields=('warehouse',), name='uniq_open_stocktake_per_warehouse'),
+        ),
+    ]
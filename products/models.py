@@ -1,11 +1,19 @@
-from django.db import models
+import secrets
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import models, transaction
+from django.dispatch import Signal
 from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.utils import timezone
 
 
 class MoveType(models.TextChoices):
     INBOUND = "INBOUND", "入库"
     OUTBOUND = "OUTBOUND", "出库"
     ADJUST = "ADJUST", "调整"
+    TRANSFER = "TRANSFER", "调拨"
 
 
 class WarehouseType(models.TextChoices):
@@ -14,14 +22,50 @@ class WarehouseType(models.TextChoices):
     BOTH = "BOTH", "通用仓"
 
 
+# 主数据批量写入（不经过 save/delete）时发出，sender 为模型类
+master_data_bulk_changed = Signal()
+
+
+class MasterDataQuerySet(models.QuerySet):
+    """
+    主数据查询集：update / bulk_create 不触发 post_save，这里补发
+    ``master_data_bulk_changed``，保证缓存版本号照样加一（bulk_update 内部走 update）。
+    QuerySet.delete()（含后台批量删除）在有 post_delete 接收者时逐条发信号，不需要额外处理。
+    """
+
+    def _changed(self):
+        master_data_bulk_changed.send(sender=self.model)
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        if rows:
+            self._changed()
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if objs:
+            self._changed()
+        return objs
+
+
 class Unit(models.Model):
     """
     单位字典表：可由后台随时新增/修改（更灵活）
     """
     name = models.CharField(max_length=50, unique=True, verbose_name="单位名称")  # e.g. 件, 箱
+    # 数量按 1/1000 定点存储（见 products.quantities），精度只约束输入和显示
+    precision = models.PositiveSmallIntegerField(
+        default=0,
+        validators=[MaxValueValidator(3)],
+        verbose_name="小数位数",
+        help_text="0 为整数（件、箱）；kg、m 等可设 1~3 位",
+    )
     is_active = models.BooleanField(default=True, verbose_name="是否启用")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = MasterDataQuerySet.as_manager()
+
     class Meta:
         ordering = ["name"]
         verbose_name = "单位"
@@ -42,6 +86,8 @@ class Warehouse(models.Model):
     is_active = models.BooleanField(default=True, verbose_name="是否启用")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = MasterDataQuerySet.as_manager()
+
     class Meta:
         ordering = ["name"]
         verbose_name = "仓库"
@@ -56,6 +102,8 @@ class Partner(models.Model):
     is_active = models.BooleanField(default=True, verbose_name="是否启用")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = MasterDataQuerySet.as_manager()
+
     class Meta:
         ordering = ["name"]
         verbose_name = "合作方"
@@ -86,9 +134,15 @@ class Item(models.Model):
     category = models.CharField(max_length=50, blank=True, verbose_name="分类（可选）")
     is_active = models.BooleanField(default=True, verbose_name="是否启用")
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = MasterDataQuerySet.as_manager()
 
     class Meta:
         ordering = ["name"]
+        indexes = [
+            models.Index(fields=["warehouse", "updated_at"]),
+        ]
         verbose_name = "物品"
         verbose_name_plural = "物品"
 
@@ -98,6 +152,108 @@ class Item(models.Model):
         return self.name
 
 
+class ItemUnit(models.Model):
+    """
+    物品的辅助单位及换算系数：1 个该单位 = factor 个基本单位（如 1 箱 = 12 件）。
+    按辅助单位录入的数量在写入时换算成基本单位，流水和余额只有基本单位。
+    """
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name="alt_units", verbose_name="物品")
+    unit = models.ForeignKey(Unit, on_delete=models.PROTECT, related_name="item_conversions", verbose_name="单位")
+    factor = models.DecimalField(
+        max_digits=18,
+        decimal_places=6,
+        validators=[MinValueValidator(Decimal("0.000001"))],
+        verbose_name="换算系数",
+        help_text="1 个该单位折合多少个基本单位",
+    )
+    is_active = models.BooleanField(default=True, verbose_name="是否启用")
+
+    objects = MasterDataQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["item", "unit"], name="uniq_item_unit"),
+        ]
+        verbose_name = "辅助单位"
+        verbose_name_plural = "辅助单位"
+
+    def __str__(self):
+        return f"1 {self.unit} = {self.factor.normalize():f} {self.item.unit}"
+
+    def clean(self):
+        if self.item_id and self.unit_id and self.unit_id == self.item.unit_id:
+            raise ValidationError({"unit": "辅助单位不能与基本单位相同"})
+
+
+class Lot(models.Model):
+    """物品批次：批号在同一物品内唯一，效期以首次入库时填写的为准。"""
+    item = models.ForeignKey(Item, on_delete=models.PROTECT, related_name="lots")
+    lot_no = models.CharField(max_length=64, verbose_name="批号")
+    expiry_date = models.DateField(null=True, blank=True, verbose_name="有效期至")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["item", "lot_no"], name="uniq_lot_item_lot_no"),
+        ]
+        verbose_name = "批次"
+        verbose_name_plural = "批次"
+
+    def __str__(self):
+        return self.lot_no
+
+
+class DocumentType(models.TextChoices):
+    INBOUND = "INBOUND", "入库单"
+    OUTBOUND = "OUTBOUND", "出库单"
+    ADJUST = "ADJUST", "调整单"
+    TRANSFER = "TRANSFER", "调拨单"
+    STOCKTAKE = "STOCKTAKE", "盘点过账"
+    BATCH = "BATCH", "接口批量"
+    REVERSAL = "REVERSAL", "冲销单"
+
+
+class StockDocument(models.Model):
+    """单据头：一次导入 / 接口批量 / 调拨 / 盘点过账写入的流水挂在同一张单据下，按单据查询和冲销。"""
+    doc_type = models.CharField(max_length=10, choices=DocumentType.choices, verbose_name="单据类型")
+    reference = models.CharField(max_length=100, blank=True, verbose_name="单号/来源")
+    note = models.TextField(blank=True, verbose_name="备注")
+    line_count = models.PositiveIntegerField(default=0, verbose_name="流水条数")
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="stock_documents",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    # 冲销单指向被冲销的单据；一对一保证同一单据只能冲销一次
+    reverses = models.OneToOneField(
+        "self",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="reversal",
+        verbose_name="冲销的单据",
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["doc_type", "created_at"]),
+            models.Index(fields=["created_by", "created_at"]),
+            models.Index(fields=["created_at"]),
+        ]
+        verbose_name = "单据"
+        verbose_name_plural = "单据"
+
+    @property
+    def number(self):
+        return f"DOC-{self.pk}"
+
+    def __str__(self):
+        return f"{self.get_doc_type_display()} {self.number}"
+
+
 class StockMove(models.Model):
     move_type = models.CharField(max_length=20, choices=MoveType.choices, verbose_name="类型")
 
@@ -112,19 +268,41 @@ class StockMove(models.Model):
         verbose_name="合作方",
     )
 
-    quantity = models.IntegerField(verbose_name="变动数量")
+    lot = models.ForeignKey(
+        Lot,
+        on_delete=models.PROTECT,
+        related_name="moves",
+        null=True,
+        blank=True,
+        verbose_name="批次",
+    )
+
+    quantity = models.BigIntegerField(verbose_name="变动数量（千分之一单位）")
     unit_cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="单位成本(可选)")
 
     reference = models.CharField(max_length=100, blank=True, verbose_name="关联单号/来源(可选)")
     note = models.TextField(blank=True, verbose_name="备注(可选)")
+    document = models.ForeignKey(
+        StockDocument,
+        on_delete=models.PROTECT,
+        related_name="moves",
+        null=True,
+        blank=True,
+        verbose_name="单据",
+    )
+    # 调拨的调出 / 调入两条流水共用同一个 id
+    transfer_id = models.UUIDField(null=True, blank=True, db_index=True, verbose_name="调拨单号")
 
     created_at = models.DateTimeField(auto_now_add=True)
+    # 由数据库触发器在每次写入时填写，变更流按 (change_seq, id) 前移游标，见 products.change_feed
+    change_seq = models.BigIntegerField(default=0, editable=False, verbose_name="变更序号")
 
     class Meta:
         indexes = [
             models.Index(fields=["item", "warehouse"]),
             models.Index(fields=["created_at"]),
             models.Index(fields=["partner"]),
+            models.Index(fields=["change_seq", "id"]),
         ]
         ordering = ["-created_at", "-id"]
         verbose_name = "库存流水"
@@ -145,6 +323,11 @@ class StockMove(models.Model):
         if self.quantity == 0:
             raise ValidationError({"quantity": "数量不能为 0"})
 
+    def save(self, *args, **kwargs):
+        # post_save 在 save() 内执行：流水、余额和 outbox 事件在同一事务里提交
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.move_type} {self.item.name} {self.quantity} @ {self.warehouse.name}"
 
@@ -152,8 +335,14 @@ class StockMove(models.Model):
 class StockBalance(models.Model):
     item = models.ForeignKey(Item, on_delete=models.PROTECT, related_name="balances")
     warehouse = models.ForeignKey(Warehouse, on_delete=models.PROTECT, related_name="balances")
-    on_hand = models.IntegerField(default=0, verbose_name="当前库存")
+    on_hand = models.BigIntegerField(default=0, verbose_name="当前库存（千分之一单位）")
+    # 有效预留合计，随预留 / 释放按增量维护；可用量 = on_hand - reserved
+    reserved = models.BigIntegerField(default=0, verbose_name="已预留（千分之一单位）")
+    # 最近一条影响该余额的流水 id
+    last_move_id = models.BigIntegerField(default=0, db_index=True, verbose_name="最近流水 ID")
     updated_at = models.DateTimeField(auto_now=True)
+    # 每次更新（含删除流水引起的）都由触发器重新填写，变更流据此返回余额变化
+    change_seq = models.BigIntegerField(default=0, editable=False, verbose_name="变更序号")
 
     class Meta:
         constraints = [
@@ -161,9 +350,332 @@ class StockBalance(models.Model):
         ]
         indexes = [
             models.Index(fields=["item", "warehouse"]),
+            models.Index(fields=["warehouse", "updated_at"]),
+            models.Index(fields=["change_seq"]),
         ]
         verbose_name = "库存余额"
         verbose_name_plural = "库存余额"
 
     def __str__(self):
         return f"{self.item.name} @ {self.warehouse.name}: {self.on_hand}"
+
+    @property
+    def available(self):
+        return self.on_hand - self.reserved
+
+
+class LotBalance(models.Model):
+    """
+    批次余额：(批次, 仓库) 一行，物品与效期冗余存放，
+    先到期先出按 (物品, 仓库, 效期) 索引一次有序查询即可分配。
+    """
+    lot = models.ForeignKey(Lot, on_delete=models.PROTECT, related_name="balances")
+    item = models.ForeignKey(Item, on_delete=models.PROTECT, related_name="lot_balances")
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.PROTECT, related_name="lot_balances")
+    expiry_date = models.DateField(null=True, blank=True, verbose_name="有效期至")
+    on_hand = models.BigIntegerField(default=0, verbose_name="当前库存（千分之一单位）")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["lot", "warehouse"], name="uniq_lot_balance_lot_warehouse"),
+        ]
+        indexes = [
+            models.Index(
+                fields=["item", "warehouse", "expiry_date", "id"],
+                condition=models.Q(on_hand__gt=0),
+                name="lot_balance_fefo_idx",
+            ),
+            models.Index(
+                fields=["expiry_date", "warehouse"],
+                condition=models.Q(on_hand__gt=0),
+                name="lot_balance_expiry_idx",
+            ),
+        ]
+        verbose_name = "批次余额"
+        verbose_name_plural = "批次余额"
+
+    def __str__(self):
+        return f"{self.lot_id} @ {self.warehouse_id}: {self.on_hand}"
+
+
+class ReservationStatus(models.TextChoices):
+    ACTIVE = "ACTIVE", "有效"
+    RELEASED = "RELEASED", "已释放"
+    EXPIRED = "EXPIRED", "已过期"
+    FULFILLED = "FULFILLED", "已出库"
+
+
+class Reservation(models.Model):
+    """库存预留：有效期内占用可用量，到期由 sweep_reservations 批量释放。"""
+    item = models.ForeignKey(Item, on_delete=models.PROTECT, related_name="reservations")
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.PROTECT, related_name="reservations")
+    quantity = models.PositiveBigIntegerField(verbose_name="预留数量（千分之一单位）")
+    status = models.CharField(
+        max_length=10,
+        choices=ReservationStatus.choices,
+        default=ReservationStatus.ACTIVE,
+    )
+    reference = models.CharField(max_length=100, blank=True, verbose_name="单号/来源")
+    note = models.TextField(blank=True, verbose_name="备注")
+    expires_at = models.DateTimeField(verbose_name="过期时间")
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="reservations",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    closed_at = models.DateTimeField(null=True, blank=True)
+    # 出库核销时生成的流水
+    move = models.ForeignKey(
+        StockMove,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["expires_at"],
+                condition=models.Q(status="ACTIVE"),
+                name="reservation_active_exp_idx",
+            ),
+            models.Index(fields=["item", "warehouse", "status"]),
+            models.Index(fields=["reference"]),
+        ]
+        verbose_name = "库存预留"
+        verbose_name_plural = "库存预留"
+
+    def __str__(self):
+        return f"预留 #{self.pk} {self.quantity}"
+
+
+class StocktakeStatus(models.TextChoices):
+    OPEN = "OPEN", "盘点中"
+    APPROVED = "APPROVED", "已过账"
+    CANCELLED = "CANCELLED", "已取消"
+
+
+class Stocktake(models.Model):
+    """盘点单：开单时快照仓库账面数，录入实盘数后一次性按差异过账为调整流水。"""
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.PROTECT, related_name="stocktakes", verbose_name="仓库")
+    status = models.CharField(
+        max_length=10,
+        choices=StocktakeStatus.choices,
+        default=StocktakeStatus.OPEN,
+    )
+    note = models.TextField(blank=True, verbose_name="备注")
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="stocktakes",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    approved_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    closed_at = models.DateTimeField(null=True, blank=True)
+    # 过账生成的调整单
+    document = models.ForeignKey(
+        StockDocument,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["warehouse", "status"]),
+        ]
+        constraints = [
+            # 同一仓库只能有一张进行中的盘点单
+            models.UniqueConstraint(
+                fields=["warehouse"],
+                condition=models.Q(status=StocktakeStatus.OPEN),
+                name="uniq_open_stocktake_per_warehouse",
+            ),
+        ]
+        verbose_name = "盘点单"
+        verbose_name_plural = "盘点单"
+
+    @property
+    def reference(self):
+        return f"STOCKTAKE-{self.pk}"
+
+    def __str__(self):
+        return f"盘点 #{self.pk}"
+
+
+class StocktakeLine(models.Model):
+    """盘点明细：expected 为开单时的账面数，counted 为空表示尚未盘到。"""
+    stocktake = models.ForeignKey(Stocktake, on_delete=models.CASCADE, related_name="lines")
+    item = models.ForeignKey(Item, on_delete=models.PROTECT, related_name="+")
+    expected = models.BigIntegerField(default=0, verbose_name="账面数（千分之一单位）")
+    counted = models.BigIntegerField(null=True, blank=True, verbose_name="实盘数（千分之一单位）")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["stocktake", "item"],
+                name="uniq_stocktake_line_item",
+            ),
+        ]
+        verbose_name = "盘点明细"
+        verbose_name_plural = "盘点明细"
+
+    @property
+    def variance(self):
+        return None if self.counted is None else self.counted - self.expected
+
+    def __str__(self):
+        return f"{self.stocktake} {self.item_id}"
+
+
+class ApiToken(models.Model):
+    """扫码枪 / ERP 等集成调用 JSON 接口时使用的访问令牌（Authorization: Token <key>）。"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="api_tokens",
+        verbose_name="所属用户",
+    )
+    name = models.CharField(max_length=100, verbose_name="用途")
+    key = models.CharField(max_length=64, unique=True, editable=False, verbose_name="令牌")
+    is_active = models.BooleanField(default=True, verbose_name="是否启用")
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(null=True, blank=True, verbose_name="最近使用")
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = "接口令牌"
+        verbose_name_plural = "接口令牌"
+
+    def save(self, *args, **kwargs):
+        if not self.key:
+            self.key = secrets.token_hex(20)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.name} ({self.user})"
+
+
+class IdempotencyKey(models.Model):
+    """已处理过的提交（表单令牌或接口 Idempotency-Key），用唯一索引去重。"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="idempotency_keys",
+    )
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=128)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    # 接口请求保存首次响应，重放时原样返回；表单令牌不保存
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "scope", "key"],
+                name="uniq_idempotency_user_scope_key",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key}"
+
+
+class MasterDataVersion(models.Model):
+    """单位 / 合作方 / 仓库 / 物品的版本号：只有一行，主数据变更时在同一事务内加一。"""
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.version)
+
+
+class OutboxEvent(models.Model):
+    """待投递给外部系统的库存事件：与流水在同一事务写入，由 relay_outbox 命令按 id 顺序投递。"""
+    topic = models.CharField(max_length=50)
+    # 同一 key 的事件需要按顺序消费，例如 "item_id:warehouse_id"
+    key = models.CharField(max_length=100, blank=True)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # relay 领取后在此之前其他 relay 不再领取；relay 中途退出时到期自动放回
+    locked_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=models.Q(delivered_at__isnull=True),
+                name="outbox_pending_idx",
+            ),
+            models.Index(fields=["delivered_at"]),
+        ]
+        verbose_name = "外发事件"
+        verbose_name_plural = "外发事件"
+
+    def __str__(self):
+        return f"{self.topic} #{self.pk}"
+
+
+class JobStatus(models.TextChoices):
+    QUEUED = "QUEUED", "排队中"
+    RUNNING = "RUNNING", "运行中"
+    SUCCEEDED = "SUCCEEDED", "已完成"
+    FAILED = "FAILED", "失败"
+
+
+class Job(models.Model):
+    """后台任务：由 run_workers 命令用 SELECT ... FOR UPDATE SKIP LOCKED 领取执行，失败按退避时间重试。"""
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=JobStatus.choices, default=JobStatus.QUEUED)
+    # 数值越大越先领取；只是尽力而为：被其他 worker 锁住的任务会被跳过，低优先级任务可能先执行
+    priority = models.SmallIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    result = models.JSONField(null=True, blank=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="jobs",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["-priority", "run_at"],
+                condition=models.Q(status="QUEUED"),
+                name="job_queued_idx",
+            ),
+            models.Index(fields=["status", "locked_at"]),
+        ]
+        verbose_name = "后台任务"
+        verbose_name_plural = "后台任务"
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk}"
@@ -0,0 +1,232 @@
+"""
+事务性 outbox：流水与对应的外发事件在同一事务里写入 OutboxEvent，回滚的流水不会产生事件；
+由 ``relay_outbox`` 命令按 id 顺序分批领取、投递到 sink，投递成功后才标记 delivered_at（至少一次）。
+
+消费方应按事件 id 去重。OUTBOX_ENABLED 关闭时不写入任何事件。
+"""
+import json
+import os
+import sys
+import urllib.request
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from products.models import OutboxEvent, StockBalance
+from products.quantities import quantity_json
+
+TOPIC_MOVE_CREATED = "stock_move.created"
+TOPIC_MOVE_UPDATED = "stock_move.updated"
+TOPIC_MOVE_DELETED = "stock_move.deleted"
+TOPIC_BALANCE_CHANGED = "balance.changed"
+
+
+def outbox_enabled():
+    return getattr(settings, "OUTBOX_ENABLED", False)
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _move_payload(move):
+    return {
+        "id": move.pk,
+        "move_type": move.move_type,
+        "item_id": move.item_id,
+        "warehouse_id": move.warehouse_id,
+        "partner_id": move.partner_id,
+        "quantity": quantity_json(move.quantity),
+        "reference": move.reference,
+        "note": move.note,
+        "document_id": move.document_id,
+        "created_at": _iso(move.created_at),
+    }
+
+
+def enqueue_moves(moves, topic):
+    """为这些流水写入事件；需在写流水的同一事务内调用。"""
+    if not outbox_enabled():
+        return
+    OutboxEvent.objects.bulk_create([
+        OutboxEvent(
+            topic=topic,
+            key=f"{move.item_id}:{move.warehouse_id}",
+            payload=_move_payload(move),
+        )
+        for move in moves
+    ])
+
+
+def enqueue_balances(keys):
+    """为这些 (item_id, warehouse_id) 写入当前余额事件；需在更新余额之后、同一事务内调用。"""
+    keys = set(keys)
+    if not keys or not outbox_enabled():
+        return
+    rows = StockBalance.objects.filter(
+        item_id__in={item_id for item_id, _ in keys},
+        warehouse_id__in={warehouse_id for _, warehouse_id in keys},
+    ).values_list("item_id", "warehouse_id", "on_hand", "last_move_id", "updated_at")
+    OutboxEvent.objects.bulk_create([
+        OutboxEvent(
+            topic=TOPIC_BALANCE_CHANGED,
+            key=f"{item_id}:{warehouse_id}",
+            payload={
+                "item_id": item_id,
+                "warehouse_id": warehouse_id,
+                "on_hand": quantity_json(on_hand),
+                "last_move_id": last_move_id,
+                "updated_at": _iso(updated_at),
+            },
+        )
+        for item_id, warehouse_id, on_hand, last_move_id, updated_at in rows
+        if (item_id, warehouse_id) in keys
+    ])
+
+
+def envelope(event):
+    return {
+        "id": event.pk,
+        "topic": event.topic,
+        "key": event.key,
+        "created_at": _iso(event.created_at),
+        "payload": event.payload,
+    }
+
+
+class StdoutSink:
+    def __init__(self, stream=None, **options):
+        self.stream = stream or sys.stdout
+
+    def send(self, events):
+        for event in events:
+            self.stream.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self.stream.flush()
+
+
+class FileSink:
+    """追加写 JSON Lines；fsync 之后才算投递成功。"""
+
+    def __init__(self, path=None, **options):
+        if not path:
+            raise ValueError("file sink 需要 --path")
+        self.path = path
+
+    def send(self, events):
+        with open(self.path, "a", encoding="utf-8") as fh:
+            for event in events:
+                fh.write(json.dumps(event, ensure_ascii=False) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+class HttpSink:
+    """整批 POST {"events": [...]}；返回 2xx 视为投递成功。"""
+
+    def __init__(self, url=None, timeout=10, **options):
+        if not url:
+            raise ValueError("http sink 需要 --url")
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, events):
+        body = json.dumps({"events": events}, ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(
+            self.url,
+            data=body,
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        # 非 2xx 由 urlopen 抛出 HTTPError
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+SINKS = {
+    "stdout": StdoutSink,
+    "file": FileSink,
+    "http": HttpSink,
+}
+
+
+def get_sink(name, **options):
+    """内置 sink 名称，或实现了 ``send(events)`` 的类的导入路径。"""
+    sink_class = SINKS.get(name) or import_string(name)
+    return sink_class(**options)
+
+
+def relay_batch(sink, batch_size):
+    """
+    投递一批未送达事件，返回 (条数, 错误)。
+
+    分三步，投递时不持有事务和行锁（长事务会拖住 xmin，妨碍 VACUUM）：
+    短事务里用 SKIP LOCKED 领取一批并写入租期 locked_until；事务外调用 sink；
+    再用一个短事务确认送达或记录错误并放回。relay 中途退出时租期到期后事件会被重新领取。
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=getattr(settings, "OUTBOX_LEASE_SECONDS", 300))
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects
+            .select_for_update(skip_locked=True)
+            .filter(delivered_at__isnull=True)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lte=now))
+            .order_by("id")[:batch_size]
+        )
+        if not events:
+            return 0, None
+        ids = [event.pk for event in events]
+        OutboxEvent.objects.filter(pk__in=ids).update(locked_until=lease)
+
+    try:
+        sink.send([envelope(event) for event in events])
+    except Exception as exc:
+        # 只放回仍属于本次领取的事件；租期已过被别人领走的不动
+        OutboxEvent.objects.filter(pk__in=ids, locked_until=lease).update(
+            attempts=F("attempts") + 1,
+            last_error=f"{type(exc).__name__}: {exc}"[:1000],
+            locked_until=None,
+        )
+        return 0, exc
+    OutboxEvent.objects.filter(pk__in=ids).update(
+        attempts=F("attempts") + 1,
+        delivered_at=timezone.now(),
+        last_error="",
+        locked_until=None,
+    )
+    return len(events), None
+
+
+def outbox_stats():
+    """积压与延迟：pending 为未投递条数，lag_seconds 为最早一条未投递事件的等待时间。"""
+    pending = OutboxEvent.objects.filter(delivered_at__isnull=True)
+    # 按 id 取最早一条，走未投递的部分索引
+    oldest = pending.order_by("id").values_list("created_at", flat=True).first()
+    last_delivered = OutboxEvent.objects.aggregate(at=Max("delivered_at"))["at"]
+    now = timezone.now()
+    return {
+        "pending": pending.count(),
+        "oldest_pending_at": _iso(oldest),
+        "lag_seconds": round((now - oldest).total_seconds(), 3) if oldest else 0,
+        "last_delivered_at": _iso(last_delivered),
+    }
+
+
+def purge_delivered(days, batch_size=5000):
+    """删除投递超过 ``days`` 天的事件，返回删除条数。"""
+    cutoff = timezone.now() - timedelta(days=days)
+    total = 0
+    while True:
+        ids = list(
+            OutboxEvent.objects
+            .filter(delivered_at__lt=cutoff)
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not ids:
+            return total
+        deleted, _ = OutboxEvent.objects.filter(pk__in=ids).delete()
+        total += deleted
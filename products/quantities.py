@@ -0,0 +1,78 @@
+"""
+定点数量。
+
+流水、余额、预留、盘点明细里的数量一律按 1/1000 基本单位（milli-units）存成 BigInteger：
+合计、比较、索引全是整数运算，不走 DECIMAL 聚合。单位的 ``precision``（小数位数，0~3）
+只决定输入允许几位小数、显示保留几位，换算只在输入解析和显示 / 接口输出两端发生。
+"""
+from decimal import Decimal, InvalidOperation
+
+QUANTITY_SCALE = 1000
+MAX_PRECISION = 3
+# 单笔数量上限（基本单位），远低于 BigInteger 范围，合计不会溢出
+MAX_QUANTITY = 10 ** 12
+
+
+def parse_quantity(value, precision=0):
+    """
+    把输入（表单字符串、JSON 数字、Excel 单元格）换算成定点整数。
+    不是数字、或小数位超过单位精度时抛出 ValueError。
+    """
+    if isinstance(value, bool) or value is None:
+        raise ValueError("数量必须是数字")
+    if isinstance(value, float):
+        # repr 给出最短的十进制表示：Excel 的 1.5 读出来是 1.5 而不是 1.4999…
+        value = repr(value)
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError("数量必须是数字")
+    if not number.is_finite():
+        raise ValueError("数量必须是数字")
+    if abs(number) >= MAX_QUANTITY:
+        raise ValueError("数量超出范围")
+    if number != round(number, min(precision, MAX_PRECISION)):
+        raise ValueError("数量必须是整数" if precision == 0 else f"数量最多 {precision} 位小数")
+    return int(number.scaleb(MAX_PRECISION))
+
+
+def convert_quantity(value, numerator, denominator, precision=0):
+    """
+    按换算系数（numerator / denominator 个基本单位）把辅助单位的定点数量换算成基本单位；
+    结果超出基本单位的小数位数时抛出 ValueError，不做舍入。
+    """
+    scaled, remainder = divmod(value * numerator, denominator)
+    if remainder or scaled % 10 ** (MAX_PRECISION - min(precision, MAX_PRECISION)):
+        raise ValueError(
+            "换算成基本单位后不是整数" if precision == 0 else f"换算成基本单位后超过 {precision} 位小数"
+        )
+    if abs(scaled) >= MAX_QUANTITY * QUANTITY_SCALE:
+        raise ValueError("数量超出范围")
+    return scaled
+
+
+def to_decimal(value):
+    """定点整数 -> Decimal（基本单位）。"""
+    return Decimal(value or 0).scaleb(-MAX_PRECISION)
+
+
+def format_quantity(value, precision=0):
+    """按单位精度显示；历史数据小数位多于当前精度时原样多显示，不做舍入。"""
+    number = to_decimal(value)
+    exact = number.quantize(Decimal(1).scaleb(-precision))
+    if exact != number:
+        exact = number.quantize(Decimal(1).scaleb(-MAX_PRECISION)).normalize()
+    return f"{exact:f}"
+
+
+def quantity_step(precision):
+    """数量输入框的 step：0 位小数为 "1"，2 位为 "0.01"。"""
+    return f"{Decimal(1).scaleb(-precision):f}"
+
+
+def quantity_json(value):
+    """接口输出：整数量给 int，否则给最多 3 位小数的数字。"""
+    value = value or 0
+    if value % QUANTITY_SCALE == 0:
+        return value // QUANTITY_SCALE
+    return float(to_decimal(value))
@@ -0,0 +1,127 @@
+"""
+慢查询记录：超过阈值的 ORM 查询连同 SQL、参数、调用视图与 EXPLAIN 计划
+以 JSON 行的形式写入滚动日志，供 ``slow_query_report`` 命令汇总。
+"""
+import json
+import logging
+import re
+import time
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger("products.slow_query")
+
+EXPLAIN_PREFIXES = {
+    "postgresql": "EXPLAIN (ANALYZE off) ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "mysql": "EXPLAIN ",
+}
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+MAX_LOGGED_PARAMS = 50
+
+
+def normalize_sql(sql: str) -> str:
+    """把 SQL 归一成“形状”：字面量与占位符替换为 ?，IN 列表折叠。"""
+    shape = _STRING_RE.sub("?", sql)
+    shape = shape.replace("%s", "?")
+    shape = _NUMBER_RE.sub("?", shape)
+    shape = _IN_LIST_RE.sub("(...)", shape)
+    return _SPACE_RE.sub(" ", shape).strip()
+
+
+def _ensure_handler():
+    if logger.handlers:
+        return
+    path = settings.SLOW_QUERY_LOG_PATH
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handler = RotatingFileHandler(
+        path,
+        maxBytes=settings.SLOW_QUERY_LOG_MAX_BYTES,
+        backupCount=settings.SLOW_QUERY_LOG_BACKUP_COUNT,
+        encoding="utf-8",
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def _serialize_params(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: str(value) for key, value in list(params.items())[:MAX_LOGGED_PARAMS]}
+    return [str(value) for value in list(params)[:MAX_LOGGED_PARAMS]]
+
+
+class SlowQueryRecorder:
+    """``connection.execute_wrapper`` 回调：计时并记录超过阈值的查询。"""
+
+    def __init__(self, connection, threshold_ms: float, request=None):
+        self.connection = connection
+        self.threshold_ms = threshold_ms
+        self.request = request
+        self._explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self._explaining:
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms >= self.threshold_ms:
+            self._record(sql, params, many, duration_ms)
+        return result
+
+    def _view_name(self):
+        request = self.request
+        if request is None:
+            return ""
+        match = getattr(request, "resolver_match", None)
+        if match is not None:
+            return match.view_name
+        return request.path
+
+    def _explain(self, sql, params):
+        prefix = EXPLAIN_PREFIXES.get(self.connection.vendor)
+        if not prefix or not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+            return None
+        self._explaining = True
+        try:
+            # 用保存点包住 EXPLAIN，避免其失败时连累外层事务
+            with transaction.atomic(using=self.connection.alias), self.connection.cursor() as cursor:
+                cursor.execute(prefix + sql, params)
+                return "\n".join(str(row[-1]) for row in cursor.fetchall())
+        except Exception as exc:  # EXPLAIN 失败不应影响业务查询
+            return f"EXPLAIN failed: {exc}"
+        finally:
+            self._explaining = False
+
+    def _record(self, sql, params, many, duration_ms):
+        _ensure_handler()
+        plan = None
+        if settings.SLOW_QUERY_EXPLAIN and not many:
+            plan = self._explain(sql, params)
+        request = self.request
+        logger.info(json.dumps({
+            "ts": timezone.now().isoformat(),
+            "duration_ms": round(duration_ms, 2),
+            "alias": self.connection.alias,
+            "vendor": self.connection.vendor,
+            "view": self._view_name(),
+            "method": request.method if request is not None else "",
+            "path": request.path if request is not None else "",
+            "sql": sql,
+            "params": None if many else _serialize_params(params),
+            "shape": normalize_sql(sql),
+            "plan": plan,
+        }, ensure_ascii=False))
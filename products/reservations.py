@@ -0,0 +1,200 @@
+"""
+库存预留与可用量（available-to-promise）。
+
+可用量 = ``StockBalance.on_hand - StockBalance.reserved``。``reserved`` 随预留、释放、核销按增量维护：
+预留是对一行余额的一条条件 UPDATE（走 (物品, 仓库) 唯一索引，可用量不足时更新 0 行），
+不需要扫描预留表，高频预留之间只在同一行余额上短暂排队。
+
+到期的预留由 ``sweep_reservations`` 命令调用 ``release_expired()`` 分批释放：
+每批用 SKIP LOCKED 领取，按 (物品, 仓库) 汇总后一条语句回写 reserved。
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, F, Sum, Value, When
+from django.utils import timezone
+
+from products.events import notify_balances
+from products.ledger import UPDATE_BATCH_SIZE, bulk_post_moves, lock_balances
+from products.masterdata import master_data
+from products.models import MoveType, Reservation, ReservationStatus, StockBalance, StockMove
+
+
+class ReservationError(Exception):
+    """可用量不足或预留状态不允许该操作。"""
+
+
+def available_for(item_id, warehouse_id):
+    """(物品, 仓库) 的当前可用量：一次唯一索引读取。"""
+    row = (
+        StockBalance.objects
+        .filter(item_id=item_id, warehouse_id=warehouse_id)
+        .values_list("on_hand", "reserved")
+        .first()
+    )
+    return row[0] - row[1] if row else 0
+
+
+def reserve(item_id, warehouse_id, quantity, *, ttl_seconds=None, reference="", note="", user=None):
+    """占用可用量并新建预留（``quantity`` 为定点整数）；可用量不足时抛出 ReservationError。"""
+    if quantity <= 0:
+        raise ReservationError("预留数量必须大于 0")
+    ttl_seconds = ttl_seconds or settings.RESERVATION_TTL_SECONDS
+    with transaction.atomic():
+        held = StockBalance.objects.filter(
+            item_id=item_id,
+            warehouse_id=warehouse_id,
+            on_hand__gte=F("reserved") + quantity,
+        ).update(reserved=F("reserved") + quantity)
+        if not held:
+            fmt = master_data().format_item_quantity
+            raise ReservationError(
+                f"可用库存不足，可用 {fmt(item_id, available_for(item_id, warehouse_id))}，需 {fmt(item_id, quantity)}"
+            )
+        reservation = Reservation.objects.create(
+            item_id=item_id,
+            warehouse_id=warehouse_id,
+            quantity=quantity,
+            reference=reference,
+            note=note,
+            expires_at=timezone.now() + timedelta(seconds=ttl_seconds),
+            created_by=user if user is not None and user.is_authenticated else None,
+        )
+        notify_balances([(item_id, warehouse_id)])
+    return reservation
+
+
+def _close(reservation_id, status):
+    """锁定有效的预留、标记为 ``status`` 并退回占用；预留不存在或已失效时返回 None。"""
+    reservation = (
+        Reservation.objects
+        .select_for_update()
+        .filter(pk=reservation_id, status=ReservationStatus.ACTIVE)
+        .first()
+    )
+    if reservation is None:
+        return None
+    reservation.status = status
+    reservation.closed_at = timezone.now()
+    reservation.save(update_fields=["status", "closed_at"])
+    StockBalance.objects.filter(
+        item_id=reservation.item_id,
+        warehouse_id=reservation.warehouse_id,
+    ).update(reserved=F("reserved") - reservation.quantity)
+    notify_balances([(reservation.item_id, reservation.warehouse_id)])
+    return reservation
+
+
+def release(reservation_id):
+    """提前释放预留；已失效时返回 None。"""
+    with transaction.atomic():
+        return _close(reservation_id, ReservationStatus.RELEASED)
+
+
+def fulfill(reservation_id):
+    """按预留数量出库：退回占用与写出库流水在同一事务内完成，返回预留（move 为出库流水）。"""
+    with transaction.atomic():
+        reservation = _close(reservation_id, ReservationStatus.FULFILLED)
+        if reservation is None:
+            raise ReservationError("预留不存在、已过期或已处理")
+        key = (reservation.item_id, reservation.warehouse_id)
+        on_hand, reserved = lock_balances([key]).get(key, (0, 0))
+        if on_hand - reserved < reservation.quantity:
+            # 预留之后库存被调整过，不能出成负数
+            fmt = master_data().format_item_quantity
+            raise ReservationError(
+                f"可用库存不足，可用 {fmt(key[0], on_hand - reserved)}，需 {fmt(key[0], reservation.quantity)}"
+            )
+        # 按增量记账：余额已在上面锁住，不再按流水合计重算
+        [reservation.move] = bulk_post_moves([StockMove(
+            move_type=MoveType.OUTBOUND,
+            item_id=reservation.item_id,
+            warehouse_id=reservation.warehouse_id,
+            quantity=-reservation.quantity,
+            reference=reservation.reference,
+            note=reservation.note,
+        )])
+        reservation.save(update_fields=["move"])
+    return reservation
+
+
+def apply_reserved_deltas(deltas):
+    """按 {(item_id, warehouse_id): 增量} 批量更新 reserved；需在事务内调用。"""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    balance_ids = {
+        (item_id, warehouse_id): pk
+        for pk, item_id, warehouse_id in StockBalance.objects.filter(
+            item_id__in={item_id for item_id, _ in deltas},
+            warehouse_id__in={warehouse_id for _, warehouse_id in deltas},
+        ).values_list("pk", "item_id", "warehouse_id")
+    }
+    rows = sorted((balance_ids[key], delta) for key, delta in deltas.items() if key in balance_ids)
+    for start in range(0, len(rows), UPDATE_BATCH_SIZE):
+        batch = rows[start:start + UPDATE_BATCH_SIZE]
+        StockBalance.objects.filter(pk__in=[pk for pk, _ in batch]).update(
+            reserved=F("reserved") + Case(
+                *[When(pk=pk, then=Value(delta)) for pk, delta in batch],
+                output_field=BigIntegerField(),
+            ),
+        )
+    notify_balances(deltas)
+
+
+def release_expired(batch_size=1000):
+    """释放已过期的预留，返回释放条数。"""
+    total = 0
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            rows = list(
+                Reservation.objects
+                .select_for_update(skip_locked=True)
+                .filter(status=ReservationStatus.ACTIVE, expires_at__lte=now)
+                .order_by("expires_at")
+                .values_list("pk", "item_id", "warehouse_id", "quantity")[:batch_size]
+            )
+            if not rows:
+                return total
+            Reservation.objects.filter(pk__in=[pk for pk, _, _, _ in rows]).update(
+                status=ReservationStatus.EXPIRED,
+                closed_at=now,
+            )
+            deltas = defaultdict(int)
+            for _, item_id, warehouse_id, quantity in rows:
+                deltas[(item_id, warehouse_id)] -= quantity
+            apply_reserved_deltas(deltas)
+        total += len(rows)
+
+
+def reconcile_reserved():
+    """按有效预留合计核对 reserved，不一致的逐组锁定后重算；返回修正组数。"""
+    active = {
+        (item_id, warehouse_id): total
+        for item_id, warehouse_id, total in Reservation.objects.filter(status=ReservationStatus.ACTIVE)
+        .values("item_id", "warehouse_id")
+        .annotate(total=Sum("quantity"))
+        .values_list("item_id", "warehouse_id", "total")
+    }
+    recorded = {
+        (item_id, warehouse_id): reserved
+        for item_id, warehouse_id, reserved in StockBalance.objects.exclude(reserved=0)
+        .values_list("item_id", "warehouse_id", "reserved")
+    }
+    fixed = 0
+    for item_id, warehouse_id in sorted(active.keys() | recorded.keys()):
+        if active.get((item_id, warehouse_id), 0) == recorded.get((item_id, warehouse_id), 0):
+            continue
+        with transaction.atomic():
+            lock_balances([(item_id, warehouse_id)])
+            total = Reservation.objects.filter(
+                item_id=item_id,
+                warehouse_id=warehouse_id,
+                status=ReservationStatus.ACTIVE,
+            ).aggregate(total=Sum("quantity"))["total"] or 0
+            StockBalance.objects.filter(item_id=item_id, warehouse_id=warehouse_id).update(reserved=total)
+        fixed += 1
+    return fixed
@@ -0,0 +1,66 @@
+"""
+只读副本路由。
+
+默认所有读写都走 default；只有 ``use_replica`` 装饰的视图在执行期间把读查询发到 replica。
+用户自己刚写过数据（见 ReplicaStickinessMiddleware 设置的 cookie）时仍读主库，保证读到自己的写入。
+"""
+import asyncio
+from contextvars import ContextVar
+from functools import wraps
+
+from django.db import connections
+
+REPLICA_ALIAS = "replica"
+STICKY_COOKIE = "db_sticky"
+
+_read_from_replica = ContextVar("read_from_replica", default=False)
+
+
+def replica_enabled():
+    return REPLICA_ALIAS in connections.databases
+
+
+def _wants_replica(request):
+    return replica_enabled() and not request.COOKIES.get(STICKY_COOKIE)
+
+
+def use_replica(view):
+    """视图内的读查询走只读副本；同步、异步视图均可使用。"""
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            token = _read_from_replica.set(_wants_replica(request))
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _read_from_replica.reset(token)
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _read_from_replica.set(_wants_replica(request))
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _read_from_replica.reset(token)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _read_from_replica.get():
+            return REPLICA_ALIAS
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replica 与 default 数据相同
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
+
@@ -0,0 +1,176 @@
+"""
+物品 / 流水搜索。
+
+PostgreSQL 上为被搜索的列建立 ``pg_trgm`` GIN 表达式索引，Django 的 ``icontains``
+（``UPPER(col::text) LIKE UPPER(%s)``）可以直接命中；SQLite 上维护 FTS5 trigram
+虚拟表，查询改写为 ``MATCH`` 子查询。两者都按表拆成 ``pk__in`` / ``<fk>_id__in`` 子查询，
+不把跨表 JOIN 的列放进同一个 OR（那样规划器用不上各表的索引）。
+其他后端或过短的关键词退回普通 ``icontains``。
+"""
+import logging
+
+from django.db import OperationalError, connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+# 被搜索的表与列；PostgreSQL 建 trigram 索引、SQLite 建 FTS5 表都以此为准
+SEARCH_COLUMNS = {
+    "products_item": ("name",),
+    "products_warehouse": ("name",),
+    "products_partner": ("name",),
+    "products_stockmove": ("reference", "note"),
+}
+
+ITEM_SEARCH_FIELDS = ("name", "warehouse__name")
+MOVE_SEARCH_FIELDS = ("reference", "note", "item__name", "warehouse__name", "partner__name")
+
+# trigram 分词器至少需要 3 个字符才能产生词元
+FTS_MIN_LENGTH = 3
+
+_fts_ready = {}
+
+logger = logging.getLogger(__name__)
+
+
+def _trgm_index_name(table, column):
+    return f"{table}_{column}_trgm"
+
+
+def _postgres_statements():
+    statements = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"]
+    for table, columns in SEARCH_COLUMNS.items():
+        for column in columns:
+            statements.append(
+                f'CREATE INDEX IF NOT EXISTS "{_trgm_index_name(table, column)}" '
+                f'ON "{table}" USING gin ((UPPER("{column}"::text)) gin_trgm_ops)'
+            )
+    return statements
+
+
+def _sqlite_statements(table, columns):
+    fts = f"{table}_fts"
+    cols = ", ".join(columns)
+    new_values = ", ".join(f"new.{c}" for c in columns)
+    old_values = ", ".join(f"old.{c}" for c in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{cols}, content='{table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_values}); END",
+        # 只在被索引的列变化时更新：其他触发器改写同一行（如变更序号）不会动到索引
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_values}); END",
+    ]
+
+
+def install_search_indexes(connection):
+    """建立（或补齐）搜索索引；可重复执行。"""
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            for statement in _postgres_statements():
+                cursor.execute(statement)
+        return
+
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        for table, columns in SEARCH_COLUMNS.items():
+            fts = f"{table}_fts"
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+                [f"{fts}_ai", f"{fts}_ad", f"{fts}_au"],
+            )
+            if cursor.fetchone()[0] == 3:
+                continue
+            # SQLite 重建表（ALTER 字段等）时会丢掉触发器，这里补齐并重建索引内容
+            try:
+                for statement in _sqlite_statements(table, columns):
+                    cursor.execute(statement)
+            except OperationalError:
+                # 未编译 FTS5 的 SQLite：保留 icontains 行为
+                logger.warning("无法建立 %s 的 FTS5 搜索索引，搜索退回 icontains", table, exc_info=True)
+                return
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    _fts_ready.pop(connection.alias, None)
+
+
+def uninstall_search_indexes(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            for table, columns in SEARCH_COLUMNS.items():
+                for column in columns:
+                    cursor.execute(f'DROP INDEX IF EXISTS "{_trgm_index_name(table, column)}"')
+        elif connection.vendor == "sqlite":
+            for table in SEARCH_COLUMNS:
+                fts = f"{table}_fts"
+                for suffix in ("ai", "ad", "au"):
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+                cursor.execute(f"DROP TABLE IF EXISTS {fts}")
+    _fts_ready.pop(connection.alias, None)
+
+
+def _sqlite_fts_available(connection):
+    if connection.alias not in _fts_ready:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = %s",
+                ["products_stockmove_fts"],
+            )
+            _fts_ready[connection.alias] = cursor.fetchone()[0] > 0
+    return _fts_ready[connection.alias]
+
+
+def _fts_phrase(q):
+    return '"' + q.replace('"', '""') + '"'
+
+
+def search_q(model, q, fields):
+    """返回匹配关键词 ``q`` 的 Q 对象；``fields`` 为相对 ``model`` 的 lookup 路径。"""
+    q = (q or "").strip()
+    if not q:
+        return Q()
+
+    connection = connections[router.db_for_read(model)]
+    use_trgm = connection.vendor == "postgresql"
+    use_fts = (
+        connection.vendor == "sqlite"
+        and len(q) >= FTS_MIN_LENGTH
+        and _sqlite_fts_available(connection)
+    )
+
+    condition = Q()
+    if not use_trgm and not use_fts:
+        for field in fields:
+            condition |= Q(**{f"{field}__icontains": q})
+        return condition
+
+    # 每张表一个子查询：同表的多个列在子查询里合并，各自命中本表的索引
+    grouped = {}
+    for field in fields:
+        relation, _, column = field.rpartition("__")
+        target = model._meta.get_field(relation).related_model if relation else model
+        table = target._meta.db_table
+        if column not in SEARCH_COLUMNS.get(table, ()):
+            condition |= Q(**{f"{field}__icontains": q})
+            continue
+        lookup = f"{relation}_id__in" if relation else "pk__in"
+        grouped.setdefault((lookup, target), []).append(column)
+
+    phrase = _fts_phrase(q)
+    for (lookup, target), columns in grouped.items():
+        if use_trgm:
+            # icontains 生成 UPPER("col"::text) LIKE UPPER(%s)，与 trigram 索引的表达式一致
+            match = Q()
+            for column in columns:
+                match |= Q(**{f"{column}__icontains": q})
+            subquery = target._base_manager.filter(match).values("pk")
+        else:
+            fts = f"{target._meta.db_table}_fts"
+            match = "{" + " ".join(columns) + "} : " + phrase
+            subquery = RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", [match])
+        condition |= Q(**{lookup: subquery})
+    return condition
@@ -1,35 +1,70 @@
-from decimal import Decimal
 from django.db import transaction
-from django.db.models import Sum
+from django.db.models import Max, Sum
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
-from .models import StockMove, StockBalance
+from .balance_triggers import trigger_engine_enabled
+from .events import notify_balances
+from .lots import recalc_lot_balance
+from .masterdata import bump_version
+from .models import Item, ItemUnit, Partner, StockMove, StockBalance, Unit, Warehouse, master_data_bulk_changed
+from .outbox import (
+    TOPIC_MOVE_CREATED,
+    TOPIC_MOVE_DELETED,
+    TOPIC_MOVE_UPDATED,
+    enqueue_balances,
+    enqueue_moves,
+)
 
 
 def recalc_balance(item_id: int, warehouse_id: int) -> None:
-    total = (
+    totals = (
         StockMove.objects
         .filter(item_id=item_id, warehouse_id=warehouse_id)
-        .aggregate(s=Sum("quantity"))
-        .get("s")
-    ) or Decimal("0")
+        .aggregate(s=Sum("quantity"), last=Max("id"))
+    )
+    # 定点整数合计，不经过 Decimal
+    total = totals["s"] or 0
 
     with transaction.atomic():
         balance, _ = StockBalance.objects.select_for_update().get_or_create(
             item_id=item_id,
             warehouse_id=warehouse_id,
-            defaults={"on_hand": Decimal("0")},
+            defaults={"on_hand": 0},
         )
         balance.on_hand = total
-        balance.save(update_fields=["on_hand"])
+        balance.last_move_id = max(balance.last_move_id, totals["last"] or 0)
+        balance.save(update_fields=["on_hand", "last_move_id", "updated_at"])
+    notify_balances([(item_id, warehouse_id)])
+
+
+def _balance_changed(instance: StockMove, topic: str) -> None:
+    if trigger_engine_enabled():
+        # 余额已由触发器在同一条语句里更新
+        notify_balances([(instance.item_id, instance.warehouse_id)])
+    else:
+        recalc_balance(instance.item_id, instance.warehouse_id)
+    if instance.lot_id is not None:
+        recalc_lot_balance(instance.lot_id, instance.warehouse_id)
+    enqueue_moves([instance], topic)
+    enqueue_balances([(instance.item_id, instance.warehouse_id)])
 
 
 @receiver(post_save, sender=StockMove)
-def stockmove_saved(sender, instance: StockMove, **kwargs):
-    recalc_balance(instance.item_id, instance.warehouse_id)
+def stockmove_saved(sender, instance: StockMove, created=False, **kwargs):
+    _balance_changed(instance, TOPIC_MOVE_CREATED if created else TOPIC_MOVE_UPDATED)
 
 
 @receiver(post_delete, sender=StockMove)
 def stockmove_deleted(sender, instance: StockMove, **kwargs):
-    recalc_balance(instance.item_id, instance.warehouse_id)
+    _balance_changed(instance, TOPIC_MOVE_DELETED)
+
+
+@receiver([post_save, post_delete], sender=Item)
+@receiver([post_save, post_delete], sender=ItemUnit)
+@receiver([post_save, post_delete], sender=Unit)
+@receiver([post_save, post_delete], sender=Partner)
+@receiver([post_save, post_delete], sender=Warehouse)
+@receiver(master_data_bulk_changed)
+def master_data_changed(sender, **kwargs):
+    bump_version()
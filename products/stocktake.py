@@ -0,0 +1,260 @@
+"""
+盘点单（cycle count）。
+
+开单时按仓库快照账面数：物品主档和余额表各读一次，明细批量插入。
+实盘数可以扫码逐件累加，也可以按文件整批覆盖，都按 CASE 分批回写，不逐行保存。
+差异（实盘 - 账面）在数据库里一次算出；过账时整单差异拆成调整流水，
+经 ``bulk_post_moves()`` 一次写入，每个 (物品, 仓库) 只更新一次余额。
+
+差异相对开单快照计算：盘点期间发生的出入库不会被过账抵消。
+"""
+import re
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import BigIntegerField, Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from products.importing import MAX_REPORTED_ERRORS, _text
+from products.documents import open_document
+from products.ledger import UPDATE_BATCH_SIZE, bulk_post_moves
+from products.lots import split_fefo
+from products.masterdata import master_data
+from products.models import (
+    DocumentType,
+    Item,
+    MoveType,
+    StockBalance,
+    StockMove,
+    Stocktake,
+    StocktakeLine,
+    StocktakeStatus,
+)
+from products.quantities import QUANTITY_SCALE, parse_quantity
+
+INSERT_BATCH_SIZE = 2000
+POST_BATCH_SIZE = 2000
+
+# 扫码行：“物品名称或 id”，可选以制表符 / 逗号 / 空白隔开的数量（可带小数）
+_SCAN_LINE = re.compile(r"^(?P<code>.+?)(?:[\t,，\s]+(?P<qty>-?\d+(?:\.\d+)?))?$")
+
+
+class StocktakeError(Exception):
+    """盘点单状态不允许该操作，或录入内容有误。"""
+
+
+def open_stocktake(warehouse, *, user=None, note=""):
+    """新建盘点单并快照该仓库的账面数；``warehouse`` 可以是模型或主数据记录。同一仓库只能有一张进行中的盘点单。"""
+    with transaction.atomic():
+        # 没有进行中的盘点单时 select_for_update 锁不到任何行，并发开单靠部分唯一约束拦截
+        try:
+            with transaction.atomic():
+                stocktake = Stocktake.objects.create(
+                    warehouse_id=warehouse.id,
+                    note=note,
+                    created_by=user if user is not None and user.is_authenticated else None,
+                )
+        except IntegrityError:
+            raise StocktakeError(f"{warehouse.name} 已有进行中的盘点单")
+        expected = dict(
+            StockBalance.objects
+            .filter(warehouse_id=warehouse.id)
+            .exclude(on_hand=0)
+            .values_list("item_id", "on_hand")
+        )
+        item_ids = set(
+            Item.objects.filter(warehouse_id=warehouse.id, is_active=True).values_list("id", flat=True)
+        ) | expected.keys()
+        StocktakeLine.objects.bulk_create(
+            [
+                StocktakeLine(stocktake=stocktake, item_id=item_id, expected=expected.get(item_id, 0))
+                for item_id in sorted(item_ids)
+            ],
+            batch_size=INSERT_BATCH_SIZE,
+        )
+    return stocktake
+
+
+def _lock_open(stocktake_id):
+    stocktake = (
+        Stocktake.objects
+        .select_for_update()
+        .filter(pk=stocktake_id, status=StocktakeStatus.OPEN)
+        .first()
+    )
+    if stocktake is None:
+        raise StocktakeError("盘点单不存在或已结束")
+    return stocktake
+
+
+def record_counts(stocktake_id, counts, *, add=False):
+    """
+    按 {item_id: 数量} 回写实盘数：``add`` 为真时在已盘数上累加（扫码），否则直接覆盖（文件）。
+    返回更新的明细行数。
+    """
+    if not counts:
+        return 0
+    rows = sorted(counts.items())
+    updated = 0
+    with transaction.atomic():
+        stocktake = _lock_open(stocktake_id)
+        lines = StocktakeLine.objects.filter(stocktake=stocktake)
+        for start in range(0, len(rows), UPDATE_BATCH_SIZE):
+            batch = rows[start:start + UPDATE_BATCH_SIZE]
+            value = Case(
+                *[When(item_id=item_id, then=Value(quantity)) for item_id, quantity in batch],
+                output_field=BigIntegerField(),
+            )
+            updated += lines.filter(item_id__in=[item_id for item_id, _ in batch]).update(
+                counted=Coalesce(F("counted"), 0) + value if add else value,
+            )
+    return updated
+
+
+def _line_items(stocktake):
+    """盘点单内的物品：(id 集合, 名称 -> id)。"""
+    item_ids = set(StocktakeLine.objects.filter(stocktake=stocktake).values_list("item_id", flat=True))
+    data = master_data()
+    names = {data.items[item_id].name: item_id for item_id in item_ids if item_id in data.items}
+    return item_ids, names
+
+
+def _resolve_item(code, item_ids, names):
+    if code in names:
+        return names[code]
+    if code.isdigit() and int(code) in item_ids:
+        return int(code)
+    return None
+
+
+def counts_from_scans(stocktake, text):
+    """
+    解析扫码枪录入：每行一个物品，省略数量时按 1 个基本单位计，同一物品多行累加。
+    返回 ({item_id: 定点数量}, 错误列表)。
+    """
+    item_ids, names = _line_items(stocktake)
+    data = master_data()
+    counts = defaultdict(int)
+    errors = []
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        match = _SCAN_LINE.match(line)
+        code, raw = match["code"].strip(), match["qty"]
+        item_id = _resolve_item(code, item_ids, names)
+        if item_id is None:
+            # 名称本身以数字结尾时整行就是名称
+            item_id, raw = _resolve_item(line, item_ids, names), None
+        if item_id is None:
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(f"第 {line_no} 行：{code} 不在本盘点单内")
+            continue
+        try:
+            quantity = parse_quantity(raw, data.item_precision(item_id)) if raw else QUANTITY_SCALE
+        except ValueError as exc:
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(f"第 {line_no} 行：{code} {exc}")
+            continue
+        counts[item_id] += quantity
+    return dict(counts), errors
+
+
+def counts_from_rows(stocktake, rows):
+    """
+    解析 ``iter_rows()`` 读出的文件：需要“物品”（或 item_id）与“数量”列，数量为实盘数；
+    可选“单位”列，按物品的辅助单位换算成基本单位。
+    返回 ({item_id: 数量}, 错误列表)；同一物品出现多次时以最后一行为准。
+    """
+    item_ids, names = _line_items(stocktake)
+    data = master_data()
+    counts = {}
+    errors = []
+    for line_no, row in rows:
+        code = _text(row.get("item_id")) or _text(row.get("item"))
+        item_id = _resolve_item(code, item_ids, names)
+        reason = "不在本盘点单内" if item_id is None else None
+        if item_id is not None:
+            try:
+                quantity = data.parse_item_quantity(item_id, _text(row.get("quantity")), _text(row.get("unit")))
+            except ValueError as exc:
+                reason = str(exc)
+            else:
+                if quantity < 0:
+                    reason = "数量不能小于 0"
+        if reason:
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(f"第 {line_no} 行：{code} {reason}")
+            continue
+        counts[item_id] = quantity
+    return counts, errors
+
+
+def variance_lines(stocktake):
+    """已盘且有差异的明细，附 diff = counted - expected。"""
+    return (
+        StocktakeLine.objects
+        .filter(stocktake=stocktake, counted__isnull=False)
+        .annotate(diff=F("counted") - F("expected"))
+        .exclude(diff=0)
+    )
+
+
+def summarize(stocktake):
+    """明细数、已盘数、差异行数以及盘盈 / 盘亏合计：一次聚合查询。"""
+    diff = F("counted") - F("expected")
+    totals = StocktakeLine.objects.filter(stocktake=stocktake).aggregate(
+        lines=Count("id"),
+        counted_lines=Count("id", filter=Q(counted__isnull=False)),
+        variances=Count("id", filter=Q(counted__isnull=False) & ~Q(counted=F("expected"))),
+        gain=Sum(diff, filter=Q(counted__gt=F("expected"))),
+        loss=Sum(diff, filter=Q(counted__lt=F("expected"))),
+    )
+    totals["gain"] = totals["gain"] or 0
+    totals["loss"] = totals["loss"] or 0
+    return totals
+
+
+def approve(stocktake_id, *, user=None):
+    """
+    过账：把差异写成调整流水（单号为 STOCKTAKE-<id>，挂在一张盘点过账单据下），盘亏按先到期先出拆到批次。
+    未盘到的物品不调整。返回写入的流水条数。
+    """
+    with transaction.atomic():
+        stocktake = _lock_open(stocktake_id)
+        note = f"盘点 #{stocktake.pk} 差异"
+        moves = [
+            StockMove(
+                move_type=MoveType.ADJUST,
+                warehouse_id=stocktake.warehouse_id,
+                item_id=item_id,
+                quantity=diff,
+                reference=stocktake.reference,
+                note=note,
+            )
+            for item_id, diff in variance_lines(stocktake).values_list("item_id", "diff").iterator()
+        ]
+        if moves:
+            stocktake.document = open_document(
+                DocumentType.STOCKTAKE,
+                user=user,
+                reference=stocktake.reference,
+                note=note,
+            )
+        created = bulk_post_moves(split_fefo(moves), batch_size=POST_BATCH_SIZE, document=stocktake.document)
+        stocktake.status = StocktakeStatus.APPROVED
+        stocktake.approved_by = user if user is not None and user.is_authenticated else None
+        stocktake.closed_at = timezone.now()
+        stocktake.save(update_fields=["status", "approved_by", "closed_at", "document"])
+    return len(created)
+
+
+def cancel(stocktake_id):
+    """作废进行中的盘点单，不写流水。"""
+    with transaction.atomic():
+        stocktake = _lock_open(stocktake_id)
+        stocktake.status = StocktakeStatus.CANCELLED
+        stocktake.closed_at = timezone.now()
+        stocktake.save(update_fields=["status", "closed_at"])
+    return stocktake
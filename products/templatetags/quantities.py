@@ -0,0 +1,22 @@
+from django import template
+
+from products.masterdata import master_data
+from products.quantities import format_quantity
+
+register = template.Library()
+
+
+@register.filter
+def qty(value, precision=0):
+    """定点数量按给定小数位数显示：``{{ balance.on_hand|qty:unit.precision }}``。"""
+    if value is None or value == "":
+        return ""
+    return format_quantity(value, int(precision or 0))
+
+
+@register.filter
+def item_qty(value, item_id):
+    """按物品单位的精度显示：``{{ move.quantity|item_qty:move.item_id }}``，精度取自主数据缓存。"""
+    if value is None or value == "":
+        return ""
+    return format_quantity(value, master_data().item_precision(item_id))
@@ -1,3 +1,1753 @@
-from django.test import TestCase
+import csv
+import importlib
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.db.models import QuerySet, Sum
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from config.settings import _cache_from_url
+from products import jobs, search
+from products.admin import EstimatedCountPaginator
+from products.balance_triggers import (
+    ENGINE_TRIGGER,
+    balance_triggers_installed,
+    install_balance_triggers,
+)
+from products.catalog import ItemIndex
+from products.change_feed import decode_cursor, encode_cursor, low_water_mark
+from products.db_pool.pool import ConnectionPool, PoolTimeout
+from products.documents import DocumentError, open_document, reverse_document
+from products.idempotency import claim, issue_form_token, verify_form_token
+from products.importing import FileFormatError, FileImporter, iter_rows
+from products.ledger import bulk_post_moves
+from products.lots import resolve_lots, split_fefo
+from products.masterdata import master_data
+from products.outbox import TOPIC_BALANCE_CHANGED, relay_batch
+from products.models import (
+    ApiToken,
+    DocumentType,
+    IdempotencyKey,
+    Item,
+    ItemUnit,
+    Job,
+    JobStatus,
+    LotBalance,
+    MasterDataVersion,
+    MoveType,
+    OutboxEvent,
+    Partner,
+    Reservation,
+    ReservationStatus,
+    StockBalance,
+    StockDocument,
+    StockMove,
+    Stocktake,
+    StocktakeLine,
+    StocktakeStatus,
+    Unit,
+    Warehouse,
+)
+from products.quantities import format_quantity, parse_quantity, quantity_json
+from products.querylog import SlowQueryRecorder, normalize_sql
+from products.reservations import (
+    ReservationError,
+    available_for,
+    fulfill,
+    reconcile_reserved,
+    release_expired,
+    reserve,
+)
+from products.routers import REPLICA_ALIAS, STICKY_COOKIE, ReplicaRouter, replica_enabled
+from products.search import ITEM_SEARCH_FIELDS, search_q
+from products.stocktake import (
+    StocktakeError,
+    approve,
+    cancel,
+    counts_from_rows,
+    counts_from_scans,
+    open_stocktake,
+    record_counts,
+    summarize,
+)
+from products.transfers import TransferError, post_transfers
+from products.views.inventory import _role_filter_kwargs
+from products.views.stream import _event_stream, _since
+
+
+class InventoryTestCase(TestCase):
+    """公共数据：管理员、两个仓库、一个按件计的物品。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        cls.unit = Unit.objects.create(name="件")
+        cls.warehouse = Warehouse.objects.create(name="原料仓", warehouse_type="RAW")
+        cls.other_warehouse = Warehouse.objects.create(name="成品仓", warehouse_type="FINISHED")
+        cls.item = Item.objects.create(name="螺丝", unit=cls.unit, warehouse=cls.warehouse)
+
+    def on_hand(self, item=None, warehouse=None):
+        return (
+            StockBalance.objects
+            .filter(item=item or self.item, warehouse=warehouse or self.warehouse)
+            .values_list("on_hand", flat=True)
+            .first()
+        ) or 0
+
+    def receive(self, quantity, item=None, **fields):
+        """按定点整数直接入库一条流水。"""
+        item = item or self.item
+        return StockMove.objects.create(
+            move_type=MoveType.INBOUND,
+            item=item,
+            warehouse_id=item.warehouse_id,
+            quantity=quantity,
+            **fields,
+        )
+
+
+class MoveBatchApiTests(InventoryTestCase):
+    def setUp(self):
+        self.token = ApiToken.objects.create(name="ERP", user=self.user)
+
+    def post_batch(self, moves, mode=None, **headers):
+        payload = {"moves": moves}
+        if mode:
+            payload["mode"] = mode
+        return self.client.post(
+            "/api/moves/batch/",
+            json.dumps(payload),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {self.token.key}",
+            **headers,
+        )
+
+    def rows(self, outbound):
+        return [
+            {"type": "INBOUND", "item_id": self.item.pk, "quantity": 5},
+            {"type": "OUTBOUND", "item_id": self.item.pk, "quantity": outbound},
+        ]
+
+    def test_atomic_batch_writes_nothing_when_a_row_fails(self):
+        response = self.post_batch(self.rows(outbound=9))
+
+        self.assertEqual(response.status_code, 400)
+        body = response.json()
+        self.assertEqual(body["created"], 0)
+        self.assertEqual([row["ok"] for row in body["results"]], [False, False])
+        self.assertIn("未写入", body["results"][0]["error"])
+        self.assertIn("可用库存不足", body["results"][1]["error"])
+        self.assertFalse(StockMove.objects.exists())
+        self.assertEqual(self.on_hand(), 0)
+
+    def test_partial_batch_writes_the_valid_rows(self):
+        response = self.post_batch(self.rows(outbound=9), mode="partial")
+
+        self.assertEqual(response.status_code, 207)
+        body = response.json()
+        self.assertEqual(body["created"], 1)
+        self.assertEqual([row["ok"] for row in body["results"]], [True, False])
+        self.assertEqual(body["balances"], [
+            {"item_id": self.item.pk, "warehouse_id": self.warehouse.pk, "on_hand": 5, "reserved": 0},
+        ])
+        self.assertEqual(self.on_hand(), 5000)
+
+    def test_outbound_sees_inbound_earlier_in_the_same_batch(self):
+        response = self.post_batch(self.rows(outbound=3))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["created"], 2)
+        self.assertEqual(self.on_hand(), 2000)
+        self.assertEqual(StockMove.objects.filter(document_id=response.json()["document_id"]).count(), 2)
+
+    def test_idempotency_key_replays_the_first_response(self):
+        first = self.post_batch(self.rows(outbound=3), HTTP_IDEMPOTENCY_KEY="order-1")
+        replay = self.post_batch(self.rows(outbound=3), HTTP_IDEMPOTENCY_KEY="order-1")
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(replay.status_code, 200)
+        self.assertEqual(replay["Idempotent-Replayed"], "true")
+        self.assertEqual(replay.json(), first.json())
+        self.assertEqual(StockMove.objects.count(), 2)
+        self.assertEqual(self.on_hand(), 2000)
+
+    def test_rejected_batch_is_replayed_under_the_same_key(self):
+        # 整批被拒没有写入，但响应同样被记录：重放得到同样的 400
+        rejected = self.post_batch(self.rows(outbound=9), HTTP_IDEMPOTENCY_KEY="order-2")
+        replay = self.post_batch(self.rows(outbound=3), HTTP_IDEMPOTENCY_KEY="order-2")
+        fresh = self.post_batch(self.rows(outbound=3), HTTP_IDEMPOTENCY_KEY="order-3")
+
+        self.assertEqual(rejected.status_code, 400)
+        self.assertEqual(replay.status_code, 400)
+        self.assertEqual(replay.json(), rejected.json())
+        self.assertEqual(fresh.status_code, 200)
+        self.assertEqual(self.on_hand(), 2000)
+
+
+class FormTokenTests(InventoryTestCase):
+    def submit(self, token, user=None):
+        request = RequestFactory().post("/inventory/inbound/", {"form_token": token})
+        request.user = user or self.user
+        return verify_form_token(request, "inbound")
+
+    def test_token_is_accepted_once(self):
+        token = issue_form_token(self.user, "inbound")
+
+        self.assertTrue(self.submit(token))
+        self.assertFalse(self.submit(token))
+        self.assertEqual(IdempotencyKey.objects.filter(scope="form:inbound").count(), 1)
+
+    def test_tampered_or_foreign_tokens_are_rejected(self):
+        token = issue_form_token(self.user, "inbound")
+        other = User.objects.create_user("clerk", password="x")
+
+        self.assertFalse(self.submit(""))
+        payload, signature = token.rsplit(":", 1)
+        self.assertFalse(self.submit(f"{payload[:-1]}{'A' if payload[-1] != 'A' else 'B'}:{signature}"))
+        self.assertFalse(self.submit(issue_form_token(self.user, "outbound")))
+        self.assertFalse(self.submit(token, user=other))
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertTrue(self.submit(token))
+
+    @override_settings(IDEMPOTENCY_TTL_SECONDS=60)
+    def test_expired_token_is_rejected(self):
+        with mock.patch("django.core.signing.time.time", return_value=time.time() - 61):
+            token = issue_form_token(self.user, "inbound")
+
+        self.assertFalse(self.submit(token))
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_claim_reuses_an_expired_key(self):
+        IdempotencyKey.objects.create(
+            user=self.user, scope="form:inbound", key="n1", expires_at=timezone.now() - timedelta(seconds=1),
+        )
+
+        record = claim(self.user, "form:inbound", "n1")
+
+        self.assertIsNotNone(record)
+        self.assertGreater(record.expires_at, timezone.now())
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_claim_loses_the_race_for_an_expired_key(self):
+        stale = IdempotencyKey.objects.create(
+            user=self.user, scope="form:inbound", key="n1", expires_at=timezone.now() - timedelta(seconds=1),
+        )
+        real_delete = QuerySet.delete
+
+        def reclaimed_meanwhile(queryset):
+            # 另一个请求抢先删掉过期记录并重新登记
+            IdempotencyKey.objects.filter(pk=stale.pk).update(expires_at=timezone.now() + timedelta(hours=1))
+            return real_delete(queryset)
+
+        with mock.patch.object(QuerySet, "delete", autospec=True, side_effect=reclaimed_meanwhile):
+            self.assertIsNone(claim(self.user, "form:inbound", "n1"))
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+
+class BalanceEngineTests(InventoryTestCase):
+    """两种余额引擎对同一串写入应得到相同的余额。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_item = Item.objects.create(name="螺母", unit=cls.unit, warehouse=cls.other_warehouse)
+
+    def run_ledger(self):
+        """单条保存、批量记账、改数量、单条删除、批量删除各一次；返回余额后回滚。"""
+        with transaction.atomic():
+            first = self.receive(10000)
+            self.receive(4000, item=self.other_item)
+            bulk_post_moves([
+                StockMove(move_type=MoveType.INBOUND, item=self.item, warehouse=self.warehouse, quantity=6000),
+                StockMove(move_type=MoveType.OUTBOUND, item=self.item, warehouse=self.warehouse, quantity=-3000),
+                StockMove(move_type=MoveType.INBOUND, item=self.other_item, warehouse=self.other_warehouse, quantity=2500),
+            ])
+            first.quantity = 8000
+            first.save()
+            StockMove.objects.filter(item=self.other_item, quantity=4000).get().delete()
+            StockMove.objects.filter(item=self.item, move_type=MoveType.OUTBOUND).delete()
+            balances = dict(
+                ((item_id, warehouse_id), on_hand)
+                for item_id, warehouse_id, on_hand in StockBalance.objects.values_list("item_id", "warehouse_id", "on_hand")
+            )
+            totals = dict(
+                ((item_id, warehouse_id), total)
+                for item_id, warehouse_id, total in StockMove.objects.values("item_id", "warehouse_id")
+                .annotate(total=Sum("quantity"))
+                .values_list("item_id", "warehouse_id", "total")
+            )
+            transaction.set_rollback(True)
+        return balances, totals
+
+    def test_trigger_engine_matches_signal_engine(self):
+        signal_balances, totals = self.run_ledger()
+        with override_settings(STOCK_BALANCE_ENGINE=ENGINE_TRIGGER):
+            with transaction.atomic():
+                install_balance_triggers(connection)
+                self.assertTrue(balance_triggers_installed(connection))
+                trigger_balances, _ = self.run_ledger()
+                transaction.set_rollback(True)
+
+        expected = {
+            (self.item.pk, self.warehouse.pk): 14000,
+            (self.other_item.pk, self.other_warehouse.pk): 2500,
+        }
+        self.assertEqual(totals, expected)
+        self.assertEqual(signal_balances, expected)
+        self.assertEqual(trigger_balances, expected)
+
+    def test_trigger_engine_counts_raw_sql_moves(self):
+        # 触发器在测试事务里安装，随测试回滚
+        with override_settings(STOCK_BALANCE_ENGINE=ENGINE_TRIGGER):
+            install_balance_triggers(connection)
+            self.receive(1000)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE products_stockmove SET quantity = quantity * 3 WHERE item_id = %s",
+                    [self.item.pk],
+                )
+            self.assertEqual(self.on_hand(), 3000)
+
+
+class FefoTests(InventoryTestCase):
+    def setUp(self):
+        lots = resolve_lots({
+            (self.item.pk, "A"): date(2027, 1, 1),
+            (self.item.pk, "B"): date(2026, 6, 1),
+            (self.item.pk, "C"): None,
+        })
+        self.lots = {lot_no: lots[(self.item.pk, lot_no)] for _, lot_no in lots}
+        bulk_post_moves([
+            StockMove(move_type=MoveType.INBOUND, item=self.item, warehouse=self.warehouse,
+                      lot_id=self.lots[lot_no], quantity=quantity)
+            for lot_no, quantity in (("A", 5000), ("B", 3000), ("C", 4000))
+        ])
+
+    def lot_balances(self):
+        names = {lot_id: lot_no for lot_no, lot_id in self.lots.items()}
+        return {
+            names[lot_id]: on_hand
+            for lot_id, on_hand in LotBalance.objects.filter(warehouse=self.warehouse).values_list("lot_id", "on_hand")
+        }
+
+    def outbound(self, quantity):
+        with transaction.atomic():
+            return bulk_post_moves(split_fefo([
+                StockMove(move_type=MoveType.OUTBOUND, item=self.item, warehouse=self.warehouse, quantity=-quantity),
+            ]))
+
+    def test_outbound_splits_by_earliest_expiry_first(self):
+        moves = self.outbound(10000)
+
+        # B 先到期，其次 A，没有效期的 C 最后
+        self.assertEqual(
+            [(move.lot_id, move.quantity) for move in moves],
+            [(self.lots["B"], -3000), (self.lots["A"], -5000), (self.lots["C"], -2000)],
+        )
+        self.assertEqual(self.lot_balances(), {"A": 0, "B": 0, "C": 2000})
+        self.assertEqual(self.on_hand(), 2000)
+
+    def test_shortfall_beyond_lots_is_taken_from_unlotted_stock(self):
+        self.receive(3000)
+        moves = self.outbound(14000)
+
+        self.assertEqual(moves[-1].lot_id, None)
+        self.assertEqual(moves[-1].quantity, -2000)
+        self.assertEqual(self.lot_balances(), {"A": 0, "B": 0, "C": 0})
+        self.assertEqual(self.on_hand(), 1000)
+
+    def test_deleting_a_move_recalculates_its_lot_balance(self):
+        moves = self.outbound(4000)
+        moves[0].delete()
+
+        self.assertEqual(self.lot_balances(), {"A": 4000, "B": 3000, "C": 4000})
+        self.assertEqual(self.on_hand(), 11000)
+
+    def test_batch_api_rejects_a_lot_on_outbound(self):
+        token = ApiToken.objects.create(name="ERP", user=self.user)
+        response = self.client.post(
+            "/api/moves/batch/",
+            json.dumps({"moves": [{"type": "OUTBOUND", "item_id": self.item.pk, "quantity": 1, "lot_no": "A"}]}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {token.key}",
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("先到期先出", response.json()["results"][0]["error"])
+
+
+class TransferTests(InventoryTestCase):
+    def transfer(self, quantity, **fields):
+        transfer = {
+            "item_id": self.item.pk,
+            "from_warehouse_id": self.warehouse.pk,
+            "to_warehouse_id": self.other_warehouse.pk,
+            "quantity": quantity,
+            **fields,
+        }
+        with transaction.atomic():
+            document = open_document(DocumentType.TRANSFER, user=self.user)
+            [transfer_id] = post_transfers([transfer], document=document)
+        return document, transfer_id
+
+    def test_both_legs_share_transfer_id_and_document(self):
+        self.receive(5000)
+        document, transfer_id = self.transfer(2000, reference="TR-1")
+
+        moves = StockMove.objects.filter(transfer_id=transfer_id).order_by("quantity")
+        self.assertEqual(
+            [(move.warehouse_id, move.quantity, move.move_type, move.reference) for move in moves],
+            [
+                (self.warehouse.pk, -2000, MoveType.TRANSFER, "TR-1"),
+                (self.other_warehouse.pk, 2000, MoveType.TRANSFER, "TR-1"),
+            ],
+        )
+        self.assertEqual({move.document_id for move in moves}, {document.pk})
+        document.refresh_from_db()
+        self.assertEqual(document.line_count, 2)
+
+    def test_both_balances_are_updated_by_delta(self):
+        self.receive(5000)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.transfer(2000)
+
+        self.assertEqual(self.on_hand(), 3000)
+        self.assertEqual(self.on_hand(warehouse=self.other_warehouse), 2000)
+        self.assertFalse([q for q in queries.captured_queries if "SUM(" in q["sql"].upper()])
+
+    def test_inbound_leg_keeps_the_fefo_lots(self):
+        lots = resolve_lots({(self.item.pk, "A"): date(2027, 1, 1), (self.item.pk, "B"): date(2026, 6, 1)})
+        bulk_post_moves([
+            StockMove(move_type=MoveType.INBOUND, item=self.item, warehouse=self.warehouse,
+                      lot_id=lots[(self.item.pk, lot_no)], quantity=quantity)
+            for lot_no, quantity in (("A", 5000), ("B", 3000))
+        ])
+
+        _, transfer_id = self.transfer(4000)
+
+        incoming = StockMove.objects.filter(transfer_id=transfer_id, warehouse=self.other_warehouse)
+        self.assertEqual(
+            sorted(incoming.values_list("lot_id", "quantity")),
+            sorted([(lots[(self.item.pk, "B")], 3000), (lots[(self.item.pk, "A")], 1000)]),
+        )
+        self.assertEqual(
+            dict(LotBalance.objects.filter(warehouse=self.other_warehouse).values_list("lot_id", "on_hand")),
+            {lots[(self.item.pk, "B")]: 3000, lots[(self.item.pk, "A")]: 1000},
+        )
+
+    def test_rejects_same_warehouse_and_non_positive_quantity(self):
+        self.receive(5000)
+
+        with self.assertRaisesMessage(TransferError, "调出与调入仓库不能相同"):
+            self.transfer(1000, to_warehouse_id=self.warehouse.pk)
+        for quantity in (0, -1000):
+            with self.assertRaisesMessage(TransferError, "调拨数量必须大于 0"):
+                self.transfer(quantity)
+        self.assertFalse(StockMove.objects.filter(move_type=MoveType.TRANSFER).exists())
+        self.assertFalse(StockDocument.objects.filter(doc_type=DocumentType.TRANSFER).exists())
+
+
+class DocumentReversalTests(InventoryTestCase):
+    def post(self, doc_type, quantity, lot_id=None):
+        document = open_document(doc_type, user=self.user)
+        move_type = MoveType.INBOUND if quantity > 0 else MoveType.OUTBOUND
+        bulk_post_moves([
+            StockMove(move_type=move_type, item=self.item, warehouse=self.warehouse, lot_id=lot_id, quantity=quantity),
+        ], document=document)
+        return document
+
+    def test_reversal_restores_the_balance_once(self):
+        document = self.post(DocumentType.INBOUND, 5000)
+
+        reversal = reverse_document(document.pk, user=self.user)
+
+        self.assertEqual(reversal.doc_type, DocumentType.REVERSAL)
+        self.assertEqual(reversal.reverses_id, document.pk)
+        self.assertEqual(reversal.line_count, 1)
+        self.assertEqual(self.on_hand(), 0)
+        # 冲销入库记为调整，不写负数的入库流水
+        self.assertEqual(
+            list(StockMove.objects.filter(document=reversal).values_list("move_type", "quantity", "reference")),
+            [(MoveType.ADJUST, -5000, document.number)],
+        )
+        with self.assertRaisesMessage(DocumentError, "已冲销"):
+            reverse_document(document.pk, user=self.user)
+        with self.assertRaisesMessage(DocumentError, "冲销单不能再冲销"):
+            reverse_document(reversal.pk, user=self.user)
+        self.assertEqual(self.on_hand(), 0)
+
+    def test_transfer_reversal_moves_the_stock_back(self):
+        self.receive(5000)
+        with transaction.atomic():
+            document = open_document(DocumentType.TRANSFER, user=self.user)
+            [transfer_id] = post_transfers([{
+                "item_id": self.item.pk,
+                "from_warehouse_id": self.warehouse.pk,
+                "to_warehouse_id": self.other_warehouse.pk,
+                "quantity": 2000,
+            }], document=document)
+
+        reversal = reverse_document(document.pk, user=self.user)
+
+        moves = list(StockMove.objects.filter(document=reversal).order_by("quantity"))
+        self.assertEqual(
+            [(move.move_type, move.warehouse_id, move.quantity) for move in moves],
+            [
+                (MoveType.TRANSFER, self.other_warehouse.pk, -2000),
+                (MoveType.TRANSFER, self.warehouse.pk, 2000),
+            ],
+        )
+        self.assertEqual(moves[0].transfer_id, moves[1].transfer_id)
+        self.assertNotEqual(moves[0].transfer_id, transfer_id)
+        self.assertEqual((self.on_hand(), self.on_hand(warehouse=self.other_warehouse)), (5000, 0))
+
+    def test_reversal_is_refused_when_available_stock_is_short(self):
+        document = self.post(DocumentType.INBOUND, 5000)
+        self.post(DocumentType.OUTBOUND, -3000)
+
+        with self.assertRaisesMessage(DocumentError, "可用 2，冲销需扣减 5"):
+            reverse_document(document.pk, user=self.user)
+        self.assertFalse(StockDocument.objects.filter(reverses=document).exists())
+        self.assertEqual(self.on_hand(), 2000)
+
+    def test_reversal_is_refused_when_the_lot_is_short(self):
+        lot_id = resolve_lots({(self.item.pk, "A"): None})[(self.item.pk, "A")]
+        document = self.post(DocumentType.INBOUND, 5000, lot_id=lot_id)
+        self.post(DocumentType.OUTBOUND, -3000, lot_id=lot_id)
+        # 物品总量够冲销，但批次 A 只剩 2
+        self.receive(5000)
+
+        with self.assertRaisesMessage(DocumentError, "结存不足，无法冲销"):
+            reverse_document(document.pk, user=self.user)
+        self.assertEqual(self.on_hand(), 7000)
+        self.assertEqual(LotBalance.objects.get(lot_id=lot_id).on_hand, 2000)
+
+
+class FixedPointQuantityTests(InventoryTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.kg = Unit.objects.create(name="kg", precision=3)
+        cls.rice = Item.objects.create(name="大米", unit=cls.kg, warehouse=cls.warehouse)
+
+    def test_parse_rejects_extra_decimals_instead_of_rounding(self):
+        self.assertEqual(parse_quantity("12"), 12000)
+        self.assertEqual(parse_quantity("1.25", 2), 1250)
+        self.assertEqual(parse_quantity(1.1, 1), 1100)
+        self.assertEqual(parse_quantity("2.50", 1), 2500)
+        with self.assertRaisesMessage(ValueError, "数量必须是整数"):
+            parse_quantity("1.5")
+        with self.assertRaisesMessage(ValueError, "数量最多 2 位小数"):
+            parse_quantity("0.125", 2)
+        with self.assertRaisesMessage(ValueError, "数量必须是数字"):
+            parse_quantity("abc")
+
+    def test_format_and_json_output(self):
+        self.assertEqual(format_quantity(1500, 3), "1.500")
+        self.assertEqual(format_quantity(1000, 2), "1.00")
+        self.assertEqual(format_quantity(12000), "12")
+        # 历史数据小数位多于当前精度时多显示，不舍入
+        self.assertEqual(format_quantity(1250, 1), "1.25")
+        self.assertEqual(quantity_json(12000), 12)
+        self.assertEqual(quantity_json(1250), 1.25)
+        self.assertEqual(quantity_json(None), 0)
+
+    def test_inbound_form_follows_the_unit_precision(self):
+        self.client.force_login(self.user)
+        for item, quantity in ((self.rice, "1.125"), (self.item, "1.5"), (self.item, "2")):
+            self.client.post("/inventory/inbound/", {
+                "warehouse_id": self.warehouse.pk,
+                "item_id": item.pk,
+                "quantity": quantity,
+                "form_token": issue_form_token(self.user, "inbound"),
+            })
+
+        self.assertEqual(self.on_hand(self.rice), 1125)
+        # 件是整数单位，1.5 被拒绝，只记入 2
+        self.assertEqual(self.on_hand(), 2000)
+
+    def test_data_migration_scales_stored_quantities(self):
+        migration = importlib.import_module("products.migrations.0028_fixed_point_quantities")
+        schema_editor = SimpleNamespace(connection=connection)
+        # bulk_create 不触发信号，按迁移前的整数单位直接写行
+        StockMove.objects.bulk_create([
+            StockMove(move_type=MoveType.INBOUND, item=self.item, warehouse=self.warehouse, quantity=7),
+            StockMove(move_type=MoveType.OUTBOUND, item=self.item, warehouse=self.warehouse, quantity=-2),
+            StockMove(move_type=MoveType.ADJUST, item=self.item, warehouse=self.warehouse, quantity=0),
+        ])
+        # 余额行放在另一个仓库：触发器引擎下上面的流水会自己生成余额
+        StockBalance.objects.bulk_create([
+            StockBalance(item=self.item, warehouse=self.other_warehouse, on_hand=5, reserved=1),
+        ])
+        balance = StockBalance.objects.filter(warehouse=self.other_warehouse).values_list("on_hand", "reserved")
+
+        migration.scale_quantities(apps, schema_editor)
+        self.assertEqual(
+            sorted(StockMove.objects.values_list("quantity", flat=True)), [-2000, 0, 7000],
+        )
+        self.assertEqual(balance.get(), (5000, 1000))
+
+        migration.unscale_quantities(apps, schema_editor)
+        self.assertEqual(sorted(StockMove.objects.values_list("quantity", flat=True)), [-2, 0, 7])
+        self.assertEqual(balance.get(), (5, 1))
+
+
+class ItemUnitConversionTests(InventoryTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.box = Unit.objects.create(name="箱")
+        cls.kg = Unit.objects.create(name="kg", precision=3)
+        cls.gram = Unit.objects.create(name="g")
+        cls.rice = Item.objects.create(name="大米", unit=cls.kg, warehouse=cls.warehouse)
+        ItemUnit.objects.create(item=cls.item, unit=cls.box, factor=12)
+        ItemUnit.objects.create(item=cls.rice, unit=cls.gram, factor=Decimal("0.001"))
+
+    def parse(self, item, value, unit=""):
+        return master_data().parse_item_quantity(item.pk, value, unit)
+
+    def test_alternate_units_convert_to_the_base_unit(self):
+        self.assertEqual(self.parse(self.item, "2", "箱"), 24000)
+        self.assertEqual(self.parse(self.item, "3", "件"), 3000)
+        self.assertEqual(self.parse(self.item, "3"), 3000)
+        self.assertEqual(self.parse(self.rice, "250", "g"), 250)
+        self.assertEqual(self.parse(self.rice, "1.5", "kg"), 1500)
+
+    def test_conversion_errors(self):
+        with self.assertRaisesMessage(ValueError, "物品未配置单位“g”"):
+            self.parse(self.item, "1", "g")
+        with self.assertRaisesMessage(ValueError, "物品未配置单位“袋”"):
+            self.parse(self.item, "1", "袋")
+        # 箱是整数单位
+        with self.assertRaisesMessage(ValueError, "数量必须是整数"):
+            self.parse(self.item, "1.5", "箱")
+        with self.assertRaisesMessage(ValueError, "数量必须是整数"):
+            self.parse(self.rice, "0.5", "g")
+
+    def test_result_beyond_base_precision_is_rejected(self):
+        ItemUnit.objects.create(item=self.item, unit=self.gram, factor=Decimal("0.5"))
+        self.assertEqual(self.parse(self.item, "4", "g"), 2000)
+        with self.assertRaisesMessage(ValueError, "换算成基本单位后不是整数"):
+            self.parse(self.item, "3", "g")
+
+    def test_inactive_conversion_is_refused(self):
+        ItemUnit.objects.filter(item=self.item, unit=self.box).update(is_active=False)
+        with self.assertRaisesMessage(ValueError, "物品未配置单位“箱”"):
+            self.parse(self.item, "1", "箱")
+
+    def test_batch_api_accepts_a_unit_per_row(self):
+        token = ApiToken.objects.create(name="ERP", user=self.user)
+        response = self.client.post(
+            "/api/moves/batch/",
+            json.dumps({"moves": [
+                {"type": "INBOUND", "item_id": self.item.pk, "quantity": 2, "unit": "箱"},
+                {"type": "INBOUND", "item_id": self.rice.pk, "quantity": 1250, "unit": "g"},
+                {"type": "OUTBOUND", "item_id": self.item.pk, "quantity": 5},
+            ]}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {token.key}",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.on_hand(), 19000)
+        self.assertEqual(self.on_hand(self.rice), 1250)
+
+
+class StocktakeTests(InventoryTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.nut = Item.objects.create(name="螺母", unit=cls.unit, warehouse=cls.warehouse)
+        # 主仓库在成品仓，但原料仓也有结存
+        cls.washer = Item.objects.create(name="垫圈", unit=cls.unit, warehouse=cls.other_warehouse)
+
+    def setUp(self):
+        lots = resolve_lots({(self.item.pk, "A"): date(2027, 1, 1), (self.item.pk, "B"): date(2026, 6, 1)})
+        self.lot_a, self.lot_b = lots[(self.item.pk, "A")], lots[(self.item.pk, "B")]
+        bulk_post_moves([
+            StockMove(move_type=MoveType.INBOUND, item=self.item, warehouse=self.warehouse,
+                      lot_id=self.lot_a, quantity=7000),
+            StockMove(move_type=MoveType.INBOUND, item=self.item, warehouse=self.warehouse,
+                      lot_id=self.lot_b, quantity=3000),
+            StockMove(move_type=MoveType.INBOUND, item=self.washer, warehouse=self.warehouse, quantity=2000),
+        ])
+
+    def lines(self, stocktake):
+        return dict(StocktakeLine.objects.filter(stocktake=stocktake).values_list("item_id", "expected"))
+
+    def counted(self, stocktake):
+        return dict(
+            StocktakeLine.objects
+            .filter(stocktake=stocktake, counted__isnull=False)
+            .values_list("item_id", "counted")
+        )
+
+    def test_open_snapshots_book_quantities(self):
+        stocktake = open_stocktake(self.warehouse, user=self.user)
+
+        self.assertEqual(self.lines(stocktake), {self.item.pk: 10000, self.nut.pk: 0, self.washer.pk: 2000})
+        # 快照之后的出入库不影响账面数
+        self.receive(1000)
+        self.assertEqual(self.lines(stocktake)[self.item.pk], 10000)
+
+    def test_one_open_stocktake_per_warehouse(self):
+        open_stocktake(self.warehouse, user=self.user)
+
+        with self.assertRaisesMessage(StocktakeError, "原料仓 已有进行中的盘点单"):
+            open_stocktake(self.warehouse, user=self.user)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Stocktake.objects.create(warehouse=self.warehouse)
+        self.assertEqual(Stocktake.objects.filter(warehouse=self.warehouse).count(), 1)
+        open_stocktake(self.other_warehouse, user=self.user)
+
+    def test_scans_accumulate_and_file_rows_overwrite(self):
+        stocktake = open_stocktake(self.warehouse, user=self.user)
+
+        counts, errors = counts_from_scans(stocktake, f"螺丝 4\n螺丝\n\n{self.nut.pk}\t2\n螺母 1.5\n扳手\n")
+        self.assertEqual(counts, {self.item.pk: 5000, self.nut.pk: 2000})
+        self.assertEqual(errors, ["第 5 行：螺母 数量必须是整数", "第 6 行：扳手 不在本盘点单内"])
+        self.assertEqual(record_counts(stocktake.pk, counts, add=True), 2)
+        record_counts(stocktake.pk, {self.item.pk: 1000}, add=True)
+        self.assertEqual(self.counted(stocktake), {self.item.pk: 6000, self.nut.pk: 2000})
+
+        counts, errors = counts_from_rows(stocktake, [
+            (2, {"item": "螺丝", "quantity": "8"}),
+            (3, {"item_id": str(self.washer.pk), "quantity": "-1"}),
+            (4, {"item": "扳手", "quantity": "1"}),
+        ])
+        self.assertEqual(counts, {self.item.pk: 8000})
+        self.assertEqual(len(errors), 2)
+        record_counts(stocktake.pk, counts)
+        self.assertEqual(self.counted(stocktake), {self.item.pk: 8000, self.nut.pk: 2000})
+
+    def test_approve_posts_one_adjustment_per_variance_split_by_fefo(self):
+        stocktake = open_stocktake(self.warehouse, user=self.user)
+        # 螺丝盘亏 4，螺母盘盈 2，垫圈未盘不调整
+        record_counts(stocktake.pk, {self.item.pk: 6000, self.nut.pk: 2000})
+
+        self.assertEqual(summarize(stocktake)["variances"], 2)
+        self.assertEqual(approve(stocktake.pk, user=self.user), 3)
+
+        stocktake.refresh_from_db()
+        self.assertEqual(stocktake.status, StocktakeStatus.APPROVED)
+        self.assertEqual(stocktake.document.doc_type, DocumentType.STOCKTAKE)
+        moves = StockMove.objects.filter(document=stocktake.document)
+        self.assertEqual(set(moves.values_list("move_type", flat=True)), {MoveType.ADJUST})
+        self.assertEqual(
+            sorted(moves.values_list("item_id", "lot_id", "quantity")),
+            sorted([(self.item.pk, self.lot_b, -3000), (self.item.pk, self.lot_a, -1000), (self.nut.pk, None, 2000)]),
+        )
+        self.assertEqual(self.on_hand(), 6000)
+        self.assertEqual(self.on_hand(self.nut), 2000)
+        self.assertEqual(self.on_hand(self.washer), 2000)
+        with self.assertRaisesMessage(StocktakeError, "盘点单不存在或已结束"):
+            approve(stocktake.pk, user=self.user)
+        with self.assertRaisesMessage(StocktakeError, "盘点单不存在或已结束"):
+            record_counts(stocktake.pk, {self.item.pk: 1000})
+
+    def test_cancel_posts_nothing_and_frees_the_warehouse(self):
+        stocktake = open_stocktake(self.warehouse, user=self.user)
+        record_counts(stocktake.pk, {self.item.pk: 1000})
+
+        cancel(stocktake.pk)
+
+        stocktake.refresh_from_db()
+        self.assertEqual(stocktake.status, StocktakeStatus.CANCELLED)
+        self.assertIsNotNone(stocktake.closed_at)
+        self.assertEqual(self.on_hand(), 10000)
+        self.assertEqual(StockMove.objects.filter(move_type=MoveType.ADJUST).count(), 0)
+        open_stocktake(self.warehouse, user=self.user)
+
+
+class MasterDataVersionTests(InventoryTestCase):
+    def version(self):
+        return MasterDataVersion.objects.filter(pk=1).values_list("version", flat=True).first() or 0
+
+    def test_queryset_update_bumps_the_version(self):
+        before = self.version()
+
+        Item.objects.filter(pk=self.item.pk).update(name="六角螺丝")
+
+        self.assertEqual(self.version(), before + 1)
+        data = master_data(strict=True)
+        self.assertEqual(data.version, before + 1)
+        self.assertEqual(data.item(self.item.pk).name, "六角螺丝")
+        # 没有命中任何行不算变更
+        Item.objects.filter(pk=0).update(name="x")
+        self.assertEqual(self.version(), before + 1)
+
+    def test_bulk_create_and_bulk_update_bump_the_version(self):
+        before = self.version()
+
+        units = Unit.objects.bulk_create([Unit(name="箱"), Unit(name="托")])
+        self.assertEqual(self.version(), before + 1)
+        for unit in units:
+            unit.is_active = False
+        Unit.objects.bulk_update(units, ["is_active"])
+        self.assertEqual(self.version(), before + 2)
+        self.assertNotIn("箱", [unit.name for unit in master_data(strict=True).active_units])
+
+    def test_admin_bulk_delete_bumps_the_version(self):
+        partners = Partner.objects.bulk_create([Partner(name="甲"), Partner(name="乙")])
+        before = self.version()
+        self.client.force_login(self.user)
+
+        response = self.client.post("/admin/products/partner/", {
+            "action": "delete_selected",
+            "_selected_action": [partner.pk for partner in partners],
+            "post": "yes",
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Partner.objects.exists())
+        self.assertGreater(self.version(), before)
+        self.assertEqual(master_data(strict=True).partners, {})
+
+
+class ImportItemsEtagTests(InventoryTestCase):
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def get(self, etag=None):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get("/inventory/import/items/", {"warehouse_id": self.warehouse.pk}, **headers)
+
+    def test_unchanged_list_returns_304(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0]["name"], "螺丝")
+
+        self.assertEqual(self.get(response["ETag"]).status_code, 304)
+
+    def test_stock_change_invalidates_the_etag(self):
+        etag = self.get()["ETag"]
+        self.receive(1000)
+
+        self.assertEqual(self.get(etag).status_code, 200)
+
+    def test_master_data_change_invalidates_the_etag(self):
+        etag = self.get()["ETag"]
+        # 改单位名称不会动物品的 updated_at，只有主数据版本号变化
+        Unit.objects.filter(pk=self.unit.pk).update(name="个")
+
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0]["unit_name"], "个")
+
+
+class RecordingSink:
+    """记录每次投递的事件 id；``failures`` 次之前抛错，投递时检查没有占着事务。"""
+    failures = 0
+    batches = []
+
+    def __init__(self, **options):
+        self.atomic_depth = len(connection.atomic_blocks)
+
+    def send(self, events):
+        RecordingSink.batches.append([event["id"] for event in events])
+        if len(connection.atomic_blocks) != self.atomic_depth:
+            raise AssertionError("sink.send() 在事务内调用")
+        if RecordingSink.failures:
+            RecordingSink.failures -= 1
+            raise ConnectionError("sink 不可用")
+
+
+class OutboxRelayTests(TestCase):
+    def setUp(self):
+        RecordingSink.failures = 0
+        RecordingSink.batches = []
+        self.events = OutboxEvent.objects.bulk_create([
+            OutboxEvent(topic=TOPIC_BALANCE_CHANGED, key="1:1", payload={"n": n}) for n in range(3)
+        ])
+
+    def pending(self):
+        return list(OutboxEvent.objects.filter(delivered_at__isnull=True).order_by("id").values_list("id", flat=True))
+
+    def test_delivers_in_id_order_outside_the_transaction(self):
+        sink = RecordingSink()
+
+        self.assertEqual(relay_batch(sink, 2), (2, None))
+        self.assertEqual(relay_batch(sink, 2), (1, None))
+        self.assertEqual(relay_batch(sink, 2), (0, None))
+
+        ids = [event.pk for event in self.events]
+        self.assertEqual(RecordingSink.batches, [ids[:2], ids[2:]])
+        self.assertEqual(self.pending(), [])
+        self.assertEqual(
+            set(OutboxEvent.objects.values_list("attempts", "last_error", "locked_until")),
+            {(1, "", None)},
+        )
+
+    def test_failure_records_the_error_and_releases_the_batch(self):
+        RecordingSink.failures = 1
+
+        delivered, error = relay_batch(RecordingSink(), 10)
+
+        self.assertEqual(delivered, 0)
+        self.assertIsInstance(error, ConnectionError)
+        self.assertEqual(
+            set(OutboxEvent.objects.values_list("attempts", "last_error", "locked_until", "delivered_at")),
+            {(1, "ConnectionError: sink 不可用", None, None)},
+        )
+        self.assertEqual(relay_batch(RecordingSink(), 10), (3, None))
+        self.assertEqual(set(OutboxEvent.objects.values_list("attempts", flat=True)), {2})
+
+    def test_leased_events_are_skipped_until_the_lease_expires(self):
+        now = timezone.now()
+        OutboxEvent.objects.filter(pk=self.events[0].pk).update(locked_until=now + timedelta(minutes=5))
+        OutboxEvent.objects.filter(pk=self.events[1].pk).update(locked_until=now - timedelta(seconds=1))
+
+        self.assertEqual(relay_batch(RecordingSink(), 10), (2, None))
+
+        self.assertEqual(RecordingSink.batches, [[self.events[1].pk, self.events[2].pk]])
+        self.assertEqual(self.pending(), [self.events[0].pk])
+
+    def test_command_backs_off_between_failed_attempts(self):
+        RecordingSink.failures = 3
+
+        with mock.patch("products.management.commands.relay_outbox.time.sleep") as sleep:
+            call_command(
+                "relay_outbox", sink="products.tests.RecordingSink", interval=1, once=True,
+                stdout=StringIO(), stderr=StringIO(),
+            )
+
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [2, 4, 8])
+        self.assertEqual(len(RecordingSink.batches), 4)
+        self.assertEqual(self.pending(), [])
+
+
+class AdminChangelistTests(InventoryTestCase):
+    def setUp(self):
+        for quantity in (1000, 2000, 3000):
+            self.receive(quantity)
+        self.moves = StockMove.objects.order_by("-id")
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=2)
+    def test_sqlite_falls_back_to_an_exact_count(self):
+        paginator = EstimatedCountPaginator(self.moves, 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(paginator.count, 3)
+        self.assertFalse([q for q in queries.captured_queries if "EXPLAIN" in q["sql"]])
+        self.assertEqual(paginator.num_pages, 2)
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=100)
+    def test_uses_the_planner_estimate_only_above_the_limit(self):
+        with mock.patch.object(EstimatedCountPaginator, "_estimate", return_value=5_000_000):
+            self.assertEqual(EstimatedCountPaginator(self.moves, 100).count, 5_000_000)
+        with mock.patch.object(EstimatedCountPaginator, "_estimate", return_value=50):
+            self.assertEqual(EstimatedCountPaginator(self.moves, 100).count, 3)
+
+    def test_stock_move_changelist_is_ordered_by_id(self):
+        self.client.force_login(self.user)
+
+        response = self.client.get("/admin/products/stockmove/", {"q": "螺丝"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["cl"].result_list), list(self.moves))
+
+
+class SlowQueryLogTests(InventoryTestCase):
+    def test_normalize_sql_folds_literals(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE name = 'a''b' AND id IN (%s, %s, %s)\n  LIMIT 21"),
+            "SELECT * FROM t WHERE name = ? AND id IN (...) LIMIT ?",
+        )
+
+    def test_records_slow_select_with_plan(self):
+        recorder = SlowQueryRecorder(connection, threshold_ms=0)
+
+        with self.assertLogs("products.slow_query", "INFO") as logs, connection.execute_wrapper(recorder):
+            list(Item.objects.filter(warehouse=self.warehouse).values_list("id", flat=True))
+
+        [entry] = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual(entry["vendor"], "sqlite")
+        self.assertIn('"products_item"', entry["sql"])
+        self.assertEqual(entry["params"], [str(self.warehouse.pk)])
+        self.assertIn("products_item", entry["plan"])
+
+    def test_queries_under_the_threshold_are_not_logged(self):
+        recorder = SlowQueryRecorder(connection, threshold_ms=60_000)
+
+        with mock.patch("products.querylog.logger") as slow_logger, connection.execute_wrapper(recorder):
+            Item.objects.count()
+
+        slow_logger.info.assert_not_called()
+
+
+class SearchTests(InventoryTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.bolt = Item.objects.create(name="不锈钢螺栓 M8", unit=cls.unit, warehouse=cls.other_warehouse)
+
+    def search(self, q):
+        return set(Item.objects.filter(search_q(Item, q, ITEM_SEARCH_FIELDS)).values_list("name", flat=True))
+
+    def test_long_keyword_uses_the_fts_index(self):
+        self.assertTrue(search._sqlite_fts_available(connection))
+        self.assertIn("MATCH", str(Item.objects.filter(search_q(Item, "不锈钢", ITEM_SEARCH_FIELDS)).query))
+
+        self.assertEqual(self.search("不锈钢"), {"不锈钢螺栓 M8"})
+        # 仓库名经 warehouse_id 子查询命中
+        self.assertEqual(self.search("成品仓"), {"不锈钢螺栓 M8"})
+        Item.objects.filter(pk=self.bolt.pk).update(name="镀锌螺栓 M8")
+        self.assertEqual(self.search("不锈钢"), set())
+
+    def test_short_keyword_falls_back_to_icontains(self):
+        condition = search_q(Item, "螺", ITEM_SEARCH_FIELDS)
+
+        self.assertNotIn("MATCH", str(Item.objects.filter(condition).query))
+        self.assertEqual(self.search("螺"), {"螺丝", "不锈钢螺栓 M8"})
+        self.assertEqual(self.search("m8"), {"不锈钢螺栓 M8"})
+
+    def test_without_fts_tables_falls_back_to_icontains(self):
+        with mock.patch.dict(search._fts_ready, {connection.alias: False}):
+            self.assertNotIn("MATCH", str(Item.objects.filter(search_q(Item, "不锈钢", ITEM_SEARCH_FIELDS)).query))
+            self.assertEqual(self.search("不锈钢"), {"不锈钢螺栓 M8"})
+            self.assertEqual(self.search("原料仓"), {"螺丝"})
+
+
+class ItemTypeaheadTests(InventoryTestCase):
+    def test_index_returns_prefix_matches_before_substring_matches(self):
+        index = ItemIndex([
+            (1, "Bolt M8", 1, "件"),
+            (2, "bolt m6", 1, "件"),
+            (3, "Anchor bolt", 1, "件"),
+            (4, "Bolt M10", 2, "件"),
+            (5, "Washer", 1, "件"),
+        ])
+
+        self.assertEqual([entry[1] for entry in index.search("BOLT", {1}, 10)], [2, 1, 3])
+        self.assertEqual([entry[1] for entry in index.search("bolt", {1, 2}, 2)], [4, 2])
+        self.assertEqual([entry[1] for entry in index.search("", {1}, 10)], [3, 2, 1, 5])
+
+    def test_lookup_is_scoped_and_reports_available_stock(self):
+        other = Item.objects.create(name="螺丝刀", unit=self.unit, warehouse=self.other_warehouse)
+        self.receive(5000)
+        reserve(self.item.pk, self.warehouse.pk, 2000)
+        self.client.force_login(self.user)
+
+        response = self.client.get("/items/lookup/", {"q": "螺丝", "warehouse_id": self.warehouse.pk})
+
+        self.assertEqual(response.json()["results"], [{
+            "id": self.item.pk, "name": "螺丝", "warehouse_id": self.warehouse.pk, "unit": "件",
+            "on_hand": "5", "available": "3", "step": "1",
+        }])
+        response = self.client.get("/items/lookup/", {"q": "螺丝", "limit": "x"})
+        self.assertEqual([row["id"] for row in response.json()["results"]], [self.item.pk, other.pk])
+
+
+class FileImportTests(InventoryTestCase):
+    def upload(self, text, name="moves.csv", encoding="utf-8"):
+        return SimpleUploadedFile(name, text.encode(encoding))
+
+    def run_import(self, action, text):
+        importer = FileImporter(action, _role_filter_kwargs(self.user), user=self.user)
+        return importer, importer.run(iter_rows(self.upload(text)))
+
+    def test_inbound_csv_is_posted_under_one_document(self):
+        importer, ok = self.run_import(MoveType.INBOUND, "物品,数量,单号,备注\n螺丝,3,PO-1,\n螺丝,2,PO-2,补货\n")
+
+        self.assertTrue(ok)
+        self.assertEqual(importer.imported, 2)
+        self.assertEqual(
+            list(StockMove.objects.filter(document=importer.document).order_by("pk").values_list("quantity", "reference")),
+            [(3000, "PO-1"), (2000, "PO-2")],
+        )
+        self.assertEqual(self.on_hand(), 5000)
+
+    def test_row_errors_roll_back_the_whole_file(self):
+        self.receive(1000)
+
+        importer, ok = self.run_import(
+            MoveType.OUTBOUND,
+            "物品,数量\n螺丝,1\n不存在,1\n螺丝,0\n螺丝,5\n",
+        )
+
+        self.assertFalse(ok)
+        self.assertEqual(importer.error_count, 3)
+        self.assertEqual(importer.errors, [
+            "第 3 行：物品不存在、已停用或无权限",
+            "第 4 行：数量必须大于 0",
+            "第 5 行：可用库存不足，可用 0，需 5",
+        ])
+        self.assertIsNone(importer.document)
+        self.assertEqual(self.on_hand(), 1000)
+        self.assertFalse(StockDocument.objects.exists())
+
+    def test_malformed_files_raise_file_format_error(self):
+        with self.assertRaisesMessage(FileFormatError, "不是有效的 XLSX 文件"):
+            list(iter_rows(self.upload("物品,数量\n", name="moves.xlsx")))
+        with self.assertRaisesMessage(FileFormatError, "CSV 格式有误"):
+            list(iter_rows(self.upload('物品,数量\n螺丝,"' + "x" * (csv.field_size_limit() + 1))))
+        with self.assertRaisesMessage(ValueError, "表头缺少"):
+            list(iter_rows(self.upload("名称,备注\n螺丝,1\n")))
+
+    def test_view_reports_file_format_errors(self):
+        self.client.force_login(self.user)
+
+        response = self.client.post("/inventory/import/file/", {
+            "action_type": MoveType.INBOUND,
+            "file": self.upload("物品,数量\n", name="moves.xlsx"),
+        }, follow=True)
+
+        self.assertContains(response, "导入失败：不是有效的 XLSX 文件")
+        self.assertFalse(StockMove.objects.exists())
+
+
+class CacheSettingsTests(SimpleTestCase):
+    def test_cache_url_parsing(self):
+        self.assertEqual(_cache_from_url("locmem://")["LOCATION"], "inventory")
+        self.assertEqual(_cache_from_url("file:///var/tmp/cache")["LOCATION"], "/var/tmp/cache")
+        memcached = _cache_from_url("memcached://10.0.0.1:11211,10.0.0.2:11211")
+        self.assertEqual(memcached["BACKEND"], "django.core.cache.backends.memcached.PyMemcacheCache")
+        self.assertEqual(memcached["LOCATION"], ["10.0.0.1:11211", "10.0.0.2:11211"])
+        redis = _cache_from_url("rediss://:secret@cache:6380/1")
+        self.assertEqual(redis["BACKEND"], "django.core.cache.backends.redis.RedisCache")
+        self.assertEqual(redis["LOCATION"], "rediss://:secret@cache:6380/1")
+
+    def test_invalid_cache_urls(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, "Unsupported DJANGO_CACHE_URL scheme: mongodb"):
+            _cache_from_url("mongodb://localhost")
+        with self.assertRaisesMessage(ImproperlyConfigured, "must include a directory"):
+            _cache_from_url("file://")
+
+
+class PurgeSessionsTests(TestCase):
+    def test_expired_sessions_are_deleted_in_batches(self):
+        now = timezone.now()
+        Session.objects.bulk_create(
+            [Session(session_key=f"old{n}", session_data="", expire_date=now - timedelta(days=1)) for n in range(5)]
+            + [Session(session_key="live", session_data="", expire_date=now + timedelta(days=1))]
+        )
+        out = StringIO()
+
+        with CaptureQueriesContext(connection) as queries:
+            call_command("purge_sessions", batch_size=2, stdout=out)
+
+        self.assertIn("已清理过期 session 5 条", out.getvalue())
+        self.assertEqual(list(Session.objects.values_list("session_key", flat=True)), ["live"])
+        deletes = [q for q in queries.captured_queries if q["sql"].startswith("DELETE")]
+        self.assertEqual(len(deletes), 3)
+
+
+class AsyncApiAuthTests(InventoryTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.token = ApiToken.objects.create(name="ERP", user=cls.user)
+        cls.clerk = User.objects.create_user("clerk", password="pw")
+        cls.clerk.groups.create(name="finished")
+        cls.product = Item.objects.create(name="成品箱", unit=cls.unit, warehouse=cls.other_warehouse)
+
+    async def test_anonymous_and_bad_tokens_get_401(self):
+        for path in ("/api/dashboard/", "/api/moves/", "/api/balances/", "/api/changes/"):
+            response = await self.async_client.get(path)
+            self.assertEqual(response.status_code, 401, path)
+            self.assertEqual(response.json(), {"error": "未登录"})
+
+        response = await self.async_client.get("/api/dashboard/", headers={"Authorization": "Token nope"})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {"error": "令牌无效或已停用"})
+
+    async def test_token_is_refused_once_the_user_is_deactivated(self):
+        await User.objects.filter(pk=self.user.pk).aupdate(is_active=False)
+
+        response = await self.async_client.get(
+            "/api/dashboard/", headers={"Authorization": f"Token {self.token.key}"},
+        )
+
+        self.assertEqual(response.status_code, 401)
+
+    async def test_token_user_sees_all_warehouses(self):
+        response = await self.async_client.get(
+            "/api/dashboard/", headers={"Authorization": f"Token {self.token.key}"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({row["id"] for row in response.json()["results"]}, {self.item.pk, self.product.pk})
+
+    async def test_session_user_is_limited_to_their_warehouses(self):
+        await sync_to_async(self.async_client.force_login)(self.clerk)
+
+        response = await self.async_client.get("/api/dashboard/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["id"] for row in response.json()["results"]], [self.product.pk])
+        response = await self.async_client.post("/api/dashboard/")
+        self.assertEqual(response.status_code, 405)
+
+
+def _succeed(job):
+    return {"echo": job.payload.get("value")}
+
+
+def _fail(job):
+    raise RuntimeError("boom")
+
+
+def _unserializable(job):
+    return {"at": date(2026, 1, 1)}
+
+
+@override_settings(JOB_RETRY_BACKOFF_SECONDS=10, JOB_LOCK_TIMEOUT_SECONDS=600)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        registry = mock.patch.dict(jobs.REGISTRY, {"ok": _succeed, "fail": _fail, "bad": _unserializable})
+        registry.start()
+        self.addCleanup(registry.stop)
+
+    def enqueue(self, kind="ok", **fields):
+        return jobs.enqueue(kind, {"value": kind}, **fields)
+
+    def test_claim_takes_the_highest_priority_due_job(self):
+        low = self.enqueue(priority=0)
+        high = self.enqueue(priority=5)
+        self.enqueue(priority=9, run_at=timezone.now() + timedelta(hours=1))
+
+        claimed = jobs.claim("w1")
+
+        self.assertEqual(claimed.pk, high.pk)
+        self.assertEqual((claimed.status, claimed.locked_by, claimed.attempts), (JobStatus.RUNNING, "w1", 1))
+        self.assertEqual(jobs.claim("w2").pk, low.pk)
+        self.assertIsNone(jobs.claim("w3"))
+
+    def test_claim_filters_by_kind_and_due_time(self):
+        self.enqueue("fail")
+        cutoff = timezone.now()
+        ok = self.enqueue("ok", run_at=cutoff + timedelta(seconds=1))
+
+        self.assertIsNone(jobs.claim("w1", kinds=["ok"]))
+        with mock.patch("products.jobs.timezone.now", return_value=cutoff + timedelta(seconds=5)):
+            self.assertIsNone(jobs.claim("w1", kinds=["ok"], due_before=cutoff))
+            self.assertEqual(jobs.claim("w1", kinds=["ok"]).pk, ok.pk)
+
+    def test_claim_skips_a_job_taken_after_it_was_selected(self):
+        job = self.enqueue()
+        first = QuerySet.first
+
+        def taken_by_other_worker(queryset):
+            pk = first(queryset)
+            # SQLite 上 select_for_update 不加锁：选中之后另一个 worker 抢先领走
+            Job.objects.filter(pk=job.pk).update(status=JobStatus.RUNNING, locked_by="other")
+            return pk
+
+        with mock.patch.object(QuerySet, "first", autospec=True, side_effect=taken_by_other_worker):
+            self.assertIsNone(jobs.claim("w1"))
+        job.refresh_from_db()
+        self.assertEqual((job.locked_by, job.attempts), ("other", 0))
+
+    def test_failed_job_is_requeued_with_backoff_then_failed(self):
+        job = self.enqueue("fail", max_attempts=2)
+
+        before = timezone.now()
+        with self.assertLogs("products.jobs", "WARNING"):
+            self.assertFalse(jobs.run_job(jobs.claim("w1")))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (JobStatus.QUEUED, ""))
+        self.assertIn("RuntimeError: boom", job.last_error)
+        self.assertGreaterEqual(job.run_at, before + timedelta(seconds=10))
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs("products.jobs", "WARNING"):
+            self.assertFalse(jobs.run_job(jobs.claim("w1")))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (JobStatus.FAILED, 2))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_backoff_doubles_up_to_the_cap(self):
+        self.assertEqual([jobs.backoff_seconds(n) for n in (1, 2, 3)], [10, 20, 40])
+        self.assertEqual(jobs.backoff_seconds(20), jobs.MAX_BACKOFF_SECONDS)
+
+    def test_result_is_saved_unless_it_cannot_be_serialized(self):
+        ok, bad = self.enqueue("ok"), self.enqueue("bad")
+
+        self.assertTrue(jobs.run_job(jobs.claim("w1", kinds=["ok"])))
+        with self.assertLogs("products.jobs", "ERROR"):
+            self.assertFalse(jobs.run_job(jobs.claim("w1", kinds=["bad"])))
+
+        ok.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual((ok.status, ok.result), (JobStatus.SUCCEEDED, {"echo": "ok"}))
+        self.assertEqual(bad.status, JobStatus.FAILED)
+        self.assertIn("JSON", bad.last_error)
+
+    def test_result_is_not_saved_after_the_job_was_reclaimed(self):
+        self.enqueue()
+        claimed = jobs.claim("w1")
+        # 超时回收后被另一个 worker 领走
+        Job.objects.filter(pk=claimed.pk).update(locked_by="w2")
+
+        jobs.run_job(claimed)
+
+        claimed.refresh_from_db()
+        self.assertEqual((claimed.status, claimed.locked_by), (JobStatus.RUNNING, "w2"))
+
+    def test_requeue_stale_recovers_abandoned_jobs(self):
+        retryable, exhausted, fresh = (self.enqueue(max_attempts=n) for n in (3, 1, 3))
+        for job in (retryable, exhausted, fresh):
+            jobs.claim("w1")
+        Job.objects.filter(pk__in=[retryable.pk, exhausted.pk]).update(
+            locked_at=timezone.now() - timedelta(seconds=601),
+        )
+
+        self.assertEqual(jobs.requeue_stale(), 2)
+
+        statuses = dict(Job.objects.values_list("pk", "status"))
+        self.assertEqual(statuses, {
+            retryable.pk: JobStatus.QUEUED,
+            exhausted.pk: JobStatus.FAILED,
+            fresh.pk: JobStatus.RUNNING,
+        })
+
+    def test_work_once_runs_due_jobs_without_retrying(self):
+        ok, failing = self.enqueue("ok"), self.enqueue("fail")
+        later = self.enqueue("ok", run_at=timezone.now() + timedelta(hours=1))
+
+        # 队列取空即返回，不等待 stop
+        with self.assertLogs("products.jobs", "WARNING"):
+            jobs.work("w1", threading.Event(), once=True)
+
+        statuses = dict(Job.objects.values_list("pk", "status"))
+        self.assertEqual(statuses[ok.pk], JobStatus.SUCCEEDED)
+        self.assertEqual(statuses[failing.pk], JobStatus.QUEUED)
+        self.assertEqual(Job.objects.get(pk=failing.pk).attempts, 1)
+        self.assertEqual(statuses[later.pk], JobStatus.QUEUED)
+
+
+class ChangeFeedTests(InventoryTestCase):
+    def setUp(self):
+        self.token = ApiToken.objects.create(name="ERP", user=self.user)
+
+    def feed(self, cursor=None, limit=None):
+        params = {key: value for key, value in (("cursor", cursor), ("limit", limit)) if value is not None}
+        response = self.client.get("/api/changes/", params, HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def drain(self, cursor=None, limit=None):
+        """翻到最后一页，返回 (流水 id 列表, 余额列表, 最终游标)。"""
+        ids, balances = [], []
+        while True:
+            page = self.feed(cursor, limit)
+            ids += [row["id"] for row in page["moves"]]
+            balances += page["balances"]
+            cursor = page["cursor"]
+            if not page["has_more"]:
+                return ids, balances, cursor
+
+    def test_cursor_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor(42, 7)), (42, 7))
+        for value in (None, "", "abc", "1-2-3", "12"):
+            self.assertEqual(decode_cursor(value), (0, 0))
+        self.assertEqual(decode_cursor("-5-3"), (0, 0))
+
+    def test_writes_are_stamped_below_the_next_watermark(self):
+        first = self.receive(1000)
+        watermark = low_water_mark("default")
+        second = self.receive(2000)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertLess(0, first.change_seq)
+        self.assertLess(first.change_seq, watermark)
+        self.assertGreaterEqual(second.change_seq, watermark)
+        balance = StockBalance.objects.get(item=self.item, warehouse=self.warehouse)
+        self.assertGreater(balance.change_seq, second.change_seq)
+
+    def test_paging_never_skips_or_repeats_moves(self):
+        self.receive(1000)
+        with transaction.atomic():
+            bulk_post_moves([
+                StockMove(move_type=MoveType.INBOUND, item=self.item, warehouse=self.warehouse, quantity=q)
+                for q in (2000, 3000, 4000)
+            ])
+        self.receive(5000)
+        expected = list(StockMove.objects.order_by("change_seq", "id").values_list("id", flat=True))
+
+        ids, _, cursor = self.drain(limit=2)
+
+        self.assertEqual(ids, expected)
+        self.receive(6000)
+        more, _, _ = self.drain(cursor, limit=2)
+        self.assertEqual(len(more), 1)
+        self.assertNotIn(more[0], ids)
+
+    def test_transaction_committed_later_with_a_lower_seq_is_delivered(self):
+        earlier, pending, committed = self.receive(1000), self.receive(2000), self.receive(3000)
+        # 模拟 PostgreSQL：pending 的事务号更小但仍未提交，低水位停在它的事务号上
+        StockMove.objects.filter(pk=pending.pk).update(change_seq=1000)
+        StockMove.objects.filter(pk=committed.pk).update(change_seq=1001)
+        StockMove.objects.filter(pk=earlier.pk).update(change_seq=999)
+
+        with mock.patch("products.views.async_api.low_water_mark", return_value=1000):
+            page = self.feed()
+        self.assertEqual([row["id"] for row in page["moves"]], [earlier.pk])
+        self.assertEqual(page["cursor"], "1000-0")
+
+        with mock.patch("products.views.async_api.low_water_mark", return_value=1002):
+            page = self.feed(page["cursor"])
+        self.assertEqual([row["id"] for row in page["moves"]], [pending.pk, committed.pk])
+
+    def test_deleting_a_move_emits_the_balance_change(self):
+        self.receive(1000)
+        mistake = self.receive(4000)
+        last_move_id = mistake.pk
+        _, balances, cursor = self.drain()
+        self.assertEqual([row["on_hand"] for row in balances], [5])
+
+        mistake.delete()
+        moves, balances, _ = self.drain(cursor)
+
+        self.assertEqual(moves, [])
+        self.assertEqual(balances, [{
+            "item_id": self.item.pk,
+            "warehouse_id": self.warehouse.pk,
+            "on_hand": 1,
+            "last_move_id": last_move_id,
+            "updated_at": balances[0]["updated_at"],
+        }])
+
+
+class BalanceStreamTests(InventoryTestCase):
+    async def collect(self, warehouse_ids, since):
+        return [chunk async for chunk in _event_stream(warehouse_ids, since, long_poll=True)]
+
+    def events(self, chunks):
+        return [json.loads(chunk.split("data: ", 1)[1]) for chunk in chunks if chunk.startswith("event: ")]
+
+    def test_last_event_id_replays_balances_changed_since(self):
+        self.receive(1000)
+        since = low_water_mark("default")
+        self.receive(2000)
+        product = Item.objects.create(name="成品箱", unit=self.unit, warehouse=self.other_warehouse)
+        self.receive(5000, item=product)
+
+        chunks = async_to_sync(self.collect)({self.warehouse.pk}, since)
+
+        # 只补发断线后变化、且在可见仓库内的余额，随后用 id 推进到当前低水位
+        self.assertEqual(chunks[0], "retry: 5000\n\n")
+        [event] = self.events(chunks)
+        self.assertEqual((event["item_id"], event["on_hand"]), (self.item.pk, 3))
+        self.assertEqual(chunks[-1], f"id: {low_water_mark('default')}\n\n")
+
+    def test_since_prefers_the_last_event_id_header(self):
+        factory = RequestFactory()
+
+        self.assertEqual(_since(factory.get("/events/balances/", {"since": "7"}, HTTP_LAST_EVENT_ID="9")), 9)
+        self.assertEqual(_since(factory.get("/events/balances/", {"since": "7"})), 7)
+        self.assertIsNone(_since(factory.get("/events/balances/", {"since": "x"})))
+
+    @override_settings(EVENT_STREAM_ENABLED=False)
+    def test_stream_is_disabled_without_asgi_or_a_shared_broker(self):
+        self.client.force_login(self.user)
+
+        self.assertEqual(self.client.get("/events/balances/").status_code, 204)
+
+
+@override_settings(DATABASE_ROUTERS=["products.routers.ReplicaRouter"])
+class ReplicaRoutingTests(InventoryTestCase):
+    """第二个数据库别名 replica：只读视图的查询发到副本，写入和写后粘滞读主库。"""
+
+    def setUp(self):
+        databases = mock.patch.dict(connections.settings, {REPLICA_ALIAS: connections.settings["default"]})
+        databases.start()
+        self.addCleanup(databases.stop)
+        default = connections["default"]
+        default.ensure_connection()
+        replica = connections.create_connection(REPLICA_ALIAS)
+        # 与 default 共用测试库连接：看得到本测试事务里的数据，查询日志仍按别名分开
+        replica.connection = default.connection
+        replica.autocommit = default.autocommit
+        connections[REPLICA_ALIAS] = replica
+        self.addCleanup(self._drop_replica, replica)
+        self.client.force_login(self.user)
+        self.receive(1000)
+
+    def _drop_replica(self, replica):
+        replica.connection = None
+        del connections[REPLICA_ALIAS]
+
+    def tables(self, queries):
+        return {table for query in queries for table in re.findall(r'FROM "(\w+)"', query["sql"])}
+
+    def get(self, path):
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections[REPLICA_ALIAS]) as replica:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return self.tables(primary.captured_queries), self.tables(replica.captured_queries)
+
+    def test_router_defaults_to_the_primary(self):
+        router = ReplicaRouter()
+        self.assertTrue(replica_enabled())
+        self.assertEqual(router.db_for_read(StockMove), "default")
+        self.assertEqual(router.db_for_write(StockMove), "default")
+        self.assertFalse(router.allow_migrate(REPLICA_ALIAS, "products"))
+
+    def test_read_only_views_query_the_replica(self):
+        for path in ("/moves/", "/api/balances/"):
+            primary, replica = self.get(path)
+            self.assertIn("products_stockmove" if path == "/moves/" else "products_stockbalance", replica)
+            # 主数据快照、会话和登录用户始终读主库
+            self.assertNotIn("products_masterdataversion", replica)
+            self.assertNotIn("django_session", replica)
+            self.assertFalse(primary & {"products_stockmove", "products_stockbalance"})
+
+    def test_write_pins_following_reads_to_the_primary(self):
+        response = self.client.post("/inventory/inbound/", {
+            "warehouse_id": self.warehouse.pk,
+            "item_id": self.item.pk,
+            "quantity": "2",
+            "form_token": issue_form_token(self.user, "inbound"),
+        })
+        self.assertEqual(response.cookies[STICKY_COOKIE].value, "1")
+        self.assertEqual(self.on_hand(), 3000)
+
+        primary, replica = self.get("/moves/")
+        self.assertEqual(replica, set())
+        self.assertIn("products_stockmove", primary)
+
+    def test_reads_do_not_set_the_sticky_cookie(self):
+        response = self.client.get("/moves/")
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+
+class FakeConnection:
+    """连接池测试用的假连接：只实现池会用到的属性。"""
+
+    def __init__(self, broken=False):
+        self.closed = False
+        self.broken = broken
+        self.rollbacks = 0
+        self.info = SimpleNamespace(transaction_status=0)
+
+    @contextmanager
+    def cursor(self):
+        if self.broken:
+            raise OperationalError("server closed the connection unexpectedly")
+        yield SimpleNamespace(execute=lambda sql: None)
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = 0
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.created = []
+
+    def factory(self):
+        conn = FakeConnection()
+        self.created.append(conn)
+        return conn
+
+    def test_first_checkout_fills_to_min_size(self):
+        pool = ConnectionPool(min_size=3, max_size=5)
+
+        conn = pool.getconn(self.factory)
+
+        self.assertIn(conn, self.created)
+        metrics = pool.metrics()
+        self.assertEqual((metrics["size"], metrics["idle"], metrics["in_use"]), (3, 2, 1))
+        self.assertEqual(metrics["connections_created"], 3)
+        pool.putconn(conn)
+        pool.getconn(self.factory)
+        self.assertEqual(len(self.created), 3)
+
+    def test_failed_fill_does_not_leak_slots(self):
+        pool = ConnectionPool(min_size=2, max_size=2)
+
+        def refuse():
+            raise OperationalError("connection refused")
+
+        with self.assertRaises(OperationalError):
+            pool.getconn(refuse)
+        self.assertEqual(pool.metrics()["size"], 0)
+        pool.getconn(self.factory)
+        self.assertEqual(pool.metrics()["size"], 2)
+
+    def test_checkout_times_out_when_exhausted(self):
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        pool.getconn(self.factory)
+
+        with self.assertRaises(PoolTimeout):
+            pool.getconn(self.factory)
+
+        metrics = pool.metrics()
+        self.assertEqual((metrics["timeouts"], metrics["waits"], metrics["size"]), (1, 1, 1))
+
+    def test_waiting_checkout_gets_the_returned_connection(self):
+        pool = ConnectionPool(max_size=1, timeout=5)
+        conn = pool.getconn(self.factory)
+        threading.Timer(0.05, pool.putconn, [conn]).start()
+
+        self.assertIs(pool.getconn(self.factory), conn)
+
+        metrics = pool.metrics()
+        self.assertEqual((metrics["waits"], metrics["checkouts"]), (1, 2))
+        self.assertGreater(metrics["wait_ms_total"], 0)
+
+    def test_broken_connections_are_discarded(self):
+        pool = ConnectionPool(max_size=5, check_after=0)
+        closed, unknown, in_transaction = (pool.getconn(self.factory) for _ in range(3))
+        closed.closed = True
+        unknown.info.transaction_status = 4
+        in_transaction.info.transaction_status = 2
+
+        for conn in (closed, unknown, in_transaction):
+            pool.putconn(conn)
+
+        self.assertTrue(unknown.closed)
+        self.assertEqual(in_transaction.rollbacks, 1)
+        self.assertEqual(pool.metrics()["size"], 1)
+        # 取出前的健康检查失败：丢弃后新建
+        in_transaction.broken = True
+        conn = pool.getconn(self.factory)
+        self.assertIsNot(conn, in_transaction)
+        self.assertTrue(in_transaction.closed)
+        metrics = pool.metrics()
+        self.assertEqual((metrics["health_check_failures"], metrics["connections_discarded"], metrics["size"]), (1, 3, 1))
+
+    def test_connections_past_max_lifetime_are_not_reused(self):
+        pool = ConnectionPool(max_size=2, max_lifetime=-1)
+        conn = pool.getconn(self.factory)
+
+        pool.putconn(conn)
+
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.metrics()["idle"], 0)
+
+    def test_stats_stay_consistent_under_concurrency(self):
+        pool = ConnectionPool(min_size=2, max_size=4, timeout=5)
+        rounds, workers = 50, 8
+
+        def worker():
+            for _ in range(rounds):
+                pool.putconn(pool.getconn(self.factory))
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        metrics = pool.metrics()
+        self.assertEqual(metrics["checkouts"], rounds * workers)
+        self.assertEqual(metrics["in_use"], 0)
+        self.assertLessEqual(metrics["size"], 4)
+        self.assertEqual(metrics["connections_created"] - metrics["connections_discarded"], metrics["size"])
+        self.assertEqual(metrics["connections_created"], len(self.created))
+
+
+class ReservationTests(InventoryTestCase):
+    def setUp(self):
+        self.receive(10000)
+
+    def reserved(self):
+        return StockBalance.objects.get(item=self.item, warehouse=self.warehouse).reserved
+
+    def reserve(self, quantity, **kwargs):
+        return reserve(self.item.pk, self.warehouse.pk, quantity, **kwargs)
+
+    def test_reserve_refuses_more_than_available(self):
+        self.reserve(6000)
+
+        with self.assertRaisesMessage(ReservationError, "可用库存不足，可用 4，需 5"):
+            self.reserve(5000)
+        self.assertEqual(Reservation.objects.count(), 1)
+        self.assertEqual(self.reserved(), 6000)
+        self.assertEqual(available_for(self.item.pk, self.warehouse.pk), 4000)
+
+    def test_fulfill_posts_the_outbound_without_recalculating(self):
+        reservation = self.reserve(4000, reference="SO-1")
+
+        with CaptureQueriesContext(connection) as queries:
+            reservation = fulfill(reservation.pk)
+
+        self.assertEqual(reservation.status, ReservationStatus.FULFILLED)
+        self.assertEqual(reservation.move.quantity, -4000)
+        self.assertEqual(reservation.move.reference, "SO-1")
+        self.assertEqual(self.on_hand(), 6000)
+        self.assertEqual(self.reserved(), 0)
+        # 余额按增量更新，不对流水表做 SUM 聚合
+        self.assertFalse([q for q in queries.captured_queries if "SUM(" in q["sql"].upper()])
+        with self.assertRaisesMessage(ReservationError, "已处理"):
+            fulfill(reservation.pk)
+
+    def test_fulfill_is_refused_after_stock_decreased(self):
+        reservation = self.reserve(5000)
+        StockMove.objects.create(
+            move_type=MoveType.ADJUST, item=self.item, warehouse=self.warehouse, quantity=-8000,
+        )
+
+        with self.assertRaisesMessage(ReservationError, "可用库存不足，可用 2，需 5"):
+            fulfill(reservation.pk)
+
+        # 整个核销回滚：预留仍有效，占用不变
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, ReservationStatus.ACTIVE)
+        self.assertEqual((self.on_hand(), self.reserved()), (2000, 5000))
+
+    def test_release_expired_in_batches(self):
+        expired = [self.reserve(1000) for _ in range(5)]
+        active = self.reserve(2000)
+        Reservation.objects.filter(pk__in=[r.pk for r in expired]).update(
+            expires_at=timezone.now() - timedelta(seconds=1),
+        )
+
+        self.assertEqual(release_expired(batch_size=2), 5)
+
+        statuses = dict(Reservation.objects.values_list("pk", "status"))
+        self.assertEqual({statuses[r.pk] for r in expired}, {ReservationStatus.EXPIRED})
+        self.assertEqual(statuses[active.pk], ReservationStatus.ACTIVE)
+        self.assertEqual(self.reserved(), 2000)
+        self.assertEqual(release_expired(), 0)
+
+    def test_reconcile_reserved_repairs_drift(self):
+        self.reserve(3000)
+        StockBalance.objects.filter(item=self.item).update(reserved=7000)
+
+        self.assertEqual(reconcile_reserved(), 1)
+        self.assertEqual(self.reserved(), 3000)
+        self.assertEqual(reconcile_reserved(), 0)
+
+    def test_outbound_form_checks_availability_net_of_reservations(self):
+        self.client.force_login(self.user)
+        self.reserve(8000)
+
+        def outbound(quantity):
+            return self.client.post("/inventory/outbound/", {
+                "warehouse_id": self.warehouse.pk,
+                "item_id": self.item.pk,
+                "quantity": quantity,
+                "form_token": issue_form_token(self.user, "outbound"),
+            }, follow=True)
+
+        response = outbound("5")
+        self.assertContains(response, "可用库存不足。可用 2，本次要出 5")
+        self.assertEqual(self.on_hand(), 10000)
+        outbound("2")
+        self.assertEqual(self.on_hand(), 8000)
@@ -0,0 +1,66 @@
+"""
+仓库间调拨。
+
+一笔调拨是两条 TRANSFER 流水：调出仓库 -数量、调入仓库 +数量，共用同一个 ``transfer_id``。
+两条腿在同一事务里经 ``bulk_post_moves()`` 一次写入，两边余额都按增量更新，
+不存在“已出未入”的中间状态。调出腿按先到期先出拆到批次，调入腿沿用相同批次。
+"""
+import uuid
+
+from products.ledger import bulk_post_moves, lock_balances
+from products.lots import allocate_fefo
+from products.models import MoveType, StockMove
+
+
+class TransferError(Exception):
+    """调拨参数不合法或调出仓库可用量不足。"""
+
+
+def lock_transfer_balances(transfers):
+    """锁定调出、调入两边的余额行（按键排序，避免互相等待），返回调出仓库的可用量。"""
+    keys = set()
+    for transfer in transfers:
+        keys.add((transfer["item_id"], transfer["from_warehouse_id"]))
+        keys.add((transfer["item_id"], transfer["to_warehouse_id"]))
+    locked = lock_balances(keys)
+    return {key: on_hand - reserved for key, (on_hand, reserved) in locked.items()}
+
+
+def post_transfers(transfers, batch_size=1000, document=None):
+    """
+    写入调拨流水。``transfers`` 为 {item_id, from_warehouse_id, to_warehouse_id, quantity, reference, note}
+    列表；需在事务内、锁定余额并校验可用量之后调用，流水挂到 ``document`` 单据下。
+    返回与 ``transfers`` 一一对应的 transfer_id 列表。
+    """
+    outgoing = []
+    for transfer in transfers:
+        if transfer["from_warehouse_id"] == transfer["to_warehouse_id"]:
+            raise TransferError("调出与调入仓库不能相同")
+        if transfer["quantity"] <= 0:
+            raise TransferError("调拨数量必须大于 0")
+        outgoing.append(StockMove(
+            move_type=MoveType.TRANSFER,
+            item_id=transfer["item_id"],
+            warehouse_id=transfer["from_warehouse_id"],
+            quantity=-transfer["quantity"],
+            reference=transfer.get("reference", ""),
+            note=transfer.get("note", ""),
+            transfer_id=uuid.uuid4(),
+        ))
+
+    moves = []
+    for transfer, legs in zip(transfers, allocate_fefo(outgoing)):
+        for leg in legs:
+            moves.append(leg)
+            moves.append(StockMove(
+                move_type=MoveType.TRANSFER,
+                item_id=leg.item_id,
+                warehouse_id=transfer["to_warehouse_id"],
+                lot_id=leg.lot_id,
+                quantity=-leg.quantity,
+                reference=leg.reference,
+                note=leg.note,
+                transfer_id=leg.transfer_id,
+            ))
+    bulk_post_moves(moves, batch_size=batch_size, document=document)
+    return [move.transfer_id for move in outgoing]
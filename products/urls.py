@@ -8,10 +8,27 @@ from products.views.warehouse import (
     unit_create,
     partner_create,
 )
-from products.views.stockmove import inbound_create, outbound_create, adjust_create
-from products.views.stockmove_list import stockmove_list, stockmove_export
+from products.views.stockmove import inbound_create, outbound_create, adjust_create, transfer_create
+from products.views.stockmove_list import stockmove_list, stockmove_export, stockmove_export_enqueue
 from products.views.item import item_create, item_update, item_toggle_active
-from products.views.importer import stock_import_start
+from products.views.importer import stock_import_start, stock_import_items, stock_import_file
+from products.views.lookup import item_typeahead
+from products.views.api import stockmove_batch, reservation_create, reservation_release, reservation_fulfill
+from products.views.async_api import dashboard_data, stockmove_data, balance_data, change_feed
+from products.views.stream import balance_stream
+from products.views.ops import db_pool_metrics, outbox_metrics
+from products.views.jobs import job_list, job_reconcile, job_retry, job_download
+from products.views.documents import document_detail, document_list, document_reverse
+from products.views.lots import lot_expiry_report
+from products.views.stocktake import (
+    stocktake_list,
+    stocktake_create,
+    stocktake_detail,
+    stocktake_scan,
+    stocktake_upload,
+    stocktake_approve,
+    stocktake_cancel,
+)
 
 
 app_name = "products"
@@ -19,6 +36,8 @@ app_name = "products"
 urlpatterns = [
     path("inventory/", inventory_dashboard, name="inventory_dashboard"),
     path("inventory/import/", stock_import_start, name="stock_import_start"),
+    path("inventory/import/items/", stock_import_items, name="stock_import_items"),
+    path("inventory/import/file/", stock_import_file, name="stock_import_file"),
 
     path("warehouses/", warehouse_list, name="warehouse_list"),
     path("warehouses/new/", warehouse_create, name="warehouse_create"),
@@ -29,8 +48,37 @@ urlpatterns = [
     path("inventory/inbound/", inbound_create, name="inventory_inbound"),
     path("inventory/outbound/", outbound_create, name="inventory_outbound"),
     path("inventory/adjust/", adjust_create, name="inventory_adjust"),
+    path("inventory/transfer/", transfer_create, name="inventory_transfer"),
+    path("inventory/expiring/", lot_expiry_report, name="lot_expiry_report"),
+    path("stocktakes/", stocktake_list, name="stocktake_list"),
+    path("stocktakes/new/", stocktake_create, name="stocktake_create"),
+    path("stocktakes/<int:pk>/", stocktake_detail, name="stocktake_detail"),
+    path("stocktakes/<int:pk>/scan/", stocktake_scan, name="stocktake_scan"),
+    path("stocktakes/<int:pk>/upload/", stocktake_upload, name="stocktake_upload"),
+    path("stocktakes/<int:pk>/approve/", stocktake_approve, name="stocktake_approve"),
+    path("stocktakes/<int:pk>/cancel/", stocktake_cancel, name="stocktake_cancel"),
+    path("documents/", document_list, name="document_list"),
+    path("documents/<int:pk>/", document_detail, name="document_detail"),
+    path("documents/<int:pk>/reverse/", document_reverse, name="document_reverse"),
     path("moves/", stockmove_list, name="stockmove_list"),
     path("moves/export/", stockmove_export, name="stockmove_export"),
+    path("moves/export/background/", stockmove_export_enqueue, name="stockmove_export_enqueue"),
+    path("api/moves/batch/", stockmove_batch, name="api_stockmove_batch"),
+    path("api/reservations/", reservation_create, name="api_reservation_create"),
+    path("api/reservations/<int:pk>/release/", reservation_release, name="api_reservation_release"),
+    path("api/reservations/<int:pk>/fulfill/", reservation_fulfill, name="api_reservation_fulfill"),
+    path("api/dashboard/", dashboard_data, name="api_dashboard_data"),
+    path("api/moves/", stockmove_data, name="api_stockmove_data"),
+    path("api/balances/", balance_data, name="api_balance_data"),
+    path("api/changes/", change_feed, name="api_change_feed"),
+    path("events/balances/", balance_stream, name="balance_stream"),
+    path("ops/db-pool/", db_pool_metrics, name="db_pool_metrics"),
+    path("ops/outbox/", outbox_metrics, name="outbox_metrics"),
+    path("ops/jobs/", job_list, name="job_list"),
+    path("ops/jobs/reconcile/", job_reconcile, name="job_reconcile"),
+    path("ops/jobs/<int:pk>/retry/", job_retry, name="job_retry"),
+    path("ops/jobs/<int:pk>/download/", job_download, name="job_download"),
+    path("items/lookup/", item_typeahead, name="item_typeahead"),
     path("items/new/", item_create, name="item_create"),
     path("items/<int:pk>/edit/", item_update, name="item_update"),
     path("items/<int:pk>/toggle/", item_toggle_active, name="item_toggle_active"),
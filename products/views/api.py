@@ -0,0 +1,390 @@
+"""
+供扫码枪、ERP 等集成调用的 JSON 接口。
+
+认证：``Authorization: Token <key>``（见 ApiToken），或已登录的浏览器会话（此时仍校验 CSRF）。
+数量可带不超过单位小数位数的小数；写入时可用 ``unit`` 指定物品已配置的辅助单位（如“箱”），
+按换算系数折成基本单位后入账。响应中的数量、余额一律是基本单位。
+"""
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.http import JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from products.documents import document_type_for, open_document
+from products.idempotency import idempotent_json
+from products.ledger import bulk_post_moves, lock_balances
+from products.lots import allocate_fefo, clean_lot, resolve_lots
+from products.masterdata import master_data
+from products.models import ApiToken, MoveType, Reservation, StockMove
+from products.quantities import quantity_json
+from products.reservations import ReservationError, available_for, fulfill, release, reserve
+from products.views.inventory import _role_warehouse_ids
+
+BATCH_MODES = ("atomic", "partial")
+BATCH_MOVE_TYPES = (MoveType.INBOUND, MoveType.OUTBOUND, MoveType.ADJUST)
+
+# last_used_at 最多每分钟写一次，避免每个请求都多一次 UPDATE
+TOKEN_TOUCH_INTERVAL_SECONDS = 60
+
+
+def _csrf_failure(request):
+    check = CsrfViewMiddleware(lambda req: None)
+    check.process_request(request)
+    return check.process_view(request, None, (), {})
+
+
+def _authenticate(request):
+    """解析令牌或会话；成功时设置 request.user 并返回 None，否则返回错误响应。"""
+    header = request.META.get("HTTP_AUTHORIZATION", "")
+    if header.startswith("Token "):
+        token = (
+            ApiToken.objects
+            .select_related("user")
+            .filter(key=header[6:].strip(), is_active=True)
+            .first()
+        )
+        if token is None or not token.user.is_active:
+            return JsonResponse({"error": "令牌无效或已停用"}, status=401)
+        now = timezone.now()
+        if (
+            token.last_used_at is None
+            or (now - token.last_used_at).total_seconds() >= TOKEN_TOUCH_INTERVAL_SECONDS
+        ):
+            ApiToken.objects.filter(pk=token.pk).update(last_used_at=now)
+        request.user = token.user
+        return None
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "未登录"}, status=401)
+    if request.method not in ("GET", "HEAD", "OPTIONS") and _csrf_failure(request) is not None:
+        return JsonResponse({"error": "CSRF 校验失败"}, status=403)
+    return None
+
+
+def api_login_required(view):
+    """令牌或会话认证；失败时返回 401 JSON 而不是跳转登录页。"""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        failure = _authenticate(request)
+        if failure is not None:
+            return failure
+        return view(request, *args, **kwargs)
+
+    return csrf_exempt(wrapper)
+
+
+def async_api_login_required(view):
+    """api_login_required 的 async 版本：认证查询放到线程里执行。"""
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        failure = await sync_to_async(_authenticate)(request)
+        if failure is not None:
+            return failure
+        return await view(request, *args, **kwargs)
+
+    # Django 4.2 的 csrf_exempt 会把协程函数包成同步函数，这里直接打标记
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+def _json_body(request):
+    try:
+        return json.loads(request.body or b"{}")
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+
+
+def _to_int(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            return None
+    return None
+
+
+class MoveBatch:
+    """一次批量请求：按主数据快照逐行校验后统一写入。"""
+
+    def __init__(self, user, rows):
+        self.rows = rows
+        self.user = user
+        self.document = None
+        self.data = master_data(strict=True)
+        self.warehouse_ids = _role_warehouse_ids(user)
+
+    def _validate(self, row):
+        """返回 (规范化后的行, 错误信息)。"""
+        if not isinstance(row, dict):
+            return None, "每条流水必须是对象"
+
+        move_type = str(row.get("type") or "").upper()
+        if move_type not in BATCH_MOVE_TYPES:
+            return None, "type 必须是 INBOUND / OUTBOUND / ADJUST"
+
+        item_id = _to_int(row.get("item_id"))
+        item = self.data.items.get(item_id)
+        if item is None or item.warehouse_id not in self.warehouse_ids:
+            return None, "物品不存在或无权限"
+        warehouse_id = item.warehouse_id
+        if not item.is_active and move_type != MoveType.ADJUST:
+            return None, "物品已停用"
+
+        if row.get("warehouse_id") not in (None, ""):
+            if _to_int(row.get("warehouse_id")) != warehouse_id:
+                return None, "仓库与物品不匹配"
+
+        try:
+            quantity = self.data.parse_item_quantity(item_id, row.get("quantity"), str(row.get("unit") or ""))
+        except ValueError as exc:
+            return None, str(exc)
+        if move_type == MoveType.ADJUST:
+            if quantity == 0:
+                return None, "调整数量不能为 0"
+        elif quantity <= 0:
+            return None, "数量必须大于 0"
+
+        partner_id = None
+        if row.get("partner_id") not in (None, ""):
+            partner_id = _to_int(row.get("partner_id"))
+            partner = self.data.partners.get(partner_id)
+            if partner is None or not partner.is_active:
+                return None, "合作方不存在或已停用"
+
+        try:
+            lot_no, expiry_date = clean_lot(row.get("lot_no"), row.get("expiry_date"))
+        except ValueError as exc:
+            return None, str(exc)
+        if lot_no and (move_type == MoveType.OUTBOUND or quantity < 0):
+            return None, "出库按先到期先出自动分配批次，不能指定 lot_no"
+
+        return {
+            "move_type": move_type,
+            "item_id": item_id,
+            "warehouse_id": warehouse_id,
+            "quantity": -quantity if move_type == MoveType.OUTBOUND else quantity,
+            "partner_id": partner_id,
+            "reference": str(row.get("reference") or "").strip()[:100],
+            "note": str(row.get("note") or "").strip(),
+            "lot": (item_id, lot_no, expiry_date) if lot_no else None,
+        }, None
+
+    def post(self, atomic):
+        """校验并写入；返回 (逐行结果, 新余额, 是否已写入)。"""
+        results = []
+        valid = []
+        for index, row in enumerate(self.rows):
+            normalized, error = self._validate(row)
+            result = {"index": index}
+            if isinstance(row, dict) and row.get("client_id") is not None:
+                result["client_id"] = row["client_id"]
+            if error:
+                result.update(ok=False, error=error)
+            else:
+                valid.append((result, normalized))
+            results.append(result)
+
+        with transaction.atomic():
+            keys = {(n["item_id"], n["warehouse_id"]) for _, n in valid}
+            locked = lock_balances(keys)
+            running = {key: locked.get(key, (0, 0))[0] for key in keys}
+            reserved = {key: locked.get(key, (0, 0))[1] for key in keys}
+
+            accepted = []
+            for result, normalized in valid:
+                key = (normalized["item_id"], normalized["warehouse_id"])
+                quantity = normalized["quantity"]
+                available = running[key] - reserved[key]
+                if normalized["move_type"] == MoveType.OUTBOUND and available + quantity < 0:
+                    fmt = self.data.format_item_quantity
+                    result.update(
+                        ok=False,
+                        error=f"可用库存不足，可用 {fmt(key[0], available)}，需 {fmt(key[0], -quantity)}",
+                    )
+                    continue
+                running[key] += quantity
+                accepted.append((result, normalized))
+
+            failed = any(not result.get("ok", True) for result in results)
+            if not accepted or (atomic and failed):
+                for result, _ in accepted:
+                    result.update(ok=False, error="同批次其他流水有误，未写入")
+                return results, [], False
+
+            lot_ids = resolve_lots({n["lot"][:2]: n["lot"][2] for _, n in accepted if n["lot"]})
+            moves = []
+            for _, normalized in accepted:
+                fields = dict(normalized)
+                lot = fields.pop("lot")
+                moves.append(StockMove(lot_id=lot_ids[lot[:2]] if lot else None, **fields))
+            self.document = document = open_document(
+                document_type_for(move.move_type for move in moves),
+                user=self.user,
+                note="接口批量",
+            )
+            # 出库按先到期先出拆到各批次，一行请求可能对应多条流水
+            groups = allocate_fefo(moves)
+            bulk_post_moves([move for group in groups for move in group], document=document)
+            for (result, _), group in zip(accepted, groups):
+                result.update(ok=True, id=group[0].pk, ids=[move.pk for move in group])
+
+        touched = sorted({(n["item_id"], n["warehouse_id"]) for _, n in accepted})
+        balances = [
+            {
+                "item_id": item_id,
+                "warehouse_id": warehouse_id,
+                "on_hand": quantity_json(running[(item_id, warehouse_id)]),
+                "reserved": quantity_json(reserved[(item_id, warehouse_id)]),
+            }
+            for item_id, warehouse_id in touched
+        ]
+        return results, balances, True
+
+
+@require_POST
+@api_login_required
+def stockmove_batch(request):
+    """
+    批量写入流水。
+
+    请求体：``{"mode": "atomic" | "partial", "moves": [{type, item_id, quantity, unit?, ...}]}``。
+    atomic（默认）任一行出错则整批不写；partial 只写入通过校验的行。
+    带 ``Idempotency-Key`` 请求头时，重复请求直接返回首次的响应。
+    """
+    payload = _json_body(request)
+    if not isinstance(payload, dict):
+        return JsonResponse({"error": "请求体必须是 JSON 对象"}, status=400)
+
+    mode = payload.get("mode") or "atomic"
+    if mode not in BATCH_MODES:
+        return JsonResponse({"error": "mode 必须是 atomic 或 partial"}, status=400)
+
+    rows = payload.get("moves")
+    if not isinstance(rows, list) or not rows:
+        return JsonResponse({"error": "moves 必须是非空数组"}, status=400)
+    if len(rows) > settings.API_BATCH_MAX_MOVES:
+        return JsonResponse(
+            {"error": f"单次最多 {settings.API_BATCH_MAX_MOVES} 条流水"},
+            status=413,
+        )
+
+    def handle():
+        batch = MoveBatch(request.user, rows)
+        results, balances, written = batch.post(atomic=mode == "atomic")
+        created = sum(1 for result in results if result.get("ok"))
+        status = 200 if written and created == len(results) else (207 if written else 400)
+        return status, {
+            "mode": mode,
+            "created": created,
+            "document_id": batch.document.pk if batch.document else None,
+            "results": results,
+            "balances": balances,
+        }
+
+    return idempotent_json(request, "api:moves_batch", handle)
+
+
+def _reservation_body(reservation):
+    return {
+        "id": reservation.pk,
+        "item_id": reservation.item_id,
+        "warehouse_id": reservation.warehouse_id,
+        "quantity": quantity_json(reservation.quantity),
+        "status": reservation.status,
+        "reference": reservation.reference,
+        "expires_at": reservation.expires_at.isoformat(),
+        "move_id": reservation.move_id,
+        "available": quantity_json(available_for(reservation.item_id, reservation.warehouse_id)),
+    }
+
+
+@require_POST
+@api_login_required
+def reservation_create(request):
+    """
+    预留库存：``{"item_id", "quantity", "unit"?, "ttl_seconds"?, "reference"?, "note"?}``。
+
+    可用量不足时返回 409；到期未核销的预留由 sweep_reservations 自动释放。
+    带 ``Idempotency-Key`` 请求头时，重复请求直接返回首次的响应。
+    """
+    payload = _json_body(request)
+    if not isinstance(payload, dict):
+        return JsonResponse({"error": "请求体必须是 JSON 对象"}, status=400)
+
+    item = master_data(strict=True).items.get(_to_int(payload.get("item_id")))
+    if item is None or not item.is_active or item.warehouse_id not in _role_warehouse_ids(request.user):
+        return JsonResponse({"error": "物品不存在、已停用或无权限"}, status=400)
+    if payload.get("warehouse_id") not in (None, "") and _to_int(payload.get("warehouse_id")) != item.warehouse_id:
+        return JsonResponse({"error": "仓库与物品不匹配"}, status=400)
+    try:
+        quantity = master_data().parse_item_quantity(item.id, payload.get("quantity"), str(payload.get("unit") or ""))
+    except ValueError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+    if quantity <= 0:
+        return JsonResponse({"error": "数量必须大于 0"}, status=400)
+    ttl_seconds = None
+    if payload.get("ttl_seconds") not in (None, ""):
+        ttl_seconds = _to_int(payload.get("ttl_seconds"))
+        if ttl_seconds is None or not 0 < ttl_seconds <= settings.RESERVATION_MAX_TTL_SECONDS:
+            return JsonResponse(
+                {"error": f"ttl_seconds 必须在 1 到 {settings.RESERVATION_MAX_TTL_SECONDS} 之间"},
+                status=400,
+            )
+
+    def handle():
+        try:
+            reservation = reserve(
+                item.id,
+                item.warehouse_id,
+                quantity,
+                ttl_seconds=ttl_seconds,
+                reference=str(payload.get("reference") or "").strip()[:100],
+                note=str(payload.get("note") or "").strip(),
+                user=request.user,
+            )
+        except ReservationError as exc:
+            return 409, {"error": str(exc)}
+        return 201, _reservation_body(reservation)
+
+    return idempotent_json(request, "api:reservations", handle)
+
+
+def _reservation_action(request, pk, action):
+    reservation = Reservation.objects.filter(pk=pk).only("warehouse_id").first()
+    if reservation is None or reservation.warehouse_id not in _role_warehouse_ids(request.user):
+        return JsonResponse({"error": "预留不存在或无权限"}, status=404)
+    try:
+        reservation = action(pk)
+    except ReservationError as exc:
+        return JsonResponse({"error": str(exc)}, status=409)
+    if reservation is None:
+        return JsonResponse({"error": "预留已过期或已处理"}, status=409)
+    return JsonResponse(_reservation_body(reservation))
+
+
+@require_POST
+@api_login_required
+def reservation_release(request, pk):
+    """提前释放预留，退回可用量。"""
+    return _reservation_action(request, pk, release)
+
+
+@require_POST
+@api_login_required
+def reservation_fulfill(request, pk):
+    """按预留数量出库：释放预留与写出库流水在同一事务内完成。"""
+    return _reservation_action(request, pk, fulfill)
@@ -0,0 +1,286 @@
+"""
+只读 JSON 接口的 async 版本：在 uvicorn（ASGI）下等待数据库时不占用 worker，
+慢客户端和长轮询不会一个连接卡住一个进程。WSGI 下同样可用。
+"""
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import router
+from django.db.models import Q
+from django.http import JsonResponse
+
+from products.change_feed import decode_cursor, encode_cursor, low_water_mark
+from products.models import Item, MoveType, StockBalance, StockMove
+from products.quantities import QUANTITY_SCALE, quantity_json
+from products.routers import use_replica
+from products.search import ITEM_SEARCH_FIELDS, MOVE_SEARCH_FIELDS, search_q
+from products.views.api import async_api_login_required
+from products.views.inventory import _role_warehouse_ids
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+MAX_LOOKUP_IDS = 500
+
+
+def _int_param(request, name, default=None):
+    try:
+        return int(request.GET.get(name) or default)
+    except (TypeError, ValueError):
+        return default
+
+
+def _page_size(request):
+    return max(1, min(_int_param(request, "limit", DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+
+
+async def _allowed_warehouse_ids(request):
+    allowed = await sync_to_async(_role_warehouse_ids)(request.user)
+    warehouse_id = _int_param(request, "warehouse_id")
+    if request.GET.get("warehouse_id"):
+        allowed &= {warehouse_id}
+    return allowed
+
+
+def _method_not_allowed(request):
+    if request.method not in ("GET", "HEAD"):
+        return JsonResponse({"error": "仅支持 GET"}, status=405)
+    return None
+
+
+async def _balances_for(item_ids):
+    return {
+        (item_id, warehouse_id): (on_hand, reserved, updated_at)
+        async for item_id, warehouse_id, on_hand, reserved, updated_at in StockBalance.objects.filter(
+            item_id__in=item_ids,
+        ).values_list("item_id", "warehouse_id", "on_hand", "reserved", "updated_at")
+    }
+
+
+@async_api_login_required
+@use_replica
+async def dashboard_data(request):
+    """看板数据：按 id 游标分页的物品及其当前库存。参数 warehouse_id、q、show_inactive、after、limit。"""
+    failure = _method_not_allowed(request)
+    if failure:
+        return failure
+
+    allowed = await _allowed_warehouse_ids(request)
+    limit = _page_size(request)
+    items = Item.objects.filter(warehouse_id__in=allowed)
+    if request.GET.get("show_inactive") != "1":
+        items = items.filter(is_active=True)
+    q = (request.GET.get("q") or "").strip()
+    if q:
+        # search_q 在 SQLite 上会探测 FTS 表（同步查询），放到线程里构造
+        items = items.filter(await sync_to_async(search_q)(Item, q, ITEM_SEARCH_FIELDS))
+    after = _int_param(request, "after")
+    if after:
+        items = items.filter(id__gt=after)
+
+    rows = [
+        row async for row in items.order_by("id").values_list(
+            "id", "name", "warehouse_id", "unit__name", "is_active",
+        )[:limit + 1]
+    ]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    balances = await _balances_for([row[0] for row in rows])
+    threshold = max(0, getattr(settings, "LOW_STOCK_ALERT_THRESHOLD", 0)) * QUANTITY_SCALE
+
+    results = []
+    for item_id, name, warehouse_id, unit_name, is_active in rows:
+        on_hand, reserved, updated_at = balances.get((item_id, warehouse_id), (0, 0, None))
+        results.append({
+            "id": item_id,
+            "name": name,
+            "warehouse_id": warehouse_id,
+            "unit": unit_name or "",
+            "is_active": is_active,
+            "on_hand": quantity_json(on_hand),
+            "reserved": quantity_json(reserved),
+            "available": quantity_json(on_hand - reserved),
+            "updated_at": updated_at.isoformat() if updated_at else None,
+            "is_low_stock": on_hand < threshold,
+        })
+    return JsonResponse({
+        "results": results,
+        "next": rows[-1][0] if has_more else None,
+    })
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+@async_api_login_required
+@use_replica
+async def stockmove_data(request):
+    """
+    流水列表：按 id 倒序的键集分页（before=上一页最后一条 id）。
+    参数 warehouse_id、item_id、partner_id、move_type、q、start_date、end_date、before、limit。
+    """
+    failure = _method_not_allowed(request)
+    if failure:
+        return failure
+
+    allowed = await _allowed_warehouse_ids(request)
+    limit = _page_size(request)
+    moves = StockMove.objects.filter(warehouse_id__in=allowed)
+
+    for name in ("item_id", "partner_id"):
+        value = _int_param(request, name)
+        if value:
+            moves = moves.filter(**{name: value})
+    move_type = (request.GET.get("move_type") or "").strip().upper()
+    if move_type in MoveType.values:
+        moves = moves.filter(move_type=move_type)
+    start_date = _parse_date(request.GET.get("start_date"))
+    if start_date:
+        moves = moves.filter(created_at__date__gte=start_date)
+    end_date = _parse_date(request.GET.get("end_date"))
+    if end_date:
+        moves = moves.filter(created_at__date__lte=end_date)
+    q = (request.GET.get("q") or "").strip()
+    if q:
+        moves = moves.filter(await sync_to_async(search_q)(StockMove, q, MOVE_SEARCH_FIELDS))
+    before = _int_param(request, "before")
+    if before:
+        moves = moves.filter(id__lt=before)
+
+    rows = [
+        row async for row in moves.order_by("-id").values(
+            "id", "created_at", "move_type", "quantity", "reference", "note",
+            "item_id", "item__name", "warehouse_id", "warehouse__name",
+            "partner_id", "partner__name",
+        )[:limit + 1]
+    ]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    for row in rows:
+        row["created_at"] = row["created_at"].isoformat()
+        row["quantity"] = quantity_json(row["quantity"])
+    return JsonResponse({
+        "results": rows,
+        "next": rows[-1]["id"] if has_more else None,
+    })
+
+
+@async_api_login_required
+@use_replica
+async def balance_data(request):
+    """余额查询：item_id 可重复传多个；不传时返回 warehouse_id 范围内全部余额（分页）。"""
+    failure = _method_not_allowed(request)
+    if failure:
+        return failure
+
+    allowed = await _allowed_warehouse_ids(request)
+    balances = StockBalance.objects.filter(warehouse_id__in=allowed)
+
+    raw_ids = request.GET.getlist("item_id")
+    if raw_ids:
+        try:
+            item_ids = {int(value) for value in raw_ids}
+        except ValueError:
+            return JsonResponse({"error": "item_id 必须是整数"}, status=400)
+        if len(item_ids) > MAX_LOOKUP_IDS:
+            return JsonResponse({"error": f"一次最多查询 {MAX_LOOKUP_IDS} 个物品"}, status=400)
+        balances = balances.filter(item_id__in=item_ids)
+        limit = MAX_LOOKUP_IDS
+    else:
+        limit = _page_size(request)
+        after = _int_param(request, "after")
+        if after:
+            balances = balances.filter(id__gt=after)
+
+    rows = [
+        row async for row in balances.order_by("id").values_list(
+            "id", "item_id", "warehouse_id", "on_hand", "reserved", "updated_at",
+        )[:limit + 1]
+    ]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return JsonResponse({
+        "results": [
+            {
+                "item_id": item_id,
+                "warehouse_id": warehouse_id,
+                "on_hand": quantity_json(on_hand),
+                "reserved": quantity_json(reserved),
+                "available": quantity_json(on_hand - reserved),
+                "updated_at": updated_at.isoformat(),
+            }
+            for _, item_id, warehouse_id, on_hand, reserved, updated_at in rows
+        ],
+        "next": rows[-1][0] if has_more and not raw_ids else None,
+    })
+
+
+@async_api_login_required
+@use_replica
+async def change_feed(request):
+    """
+    增量同步：按提交顺序返回游标之后的流水，以及同一区间内变化过的余额（含删除流水引起的）。
+
+    客户端保存返回的 cursor，下次带上即可只拉增量；不带 cursor 时从头开始。
+    只返回低水位之前的写入，仍在进行中的事务提交后才会出现，游标不会越过它们，见 products.change_feed。
+    """
+    failure = _method_not_allowed(request)
+    if failure:
+        return failure
+
+    allowed = await _allowed_warehouse_ids(request)
+    seq, after_id = decode_cursor(request.GET.get("cursor"))
+    limit = _page_size(request)
+    watermark = await sync_to_async(low_water_mark)(router.db_for_read(StockMove))
+
+    moves = [
+        row async for row in StockMove.objects.filter(
+            Q(change_seq__gt=seq) | Q(change_seq=seq, id__gt=after_id),
+            warehouse_id__in=allowed,
+            change_seq__lt=watermark,
+        ).order_by("change_seq", "id").values(
+            "id", "change_seq", "created_at", "move_type", "quantity", "reference", "note",
+            "item_id", "warehouse_id", "partner_id",
+        )[:limit + 1]
+    ]
+    has_more = len(moves) > limit
+    moves = moves[:limit]
+    if has_more:
+        # 本页截在某个事务中间：下一页从最后一条流水之后继续，余额只返回到该事务为止
+        next_cursor = encode_cursor(moves[-1]["change_seq"], moves[-1]["id"])
+        balance_until = moves[-1]["change_seq"] + 1
+    else:
+        next_cursor = encode_cursor(watermark, 0)
+        balance_until = watermark
+    for row in moves:
+        del row["change_seq"]
+        row["created_at"] = row["created_at"].isoformat()
+        row["quantity"] = quantity_json(row["quantity"])
+
+    balances = [
+        {
+            "item_id": item_id,
+            "warehouse_id": warehouse_id,
+            "on_hand": quantity_json(on_hand),
+            "last_move_id": last_move_id,
+            "updated_at": updated_at.isoformat(),
+        }
+        async for item_id, warehouse_id, on_hand, last_move_id, updated_at in StockBalance.objects.filter(
+            warehouse_id__in=allowed,
+            change_seq__gte=seq,
+            change_seq__lt=balance_until,
+        ).order_by("change_seq", "id").values_list(
+            "item_id", "warehouse_id", "on_hand", "last_move_id", "updated_at",
+        )
+    ]
+
+    return JsonResponse({
+        "cursor": next_cursor,
+        "has_more": has_more,
+        "moves": moves,
+        "balances": balances,
+    })
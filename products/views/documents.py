@@ -0,0 +1,128 @@
+from datetime import datetime, time, timedelta
+
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.db.models import Exists, OuterRef
+from django.http import Http404
+from django.shortcuts import get_object_or_404, redirect, render
+from django.utils import timezone
+from django.views.decorators.http import require_POST
+
+from products.documents import DocumentError, document_warehouse_ids, reverse_document
+from products.models import DocumentType, StockDocument, StockMove
+from products.routers import use_replica
+from products.views.inventory import _role_filter_kwargs, _role_warehouse_ids
+
+DEFAULT_DAYS = 30
+
+
+def _parse_date(value, default):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date() if value else default
+    except ValueError:
+        return default
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _get_document(request, pk):
+    """单据只对能看到其中至少一个仓库的用户可见。"""
+    document = get_object_or_404(StockDocument.objects.select_related("created_by", "reverses"), pk=pk)
+    warehouse_ids = document_warehouse_ids(document)
+    if _role_filter_kwargs(request.user).get("warehouse_filter") and not warehouse_ids & _role_warehouse_ids(request.user):
+        raise Http404("单据不存在")
+    return document, warehouse_ids
+
+
+@login_required
+@use_replica
+def document_list(request):
+    """单据列表：按类型、日期、创建人筛选，走 (doc_type, created_at) / (created_by, created_at) 索引。"""
+    doc_type = (request.GET.get("doc_type") or "").strip().upper()
+    if doc_type not in DocumentType.values:
+        doc_type = ""
+    mine = request.GET.get("mine") == "1"
+    today = timezone.localdate()
+    start_date = _parse_date((request.GET.get("start_date") or "").strip(), today - timedelta(days=DEFAULT_DAYS))
+    end_date = _parse_date((request.GET.get("end_date") or "").strip(), today)
+    if end_date < start_date:
+        end_date = start_date
+
+    documents = (
+        StockDocument.objects
+        .select_related("created_by")
+        .filter(created_at__gte=_day_start(start_date), created_at__lt=_day_start(end_date + timedelta(days=1)))
+        .order_by("-created_at", "-id")
+    )
+    if doc_type:
+        documents = documents.filter(doc_type=doc_type)
+    if mine:
+        documents = documents.filter(created_by=request.user)
+    if _role_filter_kwargs(request.user).get("warehouse_filter"):
+        documents = documents.filter(Exists(
+            StockMove.objects.filter(document_id=OuterRef("pk"), warehouse_id__in=_role_warehouse_ids(request.user))
+        ))
+
+    query_params = request.GET.copy()
+    query_params.pop("page", None)
+    paginator = Paginator(documents, 50)
+    page_obj = paginator.get_page(request.GET.get("page"))
+    return render(request, "products/document_list.html", {
+        "page_obj": page_obj,
+        "doc_type": doc_type,
+        "doc_type_choices": DocumentType.choices,
+        "mine": mine,
+        "start_date": start_date,
+        "end_date": end_date,
+        "query_string": query_params.urlencode(),
+    })
+
+
+@login_required
+@use_replica
+def document_detail(request, pk):
+    document, warehouse_ids = _get_document(request, pk)
+    moves = (
+        StockMove.objects
+        .filter(document_id=document.pk)
+        .select_related("warehouse", "item", "partner", "lot")
+        .order_by("pk")
+    )
+    paginator = Paginator(moves, 100)
+    page_obj = paginator.get_page(request.GET.get("page"))
+    reversal = StockDocument.objects.filter(reverses_id=document.pk).first()
+    return render(request, "products/document_detail.html", {
+        "document": document,
+        "reversal": reversal,
+        "page_obj": page_obj,
+        "can_reverse": (
+            document.doc_type != DocumentType.REVERSAL
+            and reversal is None
+            and document.line_count > 0
+            and warehouse_ids <= _role_warehouse_ids(request.user)
+        ),
+    })
+
+
+@login_required
+@require_POST
+def document_reverse(request, pk):
+    """整单冲销；需要对单据涉及的全部仓库都有权限。"""
+    document, warehouse_ids = _get_document(request, pk)
+    if not warehouse_ids <= _role_warehouse_ids(request.user):
+        messages.error(request, "冲销失败：单据涉及无权限的仓库")
+        return redirect("products:document_detail", pk=document.pk)
+    try:
+        reversal = reverse_document(
+            document.pk,
+            user=request.user,
+            note=(request.POST.get("note") or "").strip(),
+        )
+    except DocumentError as exc:
+        messages.error(request, f"冲销失败：{exc}")
+        return redirect("products:document_detail", pk=document.pk)
+    messages.success(request, f"{document.number} 已冲销，写入 {reversal.line_count} 条流水")
+    return redirect("products:document_detail", pk=reversal.pk)
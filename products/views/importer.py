@@ -1,15 +1,27 @@
+import hashlib
 import json
+import logging
 from collections import defaultdict
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
+from django.db.models import Count, Max
+from django.http import JsonResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse
-from django.utils import timezone
-
-from products.models import Item, Partner, MoveType, StockBalance, StockMove
-from products.views.inventory import _role_filter_kwargs
+from django.views.decorators.http import condition
+
+from products.documents import DOCUMENT_TYPES, open_document
+from products.importing import ENCODING_CHOICES, FileImporter, iter_rows
+from products.ledger import bulk_post_moves
+from products.lots import split_fefo
+from products.masterdata import master_data
+from products.models import Item, MoveType, StockBalance, StockMove
+from products.quantities import format_quantity, quantity_step
+from products.routers import use_replica
+from products.search import ITEM_SEARCH_FIELDS, search_q
+from products.views.inventory import _role_filter_kwargs, _role_warehouse_ids
 
 ACTION_CHOICES = [
     (MoveType.INBOUND, "批量入库"),
@@ -17,29 +29,35 @@ ACTION_CHOICES = [
 ]
 ACTION_TYPES = {choice for choice, _ in ACTION_CHOICES}
 ACTION_LABELS = dict(ACTION_CHOICES)
+# 调拨只支持文件导入：每行需要“调入仓库”列
+FILE_ACTION_CHOICES = ACTION_CHOICES + [(MoveType.TRANSFER, "批量调拨")]
+FILE_ACTION_TYPES = {choice for choice, _ in FILE_ACTION_CHOICES}
 
+logger = logging.getLogger(__name__)
 
-def _serialize_items(allowed_warehouse_ids):
-    items = list(
-        Item.objects
-        .select_related("warehouse", "unit")
-        .filter(warehouse_id__in=allowed_warehouse_ids, is_active=True)
-        .order_by("warehouse__name", "name")
-    )
-    item_ids = [item.id for item in items]
+IMPORT_ITEMS_PAGE_SIZE = 100
+# 文件导入失败时最多逐条提示的错误数，其余只给总数
+FILE_ERROR_MESSAGES = 20
+
+
+def _serialize_items(items):
+    """序列化给定物品（Item 或 ItemRecord 均可）及其当前库存；仓库、单位名称取自主数据缓存。"""
+    items = list(items)
+    data = master_data()
     balances = {}
-    if item_ids:
+    if items:
         balances = {
-            (balance.warehouse_id, balance.item_id): balance.on_hand
-            for balance in StockBalance.objects.filter(
-                warehouse_id__in=allowed_warehouse_ids,
-                item_id__in=item_ids,
-            )
+            (warehouse_id, item_id): on_hand
+            for warehouse_id, item_id, on_hand in StockBalance.objects.filter(
+                item_id__in=[item.id for item in items],
+            ).values_list("warehouse_id", "item_id", "on_hand")
         }
     serialized = []
     for item in items:
-        warehouse_name = item.warehouse.name if item.warehouse else ""
-        unit_name = item.unit.name if item.unit else ""
+        warehouse = data.warehouses.get(item.warehouse_id)
+        warehouse_name = warehouse.name if warehouse else ""
+        unit_name = data.unit_name(item.unit_id)
+        precision = data.unit_precision(item.unit_id)
         on_hand = balances.get((item.warehouse_id, item.id), 0)
         serialized.append({
             "id": item.id,
@@ -47,9 +65,88 @@ def _serialize_items(allowed_warehouse_ids):
             "warehouse_id": item.warehouse_id,
             "warehouse_name": warehouse_name,
             "unit_name": unit_name,
-            "on_hand": str(on_hand),
+            "on_hand": format_quantity(on_hand, precision),
+            "step": quantity_step(precision),
+            # 可录入的单位：基本单位在前，其余为辅助单位，提交后按换算系数折成基本单位
+            "units": [
+                {"name": name, "step": quantity_step(data.unit_names[name].precision)}
+                for name in data.item_unit_names(item.id)
+            ],
         })
-    return items, serialized
+    return serialized
+
+
+def _import_warehouse_ids(request):
+    if not hasattr(request, "_import_warehouse_ids"):
+        request._import_warehouse_ids = sorted(_role_warehouse_ids(request.user))
+    return request._import_warehouse_ids
+
+
+def _import_items_scope(request):
+    allowed_ids = _import_warehouse_ids(request)
+    warehouse_id = (request.GET.get("warehouse_id") or "").strip()
+    if not warehouse_id:
+        return allowed_ids
+    try:
+        warehouse_id = int(warehouse_id)
+    except ValueError:
+        return []
+    return [warehouse_id] if warehouse_id in allowed_ids else []
+
+
+def _import_items_etag(request):
+    # 物品主档、库存余额或其他主数据（仓库、单位名称，辅助单位）任一变化都会改变 ETag；
+    # 两次聚合都走 (warehouse, updated_at) 索引，版本号先按主键比对，响应里的名称与之一致
+    version = master_data(strict=True).version
+    scope = _import_items_scope(request)
+    item_state = Item.objects.filter(warehouse_id__in=scope).aggregate(
+        count=Count("id"),
+        changed=Max("updated_at"),
+    )
+    balance_changed = StockBalance.objects.filter(warehouse_id__in=scope).aggregate(
+        changed=Max("updated_at"),
+    )["changed"]
+    raw = "|".join(str(part) for part in (
+        request.user.pk,
+        sorted(scope),
+        request.GET.urlencode(),
+        version,
+        item_state["count"],
+        item_state["changed"],
+        balance_changed,
+    ))
+    return hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()
+
+
+@login_required
+@use_replica
+@condition(etag_func=_import_items_etag)
+def stock_import_items(request):
+    scope = _import_items_scope(request)
+    q = (request.GET.get("q") or "").strip()
+    try:
+        page = max(1, int(request.GET.get("page") or 1))
+    except ValueError:
+        page = 1
+
+    items = (
+        Item.objects
+        .filter(warehouse_id__in=scope, is_active=True)
+        .order_by("warehouse__name", "name")
+    )
+    if q:
+        items = items.filter(search_q(Item, q, ITEM_SEARCH_FIELDS))
+
+    # 多取一条判断是否还有下一页，避免 COUNT(*)
+    offset = (page - 1) * IMPORT_ITEMS_PAGE_SIZE
+    rows = list(items[offset:offset + IMPORT_ITEMS_PAGE_SIZE + 1])
+    response = JsonResponse({
+        "results": _serialize_items(rows[:IMPORT_ITEMS_PAGE_SIZE]),
+        "page": page,
+        "has_next": len(rows) > IMPORT_ITEMS_PAGE_SIZE,
+    })
+    response["Cache-Control"] = "private, no-cache"
+    return response
 
 
 def _clean_initial_rows(rows):
@@ -62,6 +159,7 @@ def _clean_initial_rows(rows):
             "warehouse_id": row.get("warehouse_id"),
             "item_id": row.get("item_id"),
             "quantity": row.get("quantity"),
+            "unit": row.get("unit"),
             "reference": row.get("reference"),
             "note": row.get("note"),
             "partner_id": row.get("partner_id"),
@@ -72,20 +170,19 @@ def _clean_initial_rows(rows):
 @login_required
 def stock_import_start(request):
     role_context = _role_filter_kwargs(request.user)
-    warehouses = role_context["warehouse"].order_by("name")
-    if not warehouses.exists():
+    data = master_data(strict=request.method == "POST")
+    warehouses = data.allowed_warehouses(role_context)
+    if not warehouses:
         messages.error(request, "当前账号没有可操作的仓库")
         return redirect(reverse("products:inventory_dashboard"))
 
-    allowed_ids = list(warehouses.values_list("id", flat=True))
     warehouse_lookup = {w.id: w for w in warehouses}
-    items, items_data = _serialize_items(allowed_ids)
-    item_lookup = {item.id: item for item in items}
 
-    partners = list(Partner.objects.filter(is_active=True).order_by("name"))
+    partners = data.active_partners
     partner_lookup = {partner.id: partner for partner in partners}
 
     initial_rows = []
+    initial_items = []
     selected_action = request.POST.get("action_type") or MoveType.INBOUND
 
     if request.method == "POST":
@@ -100,6 +197,20 @@ def stock_import_start(request):
             payload = []
             messages.error(request, "提交的数据格式不正确，请重试")
 
+        # 只取本次提交涉及的物品（来自主数据缓存）
+        payload_item_ids = set()
+        for entry in payload:
+            if isinstance(entry, dict):
+                try:
+                    payload_item_ids.add(int(entry.get("item_id")))
+                except (TypeError, ValueError):
+                    continue
+        item_lookup = {}
+        for item_id in payload_item_ids:
+            item = data.items.get(item_id)
+            if item and item.is_active and item.warehouse_id in warehouse_lookup:
+                item_lookup[item_id] = item
+
         if selected_action not in ACTION_TYPES:
             messages.error(request, "请选择入库或出库类型")
 
@@ -136,11 +247,10 @@ def stock_import_start(request):
                 errors.append(f"{row_prefix}：物品不存在或不属于所选仓库")
                 continue
 
-            quantity_raw = entry.get("quantity")
             try:
-                quantity_value = int(str(quantity_raw))
-            except (TypeError, ValueError):
-                errors.append(f"{row_prefix}：数量必须是整数")
+                quantity_value = data.parse_item_quantity(item_id, entry.get("quantity"), str(entry.get("unit") or ""))
+            except ValueError as exc:
+                errors.append(f"{row_prefix}：{exc}")
                 continue
 
             if quantity_value <= 0:
@@ -168,7 +278,7 @@ def stock_import_start(request):
                 "warehouse_name": warehouse.name,
                 "item_id": item_id,
                 "item_name": item.name,
-                "unit_name": item.unit.name if item.unit else "",
+                "unit_name": data.unit_name(item.unit_id),
                 "quantity": quantity_value,
                 "reference": reference,
                 "note": note,
@@ -187,19 +297,20 @@ def stock_import_start(request):
             balances = {}
             if warehouse_ids and item_ids:
                 balances = {
-                    (bal.warehouse_id, bal.item_id): bal.on_hand
-                    for bal in StockBalance.objects.filter(
+                    (warehouse_id, item_id): on_hand - reserved
+                    for warehouse_id, item_id, on_hand, reserved in StockBalance.objects.filter(
                         warehouse_id__in=warehouse_ids,
                         item_id__in=item_ids,
-                    )
+                    ).values_list("warehouse_id", "item_id", "on_hand", "reserved")
                 }
             for (warehouse_id, item_id), need in outbound_requirements.items():
-                on_hand = balances.get((warehouse_id, item_id), 0)
-                if on_hand < need:
+                available = balances.get((warehouse_id, item_id), 0)
+                if available < need:
                     warehouse_name = warehouse_lookup.get(warehouse_id).name
                     item_name = item_lookup.get(item_id).name
                     errors.append(
-                        f"库存不足：{warehouse_name} - {item_name} 当前 {on_hand}，需 {need}"
+                        f"可用库存不足：{warehouse_name} - {item_name} "
+                        f"可用 {data.format_item_quantity(item_id, available)}，需 {data.format_item_quantity(item_id, need)}"
                     )
                     normalized_rows = []
                     break
@@ -208,36 +319,95 @@ def stock_import_start(request):
             for message_text in errors:
                 messages.error(request, message_text)
         elif normalized_rows and selected_action in ACTION_TYPES:
-            batch_reference = f"BATCH-{timezone.now().strftime('%Y%m%d%H%M%S')}-{request.user.id}"
             try:
                 with transaction.atomic():
+                    document = open_document(
+                        DOCUMENT_TYPES[selected_action],
+                        user=request.user,
+                        note="批量录入",
+                    )
+                    moves = []
                     for row in normalized_rows:
                         qty_value = row["quantity"]
                         qty_value = qty_value if selected_action == MoveType.INBOUND else -qty_value
-                        StockMove.objects.create(
+                        moves.append(StockMove(
                             move_type=selected_action,
                             warehouse_id=row["warehouse_id"],
                             item_id=row["item_id"],
                             quantity=qty_value,
-                            reference=row["reference"] or batch_reference,
+                            reference=row["reference"],
                             note=row["note"],
                             partner_id=row["partner_id"],
-                        )
+                        ))
+                    # 出库按先到期先出拆到批次
+                    bulk_post_moves(split_fefo(moves), document=document)
             except Exception:
+                logger.exception("批量录入写入失败")
                 messages.error(request, "导入失败，请重试或联系管理员")
             else:
-                messages.success(request, f"已成功导入 {len(normalized_rows)} 条记录")
+                messages.success(request, f"已成功导入 {len(normalized_rows)} 条记录，单据 {document.number}")
                 return redirect(reverse("products:inventory_dashboard"))
 
         initial_rows = _clean_initial_rows(payload)
+        initial_items = _serialize_items(item_lookup.values())
 
     context = {
         "action_choices": ACTION_CHOICES,
         "warehouses": warehouses,
-        "items_data": items_data,
+        "initial_items": initial_items,
         "partners": [{"id": partner.id, "name": partner.name} for partner in partners],
         "selected_action": selected_action,
         "initial_rows": initial_rows,
         "action_labels": ACTION_LABELS,
+        "file_action_choices": FILE_ACTION_CHOICES,
+        "encoding_choices": ENCODING_CHOICES,
     }
     return render(request, "products/stock_import_upload.html", context)
+
+
+@login_required
+def stock_import_file(request):
+    back = redirect(reverse("products:stock_import_start"))
+    if request.method != "POST":
+        return back
+
+    action = request.POST.get("action_type")
+    upload = request.FILES.get("file")
+    encoding = request.POST.get("encoding") or ENCODING_CHOICES[0][0]
+    if action not in FILE_ACTION_TYPES:
+        messages.error(request, "请选择入库、出库或调拨类型")
+        return back
+    if upload is None:
+        messages.error(request, "请选择要导入的 CSV 或 XLSX 文件")
+        return back
+    if encoding not in dict(ENCODING_CHOICES):
+        encoding = ENCODING_CHOICES[0][0]
+
+    role_context = _role_filter_kwargs(request.user)
+    importer = FileImporter(action, role_context, user=request.user, reference=upload.name[:100])
+    try:
+        ok = importer.run(iter_rows(upload, encoding))
+    except UnicodeDecodeError:
+        messages.error(request, "文件编码无法识别，请尝试选择 GBK 编码后重试")
+        return back
+    except ValueError as exc:
+        # 包括 FileFormatError 与表头校验错误
+        messages.error(request, f"导入失败：{exc}")
+        return back
+    except Exception:
+        logger.exception("文件导入失败：%s", upload.name)
+        messages.error(request, "导入失败，请联系管理员")
+        return back
+
+    if not ok:
+        messages.error(request, f"共 {importer.error_count} 行有误，未导入任何数据")
+        for message_text in importer.errors[:FILE_ERROR_MESSAGES]:
+            messages.error(request, message_text)
+        return back
+
+    if importer.document is None:
+        messages.error(request, "文件中没有数据行")
+        return back
+
+    messages.success(request, f"已成功导入 {importer.imported} 条记录，单据 {importer.document.number}")
+    return redirect(reverse("products:document_detail", args=[importer.document.pk]))
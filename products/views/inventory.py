@@ -1,19 +1,20 @@
 from collections import OrderedDict
-import uuid
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
 from django.shortcuts import render
 from django.core.paginator import Paginator
+from django.db import router
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 
-from products.models import Warehouse, StockBalance, Item, WarehouseType, Unit, Partner
-
-
-def _issue_form_token(request, key: str) -> str:
-    token = uuid.uuid4().hex
-    request.session[f"form_token_{key}"] = token
-    return token
+from products.change_feed import low_water_mark
+from products.models import Warehouse, StockBalance, Item, WarehouseType
+from products.idempotency import issue_form_token
+from products.masterdata import master_data
+from products.quantities import QUANTITY_SCALE, format_quantity, quantity_step
+from products.routers import use_replica
+from products.search import ITEM_SEARCH_FIELDS, search_q
 
 
 def _role_filter_kwargs(user):
@@ -54,15 +55,22 @@ def _role_filter_kwargs(user):
     }
 
 
+def _role_warehouse_ids(user):
+    """当前用户可操作的仓库 id 集合（来自主数据缓存）。"""
+    return {w.id for w in master_data().allowed_warehouses(_role_filter_kwargs(user))}
+
+
 @login_required
+@use_replica
 def inventory_dashboard(request):
     warehouse_id = (request.GET.get("warehouse_id") or "").strip()
     q = request.GET.get("q", "").strip()
     show_inactive = request.GET.get("show_inactive") == "1"
 
     role_context = _role_filter_kwargs(request.user)
+    data = master_data()
 
-    inventory_items = Item.objects.select_related("warehouse").order_by("-created_at")
+    inventory_items = Item.objects.order_by("-created_at")
     if role_context["warehouse_filter"]:
         inventory_items = inventory_items.filter(**role_context["warehouse_filter"])
 
@@ -70,118 +78,118 @@ def inventory_dashboard(request):
         inventory_items = inventory_items.filter(warehouse_id=warehouse_id)
 
     if q:
-        inventory_items = inventory_items.filter(
-            Q(name__icontains=q) |
-            Q(warehouse__name__icontains=q)
-        )
+        inventory_items = inventory_items.filter(search_q(Item, q, ITEM_SEARCH_FIELDS))
 
     if not show_inactive:
         inventory_items = inventory_items.filter(is_active=True)
 
-    warehouses = role_context["warehouse"].order_by("name")
-    allowed_warehouse_ids = list(warehouses.values_list("id", flat=True))
-    form_items = (
-        Item.objects
-        .filter(is_active=True, warehouse_id__in=allowed_warehouse_ids)
-        .order_by("name")
-    )
-    management_items = (
-        Item.objects
-        .select_related("warehouse")
-        .filter(warehouse_id__in=allowed_warehouse_ids)
-        .order_by("name")
-    )
-    if role_context["warehouse_filter"]:
-        management_items = management_items.filter(**role_context["warehouse_filter"])
+    warehouses = data.allowed_warehouses(role_context)
+    management_items = data.items_in([w.id for w in warehouses], active_only=False)
+
+    unit_choices = [(unit.id, unit.name) for unit in data.active_units]
 
-    unit_choices = [(unit.pk, unit.name) for unit in Unit.objects.filter(is_active=True).order_by("name")]
+    # 先按仓库分组、分页，余额只查当前页的物品
+    grouped = OrderedDict()
+    for item in inventory_items:
+        grouped.setdefault(item.warehouse_id or "__unassigned__", []).append(item)
+    paginator = Paginator([item for group in grouped.values() for item in group], 50)
+    page_number = request.GET.get("page")
+    page_obj = paginator.get_page(page_number)
+    page_items = list(page_obj.object_list)
+
+    # 实时推送从读余额之前的低水位开始补发，页面渲染到 SSE 连上之间的变动不会丢
+    stream_since = None
+    if settings.EVENT_STREAM_ENABLED:
+        stream_since = low_water_mark(router.db_for_read(StockBalance))
+
+    # 所属仓库的余额，加上有权限的其他仓库（调拨到别处的库存）
+    allowed_ids = {w.id for w in warehouses}
+    balance_lookup = {
+        (bal.warehouse_id, bal.item_id): bal
+        for bal in StockBalance.objects.filter(
+            item_id__in=[item.id for item in page_items],
+            warehouse_id__in=allowed_ids | {item.warehouse_id for item in page_items if item.warehouse_id},
+        ).only("item_id", "warehouse_id", "on_hand", "reserved", "updated_at")
+    }
 
-    all_balances = StockBalance.objects.select_related("warehouse", "item")
-    balance_lookup = {}
-    balance_data = {}
-    for bal in all_balances:
-        key = (bal.warehouse_id, bal.item_id)
-        balance_lookup[key] = bal
-        balance_data[f"{bal.warehouse_id}-{bal.item_id}"] = str(bal.on_hand)
+    # 调拨到所属仓库以外的库存，在物品行里另外列出
+    elsewhere = {}
+    for bal in balance_lookup.values():
+        item = data.items.get(bal.item_id)
+        if item and bal.on_hand and bal.warehouse_id != item.warehouse_id and bal.warehouse_id in allowed_ids:
+            elsewhere.setdefault(bal.item_id, []).append({
+                "warehouse": data.warehouses[bal.warehouse_id].name,
+                "on_hand": data.format_item_quantity(bal.item_id, bal.on_hand),
+            })
 
     threshold = max(0, getattr(settings, "LOW_STOCK_ALERT_THRESHOLD", 0))
+    # 余额按定点整数比较，阈值同样换算
+    scaled_threshold = threshold * QUANTITY_SCALE
 
-    low_stock_rows = []
-
-    grouped = OrderedDict()
-    for item in inventory_items:
-        warehouse = item.warehouse
+    page_grouped = OrderedDict()
+    for item in page_items:
+        warehouse = data.warehouses.get(item.warehouse_id)
         wh_id = warehouse.id if warehouse else None
-        group_key = wh_id or "__unassigned__"
-        if group_key not in grouped:
-            grouped[group_key] = {
+        if wh_id not in page_grouped:
+            page_grouped[wh_id] = {
                 "warehouse": warehouse,
                 "rows": [],
             }
         balance = balance_lookup.get((wh_id, item.id))
         quantity = balance.on_hand if balance else 0
-        row_data = {
+        reserved = balance.reserved if balance else 0
+        precision = data.unit_precision(item.unit_id)
+        page_grouped[wh_id]["rows"].append({
             "item": item,
-            "on_hand": quantity,
+            "unit_name": data.unit_name(item.unit_id),
+            "on_hand": format_quantity(quantity, precision),
+            "reserved": format_quantity(reserved, precision) if reserved else "",
+            "available": format_quantity(quantity - reserved, precision),
+            "step": quantity_step(precision),
             "updated_at": balance.updated_at if balance else None,
-            "has_stock": quantity > 0,
-            "is_low_stock": quantity < threshold,
+            "has_stock": quantity - reserved > 0,
+            "is_low_stock": quantity < scaled_threshold,
+            "elsewhere": elsewhere.get(item.id, []),
+        })
+
+    # 低库存提醒覆盖全部筛选结果：在数据库里按 (item, warehouse) 索引取所属仓库的现存量比较
+    own_balances = StockBalance.objects.filter(item_id=OuterRef("pk"), warehouse_id=OuterRef("warehouse_id"))
+    low_stock_q = Q(Exists(own_balances.filter(on_hand__lt=scaled_threshold)))
+    if scaled_threshold > 0:
+        low_stock_q |= ~Q(Exists(own_balances))
+    low_stock_rows = [
+        {
+            "item_name": name,
+            "warehouse_name": data.warehouses[wh_id].name if wh_id in data.warehouses else "未分配仓库",
+            "on_hand": format_quantity(on_hand, data.unit_precision(unit_id)),
         }
-        grouped[group_key]["rows"].append(row_data)
-
-        if row_data["is_low_stock"]:
-            low_stock_rows.append({
-                "item_name": item.name,
-                "warehouse_name": warehouse.name if warehouse else "未分配仓库",
-                "on_hand": quantity,
-            })
-
-    flat_rows = []
-    for group in grouped.values():
-        for row in group["rows"]:
-            flat_rows.append({
-                "warehouse": group["warehouse"],
-                "row": row,
-            })
-
-    paginator = Paginator(flat_rows, 50)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
-
-    page_grouped = OrderedDict()
-    for entry in page_obj.object_list:
-        warehouse = entry["warehouse"]
-        row = entry["row"]
-        key = warehouse.id if warehouse else None
-        if key not in page_grouped:
-            page_grouped[key] = {
-                "warehouse": warehouse,
-                "rows": [],
-            }
-        page_grouped[key]["rows"].append(row)
+        for name, wh_id, unit_id, on_hand in inventory_items
+        .filter(low_stock_q)
+        .annotate(own_on_hand=Coalesce(Subquery(own_balances.values("on_hand")[:1]), 0))
+        .values_list("name", "warehouse_id", "unit_id", "own_on_hand")
+    ]
 
     query_params = request.GET.copy()
     if "page" in query_params:
         query_params.pop("page")
     query_string = query_params.urlencode()
 
-    partners = list(Partner.objects.filter(is_active=True).order_by("name"))
+    partners = data.active_partners
 
     form_tokens = {
-        "inbound": _issue_form_token(request, "inbound"),
-        "outbound": _issue_form_token(request, "outbound"),
-        "adjust": _issue_form_token(request, "adjust"),
+        "inbound": issue_form_token(request.user, "inbound"),
+        "outbound": issue_form_token(request.user, "outbound"),
+        "adjust": issue_form_token(request.user, "adjust"),
+        "transfer": issue_form_token(request.user, "transfer"),
     }
 
     return render(request, "products/inventory_dashboard.html", {
         "page_obj": page_obj,
         "grouped_rows": page_grouped.values(),
         "warehouses": warehouses,
-        "form_items": form_items,
         "selected_warehouse_id": warehouse_id,
         "q": q,
         "show_inactive": show_inactive,
-        "balance_data": balance_data,
         "low_stock_threshold": threshold,
         "low_stock_rows": low_stock_rows,
         "form_tokens": form_tokens,
@@ -189,4 +197,5 @@ def inventory_dashboard(request):
         "units": unit_choices,
         "query_string": query_string,
         "partners": partners,
+        "stream_since": stream_since,
     })
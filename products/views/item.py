@@ -3,7 +3,8 @@ from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
 
-from products.models import Item, Unit, Warehouse
+from products.masterdata import master_data
+from products.models import Item
 from products.views.inventory import _role_filter_kwargs
 
 
@@ -21,17 +22,15 @@ def item_create(request):
         messages.error(request, "新增失败：名称 / 单位 / 品类不能为空")
         return redirect(reverse("products:inventory_dashboard"))
 
-    unit = Unit.objects.filter(pk=unit_id, is_active=True).first()
-    if unit is None:
+    data = master_data(strict=True)
+    unit = data.unit(unit_id)
+    if unit is None or not unit.is_active:
         messages.error(request, "新增失败：请选择有效单位")
         return redirect(reverse("products:inventory_dashboard"))
 
     role_context = _role_filter_kwargs(request.user)
-    warehouse = Warehouse.objects.filter(id=warehouse_id)
-    if role_context["warehouse_filter"]:
-        warehouse = warehouse.filter(**role_context["warehouse_filter"])
-    warehouse = warehouse.first()
-    if warehouse is None:
+    warehouse = data.warehouse(warehouse_id)
+    if not data.warehouse_allowed(warehouse, role_context):
         messages.error(request, "新增失败：请选择有效品类")
         return redirect(reverse("products:inventory_dashboard"))
 
@@ -41,8 +40,8 @@ def item_create(request):
 
     Item.objects.create(
         name=name,
-        unit=unit,
-        warehouse=warehouse,
+        unit_id=unit.id,
+        warehouse_id=warehouse.id,
         is_active=is_active,
     )
     messages.success(request, "物品已新增")
@@ -65,17 +64,15 @@ def item_update(request, pk: int):
         messages.error(request, "更新失败：名称 / 单位 / 品类不能为空")
         return redirect(reverse("products:inventory_dashboard"))
 
-    unit = Unit.objects.filter(pk=unit_id, is_active=True).first()
-    if unit is None:
+    data = master_data(strict=True)
+    unit = data.unit(unit_id)
+    if unit is None or not unit.is_active:
         messages.error(request, "更新失败：请选择有效单位")
         return redirect(reverse("products:inventory_dashboard"))
 
     role_context = _role_filter_kwargs(request.user)
-    warehouse = Warehouse.objects.filter(id=warehouse_id)
-    if role_context["warehouse_filter"]:
-        warehouse = warehouse.filter(**role_context["warehouse_filter"])
-    warehouse = warehouse.first()
-    if warehouse is None:
+    warehouse = data.warehouse(warehouse_id)
+    if not data.warehouse_allowed(warehouse, role_context):
         messages.error(request, "更新失败：请选择有效品类")
         return redirect(reverse("products:inventory_dashboard"))
 
@@ -84,10 +81,10 @@ def item_update(request, pk: int):
         return redirect(reverse("products:inventory_dashboard"))
 
     item.name = name
-    item.unit = unit
-    item.warehouse = warehouse
+    item.unit_id = unit.id
+    item.warehouse_id = warehouse.id
     item.is_active = is_active
-    item.save(update_fields=["name", "unit", "warehouse", "is_active"])
+    item.save(update_fields=["name", "unit", "warehouse", "is_active", "updated_at"])
 
     messages.success(request, "物品已更新")
     return redirect(reverse("products:inventory_dashboard"))
@@ -100,7 +97,7 @@ def item_toggle_active(request, pk: int):
 
     item = get_object_or_404(Item, pk=pk)
     item.is_active = not item.is_active
-    item.save(update_fields=["is_active"])
+    item.save(update_fields=["is_active", "updated_at"])
 
     messages.success(
         request,
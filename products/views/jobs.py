@@ -0,0 +1,61 @@
+from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404, redirect, render
+from django.views.decorators.http import require_POST
+
+from products.jobs import enqueue, job_stats, result_file, retry
+from products.models import Job, JobStatus
+
+RECENT_JOBS = 100
+
+
+@staff_member_required
+def job_list(request):
+    """后台任务状态：各状态数量、排队延迟和最近的任务。"""
+    status = (request.GET.get("status") or "").strip().upper()
+    jobs = Job.objects.select_related("created_by").order_by("-id")
+    if status in JobStatus.values:
+        jobs = jobs.filter(status=status)
+    else:
+        status = ""
+
+    stats = job_stats()
+    status_options = [
+        {"value": value, "label": label, "count": stats[value], "active": status == value}
+        for value, label in JobStatus.choices
+    ]
+    return render(request, "products/job_list.html", {
+        "jobs": jobs[:RECENT_JOBS],
+        "status": status,
+        "status_options": status_options,
+        "lag_seconds": stats["lag_seconds"],
+    })
+
+
+@staff_member_required
+@require_POST
+def job_reconcile(request):
+    job = enqueue("reconcile_balances", user=request.user)
+    messages.success(request, f"对账任务 #{job.pk} 已提交")
+    return redirect("products:job_list")
+
+
+@staff_member_required
+@require_POST
+def job_retry(request, pk):
+    job = get_object_or_404(Job, pk=pk)
+    if retry(job):
+        messages.success(request, f"任务 #{job.pk} 已重新排队")
+    else:
+        messages.error(request, f"任务 #{job.pk} 不是失败状态，无法重试")
+    return redirect("products:job_list")
+
+
+@staff_member_required
+def job_download(request, pk):
+    job = get_object_or_404(Job, pk=pk, status=JobStatus.SUCCEEDED)
+    path = result_file(job.result)
+    if path is None or not path.exists():
+        raise Http404("导出文件不存在或已清理")
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=path.name)
@@ -0,0 +1,58 @@
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+
+from products.catalog import item_index
+from products.masterdata import master_data
+from products.models import StockBalance
+from products.quantities import format_quantity, quantity_step
+from products.views.inventory import _role_filter_kwargs
+
+TYPEAHEAD_DEFAULT_LIMIT = 20
+TYPEAHEAD_MAX_LIMIT = 50
+
+
+@login_required
+def item_typeahead(request):
+    q = (request.GET.get("q") or "").strip()
+    warehouse_id = (request.GET.get("warehouse_id") or "").strip()
+    try:
+        limit = int(request.GET.get("limit") or TYPEAHEAD_DEFAULT_LIMIT)
+    except ValueError:
+        limit = TYPEAHEAD_DEFAULT_LIMIT
+    limit = max(1, min(limit, TYPEAHEAD_MAX_LIMIT))
+
+    role_context = _role_filter_kwargs(request.user)
+    allowed_ids = set(role_context["warehouse"].values_list("id", flat=True))
+    if warehouse_id:
+        try:
+            allowed_ids &= {int(warehouse_id)}
+        except ValueError:
+            allowed_ids = set()
+
+    matches = item_index().search(q, allowed_ids, limit) if allowed_ids else []
+
+    # 库存现查：只取命中的这几个物品，走 (item, warehouse) 索引
+    balances = {}
+    if matches:
+        balances = {
+            (item_id, wh_id): (qty, reserved)
+            for item_id, wh_id, qty, reserved in StockBalance.objects.filter(
+                item_id__in=[entry[1] for entry in matches],
+            ).values_list("item_id", "warehouse_id", "on_hand", "reserved")
+        }
+
+    data = master_data()
+    results = []
+    for _, item_id, name, wh_id, unit_name in matches:
+        on_hand, reserved = balances.get((item_id, wh_id), (0, 0))
+        precision = data.item_precision(item_id)
+        results.append({
+            "id": item_id,
+            "name": name,
+            "warehouse_id": wh_id,
+            "unit": unit_name,
+            "on_hand": format_quantity(on_hand, precision),
+            "available": format_quantity(on_hand - reserved, precision),
+            "step": quantity_step(precision),
+        })
+    return JsonResponse({"results": results})
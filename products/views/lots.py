@@ -0,0 +1,44 @@
+from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.shortcuts import render
+from django.utils import timezone
+
+from products.lots import expiring_lots
+from products.masterdata import master_data
+from products.routers import use_replica
+from products.views.inventory import _role_filter_kwargs
+
+DEFAULT_EXPIRY_DAYS = 30
+MAX_EXPIRY_DAYS = 3650
+
+
+@login_required
+@use_replica
+def lot_expiry_report(request):
+    """临期批次：指定天数内到期（含已过期）且仍有库存的批次，按效期从早到晚。"""
+    try:
+        days = min(max(int(request.GET.get("days") or DEFAULT_EXPIRY_DAYS), 0), MAX_EXPIRY_DAYS)
+    except ValueError:
+        days = DEFAULT_EXPIRY_DAYS
+    warehouse_id = (request.GET.get("warehouse_id") or "").strip()
+
+    warehouses = master_data().allowed_warehouses(_role_filter_kwargs(request.user))
+    warehouse_ids = [w.id for w in warehouses]
+    if warehouse_id.isdigit() and int(warehouse_id) in warehouse_ids:
+        warehouse_ids = [int(warehouse_id)]
+    else:
+        warehouse_id = ""
+
+    paginator = Paginator(expiring_lots(warehouse_ids, days), 50)
+    page_obj = paginator.get_page(request.GET.get("page"))
+
+    query_params = request.GET.copy()
+    query_params.pop("page", None)
+    return render(request, "products/lot_expiry.html", {
+        "page_obj": page_obj,
+        "warehouses": warehouses,
+        "warehouse_id": warehouse_id,
+        "days": days,
+        "today": timezone.localdate(),
+        "query_string": query_params.urlencode(),
+    })
@@ -0,0 +1,17 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+
+from products.db_pool.pool import all_pool_metrics
+from products.outbox import outbox_stats
+
+
+@staff_member_required
+def db_pool_metrics(request):
+    """当前 worker 进程内各数据库连接池的指标；未启用连接池时 pools 为空。"""
+    return JsonResponse({"pools": all_pool_metrics()})
+
+
+@staff_member_required
+def outbox_metrics(request):
+    """外发事件积压与投递延迟。"""
+    return JsonResponse(outbox_stats())
@@ -1,32 +1,25 @@
-from decimal import Decimal
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.utils.http import url_has_allowed_host_and_scheme
 
 from products.models import (
-    Warehouse,
-    Item,
+    DocumentType,
     StockMove,
-    StockBalance,
     MoveType,
-    WarehouseType,
-    Partner,
 )
+from products.documents import open_document
+from products.idempotency import verify_form_token
+from products.ledger import lock_balances
+from products.lots import clean_lot, resolve_lots, split_fefo
+from products.masterdata import master_data
+from products.quantities import parse_quantity
+from products.transfers import lock_transfer_balances, post_transfers
 from products.views.inventory import _role_filter_kwargs
 
 
-def _verify_form_token(request, key: str) -> bool:
-    token = (request.POST.get("form_token") or "").strip()
-    session_key = f"form_token_{key}"
-    expected = request.session.get(session_key)
-    if not token or not expected or token != expected:
-        return False
-    request.session.pop(session_key, None)
-    return True
-
-
 def _redirect_back(request):
     next_url = (request.POST.get("next") or "").strip()
     if not next_url:
@@ -45,7 +38,7 @@ def inbound_create(request):
     if request.method != "POST":
         return _redirect_back(request)
 
-    if not _verify_form_token(request, "inbound"):
+    if not verify_form_token(request, "inbound"):
         messages.error(request, "请勿重复提交入库请求")
         return _redirect_back(request)
 
@@ -59,40 +52,49 @@ def inbound_create(request):
     partner_id = (request.POST.get("partner_id") or "").strip()
 
     try:
-        qty = Decimal(qty_str)
-        if qty <= 0:
-            raise ValueError
-    except Exception:
-        messages.error(request, "入库失败：数量必须是 > 0 的数字")
+        lot_no, expiry_date = clean_lot(request.POST.get("lot_no"), request.POST.get("expiry_date"))
+    except ValueError as exc:
+        messages.error(request, f"入库失败：{exc}")
         return _redirect_back(request)
 
-    warehouse = (
-        role_context["warehouse"]
-        .filter(id=warehouse_id)
-        .first()
-    )
-    item = Item.objects.filter(id=item_id, is_active=True, warehouse=warehouse).first()
+    data = master_data(strict=True)
+    warehouse = data.allowed_warehouse(warehouse_id, role_context)
+    item = data.item(item_id)
+    if item and (not item.is_active or not warehouse or item.warehouse_id != warehouse.id):
+        item = None
 
     if not warehouse or not item:
         messages.error(request, "入库失败：仓库或物品不存在/未启用")
         return _redirect_back(request)
 
+    # 按物品单位的小数位数换算成定点整数
+    try:
+        qty = parse_quantity(qty_str, data.item_precision(item.id))
+        if qty <= 0:
+            raise ValueError("数量必须大于 0")
+    except ValueError as exc:
+        messages.error(request, f"入库失败：{exc}")
+        return _redirect_back(request)
+
     partner = None
     if partner_id:
-        partner = Partner.objects.filter(id=partner_id, is_active=True).first()
-        if not partner:
+        partner = data.partner(partner_id)
+        if not partner or not partner.is_active:
             messages.error(request, "入库失败：合作方不存在或已停用")
             return _redirect_back(request)
 
-    StockMove.objects.create(
-        move_type=MoveType.INBOUND,
-        warehouse=warehouse,
-        item=item,
-        quantity=qty,   # 入库：正数
-        reference=reference,
-        note=note,
-        partner=partner,
-    )
+    with transaction.atomic():
+        lot_id = resolve_lots({(item.id, lot_no): expiry_date})[(item.id, lot_no)] if lot_no else None
+        StockMove.objects.create(
+            move_type=MoveType.INBOUND,
+            warehouse_id=warehouse.id,
+            item_id=item.id,
+            lot_id=lot_id,
+            quantity=qty,   # 入库：正数
+            reference=reference,
+            note=note,
+            partner_id=partner.id if partner else None,
+        )
     messages.success(request, "入库成功")
     return _redirect_back(request)
 
@@ -102,7 +104,7 @@ def outbound_create(request):
     if request.method != "POST":
         return _redirect_back(request)
 
-    if not _verify_form_token(request, "outbound"):
+    if not verify_form_token(request, "outbound"):
         messages.error(request, "请勿重复提交出库请求")
         return _redirect_back(request)
 
@@ -115,53 +117,56 @@ def outbound_create(request):
     note = (request.POST.get("note") or "").strip()
     partner_id = (request.POST.get("partner_id") or "").strip()
 
-    # 1) 校验数量
-    try:
-        qty = Decimal(qty_str)
-        if qty <= 0:
-            raise ValueError
-    except Exception:
-        messages.error(request, "出库失败：数量必须是 > 0 的数字")
-        return _redirect_back(request)
-
-    # 2) 校验仓库/物品存在
-    warehouse = (
-        role_context["warehouse"]
-        .filter(id=warehouse_id)
-        .first()
-    )
-    item = Item.objects.filter(id=item_id, is_active=True, warehouse=warehouse).first()
+    # 1) 校验仓库/物品存在
+    data = master_data(strict=True)
+    warehouse = data.allowed_warehouse(warehouse_id, role_context)
+    item = data.item(item_id)
+    if item and (not item.is_active or not warehouse or item.warehouse_id != warehouse.id):
+        item = None
     if not warehouse or not item:
         messages.error(request, "出库失败：仓库或物品不存在/未启用")
         return _redirect_back(request)
 
-    # 3) ✅ 负库存校验：查余额，不够就拒绝
-    bal = StockBalance.objects.filter(warehouse=warehouse, item=item).first()
-    on_hand = bal.on_hand if bal else Decimal("0")
-    if on_hand < qty:
-        messages.error(
-            request,
-            f"出库失败：库存不足。当前 {on_hand}，本次要出 {qty}"
-        )
+    # 2) 校验数量：按物品单位的小数位数换算成定点整数
+    try:
+        qty = parse_quantity(qty_str, data.item_precision(item.id))
+        if qty <= 0:
+            raise ValueError("数量必须大于 0")
+    except ValueError as exc:
+        messages.error(request, f"出库失败：{exc}")
         return _redirect_back(request)
 
-    # 4) 通过校验：创建出库流水（quantity 为负数）
     partner = None
     if partner_id:
-        partner = Partner.objects.filter(id=partner_id, is_active=True).first()
-        if not partner:
+        partner = data.partner(partner_id)
+        if not partner or not partner.is_active:
             messages.error(request, "出库失败：合作方不存在或已停用")
             return _redirect_back(request)
 
-    StockMove.objects.create(
-        move_type=MoveType.OUTBOUND,
-        warehouse=warehouse,
-        item=item,
-        quantity=-qty,
-        reference=reference,
-        note=note,
-        partner=partner,
-    )
+    with transaction.atomic():
+        # 3) ✅ 负库存校验：先锁余额行，再按锁内读到的可用量（现存 - 已预留）校验，
+        #    并发出库不会都通过校验后一起扣成负数
+        key = (item.id, warehouse.id)
+        on_hand, reserved = lock_balances([key]).get(key, (0, 0))
+        if on_hand - reserved < qty:
+            fmt = data.format_item_quantity
+            messages.error(
+                request,
+                f"出库失败：可用库存不足。可用 {fmt(item.id, on_hand - reserved)}，本次要出 {fmt(item.id, qty)}"
+            )
+            return _redirect_back(request)
+
+        # 4) 通过校验：按先到期先出拆到各批次，创建出库流水（quantity 为负数）
+        for move in split_fefo([StockMove(
+            move_type=MoveType.OUTBOUND,
+            warehouse_id=warehouse.id,
+            item_id=item.id,
+            quantity=-qty,
+            reference=reference,
+            note=note,
+            partner_id=partner.id if partner else None,
+        )]):
+            move.save()
 
     messages.success(request, "出库成功")
     return _redirect_back(request)
@@ -172,7 +177,7 @@ def adjust_create(request):
     if request.method != "POST":
         return _redirect_back(request)
 
-    if not _verify_form_token(request, "adjust"):
+    if not verify_form_token(request, "adjust"):
         messages.error(request, "请勿重复提交库存调整")
         return _redirect_back(request)
 
@@ -184,32 +189,104 @@ def adjust_create(request):
     reference = (request.POST.get("reference") or "").strip()
     note = (request.POST.get("note") or "").strip()
 
+    data = master_data(strict=True)
+    warehouse = data.allowed_warehouse(warehouse_id, role_context)
+    item = data.item(item_id)
+    if item and (not warehouse or item.warehouse_id != warehouse.id):
+        item = None
+    if not warehouse or not item:
+        messages.error(request, "调整失败：仓库或物品不存在/未启用")
+        return _redirect_back(request)
+
     try:
-        qty = Decimal(qty_str)
+        qty = parse_quantity(qty_str, data.item_precision(item.id))
         if qty == 0:
-            raise ValueError
-    except Exception:
-        messages.error(request, "调整失败：数量必须是非 0 数字，可正可负")
+            raise ValueError("数量必须是非 0 数字，可正可负")
+    except ValueError as exc:
+        messages.error(request, f"调整失败：{exc}")
         return _redirect_back(request)
 
-    warehouse = (
-        role_context["warehouse"]
-        .filter(id=warehouse_id)
-        .first()
-    )
-    item = Item.objects.filter(id=item_id, warehouse=warehouse).first()
-    if not warehouse or not item:
-        messages.error(request, "调整失败：仓库或物品不存在/未启用")
+    try:
+        lot_no, expiry_date = clean_lot(request.POST.get("lot_no"), request.POST.get("expiry_date"))
+    except ValueError as exc:
+        messages.error(request, f"调整失败：{exc}")
+        return _redirect_back(request)
+    if lot_no and qty < 0:
+        messages.error(request, "调整失败：减少库存按先到期先出自动分配批次，不能指定批号")
         return _redirect_back(request)
 
-    StockMove.objects.create(
-        move_type=MoveType.ADJUST,
-        warehouse=warehouse,
-        item=item,
-        quantity=qty,
-        reference=reference,
-        note=note,
-    )
+    with transaction.atomic():
+        lot_id = resolve_lots({(item.id, lot_no): expiry_date})[(item.id, lot_no)] if lot_no else None
+        for move in split_fefo([StockMove(
+            move_type=MoveType.ADJUST,
+            warehouse_id=warehouse.id,
+            item_id=item.id,
+            lot_id=lot_id,
+            quantity=qty,
+            reference=reference,
+            note=note,
+        )]):
+            move.save()
 
     messages.success(request, "库存已调整")
     return _redirect_back(request)
+
+
+@login_required
+def transfer_create(request):
+    if request.method != "POST":
+        return _redirect_back(request)
+
+    if not verify_form_token(request, "transfer"):
+        messages.error(request, "请勿重复提交调拨请求")
+        return _redirect_back(request)
+
+    role_context = _role_filter_kwargs(request.user)
+
+    item_id = request.POST.get("item_id")
+    qty_str = (request.POST.get("quantity") or "").strip()
+    reference = (request.POST.get("reference") or "").strip()
+    note = (request.POST.get("note") or "").strip()
+
+    data = master_data(strict=True)
+    source = data.allowed_warehouse(request.POST.get("warehouse_id"), role_context)
+    target = data.allowed_warehouse(request.POST.get("to_warehouse_id"), role_context)
+    item = data.item(item_id)
+    if not source or not target or not item or not item.is_active:
+        messages.error(request, "调拨失败：仓库或物品不存在/未启用")
+        return _redirect_back(request)
+    if source.id == target.id:
+        messages.error(request, "调拨失败：调出与调入仓库不能相同")
+        return _redirect_back(request)
+
+    try:
+        qty = parse_quantity(qty_str, data.item_precision(item.id))
+        if qty <= 0:
+            raise ValueError("数量必须大于 0")
+    except ValueError as exc:
+        messages.error(request, f"调拨失败：{exc}")
+        return _redirect_back(request)
+
+    transfer = {
+        "item_id": item.id,
+        "from_warehouse_id": source.id,
+        "to_warehouse_id": target.id,
+        "quantity": qty,
+        "reference": reference,
+        "note": note,
+    }
+    # 两边余额先锁定再校验，调出、调入在同一事务里按增量记账
+    with transaction.atomic():
+        available = lock_transfer_balances([transfer]).get((item.id, source.id), 0)
+        if available < qty:
+            fmt = data.format_item_quantity
+            messages.error(
+                request,
+                f"调拨失败：{source.name} 可用库存不足。可用 {fmt(item.id, available)}，本次要调 {fmt(item.id, qty)}",
+            )
+            return _redirect_back(request)
+        document = open_document(DocumentType.TRANSFER, user=request.user, reference=reference, note=note)
+        post_transfers([transfer], document=document)
+
+    messages.success(request, f"已从 {source.name} 调拨 {data.format_item_quantity(item.id, qty)} 到 {target.name}")
+    return _redirect_back(request)
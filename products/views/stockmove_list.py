@@ -1,15 +1,22 @@
 from datetime import timedelta
 from io import BytesIO
 
+from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
-from django.db.models import Q
 from django.http import HttpResponse
-from django.shortcuts import render
+from django.shortcuts import redirect, render
 from django.utils import timezone
+from django.views.decorators.http import require_POST
 from openpyxl import Workbook
 
-from products.models import StockMove, Warehouse, Item, MoveType, Partner
+from products.jobs import enqueue
+from products.masterdata import master_data
+from products.models import StockMove, MoveType
+from products.quantities import to_decimal
+from products.routers import use_replica
+from products.search import MOVE_SEARCH_FIELDS, search_q
 from products.views.inventory import _role_filter_kwargs
 
 
@@ -18,7 +25,7 @@ def _build_move_context(request):
     item_id = (request.GET.get("item_id") or "").strip()
     partner_id = (request.GET.get("partner_id") or "").strip()
     move_type = (request.GET.get("move_type") or "ALL").strip().upper()
-    allowed_types = {"ALL", MoveType.INBOUND, MoveType.OUTBOUND, MoveType.ADJUST}
+    allowed_types = {"ALL", MoveType.INBOUND, MoveType.OUTBOUND, MoveType.ADJUST, MoveType.TRANSFER}
     if move_type not in allowed_types:
         move_type = "ALL"
     q = (request.GET.get("q") or "").strip()
@@ -42,7 +49,7 @@ def _build_move_context(request):
 
     moves = (
         StockMove.objects
-        .select_related("warehouse", "item", "partner")
+        .select_related("warehouse", "item", "partner", "lot")
         .filter(**role_context.get("warehouse_filter", {}))
         .order_by("-created_at", "-id")
     )
@@ -63,20 +70,16 @@ def _build_move_context(request):
         moves = moves.filter(move_type=MoveType.OUTBOUND)
     elif move_type == MoveType.ADJUST:
         moves = moves.filter(move_type=MoveType.ADJUST)
+    elif move_type == MoveType.TRANSFER:
+        moves = moves.filter(move_type=MoveType.TRANSFER)
 
     if q:
-        moves = moves.filter(
-            Q(reference__icontains=q) |
-            Q(note__icontains=q) |
-            Q(item__name__icontains=q) |
-            Q(warehouse__name__icontains=q) |
-            Q(partner__name__icontains=q)
-        )
-
-    warehouses = role_context["warehouse"].order_by("name")
-    allowed_warehouse_ids = list(warehouses.values_list("id", flat=True))
-    items = Item.objects.filter(is_active=True, warehouse_id__in=allowed_warehouse_ids).order_by("name")
-    partners = Partner.objects.filter(is_active=True).order_by("name")
+        moves = moves.filter(search_q(StockMove, q, MOVE_SEARCH_FIELDS))
+
+    data = master_data()
+    warehouses = data.allowed_warehouses(role_context)
+    items = data.items_in([w.id for w in warehouses])
+    partners = data.active_partners
 
     query_params = request.GET.copy()
     if "page" in query_params:
@@ -87,6 +90,7 @@ def _build_move_context(request):
         {"value": MoveType.INBOUND, "label": "入库", "active": move_type == MoveType.INBOUND},
         {"value": MoveType.OUTBOUND, "label": "出库", "active": move_type == MoveType.OUTBOUND},
         {"value": MoveType.ADJUST, "label": "调整", "active": move_type == MoveType.ADJUST},
+        {"value": MoveType.TRANSFER, "label": "调拨", "active": move_type == MoveType.TRANSFER},
     ]
 
     return {
@@ -107,6 +111,7 @@ def _build_move_context(request):
 
 
 @login_required
+@use_replica
 def stockmove_list(request):
     context = _build_move_context(request)
     moves = context.pop("moves")
@@ -121,31 +126,39 @@ def stockmove_list(request):
     })
 
 
-@login_required
-def stockmove_export(request):
-    context = _build_move_context(request)
-    moves = context["moves"]
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "库存流水"
-    ws.append(["时间", "仓库", "物品", "合作方", "类型", "数量", "单号/来源", "备注"])
+def write_moves_workbook(moves, target):
+    """把流水写成 xlsx 到 ``target``（路径或文件对象），返回行数。"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("库存流水")
+    ws.append(["时间", "仓库", "物品", "批次", "合作方", "类型", "数量", "单号/来源", "备注"])
 
+    move_types = dict(MoveType.choices)
+    rows = 0
     for move in moves.iterator():
         ws.append([
             timezone.localtime(move.created_at).strftime("%Y-%m-%d %H:%M"),
             move.warehouse.name,
             move.item.name,
+            move.lot.lot_no if move.lot else "",
             move.partner.name if move.partner else "-",
-            dict(MoveType.choices).get(move.move_type, move.move_type),
-            move.quantity,
+            move_types.get(move.move_type, move.move_type),
+            to_decimal(move.quantity),
             move.reference or "",
             move.note or "",
         ])
+        rows += 1
+
+    wb.save(target)
+    return rows
+
+
+@login_required
+@use_replica
+def stockmove_export(request):
+    context = _build_move_context(request)
 
     buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
+    write_moves_workbook(context["moves"], buffer)
 
     filename = timezone.now().strftime("stockmoves_%Y%m%d_%H%M%S.xlsx")
     response = HttpResponse(
@@ -154,3 +167,13 @@ def stockmove_export(request):
     )
     response["Content-Disposition"] = f'attachment; filename="{filename}"'
     return response
+
+
+@staff_member_required
+@require_POST
+def stockmove_export_enqueue(request):
+    """大范围导出交给后台任务，完成后在任务页下载。"""
+    query = request.POST.get("query", "")
+    job = enqueue("export_moves", {"query": query, "user_id": request.user.pk}, user=request.user)
+    messages.success(request, f"导出任务 #{job.pk} 已提交，完成后可在此页下载")
+    return redirect("products:job_list")
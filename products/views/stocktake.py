@@ -0,0 +1,187 @@
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.db.models import F
+from django.http import Http404
+from django.shortcuts import get_object_or_404, redirect, render
+from django.views.decorators.http import require_POST
+
+from products.importing import ENCODING_CHOICES, iter_rows
+from products.masterdata import master_data
+from products.models import Stocktake, StocktakeLine, StocktakeStatus
+from products.stocktake import (
+    StocktakeError,
+    approve,
+    cancel,
+    counts_from_rows,
+    counts_from_scans,
+    open_stocktake,
+    record_counts,
+    summarize,
+)
+from products.views.inventory import _role_filter_kwargs, _role_warehouse_ids
+
+RECENT_STOCKTAKES = 50
+LINE_FILTERS = {
+    "all": "全部",
+    "variance": "有差异",
+    "uncounted": "未盘",
+}
+
+
+def _get_stocktake(request, pk):
+    stocktake = get_object_or_404(Stocktake.objects.select_related("warehouse"), pk=pk)
+    if stocktake.warehouse_id not in _role_warehouse_ids(request.user):
+        raise Http404("盘点单不存在")
+    return stocktake
+
+
+def _detail(stocktake):
+    return redirect("products:stocktake_detail", pk=stocktake.pk)
+
+
+@login_required
+def stocktake_list(request):
+    """盘点单列表，以及按仓库开新盘点单。"""
+    warehouses = master_data().allowed_warehouses(_role_filter_kwargs(request.user))
+    stocktakes = (
+        Stocktake.objects
+        .select_related("warehouse", "created_by")
+        .filter(warehouse_id__in=[w.id for w in warehouses])
+        .order_by("-id")[:RECENT_STOCKTAKES]
+    )
+    return render(request, "products/stocktake_list.html", {
+        "stocktakes": stocktakes,
+        "warehouses": warehouses,
+    })
+
+
+@login_required
+@require_POST
+def stocktake_create(request):
+    warehouse = master_data(strict=True).allowed_warehouse(
+        request.POST.get("warehouse_id"),
+        _role_filter_kwargs(request.user),
+    )
+    if warehouse is None:
+        messages.error(request, "开单失败：仓库不存在或无权限")
+        return redirect("products:stocktake_list")
+    try:
+        stocktake = open_stocktake(
+            warehouse,
+            user=request.user,
+            note=(request.POST.get("note") or "").strip(),
+        )
+    except StocktakeError as exc:
+        messages.error(request, f"开单失败：{exc}")
+        return redirect("products:stocktake_list")
+    messages.success(request, f"盘点单 #{stocktake.pk} 已创建，账面数已快照")
+    return _detail(stocktake)
+
+
+@login_required
+def stocktake_detail(request, pk):
+    stocktake = _get_stocktake(request, pk)
+    show = request.GET.get("show") or "all"
+    if show not in LINE_FILTERS:
+        show = "all"
+
+    lines = (
+        StocktakeLine.objects
+        .filter(stocktake=stocktake)
+        .select_related("item__unit")
+        .order_by("item__name")
+    )
+    if show == "variance":
+        lines = lines.filter(counted__isnull=False).exclude(counted=F("expected"))
+    elif show == "uncounted":
+        lines = lines.filter(counted__isnull=True)
+
+    paginator = Paginator(lines, 100)
+    page_obj = paginator.get_page(request.GET.get("page"))
+    return render(request, "products/stocktake_detail.html", {
+        "stocktake": stocktake,
+        "summary": summarize(stocktake),
+        "page_obj": page_obj,
+        "show": show,
+        "show_options": [
+            {"value": value, "label": label, "active": show == value}
+            for value, label in LINE_FILTERS.items()
+        ],
+        "is_open": stocktake.status == StocktakeStatus.OPEN,
+        "encoding_choices": ENCODING_CHOICES,
+    })
+
+
+def _record(request, stocktake, counts, errors, *, add):
+    if errors:
+        for message_text in errors:
+            messages.error(request, message_text)
+        messages.error(request, "录入有误，未保存任何数量")
+        return
+    try:
+        updated = record_counts(stocktake.pk, counts, add=add)
+    except StocktakeError as exc:
+        messages.error(request, f"录入失败：{exc}")
+        return
+    messages.success(request, f"已录入 {updated} 个物品的实盘数")
+
+
+@login_required
+@require_POST
+def stocktake_scan(request, pk):
+    """扫码录入：每行一个物品名称或 id，可带数量，累加到已盘数。"""
+    stocktake = _get_stocktake(request, pk)
+    counts, errors = counts_from_scans(stocktake, request.POST.get("scans") or "")
+    if not counts and not errors:
+        messages.error(request, "请扫码或输入至少一行")
+    else:
+        _record(request, stocktake, counts, errors, add=True)
+    return _detail(stocktake)
+
+
+@login_required
+@require_POST
+def stocktake_upload(request, pk):
+    """文件录入：按“物品 / 数量”两列覆盖实盘数。"""
+    stocktake = _get_stocktake(request, pk)
+    upload = request.FILES.get("file")
+    if upload is None:
+        messages.error(request, "请选择要上传的文件")
+        return _detail(stocktake)
+    encoding = request.POST.get("encoding") or ENCODING_CHOICES[0][0]
+    if encoding not in dict(ENCODING_CHOICES):
+        encoding = ENCODING_CHOICES[0][0]
+    try:
+        counts, errors = counts_from_rows(stocktake, iter_rows(upload, encoding))
+    except (ValueError, UnicodeDecodeError) as exc:
+        messages.error(request, f"文件读取失败：{exc}")
+        return _detail(stocktake)
+    _record(request, stocktake, counts, errors, add=False)
+    return _detail(stocktake)
+
+
+@login_required
+@require_POST
+def stocktake_approve(request, pk):
+    stocktake = _get_stocktake(request, pk)
+    try:
+        posted = approve(stocktake.pk, user=request.user)
+    except StocktakeError as exc:
+        messages.error(request, f"过账失败：{exc}")
+    else:
+        messages.success(request, f"盘点单 #{stocktake.pk} 已过账，写入 {posted} 条调整流水")
+    return _detail(stocktake)
+
+
+@login_required
+@require_POST
+def stocktake_cancel(request, pk):
+    stocktake = _get_stocktake(request, pk)
+    try:
+        cancel(stocktake.pk)
+    except StocktakeError as exc:
+        messages.error(request, f"作废失败：{exc}")
+    else:
+        messages.success(request, f"盘点单 #{stocktake.pk} 已作废")
+    return _detail(stocktake)
@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponse, StreamingHttpResponse
+
+from products.change_feed import low_water_mark
+from products.events import get_broker, replay_balance_events
+from products.views.api import async_api_login_required
+from products.views.inventory import _role_warehouse_ids
+
+
+def _format(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def _event_id(event_id):
+    # 只有 id 没有 data 的消息不触发事件，但会更新 EventSource 重连时带上的 Last-Event-ID
+    return f"id: {event_id}\n\n"
+
+
+def _since(request):
+    value = request.headers.get("Last-Event-ID") or request.GET.get("since")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+async def _event_stream(warehouse_ids, since, long_poll):
+    heartbeat = settings.EVENT_STREAM_HEARTBEAT_SECONDS
+    # 在消费响应的事件循环里订阅（WSGI 下与执行视图的不是同一个循环）
+    subscription = get_broker().subscribe(warehouse_ids)
+    try:
+        # 先订阅再取低水位、补发：之后提交的变动要么在补发里，要么会推送过来
+        confirmed = await sync_to_async(low_water_mark)(DEFAULT_DB_ALIAS)
+        yield "retry: 5000\n\n"
+        replayed = []
+        if since is not None:
+            replayed = await sync_to_async(replay_balance_events)(warehouse_ids, since)
+            for event in replayed:
+                yield _format(event)
+        yield _event_id(confirmed)
+        if long_poll and replayed:
+            return
+        pending = confirmed
+        while True:
+            try:
+                event = await subscription.get(heartbeat)
+            except asyncio.TimeoutError:
+                # 上一次心跳时已提交的事务，推送早已送达，id 才推进到那时的低水位
+                if pending != confirmed:
+                    yield _event_id(pending)
+                    confirmed = pending
+                pending = await sync_to_async(low_water_mark)(DEFAULT_DB_ALIAS)
+                yield ": ping\n\n"
+                if long_poll:
+                    return
+                continue
+            yield _format(event)
+            if long_poll:
+                return
+    finally:
+        subscription.close()
+
+
+@async_api_login_required
+async def balance_stream(request):
+    """
+    余额变动的 SSE 流，只包含当前用户可见仓库的事件。
+
+    事件 id 为变更流低水位；重连时按 Last-Event-ID（首次连接按 ?since=）从数据库补发
+    断线期间变化的余额，不会漏推送。
+
+    WSGI 下 Django 会把整个异步流读完才发送，因此退化为长轮询：收到一条事件
+    或心跳超时即结束，由 EventSource 自动重连。实时推送请用 ASGI 部署；
+    EVENT_STREAM_ENABLED 关闭时返回 204，EventSource 不再重连。
+    """
+    if not settings.EVENT_STREAM_ENABLED:
+        return HttpResponse(status=204)
+    warehouse_ids = await sync_to_async(_role_warehouse_ids)(request.user)
+    response = StreamingHttpResponse(
+        _event_stream(warehouse_ids, _since(request), long_poll=not isinstance(request, ASGIRequest)),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    # nginx 默认会缓冲代理响应
+    response["X-Accel-Buffering"] = "no"
+    return response